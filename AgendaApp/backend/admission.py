@@ -0,0 +1,292 @@
+"""Admission control and load shedding, shared by every backend.
+
+When the database slows down, requests used to pile up on the connection
+pool or on slow queries until they timed out, and latency climbed for
+everyone. Now every request is admitted by the limiter of its class
+(reads: GET/HEAD, writes: everything else) before it runs:
+
+- at most `limit` requests of a class run at once;
+- up to ADMISSION_QUEUE more wait, for at most ADMISSION_QUEUE_TIMEOUT;
+- the rest get 503 with Retry-After right away, which is cheaper for the
+  database and clearer for clients than a timeout.
+
+The limits adapt to database latency (AIMD). The drivers' timing hooks in
+metrics.py feed every DB call made by a request into
+AdmissionController.observe(); background jobs and listeners are left out,
+since a change stream idling for a second is not a slow database. Every
+ADMISSION_INTERVAL seconds the average is compared with
+ADMISSION_TARGET_LATENCY. Above it, each limit is cut by
+ADMISSION_BACKOFF (down to ADMISSION_MIN_LIMIT). Below it, a limit that
+was reached grows by one (up to ADMISSION_MAX_LIMIT). So a slow database
+gets fewer concurrent queries from every pod instead of more.
+
+Limits are per process: a gunicorn worker, or the event loop of an ASGI
+worker. Probes, /metrics and change streams are never shed (see
+ADMISSION_EXEMPT_PATHS); a stream would hold a slot for minutes.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+
+ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', 'true').lower() == 'true'
+ADMISSION_READ_LIMIT = int(os.getenv('ADMISSION_READ_LIMIT', 16))
+ADMISSION_WRITE_LIMIT = int(os.getenv('ADMISSION_WRITE_LIMIT', 8))
+ADMISSION_MIN_LIMIT = int(os.getenv('ADMISSION_MIN_LIMIT', 2))
+ADMISSION_MAX_LIMIT = int(os.getenv('ADMISSION_MAX_LIMIT', 64))
+ADMISSION_QUEUE = int(os.getenv('ADMISSION_QUEUE', 32))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 0.25))
+ADMISSION_TARGET_LATENCY = float(os.getenv('ADMISSION_TARGET_LATENCY', 0.05))
+ADMISSION_INTERVAL = float(os.getenv('ADMISSION_INTERVAL', 1))
+ADMISSION_BACKOFF = float(os.getenv('ADMISSION_BACKOFF', 0.75))
+ADMISSION_RETRY_AFTER = int(os.getenv('ADMISSION_RETRY_AFTER', 1))
+
+ADMISSION_EXEMPT_PATHS = frozenset(['/livez', '/readyz', '/health', '/metrics', '/tasks/changes/stream'])
+READ_METHODS = frozenset(['GET', 'HEAD'])
+
+BUSY_BODY = {"error": "Server busy, try again later"}
+
+
+def request_class(method, path):
+    """'read', 'write' or None for requests that are never shed."""
+    if method == 'OPTIONS' or path in ADMISSION_EXEMPT_PATHS:
+        return None
+    return 'read' if method in READ_METHODS else 'write'
+
+
+class _Limiter:
+    def __init__(self, limit, queue_size, queue_timeout):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.saturated = False   # the limit was reached since the last adjustment
+        self._counters = {
+            "admitted": 0,
+            "queued": 0,
+            "rejected": 0,
+            "timeouts": 0,
+        }
+
+    def stats(self):
+        return {"limit": self.limit, "in_flight": self.in_flight, "waiting": self.waiting, **self._counters}
+
+
+class ConcurrencyLimiter(_Limiter):
+    """Concurrency limit with a bounded wait queue, for threads (and gevent)."""
+
+    def __init__(self, limit, queue_size=ADMISSION_QUEUE, queue_timeout=ADMISSION_QUEUE_TIMEOUT):
+        super().__init__(limit, queue_size, queue_timeout)
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """True once admitted (call release() afterwards), False to shed the request."""
+        with self._condition:
+            if self.in_flight < self.limit:
+                return self._admit()
+            self.saturated = True
+            if self.waiting >= self.queue_size:
+                self._counters["rejected"] += 1
+                return False
+            self.waiting += 1
+            self._counters["queued"] += 1
+            try:
+                if self._condition.wait_for(lambda: self.in_flight < self.limit, self.queue_timeout):
+                    return self._admit()
+            finally:
+                self.waiting -= 1
+            self._counters["timeouts"] += 1
+            return False
+
+    def _admit(self):
+        self.in_flight += 1
+        self._counters["admitted"] += 1
+        return True
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def set_limit(self, limit):
+        with self._condition:
+            self.limit = limit
+            self._condition.notify_all()
+
+
+class AsyncConcurrencyLimiter(_Limiter):
+    """ConcurrencyLimiter for coroutines; all calls must run on the event loop."""
+
+    def __init__(self, limit, queue_size=ADMISSION_QUEUE, queue_timeout=ADMISSION_QUEUE_TIMEOUT):
+        super().__init__(limit, queue_size, queue_timeout)
+        self._waiters = deque()
+        self._loop = None
+
+    async def acquire(self):
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            self._counters["admitted"] += 1
+            return True
+        self.saturated = True
+        if self.waiting >= self.queue_size:
+            self._counters["rejected"] += 1
+            return False
+        self._loop = asyncio.get_running_loop()
+        waiter = self._loop.create_future()
+        self._waiters.append(waiter)
+        self.waiting += 1
+        self._counters["queued"] += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()   # admitted just as we were cancelled
+            raise
+        finally:
+            self.waiting -= 1
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        # release() hands its slot over: in_flight already counts us
+        if waiter.done() and not waiter.cancelled():
+            self._counters["admitted"] += 1
+            return True
+        waiter.cancel()
+        self._counters["timeouts"] += 1
+        return False
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def set_limit(self, limit):
+        # Latency observations may come from driver threads (motor)
+        self.limit = limit
+        if self._loop is not None and not self._loop.is_closed():
+            try:
+                self._loop.call_soon_threadsafe(self._wake)
+            except RuntimeError:
+                pass   # the loop closed meanwhile: nobody is waiting any more
+
+
+class AdmissionController:
+    """One limiter per request class plus the latency-driven limit updates."""
+
+    def __init__(self, limiter_class=ConcurrencyLimiter, read_limit=ADMISSION_READ_LIMIT,
+                 write_limit=ADMISSION_WRITE_LIMIT, enabled=ADMISSION_ENABLED,
+                 target_latency=ADMISSION_TARGET_LATENCY, interval=ADMISSION_INTERVAL,
+                 clock=time.monotonic):
+        self.enabled = enabled
+        self.target_latency = target_latency
+        self.interval = interval
+        self._clock = clock
+        self.limiters = {'read': limiter_class(read_limit), 'write': limiter_class(write_limit)}
+        self._lock = threading.Lock()
+        self._window_start = clock()
+        self._window_sum = 0.0
+        self._window_count = 0
+        self.latency = 0.0   # average DB call latency of the last window
+
+    def limiter(self, method, path):
+        """The limiter that admits this request, or None if it is not limited."""
+        if not self.enabled:
+            return None
+        kind = request_class(method, path)
+        return self.limiters[kind] if kind else None
+
+    def observe(self, seconds):
+        """Record one DB call; adjusts the limits once per interval."""
+        with self._lock:
+            self._window_sum += seconds
+            self._window_count += 1
+            now = self._clock()
+            if now - self._window_start < self.interval:
+                return
+            average = self._window_sum / self._window_count
+            self._window_start, self._window_sum, self._window_count = now, 0.0, 0
+            self.latency = average
+        self.adjust(average)
+
+    def adjust(self, average):
+        for limiter in self.limiters.values():
+            if average > self.target_latency:
+                limit = max(ADMISSION_MIN_LIMIT, int(limiter.limit * ADMISSION_BACKOFF))
+            elif limiter.saturated:
+                limit = min(ADMISSION_MAX_LIMIT, limiter.limit + 1)
+            else:
+                limit = limiter.limit
+            limiter.saturated = False
+            if limit != limiter.limit:
+                limiter.set_limit(limit)
+
+    def stats(self):
+        """Numeric view for /metrics."""
+        stats = {"enabled": int(self.enabled), "db_latency_ms": round(self.latency * 1000, 3)}
+        for kind, limiter in self.limiters.items():
+            for key, value in limiter.stats().items():
+                stats[f"{kind}_{key}"] = value
+        return stats
+
+
+# ----------------------------------------------------------------------
+# Flask
+# ----------------------------------------------------------------------
+
+def install_flask(app, controller, busy_body=BUSY_BODY):
+    """Admit every request through controller; install after instrument_flask."""
+    from flask import g, jsonify, request
+
+    @app.before_request
+    def _admission_acquire():
+        limiter = controller.limiter(request.method, request.path)
+        if limiter is None:
+            return None
+        if not limiter.acquire():
+            response = jsonify(busy_body)
+            response.status_code = 503
+            response.headers['Retry-After'] = str(ADMISSION_RETRY_AFTER)
+            return response
+        g.admission_limiter = limiter
+        return None
+
+    @app.teardown_request
+    def _admission_release(exc):
+        limiter = g.pop('admission_limiter', None)
+        if limiter is not None:
+            limiter.release()
+
+
+# ----------------------------------------------------------------------
+# ASGI (Starlette)
+# ----------------------------------------------------------------------
+
+class AdmissionMiddleware:
+    """ASGI counterpart of install_flask; the slot is held until the last body chunk."""
+
+    def __init__(self, app, controller, busy_body=BUSY_BODY):
+        self.app = app
+        self.controller = controller
+        self.busy_body = busy_body
+
+    async def __call__(self, scope, receive, send):
+        limiter = self.controller.limiter(scope['method'], scope['path']) if scope['type'] == 'http' else None
+        if limiter is None:
+            return await self.app(scope, receive, send)
+        if not await limiter.acquire():
+            from starlette.responses import JSONResponse
+            response = JSONResponse(self.busy_body, 503, {'Retry-After': str(ADMISSION_RETRY_AFTER)})
+            return await response(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
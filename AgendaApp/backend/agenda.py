@@ -0,0 +1,106 @@
+"""Agenda window for GET /agenda, shared by every backend.
+
+    GET /agenda?from=2025-03-03&to=2025-03-09&include_done=false
+
+Returns the tasks due in [from, to] grouped by day, plus how many open
+tasks are overdue (due before today). from defaults to today and to to
+six days later; windows are capped at AGENDA_MAX_DAYS.
+
+Open tasks are read through a partial index on (owner_id, due_date) WHERE
+NOT done (PostgreSQL) or with partialFilterExpression done: false (MongoDB),
+so a week view is a short range scan over the caller's tasks (owners.py)
+however many tasks are done. With include_done=true the
+(owner_id, due_date, created_at, id) index is used instead.
+MongoDB stores due_date as a 'YYYY-MM-DD' string (BSON has no date-only
+type), which sorts and compares like the date. Archived tasks (archive.py)
+are left out.
+"""
+import os
+from datetime import date, timedelta
+
+from pagination import parse_bool, parse_date
+
+AGENDA_DEFAULT_DAYS = 7
+AGENDA_MAX_DAYS = int(os.getenv('AGENDA_MAX_DAYS', 92))
+AGENDA_MAX_TASKS = int(os.getenv('AGENDA_MAX_TASKS', 1000))
+
+MONGO_AGENDA_INDEX = ([("owner_id", 1), ("due_date", 1)],
+                      {"name": "owner_id_1_due_date_open", "partialFilterExpression": {"done": False}})
+
+
+def parse_agenda_args(args, today=None):
+    """Validate the query string of GET /agenda.
+
+    Returns a dict with from, to (dates), include_done and today. Raises
+    ValueError with a message suitable for a 400 response.
+    """
+    today = today or date.today()
+    start = parse_date(args['from'], 'from') if args.get('from') else today
+    end = parse_date(args['to'], 'to') if args.get('to') else start + timedelta(days=AGENDA_DEFAULT_DAYS - 1)
+    if end < start:
+        raise ValueError("'from' must not be after 'to'")
+    if (end - start).days >= AGENDA_MAX_DAYS:
+        raise ValueError(f"The window must be at most {AGENDA_MAX_DAYS} days")
+    include_done = parse_bool(args['include_done'], 'include_done') if args.get('include_done') else False
+    return {'from': start, 'to': end, 'include_done': include_done, 'today': today}
+
+
+def mongo_due_date(value):
+    """date (or None) as stored in MongoDB."""
+    return value.isoformat() if value else None
+
+
+def group_by_day(tasks, due_date=lambda task: task['due_date']):
+    """[{"date": ..., "tasks": [...]}] in due-date order; tasks must be sorted by due date."""
+    days = []
+    for task in tasks:
+        day = due_date(task)
+        if not days or days[-1]['date'] != day:
+            days.append({'date': day, 'tasks': []})
+        days[-1]['tasks'].append(task)
+    return days
+
+
+def agenda_body(params, days, overdue, truncated):
+    return {
+        'from': params['from'].isoformat(),
+        'to': params['to'].isoformat(),
+        'days': days,
+        'overdue': overdue,
+        'truncated': truncated,
+    }
+
+
+# ----------------------------------------------------------------------
+# PostgreSQL
+# ----------------------------------------------------------------------
+
+def pg_agenda_query(ph, include_done):
+    """Tasks due in the window; ph maps owner, from, to and limit to placeholders."""
+    open_only = "" if include_done else "AND NOT done"
+    return f'''
+        SELECT id, title, done, due_date, created_at, updated_at FROM tasks
+        WHERE NOT archived AND owner_id = {ph['owner']} AND due_date BETWEEN {ph['from']} AND {ph['to']} {open_only}
+        ORDER BY due_date, created_at, id
+        LIMIT {ph['limit']}
+    '''
+
+
+def pg_overdue_query(ph):
+    return (f"SELECT count(*) FROM tasks"
+            f" WHERE NOT archived AND owner_id = {ph['owner']} AND NOT done AND due_date < {ph['today']}")
+
+
+# ----------------------------------------------------------------------
+# MongoDB
+# ----------------------------------------------------------------------
+
+def mongo_agenda_filter(params, owner):
+    query = {"owner_id": owner, "due_date": {"$gte": params['from'].isoformat(), "$lte": params['to'].isoformat()}}
+    if not params['include_done']:
+        query['done'] = False
+    return query
+
+
+def mongo_overdue_filter(params, owner):
+    return {"owner_id": owner, "done": False, "due_date": {"$lt": params['today'].isoformat()}}
@@ -1,11 +1,40 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
-from pymongo import MongoClient
+from pymongo import MongoClient, InsertOne, UpdateOne, DeleteOne, ReturnDocument
+from pymongo.errors import BulkWriteError, WriteError
 from bson import ObjectId
+from bson.errors import InvalidId
 import os
+from contextlib import contextmanager
 from datetime import datetime
 import logging
 
+from pagination import parse_list_args, encode_cursor, decode_cursor
+from counters import (mongo_apply_delta, mongo_delta_requests, mongo_read_counters, mongo_reconcile, start_reconciler,
+                      mongo_changed_owner)
+from conditional import make_etag, query_key, not_modified, with_etag
+from read_cache import ReadCache, MongoChangeListener
+from single_flight import SingleFlight
+from batch_ops import BatchError, parse_batch, item_result, parse_due_date
+from agenda import (AGENDA_MAX_TASKS, MONGO_AGENDA_INDEX, parse_agenda_args, mongo_due_date, group_by_day,
+                    agenda_body, mongo_agenda_filter, mongo_overdue_filter)
+from export_stream import EXPORT_BATCH_SIZE, EXPORT_FORMATS, encode_rows, primed, export_filename
+from probes import ReadinessChecker, mongo_readiness_check, liveness
+from metrics import instrument_flask, register_stats, add_db_observer, mongo_command_timer, mongo_pool_listener
+from admission import AdmissionController, install_flask as install_admission
+from owners import (OWNER_HEADER, MONGO_OWNER_INDEXES, MONGO_UNSCOPED_INDEXES, MONGO_ARCHIVED_UNSCOPED_INDEXES,
+                    install_flask as install_owners, mongo_owned, mongo_drop_indexes, mongo_backfill)
+from archive import (ARCHIVE_INTERVAL, MONGO_ARCHIVE_COLLECTION, MONGO_ARCHIVE_INDEX, MONGO_ARCHIVED_INDEXES,
+                     MONGO_KEEP_DONE_INDEX, mongo_archive, mongo_restore, newest_first, oldest_first)
+from replicas import (READ_AFTER_COOKIE, MONGO_READ_PREFERENCE, ReplicaRouter, ReplicaMonitor, mongo_read_preference,
+                      mongo_replica_check, mongo_position, mongo_timestamp, read_after, read_after_cookie)
+from fast_json import install_json_provider, http_date
+from wire_format import negotiate_format, wire_tasks, encode as encode_wire
+from compression import install_flask as install_compression
+from group_commit import GROUP_COMMIT, GroupCommitter
+from search import (parse_search_args, next_search_cursor, MONGO_SEARCH_INDEXES, mongo_search_find,
+                    mongo_autocomplete_filter)
+
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -14,7 +43,13 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 
 # Habilitar CORS para permitir requests desde el frontend
-CORS(app)
+CORS(app, expose_headers=["ETag"], allow_headers=["Content-Type", "Authorization", OWNER_HEADER])
+
+# Serializar JSON con orjson (misma salida que el proveedor por defecto de Flask)
+install_json_provider(app)
+
+# gzip/brotli según Accept-Encoding para los cuerpos JSON, CSV y MessagePack (ver compression.py)
+install_compression(app)
 
 # Configuración de MongoDB
 # En desarrollo local usa localhost, en Kubernetes usa el nombre del servicio
@@ -24,16 +59,119 @@ MONGO_DB = os.getenv('MONGO_DB', 'agendaapp')
 
 logger.info(f" Conectando a MongoDB en {MONGO_HOST}:{MONGO_PORT}")
 
+# Caché en memoria de la lista de tareas y las estadísticas
+read_cache = ReadCache()
+# Los fallos de caché idénticos y simultáneos comparten una sola carga (ver single_flight.py)
+read_flights = SingleFlight()
+
+# Lecturas en secundarios según MONGO_READ_PREFERENCE (ver replicas.py); las escrituras van al primario
+LECTURAS_EN_SECUNDARIOS = MONGO_READ_PREFERENCE != 'primary'
+# Los secundarios se descubren al conectar; el monitor los va añadiendo
+replicas = ReplicaRouter([])
+
+# Máximo de viajes a MongoDB por ruta (X-DB-Roundtrips en los tests).
+# Cada escritura es un solo comando sobre la tarea más el $inc de los contadores;
+# sin transacciones multi-documento ese segundo viaje no se puede juntar.
+ROUNDTRIP_BUDGETS = {
+    'live_check': 0,
+    'ready_check': 0,
+    'health_check': 1,
+    'get_stats': 1,
+    'get_all_tasks': 2,
+    'get_task': 3,
+    'search_tasks': 1,
+    'get_agenda': 2,
+    'create_task': 2,
+    'update_task': 2,
+    'delete_task': 2,
+    'batch_tasks': 5,
+}
+if LECTURAS_EN_SECUNDARIOS:
+    # Las escrituras preguntan además la posición del primario para la cookie read-after
+    for ruta in ('create_task', 'update_task', 'delete_task', 'batch_tasks'):
+        ROUNDTRIP_BUDGETS[ruta] += 1
+# Una tarea que no está en tasks se busca también en el archivo (get_task). Escribir
+# en una archivada cuesta además devolverla a tasks; es raro y no entra en el presupuesto.
+
+# Métricas de Prometheus en /metrics; el tiempo en MongoDB sale de los eventos del driver
+instrument_flask(app, ROUNDTRIP_BUDGETS)
+# Si MongoDB se vuelve lento se rechazan peticiones con 503 + Retry-After (ver admission.py)
+admission = AdmissionController()
+add_db_observer(admission.observe)
+install_admission(app, admission, {"success": False, "error": "Servidor ocupado, inténtalo de nuevo más tarde"})
+# Cada ruta de tareas actúa para el dueño de la cabecera OWNER_HEADER, en g.owner (ver owners.py)
+install_owners(app, lambda error: {"success": False, "error": error})
+mongo_pool = mongo_pool_listener()
+register_stats('agendaapp_db_pool', 'Conexiones del pool de MongoDB', mongo_pool.stats)
+register_stats('agendaapp_cache', 'Estadísticas de la caché de lecturas (ver /cache/stats)', read_cache.stats)
+register_stats('agendaapp_single_flight', 'Lecturas simultáneas agrupadas (ver /cache/stats)', read_flights.stats)
+register_stats('agendaapp_admission', 'Límites de admisión y peticiones rechazadas', admission.stats)
+register_stats('agendaapp_replicas', 'Lecturas en secundarios y su retraso (ver replicas.py)', replicas.stats)
+
 # Conectar a MongoDB
 try:
-    client = MongoClient(MONGO_HOST, MONGO_PORT, serverSelectionTimeoutMS=5000)
+    client = MongoClient(MONGO_HOST, MONGO_PORT, serverSelectionTimeoutMS=5000,
+                         event_listeners=[mongo_command_timer(), mongo_pool])
     db = client[MONGO_DB]
     tasks_collection = db.tasks
+    stats_collection = db.task_stats
+    # Tareas completadas hace tiempo (ver archive.py)
+    archive_collection = db[MONGO_ARCHIVE_COLLECTION]
+    
+    # Colecciones para las lecturas, con la preferencia de lectura configurada
+    tasks_read = tasks_collection.with_options(read_preference=mongo_read_preference())
+    stats_read = stats_collection.with_options(read_preference=mongo_read_preference())
+    archive_read = archive_collection.with_options(read_preference=mongo_read_preference())
+    if LECTURAS_EN_SECUNDARIOS:
+        # Retraso de cada secundario según los heartbeats del driver, sin consultas extra
+        ReplicaMonitor(replicas, mongo_replica_check(client)).start()
+    
+    # Comprobar MongoDB en segundo plano; /readyz solo lee el último resultado
+    readiness = ReadinessChecker(mongo_readiness_check(tasks_collection)).start()
+    register_stats('agendaapp_readiness', 'Última comprobación de MongoDB (ver /readyz)', readiness.stats)
     
     # Probar la conexión
     client.admin.command('ping')
     logger.info(" Conectado exitosamente a MongoDB")
     
+    # Los índices sin owner_id quedan sustituidos por los de abajo, que empiezan por el dueño
+    mongo_drop_indexes(tasks_collection, MONGO_UNSCOPED_INDEXES)
+    mongo_drop_indexes(archive_collection, MONGO_ARCHIVED_UNSCOPED_INDEXES)
+    
+    # Índices compuestos para la paginación por cursor y los filtros de GET /tasks
+    for keys, options in MONGO_OWNER_INDEXES:
+        tasks_collection.create_index(keys, **options)
+    
+    # Índice parcial de tareas pendientes por fecha de vencimiento para /agenda
+    tasks_collection.create_index(MONGO_AGENDA_INDEX[0], **MONGO_AGENDA_INDEX[1])
+    
+    # Índice de texto para /tasks/search y otro normal para el autocompletado
+    for keys, options in MONGO_SEARCH_INDEXES:
+        tasks_collection.create_index(keys, **options)
+    
+    # Completadas por antigüedad (y por dueño) para el archivado, y el orden de la lista en el archivo
+    tasks_collection.create_index(MONGO_ARCHIVE_INDEX[0], **MONGO_ARCHIVE_INDEX[1])
+    tasks_collection.create_index(MONGO_KEEP_DONE_INDEX[0], **MONGO_KEEP_DONE_INDEX[1])
+    for keys, options in MONGO_ARCHIVED_INDEXES:
+        archive_collection.create_index(keys, **options)
+    
+    # Las tareas anteriores a los dueños pasan al dueño por defecto, con sus contadores
+    if mongo_backfill(tasks_collection) + mongo_backfill(archive_collection):
+        mongo_reconcile(tasks_collection, stats_collection, archive_collection)
+    
+    # Recalcular periódicamente los contadores por si se desvían
+    start_reconciler(lambda: mongo_reconcile(tasks_collection, stats_collection, archive_collection))
+    
+    # Mover al archivo las tareas completadas hace tiempo; tasks solo guarda las activas
+    start_reconciler(lambda: mongo_archive(tasks_collection, archive_collection, stats_collection),
+                     ARCHIVE_INTERVAL)
+    
+    # Invalidar la caché cuando otra réplica escribe (change streams; sin ellos, solo TTL)
+    if read_cache.enabled:
+        # Cada escritura sube la versión de su dueño en task_stats: solo se invalida ese dueño
+        MongoChangeListener(stats_collection, read_cache.invalidate, read_cache.set_listening,
+                            owner_of=mongo_changed_owner).start()
+    
 except Exception as e:
     logger.error(f" Error al conectar con MongoDB: {e}")
     # La app seguirá ejecutándose, pero las operaciones de DB fallarán
@@ -42,32 +180,96 @@ except Exception as e:
 def serialize_task(task):
     if task:
         task['_id'] = str(task['_id'])
+        # El dueño es el de la petición (ver owners.py)
+        task.pop('owner_id', None)
         return task
     return None
 
+@contextmanager
+def sesion_lectura():
+    """Sesión causal para las lecturas de la petición; None si se lee del primario.
+
+    Dentro de la sesión cada lectura ve al menos lo que vio la anterior (la
+    versión de los contadores y las tareas cuadran aunque vayan a distintos
+    secundarios). Con la cookie read-after la sesión empieza en la última
+    escritura del cliente: el secundario espera a tenerla antes de responder.
+    """
+    if not LECTURAS_EN_SECUNDARIOS:
+        yield None
+        return
+    with client.start_session(causal_consistency=True) as session:
+        posicion = read_after(request.cookies.get(READ_AFTER_COOKIE))
+        if posicion is not None:
+            session.advance_operation_time(mongo_timestamp(posicion))
+        yield session
+
+def posicion_lectura(session):
+    """Posición (cluster time) de lo leído en la sesión, para la caché; None en el primario"""
+    return mongo_position(session.operation_time) if session is not None else None
+
+def read_after_position():
+    """Posición de la última escritura del cliente (cookie READ_AFTER_COOKIE) o None"""
+    return read_after(request.cookies.get(READ_AFTER_COOKIE))
+
 # Función auxiliar para obtener estadísticas
-def get_database_stats():
+# Lee el documento de contadores (O(1)); si aún no existe, lo calcula una vez.
+# Devuelve (estadísticas, versión); la versión alimenta los ETags y la caché.
+# Las estadísticas y la versión son las del dueño: las escrituras de otros dueños no las cambian
+def get_database_counters(session=None, *, owner):
     try:
-        total_tasks = tasks_collection.count_documents({})
-        completed_tasks = tasks_collection.count_documents({"done": True})
-        pending_tasks = total_tasks - completed_tasks
-        
-        return {
-            "total": total_tasks,
-            "completed": completed_tasks,
-            "pending": pending_tasks
-        }
+        stats, version = mongo_read_counters(stats_read, session, owner=owner)
+        if stats is None:
+            mongo_reconcile(tasks_collection, stats_collection, archive_collection)
+            stats, version = mongo_read_counters(stats_collection, owner=owner)
+        return stats, version
     except Exception as e:
         logger.error(f"Error al obtener estadísticas: {e}")
-        return {"total": 0, "completed": 0, "pending": 0}
+        return {"total": 0, "completed": 0, "pending": 0}, None
+
+# Escritura agrupada (GROUP_COMMIT=true): las tareas que llegan dentro de la
+# ventana se insertan con un solo insert_many y un solo bulk_write de los
+# contadores (los de cada dueño). Cada petición recibe su tarea o,
+# si falló, su propio error.
+def insertar_tareas(tareas):
+    errores = {}
+    try:
+        tasks_collection.insert_many(tareas, ordered=False)
+    except BulkWriteError as e:
+        errores = {error['index']: WriteError(error['errmsg'], error['code'], error)
+                   for error in e.details['writeErrors']}
+    creadas = [tarea for i, tarea in enumerate(tareas) if i not in errores]
+    if creadas:
+        por_dueno = {}
+        for tarea in creadas:
+            total, completadas = por_dueno.get(tarea['owner_id'], (0, 0))
+            por_dueno[tarea['owner_id']] = (total + 1, completadas + int(tarea['done'] is True))
+        stats_collection.bulk_write(mongo_delta_requests(por_dueno), ordered=False)
+    return [errores.get(i, tarea) for i, tarea in enumerate(tareas)]
+
+task_committer = GroupCommitter(insertar_tareas) if GROUP_COMMIT else None
+
+# Variación del contador de completadas al pasar de 'before' a 'after'
+def completed_delta(before, after):
+    return int(after.get('done') is True) - int(before.get('done') is True)
 
 # ============================================================================
 # RUTAS DE LA API
 # ============================================================================
 
+@app.route('/livez', methods=['GET'])
+def live_check():
+    """Sonda de vida: solo el proceso, sin tocar MongoDB"""
+    return jsonify(liveness())
+
+@app.route('/readyz', methods=['GET'])
+def ready_check():
+    """Sonda de disponibilidad: último resultado de la comprobación en segundo plano"""
+    ready, body = readiness.status()
+    return jsonify(body), 200 if ready else 503
+
 @app.route('/health', methods=['GET'])
 def health_check():
-    """Endpoint para verificar que el backend está funcionando"""
+    """Informe detallado para humanos (las sondas usan /livez y /readyz)"""
     try:
         # Probar conexión a MongoDB
         client.admin.command('ping')
@@ -75,43 +277,222 @@ def health_check():
     except Exception as e:
         mongo_status = f"error: {str(e)}"
     
-    return jsonify({
+    body = {
         "status": "healthy",
         "service": "AgendaApp Backend",
         "timestamp": datetime.now().isoformat(),
         "mongodb": mongo_status,
         "version": "1.0.0"
-    })
+    }
+    if LECTURAS_EN_SECUNDARIOS:
+        body["replicas"] = [status._asdict() for status in replicas.status()]
+    return jsonify(body)
+
+def load_tasks_page(query, limit, wire_format, revalidate=True, include_archived=False):
+    """((etag, cuerpo codificado), posición leída) de una página de GET /tasks; cuerpo None si el cliente ya la tiene"""
+    with sesion_lectura() as session:
+        # Si el cliente ya tiene esta versión de la lista, no tocamos las tareas
+        stats, version = get_database_counters(session, owner=g.owner)
+        etag = make_etag(version, 'tasks', g.owner, wire_format, query_key(request.args))
+        if revalidate and not_modified(etag):
+            return (etag, None), posicion_lectura(session)
+        
+        # Ordenadas por fecha de creación; pedimos una de más para saber si hay otra página
+        tasks = list(tasks_read.find(query, session=session).sort("_id", -1).limit(limit + 1))
+        if include_archived:
+            # La misma página en el archivo, mezclada por _id
+            archived = archive_read.find(query, session=session).sort("_id", -1).limit(limit + 1)
+            tasks = newest_first([tasks, archived], limit + 1)
+        tasks = [serialize_task(task) for task in tasks]
+        posicion = posicion_lectura(session)
+    
+    next_cursor = None
+    if len(tasks) > limit:
+        tasks = tasks[:limit]
+        next_cursor = encode_cursor(tasks[-1]['_id'])
+    
+    logger.info(f" Encontradas {len(tasks)} tareas")
+    
+    # Guardamos el cuerpo ya codificado para no volver a serializar en cada acierto;
+    # las fechas van en MessagePack igual que en el JSON
+    return (etag, encode_wire({
+        "success": True,
+        "tasks": wire_tasks(tasks, wire_format),
+        "stats": stats,
+        "total": len(tasks),
+        "next": next_cursor
+    }, wire_format, app.json.dumps, http_date)), posicion
 
 @app.route('/tasks', methods=['GET'])
 def get_all_tasks():
-    """Obtener todas las tareas"""
+    """Obtener una página de tareas (paginación por cursor sobre _id)"""
     try:
-        logger.info(" Obteniendo todas las tareas")
-        
-        # Obtener todas las tareas ordenadas por fecha de creación
-        tasks_cursor = tasks_collection.find().sort("_id", -1)
-        tasks = [serialize_task(task) for task in tasks_cursor]
+        try:
+            filters = parse_list_args(request.args)
+            # El dueño va primero en todos los índices de la lista
+            query = {"owner_id": g.owner}
+            if filters['done'] is not None:
+                query['done'] = filters['done']
+            if filters['due_from'] or filters['due_to']:
+                query['due_date'] = {}
+                if filters['due_from']:
+                    query['due_date']['$gte'] = filters['due_from'].isoformat()
+                if filters['due_to']:
+                    query['due_date']['$lte'] = filters['due_to'].isoformat()
+            if filters['cursor']:
+                last_id, = decode_cursor(filters['cursor'], 1)
+                query['_id'] = {"$lt": ObjectId(last_id)}
+        except (ValueError, TypeError, InvalidId) as e:
+            return jsonify({
+                "success": False,
+                "error": str(e),
+                "tasks": []
+            }), 400
         
-        stats = get_database_stats()
+        logger.info(f" Obteniendo tareas (limit={filters['limit']})")
+        
+        # JSON, JSON por columnas o MessagePack, según la cabecera Accept (ver wire_format.py)
+        wire_format = negotiate_format(request.headers.get('Accept'))
+        cache_key = ('tasks', g.owner, wire_format, query_key(request.args))
+        posicion_cliente = read_after_position()
+        page = read_cache.get(cache_key, posicion_cliente)
+        if page is None:
+            generation = read_cache.generation_for(g.owner)
+            page, posicion = read_flights.do((cache_key, generation, posicion_cliente),
+                                             lambda: load_tasks_page(query, filters['limit'], wire_format,
+                                                                     include_archived=filters['include_archived']))
+            if page[1] is None:
+                # El cliente del líder ya tenía esta versión y no se leyeron las tareas
+                cached = not_modified(page[0])
+                if cached:
+                    cached.vary.add('Accept')
+                    return cached
+                page, posicion = load_tasks_page(query, filters['limit'], wire_format, revalidate=False,
+                                                 include_archived=filters['include_archived'])
+            read_cache.set(cache_key, page, generation, posicion, posicion_cliente)
+        
+        etag, body = page
+        response = not_modified(etag) or with_etag(app.response_class(body, mimetype=wire_format), etag)
+        response.vary.add('Accept')
+        return response
         
-        logger.info(f" Encontradas {len(tasks)} tareas")
+    except Exception as e:
+        logger.error(f" Error al obtener tareas: {e}")
+        return jsonify({
+            "success": False,
+            "error": str(e),
+            "tasks": []
+        }), 500
+
+@app.route('/tasks/search', methods=['GET'])
+def search_tasks():
+    """Buscar tareas por título (índice de texto), ordenadas por relevancia"""
+    try:
+        params = parse_search_args(request.args)
+    except (ValueError, TypeError) as e:
+        return jsonify({
+            "success": False,
+            "error": str(e),
+            "tasks": []
+        }), 400
+    
+    try:
+        with sesion_lectura() as session:
+            if params['mode'] == 'autocomplete':
+                # Solo _id y título, para sugerencias mientras se escribe
+                cursor = tasks_read.find(mongo_autocomplete_filter(params['q'], g.owner), {"title": 1},
+                                         session=session).limit(params['limit'])
+                return jsonify({
+                    "success": True,
+                    "tasks": [serialize_task(task) for task in cursor]
+                })
+            
+            query, projection, sort = mongo_search_find(params, g.owner)
+            cursor = tasks_read.find(query, projection, session=session).sort(sort).skip(params['offset']).limit(params['limit'] + 1)
+            tasks = [serialize_task(task) for task in cursor]
+        next_cursor = next_search_cursor(params, len(tasks))
+        tasks = tasks[:params['limit']]
         
         return jsonify({
             "success": True,
             "tasks": tasks,
-            "stats": stats,
-            "total": len(tasks)
+            "total": len(tasks),
+            "next": next_cursor
         })
         
     except Exception as e:
-        logger.error(f" Error al obtener tareas: {e}")
+        logger.error(f" Error al buscar tareas: {e}")
         return jsonify({
             "success": False,
             "error": str(e),
             "tasks": []
         }), 500
 
+@app.route('/agenda', methods=['GET'])
+def get_agenda():
+    """Tareas que vencen en una ventana de fechas, agrupadas por día, y cuántas están atrasadas"""
+    try:
+        params = parse_agenda_args(request.args)
+    except ValueError as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 400
+    
+    try:
+        with sesion_lectura() as session:
+            cursor = tasks_read.find(mongo_agenda_filter(params, g.owner), session=session).sort([("due_date", 1), ("_id", 1)]).limit(AGENDA_MAX_TASKS + 1)
+            tasks = [serialize_task(task) for task in cursor]
+            overdue = tasks_read.count_documents(mongo_overdue_filter(params, g.owner), session=session)
+        
+        days = group_by_day(tasks[:AGENDA_MAX_TASKS])
+        return jsonify({"success": True, **agenda_body(params, days, overdue, len(tasks) > AGENDA_MAX_TASKS)})
+        
+    except Exception as e:
+        logger.error(f" Error al obtener la agenda: {e}")
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+EXPORT_FIELDS = ['_id', 'title', 'done', 'due_date', 'created_at', 'updated_at']
+
+@app.route('/tasks/export', methods=['GET'])
+def export_tasks():
+    """Exportar todas las tareas del dueño en streaming (NDJSON o CSV)"""
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({
+            "success": False,
+            "error": f"Formato de exportación no soportado: {fmt}"
+        }), 400
+    
+    def rows(owner):
+        # Los cursores traen los documentos de Mongo en lotes de EXPORT_BATCH_SIZE;
+        # las archivadas se intercalan por _id
+        cursors = [collection.find({"owner_id": owner}, batch_size=EXPORT_BATCH_SIZE).sort("_id", 1)
+                   for collection in (tasks_collection, archive_collection)]
+        try:
+            for task in oldest_first(cursors):
+                yield serialize_task(task)
+        finally:
+            for cursor in cursors:
+                cursor.close()
+    
+    try:
+        # g no existe ya cuando se consume el generador
+        body = primed(encode_rows(rows(g.owner), fmt, EXPORT_FIELDS))
+    except Exception as e:
+        logger.error(f" Error al exportar tareas: {e}")
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+    
+    response = Response(body, mimetype=EXPORT_FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename={export_filename(fmt)}'
+    return response
+
 @app.route('/tasks', methods=['POST'])
 def create_task():
     """Crear una nueva tarea"""
@@ -128,22 +509,26 @@ def create_task():
         new_task = {
             "title": data['title'].strip(),
             "done": data.get('done', False),
+            "due_date": mongo_due_date(parse_due_date(data.get('due_date'))),
             "created_at": datetime.now(),
-            "updated_at": datetime.now()
+            "updated_at": datetime.now(),
+            "owner_id": g.owner
         }
         
-        # Insertar en MongoDB
-        result = tasks_collection.insert_one(new_task)
-        
-        # Obtener la tarea creada
-        created_task = tasks_collection.find_one({"_id": result.inserted_id})
+        # Insertar en MongoDB; insert_one añade el _id a new_task, así que la
+        # respuesta se arma sin volver a leer el documento
+        if task_committer is not None:
+            new_task = task_committer.submit(new_task)
+        else:
+            tasks_collection.insert_one(new_task)
+            mongo_apply_delta(stats_collection, total=1, completed=1 if new_task['done'] is True else 0, owner=g.owner)
         
         logger.info(f" Nueva tarea creada: {new_task['title']}")
         
         return jsonify({
             "success": True,
             "message": "Tarea creada exitosamente",
-            "task": serialize_task(created_task)
+            "task": serialize_task(new_task)
         }), 201
         
     except Exception as e:
@@ -153,6 +538,141 @@ def create_task():
             "error": str(e)
         }), 500
 
+@app.route('/tasks/batch', methods=['POST'])
+def batch_tasks():
+    """Crear, actualizar y eliminar varias tareas con un solo bulk_write"""
+    try:
+        creates, updates, deletes, results = parse_batch(request.get_json(silent=True))
+    except BatchError as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), e.status
+    
+    try:
+        now = datetime.now()
+        
+        # Validar ids y leer de una sola vez las tareas que se van a tocar
+        object_ids = {}
+        for op, entries in (('update', updates), ('delete', deletes)):
+            for index, task_id, *_ in entries:
+                try:
+                    object_ids[task_id] = ObjectId(task_id)
+                except (InvalidId, TypeError):
+                    results[index] = item_result(index, op, 404, error="Tarea no encontrada")
+        existing = {}
+        if object_ids:
+            existing = {task['_id']: task for task in tasks_collection.find(
+                mongo_owned({"_id": {"$in": list(object_ids.values())}}, g.owner))}
+            # Las archivadas vuelven a tasks antes de escribir en ellas
+            missing = set(object_ids.values()) - set(existing)
+            if missing:
+                existing.update(mongo_restore(tasks_collection, archive_collection, missing, now, g.owner))
+        
+        operations = []
+        delta_total = 0
+        delta_completed = 0
+        
+        for index, fields in creates:
+            new_task = {
+                "_id": ObjectId(),
+                "title": fields['title'],
+                "done": fields['done'],
+                "due_date": mongo_due_date(fields['due_date']),
+                "created_at": now,
+                "updated_at": now,
+                "owner_id": g.owner
+            }
+            operations.append(InsertOne(new_task))
+            delta_total += 1
+            delta_completed += int(new_task['done'] is True)
+            results[index] = item_result(index, 'create', 201, task=serialize_task(dict(new_task)))
+        
+        for index, task_id, fields in updates:
+            if results[index] is not None:
+                continue
+            current = existing.get(object_ids[task_id])
+            if current is None:
+                results[index] = item_result(index, 'update', 404, error="Tarea no encontrada")
+                continue
+            update_fields = {"updated_at": now}
+            for field in ('title', 'done'):
+                if field in fields:
+                    update_fields[field] = fields[field]
+            if 'due_date' in fields:
+                update_fields['due_date'] = mongo_due_date(fields['due_date'])
+            operations.append(UpdateOne(mongo_owned({"_id": current['_id']}, g.owner), {"$set": update_fields}))
+            delta_completed += completed_delta(current, {**current, **update_fields})
+            results[index] = item_result(index, 'update', 200, task=serialize_task({**current, **update_fields}))
+        
+        for index, task_id in deletes:
+            if results[index] is not None:
+                continue
+            if object_ids[task_id] not in existing:
+                results[index] = item_result(index, 'delete', 404, error="Tarea no encontrada")
+                continue
+            operations.append(DeleteOne(mongo_owned({"_id": object_ids[task_id]}, g.owner)))
+            delta_total -= 1
+            delta_completed -= int(existing[object_ids[task_id]].get('done') is True)
+            results[index] = item_result(index, 'delete', 200)
+        
+        if operations:
+            tasks_collection.bulk_write(operations, ordered=False)
+            mongo_apply_delta(stats_collection, total=delta_total, completed=delta_completed, owner=g.owner)
+        
+        logger.info(f" Lote aplicado: {len(operations)} operaciones")
+        
+        return jsonify({
+            "success": True,
+            "results": results
+        })
+        
+    except Exception as e:
+        logger.error(f" Error al aplicar lote: {e}")
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+@app.route('/tasks/<task_id>', methods=['GET'])
+def get_task(task_id):
+    """Obtener una tarea por id"""
+    try:
+        with sesion_lectura() as session:
+            _, version = get_database_counters(session, owner=g.owner)
+            etag = make_etag(version, 'task', g.owner, task_id)
+            cached = not_modified(etag)
+            if cached:
+                return cached
+            
+            query = mongo_owned({"_id": ObjectId(task_id)}, g.owner)
+            task = tasks_read.find_one(query, session=session)
+            if task is None:
+                task = archive_read.find_one(query, session=session)
+        
+        if task is None:
+            return jsonify({
+                "success": False,
+                "error": "Tarea no encontrada"
+            }), 404
+        
+        return with_etag(jsonify({
+            "success": True,
+            "task": serialize_task(task)
+        }), etag)
+        
+    except InvalidId:
+        return jsonify({
+            "success": False,
+            "error": "Tarea no encontrada"
+        }), 404
+    except Exception as e:
+        logger.error(f" Error al obtener tarea: {e}")
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
 @app.route('/tasks/<task_id>', methods=['PUT'])
 def update_task(task_id):
     """Actualizar una tarea existente"""
@@ -172,21 +692,29 @@ def update_task(task_id):
             update_fields['title'] = data['title'].strip()
         if 'done' in data:
             update_fields['done'] = bool(data['done'])
-        
-        # Actualizar tarea
-        result = tasks_collection.update_one(
-            {"_id": ObjectId(task_id)},
-            {"$set": update_fields}
+        if 'due_date' in data:
+            update_fields['due_date'] = mongo_due_date(parse_due_date(data['due_date']))
+        
+        # Actualizar tarea; el documento previo indica si cambió 'done'
+        actualizar = lambda: tasks_collection.find_one_and_update(
+            mongo_owned({"_id": ObjectId(task_id)}, g.owner),
+            {"$set": update_fields},
+            return_document=ReturnDocument.BEFORE
         )
+        previous_task = actualizar()
+        if previous_task is None and mongo_restore(tasks_collection, archive_collection, [ObjectId(task_id)],
+                                                   owner=g.owner):
+            # Estaba archivada: vuelve a tasks con el cambio
+            previous_task = actualizar()
         
-        if result.matched_count == 0:
+        if previous_task is None:
             return jsonify({
                 "success": False,
                 "error": "Tarea no encontrada"
             }), 404
         
-        # Obtener tarea actualizada
-        updated_task = tasks_collection.find_one({"_id": ObjectId(task_id)})
+        updated_task = {**previous_task, **update_fields}
+        mongo_apply_delta(stats_collection, completed=completed_delta(previous_task, updated_task), owner=g.owner)
         
         logger.info(f" Tarea actualizada: {task_id}")
         
@@ -207,14 +735,20 @@ def update_task(task_id):
 def delete_task(task_id):
     """Eliminar una tarea"""
     try:
-        result = tasks_collection.delete_one({"_id": ObjectId(task_id)})
+        query = mongo_owned({"_id": ObjectId(task_id)}, g.owner)
+        deleted_task = tasks_collection.find_one_and_delete(query)
+        if deleted_task is None:
+            deleted_task = archive_collection.find_one_and_delete(query)
         
-        if result.deleted_count == 0:
+        if deleted_task is None:
             return jsonify({
                 "success": False,
                 "error": "Tarea no encontrada"
             }), 404
         
+        mongo_apply_delta(stats_collection, total=-1, completed=-1 if deleted_task.get('done') is True else 0,
+                          owner=g.owner)
+        
         logger.info(f" Tarea eliminada: {task_id}")
         
         return jsonify({
@@ -229,16 +763,31 @@ def delete_task(task_id):
             "error": str(e)
         }), 500
 
+def load_stats_entry(owner):
+    """((etag, estadísticas del dueño), posición leída)"""
+    with sesion_lectura() as session:
+        stats, version = get_database_counters(session, owner=owner)
+        return (make_etag(version, 'stats', owner), stats), posicion_lectura(session)
+
 @app.route('/stats', methods=['GET'])
 def get_stats():
     """Obtener estadísticas de las tareas"""
     try:
-        stats = get_database_stats()
-        
-        return jsonify({
+        posicion_cliente = read_after_position()
+        owner = g.owner
+        entry = read_cache.get(('stats', owner), posicion_cliente)
+        if entry is None:
+            generation = read_cache.generation_for(owner)
+            # Quien acaba de escribir no comparte una lectura que podría ser anterior a su escritura
+            entry, posicion = read_flights.do(('stats', owner, generation, posicion_cliente),
+                                              lambda: load_stats_entry(owner))
+            read_cache.set(('stats', owner), entry, generation, posicion, posicion_cliente)
+        etag, stats = entry
+        
+        return not_modified(etag) or with_etag(jsonify({
             "success": True,
             "stats": stats
-        })
+        }), etag)
         
     except Exception as e:
         logger.error(f"❌ Error al obtener estadísticas: {e}")
@@ -248,6 +797,70 @@ def get_stats():
             "stats": {"total": 0, "completed": 0, "pending": 0}
         }), 500
 
+@app.route('/stats/reconcile', methods=['POST'])
+def reconcile_stats():
+    """Recalcular los contadores desde la colección y corregir desviaciones"""
+    try:
+        report = mongo_reconcile(tasks_collection, stats_collection, archive_collection)
+        
+        return jsonify({
+            "success": True,
+            **report
+        })
+        
+    except Exception as e:
+        logger.error(f" Error al reconciliar estadísticas: {e}")
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+@app.route('/tasks/archive', methods=['POST'])
+def archive_now():
+    """Archivar ya las tareas completadas que toquen, sin esperar al proceso periódico"""
+    try:
+        report = mongo_archive(tasks_collection, archive_collection, stats_collection)
+        
+        return jsonify({
+            "success": True,
+            **report
+        })
+        
+    except Exception as e:
+        logger.error(f" Error al archivar tareas: {e}")
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """Aciertos, fallos y desalojos de la caché de lecturas"""
+    return jsonify({
+        "success": True,
+        "cache": read_cache.stats(),
+        "single_flight": read_flights.stats()
+    })
+
+def set_read_after(response):
+    """Cookie con la posición del primario: las siguientes lecturas del cliente incluyen su escritura"""
+    try:
+        posicion = mongo_position(client.admin.command('hello')['lastWrite']['opTime']['ts'])
+    except Exception as e:
+        logger.warning(f" No se pudo leer la posición del primario: {e}")
+        return
+    name, value, options = read_after_cookie(posicion)
+    response.set_cookie(name, value, **options)
+
+@app.after_request
+def invalidate_cache_after_write(response):
+    # Las escrituras locales se ven en la siguiente lectura sin esperar al change stream
+    if request.method in ('POST', 'PUT', 'DELETE'):
+        read_cache.invalidate_all()
+        if LECTURAS_EN_SECUNDARIOS and response.status_code < 400:
+            set_read_after(response)
+    return response
+
 @app.route('/database/info', methods=['GET'])
 def get_database_info():
     """Obtener información detallada de la base de datos - ÚTIL PARA DEBUG"""
@@ -258,8 +871,8 @@ def get_database_info():
         # Información de la colección de tareas
         collection_stats = db.command("collstats", "tasks")
         
-        # Algunas tareas de ejemplo
-        sample_tasks = list(tasks_collection.find().limit(3))
+        # Algunas tareas de ejemplo, solo del dueño que pregunta
+        sample_tasks = list(tasks_collection.find(mongo_owned({}, g.owner)).limit(3))
         
         return jsonify({
             "success": True,
@@ -269,13 +882,13 @@ def get_database_info():
                 "port": MONGO_PORT,
                 "collections": db.list_collection_names(),
                 "db_size_mb": round(db_stats.get("dataSize", 0) / (1024*1024), 2),
+                # El número de documentos es de todos los dueños: no se publica
                 "tasks_collection": {
-                    "count": collection_stats.get("count", 0),
                     "size_bytes": collection_stats.get("size", 0)
                 }
             },
             "sample_tasks": [serialize_task(task) for task in sample_tasks],
-            "stats": get_database_stats()
+            "stats": get_database_counters(owner=g.owner)[0]
         })
         
     except Exception as e:
@@ -318,4 +931,4 @@ if __name__ == '__main__':
         port=5000, 
         debug=os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
     )
-// GitHub Actions test - vie 07 nov 2025 06:24:43 -05
+# GitHub Actions test - vie 07 nov 2025 06:24:43 -05
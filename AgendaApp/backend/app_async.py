@@ -0,0 +1,1107 @@
+"""Variante ASGI de app.py sobre motor (driver asíncrono de MongoDB).
+
+Mismas rutas y mismas respuestas JSON que la app Flask, pero cada acceso a
+MongoDB se espera con await en lugar de bloquear un hilo, así que un solo
+proceso atiende muchos clientes lentos a la vez:
+
+    uvicorn app_async:app --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import contextlib
+import json
+import logging
+import os
+from datetime import date, datetime
+from functools import partial
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import InsertOne, UpdateOne, DeleteOne, ReturnDocument
+from pymongo.errors import BulkWriteError, OperationFailure
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+from werkzeug.http import http_date
+
+from pagination import parse_list_args, encode_cursor, decode_cursor
+from counters import (COUNTERS_RECONCILE_INTERVAL, MONGO_OWNER_COUNTS, mongo_delta_requests, mongo_changed_owner,
+                      mongo_counted, mongo_counters_from_docs, mongo_counters_query, mongo_owner_totals,
+                      mongo_reconcile_requests, stats_dict, reconcile_report)
+from conditional import make_etag, query_key, client_has, etag_headers
+from read_cache import ReadCache
+from single_flight import AsyncSingleFlight
+from batch_ops import BatchError, parse_batch, item_result, parse_due_date
+from agenda import (AGENDA_MAX_TASKS, MONGO_AGENDA_INDEX, parse_agenda_args, mongo_due_date, group_by_day,
+                    agenda_body, mongo_agenda_filter, mongo_overdue_filter)
+from export_stream import EXPORT_BATCH_SIZE, EXPORT_FORMATS, encode_rows, export_filename
+from search import (parse_search_args, next_search_cursor, MONGO_SEARCH_INDEXES, mongo_search_find,
+                    mongo_autocomplete_filter)
+from probes import ReadinessChecker, motor_readiness_check, liveness
+from metrics import (MetricsMiddleware, metrics_endpoint, register_stats, add_db_observer, mongo_command_timer,
+                     mongo_pool_listener)
+from admission import AdmissionController, AdmissionMiddleware, AsyncConcurrencyLimiter
+from owners import (DEFAULT_OWNER, MONGO_OWNER_INDEXES, MONGO_UNSCOPED_INDEXES, MONGO_ARCHIVED_UNSCOPED_INDEXES,
+                    OwnerMiddleware, mongo_owned)
+from archive import (ARCHIVE_BATCH_SIZE, ARCHIVE_INTERVAL, MONGO_ARCHIVE_COLLECTION, MONGO_ARCHIVE_INDEX,
+                     MONGO_ARCHIVED_INDEXES, MONGO_KEEP_DONE_INDEX, archive_report, ignore_duplicates,
+                     mongo_archive_filter, mongo_keep_owners, mongo_keep_cutoff_find, mongo_remove_unchanged,
+                     mongo_restore_filter, mongo_restored, mongo_written_meanwhile, newest_first, oldest_first_async)
+from wire_format import negotiate_format, wire_tasks, encode as encode_wire
+from compression import CompressionMiddleware
+from replicas import (READ_AFTER_COOKIE, MONGO_READ_PREFERENCE, ReplicaRouter, ReplicaMonitor, mongo_read_preference,
+                      mongo_replica_check, mongo_position, mongo_timestamp, read_after, read_after_cookie)
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Configuración de MongoDB (igual que app.py)
+MONGO_HOST = os.getenv('MONGO_HOST', 'localhost')
+MONGO_PORT = int(os.getenv('MONGO_PORT', 27017))
+MONGO_DB = os.getenv('MONGO_DB', 'agendaapp')
+MONGO_POOL_MAX = int(os.getenv('MONGO_POOL_MAX', 100))
+
+logger.info(f" Conectando a MongoDB en {MONGO_HOST}:{MONGO_PORT}")
+
+# Motor conecta de forma perezosa; el pool de conexiones es el del driver
+mongo_pool = mongo_pool_listener()
+client = AsyncIOMotorClient(MONGO_HOST, MONGO_PORT, serverSelectionTimeoutMS=5000, maxPoolSize=MONGO_POOL_MAX,
+                            event_listeners=[mongo_command_timer(), mongo_pool])
+db = client[MONGO_DB]
+tasks_collection = db.tasks
+stats_collection = db.task_stats
+# Tareas completadas hace tiempo (ver archive.py)
+archive_collection = db[MONGO_ARCHIVE_COLLECTION]
+
+# Lecturas en secundarios según MONGO_READ_PREFERENCE (ver replicas.py); las escrituras van al primario
+LECTURAS_EN_SECUNDARIOS = MONGO_READ_PREFERENCE != 'primary'
+if LECTURAS_EN_SECUNDARIOS:
+    tasks_read = tasks_collection.with_options(read_preference=mongo_read_preference())
+    stats_read = stats_collection.with_options(read_preference=mongo_read_preference())
+    archive_read = archive_collection.with_options(read_preference=mongo_read_preference())
+else:
+    tasks_read, stats_read, archive_read = tasks_collection, stats_collection, archive_collection
+# Los secundarios se descubren al conectar; el monitor los va añadiendo
+replicas = ReplicaRouter([])
+
+# Caché en memoria de la lista de tareas y las estadísticas
+read_cache = ReadCache()
+# Los fallos de caché idénticos y simultáneos comparten una sola carga (ver single_flight.py)
+read_flights = AsyncSingleFlight()
+background_tasks = []
+
+# Comprobación de MongoDB en segundo plano; /readyz solo lee el último resultado
+readiness = ReadinessChecker(motor_readiness_check(tasks_collection))
+
+EXPORT_FIELDS = ['_id', 'title', 'done', 'due_date', 'created_at', 'updated_at']
+
+
+# Las fechas salen en el mismo formato que el JSON de Flask (RFC 822)
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return http_date(value)
+    return str(value)
+
+
+def json_response(data, status=200, headers=None):
+    return Response(json.dumps(data, default=_json_default), status_code=status,
+                    headers=headers, media_type='application/json')
+
+
+def not_modified(request, etag):
+    if not client_has(request.headers.get('if-none-match'), etag):
+        return None
+    return Response(status_code=304, headers=etag_headers(etag))
+
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+# Función auxiliar para convertir ObjectId a string
+def serialize_task(task):
+    if task:
+        task['_id'] = str(task['_id'])
+        # El dueño es el de la petición (ver owners.py)
+        task.pop('owner_id', None)
+        return task
+    return None
+
+
+# Versiones asíncronas de los helpers de counters.py
+async def apply_delta(total=0, completed=0, *, owner):
+    await stats_collection.bulk_write(mongo_delta_requests({owner: (total, completed)}), ordered=False)
+
+
+async def read_counters(session=None, *, owner):
+    docs = await stats_read.find(mongo_counters_query(owner), session=session).to_list(None)
+    return mongo_counters_from_docs(docs, owner)
+
+
+async def reconcile_counters():
+    before, counted = mongo_counted(await stats_collection.find().to_list(None))
+    # Una pasada por colección cuenta todos los dueños; las archivadas también cuentan
+    totals = mongo_owner_totals(await tasks_collection.aggregate(MONGO_OWNER_COUNTS).to_list(None),
+                                await archive_collection.aggregate(MONGO_OWNER_COUNTS).to_list(None))
+    after = stats_dict(sum(t for t, _ in totals.values()), sum(c for _, c in totals.values()))
+    await stats_collection.bulk_write(mongo_reconcile_requests(totals, counted), ordered=False)
+    return reconcile_report(before, after)
+
+
+async def preparar_duenos():
+    """Índices que empiezan por owner_id en lugar de los antiguos, y dueño por defecto para las tareas previas"""
+    for collection, names in ((tasks_collection, MONGO_UNSCOPED_INDEXES),
+                              (archive_collection, MONGO_ARCHIVED_UNSCOPED_INDEXES)):
+        for name in names:
+            try:
+                await collection.drop_index(name)
+            except OperationFailure:
+                pass
+    for keys, options in MONGO_OWNER_INDEXES:
+        await tasks_collection.create_index(keys, **options)
+    backfilled = 0
+    for collection in (tasks_collection, archive_collection):
+        result = await collection.update_many({"owner_id": None}, {"$set": {"owner_id": DEFAULT_OWNER}})
+        backfilled += result.modified_count
+    if backfilled:
+        await reconcile_counters()
+
+
+@contextlib.asynccontextmanager
+async def sesion_lectura(request):
+    """Sesión causal para las lecturas de la petición; None si se lee del primario (ver app.py)"""
+    if not LECTURAS_EN_SECUNDARIOS:
+        yield None
+        return
+    async with await client.start_session(causal_consistency=True) as session:
+        posicion = read_after_position(request)
+        if posicion is not None:
+            session.advance_operation_time(mongo_timestamp(posicion))
+        yield session
+
+
+def posicion_lectura(session):
+    """Posición (cluster time) de lo leído en la sesión, para la caché; None en el primario"""
+    return mongo_position(session.operation_time) if session is not None else None
+
+
+def read_after_position(request):
+    """Posición de la última escritura del cliente (cookie READ_AFTER_COOKIE) o None"""
+    return read_after(request.cookies.get(READ_AFTER_COOKIE))
+
+
+async def comprobar_replicas(check):
+    # Sin E/S: el retraso sale de los heartbeats del driver
+    return check()
+
+
+# Devuelve (estadísticas, versión) de los contadores; con owner, las de ese dueño
+async def get_database_counters(session=None, *, owner):
+    try:
+        stats, version = await read_counters(session, owner=owner)
+        if stats is None:
+            await reconcile_counters()
+            stats, version = await read_counters(owner=owner)
+        return stats, version
+    except Exception as e:
+        logger.error(f"Error al obtener estadísticas: {e}")
+        return {"total": 0, "completed": 0, "pending": 0}, None
+
+
+# Variación del contador de completadas al pasar de 'before' a 'after'
+def completed_delta(before, after):
+    return int(after.get('done') is True) - int(before.get('done') is True)
+
+
+async def reconcile_periodically():
+    while True:
+        await asyncio.sleep(COUNTERS_RECONCILE_INTERVAL)
+        try:
+            await reconcile_counters()
+        except Exception as e:
+            logger.error(f"Counter reconciliation failed: {str(e)}")
+
+
+async def archivar_tareas():
+    """Versión asíncrona de archive.mongo_archive"""
+    # Un límite de completadas por dueño
+    keep_cutoffs = {}
+    keep_owners = mongo_keep_owners()
+    if keep_owners is not None:
+        async for row in tasks_collection.aggregate(keep_owners):
+            newest = await tasks_collection.find(**mongo_keep_cutoff_find(row["_id"])).to_list(1)
+            if newest:
+                keep_cutoffs[row["_id"]] = newest[0].get("updated_at")
+    query = mongo_archive_filter(keep_cutoffs)
+
+    moved = 0
+    owners = set()
+    while True:
+        batch = await tasks_collection.find(query).sort("updated_at", 1).limit(ARCHIVE_BATCH_SIZE).to_list(None)
+        if not batch:
+            break
+        owners.update(task["owner_id"] for task in batch)
+        try:
+            await archive_collection.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            ignore_duplicates(e)
+        removed = (await tasks_collection.bulk_write(mongo_remove_unchanged(batch), ordered=False)).deleted_count
+        moved += removed
+        if removed < len(batch):
+            # Escrita mientras tanto: manda la de tasks
+            found = await tasks_collection.find({"_id": {"$in": [task["_id"] for task in batch]}},
+                                                {"_id": 1}).to_list(None)
+            gone = mongo_written_meanwhile(removed, batch, found)
+            if gone:
+                await archive_collection.delete_many({"_id": {"$in": gone}})
+        if len(batch) < ARCHIVE_BATCH_SIZE:
+            break
+    if moved:
+        # Los totales no cambian, pero las listas de estos dueños sí: ETags nuevos
+        await stats_collection.bulk_write(mongo_delta_requests(dict.fromkeys(owners, (0, 0))), ordered=False)
+    return archive_report(moved)
+
+
+async def archivar_periodicamente():
+    while True:
+        await asyncio.sleep(ARCHIVE_INTERVAL)
+        try:
+            await archivar_tareas()
+        except Exception as e:
+            logger.error(f"Archiving tasks failed: {str(e)}")
+
+
+async def restaurar_archivadas(ids, now=None, owner=None):
+    """Versión asíncrona de archive.mongo_restore: las archivadas vuelven a tasks antes de escribir"""
+    restored = mongo_restored([task async for task in archive_collection.find(mongo_restore_filter(ids, owner))],
+                              now)
+    if restored:
+        try:
+            await tasks_collection.insert_many(list(restored.values()), ordered=False)
+        except BulkWriteError as e:
+            ignore_duplicates(e)
+        await archive_collection.delete_many({"_id": {"$in": list(restored)}})
+    return restored
+
+
+async def follow_changes(retry=5.0):
+    """Equivalente asíncrono de read_cache.MongoChangeListener."""
+    while True:
+        try:
+            # Cada escritura sube la versión de su dueño en task_stats (ver counters.py)
+            async with stats_collection.watch() as stream:
+                read_cache.set_listening(True)
+                read_cache.invalidate_all()
+                async for change in stream:
+                    read_cache.invalidate(mongo_changed_owner(change))
+        except (OperationFailure, NotImplementedError) as e:
+            # Un servidor standalone no tiene change streams: solo TTL
+            logger.warning(f"Change streams unavailable, cache is TTL-only: {e}")
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Cache change stream disconnected: {e}")
+        finally:
+            read_cache.set_listening(False)
+            read_cache.invalidate_all()
+        await asyncio.sleep(retry)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    logger.info(" Iniciando AgendaApp Backend (ASGI)")
+    background_tasks.append(asyncio.create_task(readiness.run_async()))
+    try:
+        await client.admin.command('ping')
+        logger.info(" Conectado exitosamente a MongoDB")
+        await preparar_duenos()
+        await tasks_collection.create_index(MONGO_AGENDA_INDEX[0], **MONGO_AGENDA_INDEX[1])
+        for keys, options in MONGO_SEARCH_INDEXES:
+            await tasks_collection.create_index(keys, **options)
+        await tasks_collection.create_index(MONGO_ARCHIVE_INDEX[0], **MONGO_ARCHIVE_INDEX[1])
+        await tasks_collection.create_index(MONGO_KEEP_DONE_INDEX[0], **MONGO_KEEP_DONE_INDEX[1])
+        for keys, options in MONGO_ARCHIVED_INDEXES:
+            await archive_collection.create_index(keys, **options)
+        if COUNTERS_RECONCILE_INTERVAL > 0:
+            background_tasks.append(asyncio.create_task(reconcile_periodically()))
+        if ARCHIVE_INTERVAL > 0:
+            # Mover al archivo las tareas completadas hace tiempo (ver archive.py)
+            background_tasks.append(asyncio.create_task(archivar_periodicamente()))
+        if read_cache.enabled:
+            background_tasks.append(asyncio.create_task(follow_changes()))
+        if LECTURAS_EN_SECUNDARIOS:
+            background_tasks.append(asyncio.create_task(ReplicaMonitor(
+                replicas, partial(comprobar_replicas, mongo_replica_check(client.delegate))).run_async()))
+    except Exception as e:
+        logger.error(f" Error al conectar con MongoDB: {e}")
+        # La app seguirá ejecutándose, pero las operaciones de DB fallarán
+    yield
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    client.close()
+
+
+# ============================================================================
+# RUTAS DE LA API
+# ============================================================================
+
+async def live_check(request):
+    """Sonda de vida: solo el proceso, sin tocar MongoDB"""
+    return json_response(liveness())
+
+
+async def ready_check(request):
+    """Sonda de disponibilidad: último resultado de la comprobación en segundo plano"""
+    ready, body = readiness.status()
+    return json_response(body, 200 if ready else 503)
+
+
+async def health_check(request):
+    """Informe detallado para humanos (las sondas usan /livez y /readyz)"""
+    try:
+        await client.admin.command('ping')
+        mongo_status = "connected"
+    except Exception as e:
+        mongo_status = f"error: {str(e)}"
+
+    body = {
+        "status": "healthy",
+        "service": "AgendaApp Backend",
+        "timestamp": datetime.now().isoformat(),
+        "mongodb": mongo_status,
+        "version": "1.0.0"
+    }
+    if LECTURAS_EN_SECUNDARIOS:
+        body["replicas"] = [status._asdict() for status in replicas.status()]
+    return json_response(body)
+
+
+async def load_tasks_page(request, query, limit, wire_format, revalidate=True, include_archived=False):
+    """((etag, cuerpo codificado), posición leída) de una página de GET /tasks; cuerpo None si el cliente ya la tiene"""
+    async with sesion_lectura(request) as session:
+        # Si el cliente ya tiene esta versión de la lista, no tocamos las tareas
+        stats, version = await get_database_counters(session, owner=request.state.owner)
+        etag = make_etag(version, 'tasks', request.state.owner, wire_format, query_key(request.query_params))
+        if revalidate and not_modified(request, etag):
+            return (etag, None), posicion_lectura(session)
+
+        tasks = await tasks_read.find(query, session=session).sort("_id", -1).limit(limit + 1).to_list(None)
+        if include_archived:
+            # La misma página en el archivo, mezclada por _id
+            archived = await archive_read.find(query, session=session).sort("_id", -1).limit(limit + 1).to_list(None)
+            tasks = newest_first([tasks, archived], limit + 1)
+        tasks = [serialize_task(task) for task in tasks]
+        posicion = posicion_lectura(session)
+
+    next_cursor = None
+    if len(tasks) > limit:
+        tasks = tasks[:limit]
+        next_cursor = encode_cursor(tasks[-1]['_id'])
+
+    return (etag, encode_wire({
+        "success": True,
+        "tasks": wire_tasks(tasks, wire_format),
+        "stats": stats,
+        "total": len(tasks),
+        "next": next_cursor
+    }, wire_format, partial(json.dumps, default=_json_default), _json_default)), posicion
+
+
+async def get_all_tasks(request):
+    """Obtener una página de tareas (paginación por cursor sobre _id)"""
+    try:
+        try:
+            filters = parse_list_args(request.query_params)
+            # El dueño va primero en todos los índices de la lista
+            query = {"owner_id": request.state.owner}
+            if filters['done'] is not None:
+                query['done'] = filters['done']
+            if filters['due_from'] or filters['due_to']:
+                query['due_date'] = {}
+                if filters['due_from']:
+                    query['due_date']['$gte'] = filters['due_from'].isoformat()
+                if filters['due_to']:
+                    query['due_date']['$lte'] = filters['due_to'].isoformat()
+            if filters['cursor']:
+                last_id, = decode_cursor(filters['cursor'], 1)
+                query['_id'] = {"$lt": ObjectId(last_id)}
+        except (ValueError, TypeError, InvalidId) as e:
+            return json_response({
+                "success": False,
+                "error": str(e),
+                "tasks": []
+            }, 400)
+
+        # JSON, JSON por columnas o MessagePack, según la cabecera Accept (ver wire_format.py)
+        wire_format = negotiate_format(request.headers.get('accept'))
+        cache_key = ('tasks', request.state.owner, wire_format, query_key(request.query_params))
+        posicion_cliente = read_after_position(request)
+        page = read_cache.get(cache_key, posicion_cliente)
+        if page is None:
+            generation = read_cache.generation_for(request.state.owner)
+            page, posicion = await read_flights.do((cache_key, generation, posicion_cliente),
+                                                   lambda: load_tasks_page(request, query, filters['limit'], wire_format,
+                                                                           include_archived=filters['include_archived']))
+            if page[1] is None:
+                # El cliente del líder ya tenía esta versión y no se leyeron las tareas
+                cached = not_modified(request, page[0])
+                if cached:
+                    cached.headers['Vary'] = 'Accept'
+                    return cached
+                page, posicion = await load_tasks_page(request, query, filters['limit'], wire_format,
+                                                       revalidate=False, include_archived=filters['include_archived'])
+            read_cache.set(cache_key, page, generation, posicion, posicion_cliente)
+
+        etag, body = page
+        response = not_modified(request, etag) or Response(body, headers=etag_headers(etag), media_type=wire_format)
+        response.headers['Vary'] = 'Accept'
+        return response
+
+    except Exception as e:
+        logger.error(f" Error al obtener tareas: {e}")
+        return json_response({
+            "success": False,
+            "error": str(e),
+            "tasks": []
+        }, 500)
+
+
+async def search_tasks(request):
+    """Buscar tareas por título (índice de texto), ordenadas por relevancia"""
+    try:
+        params = parse_search_args(request.query_params)
+    except (ValueError, TypeError) as e:
+        return json_response({
+            "success": False,
+            "error": str(e),
+            "tasks": []
+        }, 400)
+
+    try:
+        async with sesion_lectura(request) as session:
+            if params['mode'] == 'autocomplete':
+                cursor = tasks_read.find(mongo_autocomplete_filter(params['q'], request.state.owner), {"title": 1},
+                                         session=session).limit(params['limit'])
+                return json_response({
+                    "success": True,
+                    "tasks": [serialize_task(task) async for task in cursor]
+                })
+
+            query, projection, sort = mongo_search_find(params, request.state.owner)
+            cursor = tasks_read.find(query, projection, session=session).sort(sort).skip(params['offset']).limit(params['limit'] + 1)
+            tasks = [serialize_task(task) async for task in cursor]
+        next_cursor = next_search_cursor(params, len(tasks))
+        tasks = tasks[:params['limit']]
+
+        return json_response({
+            "success": True,
+            "tasks": tasks,
+            "total": len(tasks),
+            "next": next_cursor
+        })
+
+    except Exception as e:
+        logger.error(f" Error al buscar tareas: {e}")
+        return json_response({
+            "success": False,
+            "error": str(e),
+            "tasks": []
+        }, 500)
+
+
+async def get_agenda(request):
+    """Tareas que vencen en una ventana de fechas, agrupadas por día, y cuántas están atrasadas"""
+    try:
+        params = parse_agenda_args(request.query_params)
+    except ValueError as e:
+        return json_response({
+            "success": False,
+            "error": str(e)
+        }, 400)
+
+    try:
+        async with sesion_lectura(request) as session:
+            cursor = tasks_read.find(mongo_agenda_filter(params, request.state.owner), session=session).sort([("due_date", 1), ("_id", 1)]).limit(AGENDA_MAX_TASKS + 1)
+            tasks = [serialize_task(task) async for task in cursor]
+            overdue = await tasks_read.count_documents(mongo_overdue_filter(params, request.state.owner),
+                                                     session=session)
+
+        days = group_by_day(tasks[:AGENDA_MAX_TASKS])
+        return json_response({"success": True, **agenda_body(params, days, overdue, len(tasks) > AGENDA_MAX_TASKS)})
+
+    except Exception as e:
+        logger.error(f" Error al obtener la agenda: {e}")
+        return json_response({
+            "success": False,
+            "error": str(e)
+        }, 500)
+
+
+async def export_tasks(request):
+    """Exportar todas las tareas del dueño en streaming (NDJSON o CSV)"""
+    fmt = request.query_params.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return json_response({
+            "success": False,
+            "error": f"Formato de exportación no soportado: {fmt}"
+        }, 400)
+
+    # Tareas activas y archivadas, mezcladas por _id
+    query = {"owner_id": request.state.owner}
+    cursors = [tasks_collection.find(query, batch_size=EXPORT_BATCH_SIZE).sort("_id", 1),
+               archive_collection.find(query, batch_size=EXPORT_BATCH_SIZE).sort("_id", 1)]
+    merged = oldest_first_async(cursors)
+
+    async def next_rows():
+        rows = []
+        async for task in merged:
+            rows.append(task)
+            if len(rows) == EXPORT_BATCH_SIZE:
+                break
+        return rows
+
+    async def close():
+        await merged.aclose()
+        for cursor in cursors:
+            await cursor.close()
+
+    # Primer lote antes de empezar la respuesta: los errores siguen siendo un 500
+    try:
+        rows = await next_rows()
+    except Exception as e:
+        logger.error(f" Error al exportar tareas: {e}")
+        await close()
+        return json_response({
+            "success": False,
+            "error": str(e)
+        }, 500)
+
+    async def body(rows):
+        try:
+            header = True
+            while rows:
+                for chunk in encode_rows([serialize_task(task) for task in rows], fmt, EXPORT_FIELDS, header=header):
+                    yield chunk
+                rows, header = await next_rows(), False
+            if header:
+                for chunk in encode_rows([], fmt, EXPORT_FIELDS):
+                    yield chunk
+        finally:
+            await close()
+
+    return StreamingResponse(body(rows), media_type=EXPORT_FORMATS[fmt], headers={
+        'Content-Disposition': f'attachment; filename={export_filename(fmt)}'
+    })
+
+
+async def create_task(request):
+    """Crear una nueva tarea"""
+    try:
+        data = await read_json(request)
+
+        if not data or 'title' not in data:
+            return json_response({
+                "success": False,
+                "error": "El campo 'title' es requerido"
+            }, 400)
+
+        new_task = {
+            "title": data['title'].strip(),
+            "done": data.get('done', False),
+            "due_date": mongo_due_date(parse_due_date(data.get('due_date'))),
+            "created_at": datetime.now(),
+            "updated_at": datetime.now(),
+            "owner_id": request.state.owner
+        }
+
+        # insert_one añade el _id a new_task: no hace falta volver a leerla
+        await tasks_collection.insert_one(new_task)
+        await apply_delta(total=1, completed=1 if new_task['done'] is True else 0, owner=request.state.owner)
+
+        logger.info(f" Nueva tarea creada: {new_task['title']}")
+
+        return json_response({
+            "success": True,
+            "message": "Tarea creada exitosamente",
+            "task": serialize_task(new_task)
+        }, 201)
+
+    except Exception as e:
+        logger.error(f" Error al crear tarea: {e}")
+        return json_response({
+            "success": False,
+            "error": str(e)
+        }, 500)
+
+
+async def batch_tasks(request):
+    """Crear, actualizar y eliminar varias tareas con un solo bulk_write"""
+    try:
+        creates, updates, deletes, results = parse_batch(await read_json(request))
+    except BatchError as e:
+        return json_response({
+            "success": False,
+            "error": str(e)
+        }, e.status)
+
+    try:
+        now = datetime.now()
+        owner = request.state.owner
+
+        # Validar ids y leer de una sola vez las tareas que se van a tocar
+        object_ids = {}
+        for op, entries in (('update', updates), ('delete', deletes)):
+            for index, task_id, *_ in entries:
+                try:
+                    object_ids[task_id] = ObjectId(task_id)
+                except (InvalidId, TypeError):
+                    results[index] = item_result(index, op, 404, error="Tarea no encontrada")
+        existing = {}
+        if object_ids:
+            existing = {task['_id']: task
+                        async for task in tasks_collection.find(
+                            mongo_owned({"_id": {"$in": list(object_ids.values())}}, owner))}
+            # Las archivadas vuelven a tasks antes de escribir en ellas
+            missing = set(object_ids.values()) - set(existing)
+            if missing:
+                existing.update(await restaurar_archivadas(missing, now, owner))
+
+        operations = []
+        delta_total = 0
+        delta_completed = 0
+
+        for index, fields in creates:
+            new_task = {
+                "_id": ObjectId(),
+                "title": fields['title'],
+                "done": fields['done'],
+                "due_date": mongo_due_date(fields['due_date']),
+                "created_at": now,
+                "updated_at": now,
+                "owner_id": owner
+            }
+            operations.append(InsertOne(new_task))
+            delta_total += 1
+            delta_completed += int(new_task['done'] is True)
+            results[index] = item_result(index, 'create', 201, task=serialize_task(dict(new_task)))
+
+        for index, task_id, fields in updates:
+            if results[index] is not None:
+                continue
+            current = existing.get(object_ids[task_id])
+            if current is None:
+                results[index] = item_result(index, 'update', 404, error="Tarea no encontrada")
+                continue
+            update_fields = {"updated_at": now}
+            for field in ('title', 'done'):
+                if field in fields:
+                    update_fields[field] = fields[field]
+            if 'due_date' in fields:
+                update_fields['due_date'] = mongo_due_date(fields['due_date'])
+            operations.append(UpdateOne(mongo_owned({"_id": current['_id']}, owner), {"$set": update_fields}))
+            delta_completed += completed_delta(current, {**current, **update_fields})
+            results[index] = item_result(index, 'update', 200, task=serialize_task({**current, **update_fields}))
+
+        for index, task_id in deletes:
+            if results[index] is not None:
+                continue
+            if object_ids[task_id] not in existing:
+                results[index] = item_result(index, 'delete', 404, error="Tarea no encontrada")
+                continue
+            operations.append(DeleteOne(mongo_owned({"_id": object_ids[task_id]}, owner)))
+            delta_total -= 1
+            delta_completed -= int(existing[object_ids[task_id]].get('done') is True)
+            results[index] = item_result(index, 'delete', 200)
+
+        if operations:
+            await tasks_collection.bulk_write(operations, ordered=False)
+            await apply_delta(total=delta_total, completed=delta_completed, owner=owner)
+
+        logger.info(f" Lote aplicado: {len(operations)} operaciones")
+
+        return json_response({
+            "success": True,
+            "results": results
+        })
+
+    except Exception as e:
+        logger.error(f" Error al aplicar lote: {e}")
+        return json_response({
+            "success": False,
+            "error": str(e)
+        }, 500)
+
+
+async def get_task(request):
+    """Obtener una tarea por id"""
+    task_id = request.path_params['task_id']
+    try:
+        async with sesion_lectura(request) as session:
+            _, version = await get_database_counters(session, owner=request.state.owner)
+            etag = make_etag(version, 'task', request.state.owner, task_id)
+            cached = not_modified(request, etag)
+            if cached:
+                return cached
+
+            query = mongo_owned({"_id": ObjectId(task_id)}, request.state.owner)
+            task = await tasks_read.find_one(query, session=session)
+            if task is None:
+                task = await archive_read.find_one(query, session=session)
+
+        if task is None:
+            return json_response({
+                "success": False,
+                "error": "Tarea no encontrada"
+            }, 404)
+
+        return json_response({
+            "success": True,
+            "task": serialize_task(task)
+        }, headers=etag_headers(etag))
+
+    except InvalidId:
+        return json_response({
+            "success": False,
+            "error": "Tarea no encontrada"
+        }, 404)
+    except Exception as e:
+        logger.error(f" Error al obtener tarea: {e}")
+        return json_response({
+            "success": False,
+            "error": str(e)
+        }, 500)
+
+
+async def update_task(request):
+    """Actualizar una tarea existente"""
+    task_id = request.path_params['task_id']
+    try:
+        data = await read_json(request)
+
+        if not data:
+            return json_response({
+                "success": False,
+                "error": "No se proporcionaron datos para actualizar"
+            }, 400)
+
+        update_fields = {"updated_at": datetime.now()}
+
+        if 'title' in data:
+            update_fields['title'] = data['title'].strip()
+        if 'done' in data:
+            update_fields['done'] = bool(data['done'])
+        if 'due_date' in data:
+            update_fields['due_date'] = mongo_due_date(parse_due_date(data['due_date']))
+
+        # Actualizar tarea; el documento previo indica si cambió 'done'
+        actualizar = lambda: tasks_collection.find_one_and_update(
+            mongo_owned({"_id": ObjectId(task_id)}, request.state.owner),
+            {"$set": update_fields},
+            return_document=ReturnDocument.BEFORE
+        )
+        previous_task = await actualizar()
+        if previous_task is None and await restaurar_archivadas([ObjectId(task_id)], owner=request.state.owner):
+            # Estaba archivada: vuelve a tasks con el cambio
+            previous_task = await actualizar()
+
+        if previous_task is None:
+            return json_response({
+                "success": False,
+                "error": "Tarea no encontrada"
+            }, 404)
+
+        updated_task = {**previous_task, **update_fields}
+        await apply_delta(completed=completed_delta(previous_task, updated_task), owner=request.state.owner)
+
+        logger.info(f" Tarea actualizada: {task_id}")
+
+        return json_response({
+            "success": True,
+            "message": "Tarea actualizada exitosamente",
+            "task": serialize_task(updated_task)
+        })
+
+    except Exception as e:
+        logger.error(f" Error al actualizar tarea: {e}")
+        return json_response({
+            "success": False,
+            "error": str(e)
+        }, 500)
+
+
+async def delete_task(request):
+    """Eliminar una tarea"""
+    task_id = request.path_params['task_id']
+    try:
+        query = mongo_owned({"_id": ObjectId(task_id)}, request.state.owner)
+        deleted_task = await tasks_collection.find_one_and_delete(query)
+        if deleted_task is None:
+            deleted_task = await archive_collection.find_one_and_delete(query)
+
+        if deleted_task is None:
+            return json_response({
+                "success": False,
+                "error": "Tarea no encontrada"
+            }, 404)
+
+        await apply_delta(total=-1, completed=-1 if deleted_task.get('done') is True else 0,
+                          owner=request.state.owner)
+
+        logger.info(f" Tarea eliminada: {task_id}")
+
+        return json_response({
+            "success": True,
+            "message": "Tarea eliminada exitosamente"
+        })
+
+    except Exception as e:
+        logger.error(f" Error al eliminar tarea: {e}")
+        return json_response({
+            "success": False,
+            "error": str(e)
+        }, 500)
+
+
+async def load_stats_entry(request):
+    """((etag, estadísticas del dueño), posición leída)"""
+    owner = request.state.owner
+    async with sesion_lectura(request) as session:
+        stats, version = await get_database_counters(session, owner=owner)
+        return (make_etag(version, 'stats', owner), stats), posicion_lectura(session)
+
+
+async def get_stats(request):
+    """Obtener estadísticas de las tareas"""
+    try:
+        owner = request.state.owner
+        posicion_cliente = read_after_position(request)
+        entry = read_cache.get(('stats', owner), posicion_cliente)
+        if entry is None:
+            generation = read_cache.generation_for(owner)
+            # Quien acaba de escribir no comparte una lectura que podría ser anterior a su escritura
+            entry, posicion = await read_flights.do(('stats', owner, generation, posicion_cliente),
+                                                    lambda: load_stats_entry(request))
+            read_cache.set(('stats', owner), entry, generation, posicion, posicion_cliente)
+        etag, stats = entry
+
+        return not_modified(request, etag) or json_response({
+            "success": True,
+            "stats": stats
+        }, headers=etag_headers(etag))
+
+    except Exception as e:
+        logger.error(f"❌ Error al obtener estadísticas: {e}")
+        return json_response({
+            "success": False,
+            "error": str(e),
+            "stats": {"total": 0, "completed": 0, "pending": 0}
+        }, 500)
+
+
+async def reconcile_stats(request):
+    """Recalcular los contadores desde la colección y corregir desviaciones"""
+    try:
+        report = await reconcile_counters()
+
+        return json_response({
+            "success": True,
+            **report
+        })
+
+    except Exception as e:
+        logger.error(f" Error al reconciliar estadísticas: {e}")
+        return json_response({
+            "success": False,
+            "error": str(e)
+        }, 500)
+
+
+async def archive_now(request):
+    """Archivar ya las tareas completadas que toquen, sin esperar al proceso periódico"""
+    try:
+        report = await archivar_tareas()
+
+        return json_response({
+            "success": True,
+            **report
+        })
+
+    except Exception as e:
+        logger.error(f" Error al archivar tareas: {e}")
+        return json_response({
+            "success": False,
+            "error": str(e)
+        }, 500)
+
+
+async def get_cache_stats(request):
+    """Aciertos, fallos y desalojos de la caché de lecturas"""
+    return json_response({
+        "success": True,
+        "cache": read_cache.stats(),
+        "single_flight": read_flights.stats()
+    })
+
+
+async def get_database_info(request):
+    """Obtener información detallada de la base de datos - ÚTIL PARA DEBUG"""
+    try:
+        db_stats = await db.command("dbstats")
+        collection_stats = await db.command("collstats", "tasks")
+        # Tareas de ejemplo y contadores solo del dueño que pregunta
+        sample_tasks = await tasks_collection.find(mongo_owned({}, request.state.owner)).limit(3).to_list(3)
+
+        return json_response({
+            "success": True,
+            "database_info": {
+                "name": MONGO_DB,
+                "host": MONGO_HOST,
+                "port": MONGO_PORT,
+                "collections": await db.list_collection_names(),
+                "db_size_mb": round(db_stats.get("dataSize", 0) / (1024*1024), 2),
+                # El número de documentos es de todos los dueños: no se publica
+                "tasks_collection": {
+                    "size_bytes": collection_stats.get("size", 0)
+                }
+            },
+            "sample_tasks": [serialize_task(task) for task in sample_tasks],
+            "stats": (await get_database_counters(owner=request.state.owner))[0]
+        })
+
+    except Exception as e:
+        logger.error(f" Error al obtener info de DB: {e}")
+        return json_response({
+            "success": False,
+            "error": str(e)
+        }, 500)
+
+
+# ============================================================================
+# ERROR HANDLERS
+# ============================================================================
+
+async def not_found(request, exc):
+    return json_response({
+        "success": False,
+        "error": "Endpoint no encontrado"
+    }, 404)
+
+
+async def internal_error(request, exc):
+    return json_response({
+        "success": False,
+        "error": "Error interno del servidor"
+    }, 500)
+
+
+async def read_after_headers():
+    """Set-Cookie con la posición del primario: las siguientes lecturas del cliente incluyen su escritura"""
+    try:
+        posicion = mongo_position((await client.admin.command('hello'))['lastWrite']['opTime']['ts'])
+    except Exception as e:
+        logger.warning(f" No se pudo leer la posición del primario: {e}")
+        return []
+    response = Response()
+    name, value, options = read_after_cookie(posicion)
+    response.set_cookie(name, value, **options)
+    return [header for header in response.raw_headers if header[0] == b'set-cookie']
+
+
+class InvalidateCacheOnWrite:
+    """Las escrituras locales se ven en la siguiente lectura sin esperar al change stream"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] not in ('POST', 'PUT', 'DELETE'):
+            return await self.app(scope, receive, send)
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                read_cache.invalidate_all()
+                if LECTURAS_EN_SECUNDARIOS and message['status'] < 400:
+                    message['headers'] = [*message.get('headers', []), *await read_after_headers()]
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+register_stats('agendaapp_db_pool', 'Conexiones del pool de MongoDB', mongo_pool.stats)
+register_stats('agendaapp_cache', 'Estadísticas de la caché de lecturas (ver /cache/stats)', read_cache.stats)
+register_stats('agendaapp_single_flight', 'Lecturas simultáneas agrupadas (ver /cache/stats)', read_flights.stats)
+register_stats('agendaapp_readiness', 'Última comprobación de MongoDB (ver /readyz)', readiness.stats)
+
+# Si MongoDB se vuelve lento se rechazan peticiones con 503 + Retry-After (ver admission.py)
+admission = AdmissionController(AsyncConcurrencyLimiter)
+add_db_observer(admission.observe)
+register_stats('agendaapp_admission', 'Límites de admisión y peticiones rechazadas', admission.stats)
+register_stats('agendaapp_replicas', 'Lecturas en secundarios y su retraso (ver replicas.py)', replicas.stats)
+
+routes = [
+    Route('/livez', live_check, methods=['GET']),
+    Route('/readyz', ready_check, methods=['GET']),
+    Route('/health', health_check, methods=['GET']),
+    Route('/metrics', metrics_endpoint, methods=['GET']),
+    Route('/tasks', get_all_tasks, methods=['GET']),
+    Route('/tasks', create_task, methods=['POST']),
+    Route('/agenda', get_agenda, methods=['GET']),
+    Route('/tasks/search', search_tasks, methods=['GET']),
+    Route('/tasks/export', export_tasks, methods=['GET']),
+    Route('/tasks/batch', batch_tasks, methods=['POST']),
+    Route('/tasks/{task_id}', get_task, methods=['GET']),
+    Route('/tasks/{task_id}', update_task, methods=['PUT']),
+    Route('/tasks/{task_id}', delete_task, methods=['DELETE']),
+    Route('/stats', get_stats, methods=['GET']),
+    Route('/stats/reconcile', reconcile_stats, methods=['POST']),
+    Route('/tasks/archive', archive_now, methods=['POST']),
+    Route('/cache/stats', get_cache_stats, methods=['GET']),
+    Route('/database/info', get_database_info, methods=['GET']),
+]
+
+# Mismos presupuestos de viajes a MongoDB que app.py
+ROUNDTRIP_BUDGETS = {
+    'live_check': 0,
+    'ready_check': 0,
+    'health_check': 1,
+    'get_stats': 1,
+    'get_all_tasks': 2,
+    'get_task': 3,
+    'search_tasks': 1,
+    'get_agenda': 2,
+    'create_task': 2,
+    'update_task': 2,
+    'delete_task': 2,
+    'batch_tasks': 5,
+}
+if LECTURAS_EN_SECUNDARIOS:
+    # Las escrituras preguntan además la posición del primario para la cookie read-after
+    for ruta in ('create_task', 'update_task', 'delete_task', 'batch_tasks'):
+        ROUNDTRIP_BUDGETS[ruta] += 1
+
+app = Starlette(
+    routes=routes,
+    lifespan=lifespan,
+    exception_handlers={404: not_found, 500: internal_error},
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"],
+                   expose_headers=["ETag"]),
+        # gzip/brotli según Accept-Encoding para los cuerpos JSON, CSV y MessagePack (ver compression.py)
+        Middleware(CompressionMiddleware),
+        Middleware(InvalidateCacheOnWrite),
+        Middleware(MetricsMiddleware, roundtrip_budgets=ROUNDTRIP_BUDGETS),
+        Middleware(AdmissionMiddleware, controller=admission,
+                   busy_body={"success": False, "error": "Servidor ocupado, inténtalo de nuevo más tarde"}),
+        # Cada ruta de tareas actúa para el dueño de la cabecera OWNER_HEADER, en request.state.owner (ver owners.py)
+        Middleware(OwnerMiddleware, body=lambda error: {"success": False, "error": error}),
+    ]
+)
@@ -0,0 +1,999 @@
+"""ASGI variant of app_postgres.py on asyncpg.
+
+Same routes and JSON shapes as the Flask app; every database round trip is
+awaited instead of blocking a worker thread, so one process can hold many
+slow clients at once. Selected with BACKEND_MODE=async (see entrypoint.sh):
+
+    uvicorn app_async_postgres:app --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import uuid
+from datetime import datetime
+from functools import partial
+from urllib.parse import urlencode
+
+import asyncpg
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+
+from pagination import parse_list_args, encode_cursor, decode_cursor
+from counters import (COUNTERS_RECONCILE_INTERVAL, PG_OWNER_COUNTERS_SQL, PG_RECONCILE_LOCK_SQL,
+                      PG_COUNTERS_TOTALS_SQL, PG_RECOUNT_SQL, stats_dict, reconcile_report)
+from conditional import make_etag, query_key, client_has, etag_headers
+from read_cache import ReadCache, PG_NOTIFY_CHANNEL
+from single_flight import AsyncSingleFlight
+from schema import PG_SCHEMA_CHECK_SQL, PG_WARMUP_SQL, check_schema_versions
+from batch_ops import BatchError, parse_batch, item_result, parse_due_date
+from export_stream import EXPORT_BATCH_SIZE, EXPORT_FORMATS, encode_rows, export_filename
+from probes import ReadinessChecker, AsyncPgReadinessCheck, liveness
+from metrics import MetricsMiddleware, metrics_endpoint, register_stats, add_db_observer, asyncpg_query_timer
+from admission import AdmissionController, AdmissionMiddleware, AsyncConcurrencyLimiter
+from owners import OWNER_HEADER, OwnerMiddleware
+from wire_format import WIRE_JSON, negotiate_format, wire_tasks, encode as encode_wire
+from compression import CompressionMiddleware
+from archive import (ARCHIVE_AFTER_DAYS, ARCHIVE_KEEP_DONE, ARCHIVE_BATCH_SIZE, ARCHIVE_INTERVAL,
+                     pg_archive_query, archive_report)
+from replicas import (READ_AFTER_COOKIE, PG_PRIMARY_POSITION_SQL, ReplicaRouter, ReplicaMonitor,
+                      AsyncPgReplicaCheck, replica_hosts, parse_lsn, read_after, read_after_cookie)
+from fast_json import FAST_JSON, pg_page_query
+from agenda import AGENDA_MAX_TASKS, parse_agenda_args, group_by_day, agenda_body, pg_agenda_query, pg_overdue_query
+from search import (parse_search_args, next_search_cursor, prefix_tsquery, pg_search_query,
+                    pg_autocomplete_query)
+from changes import (CHANGES_PRUNE_INTERVAL, CHANGES_RETENTION_DAYS, CHANGES_HEARTBEAT, CHANGES_STREAM_MAX,
+                     SSE_HEADERS, SSE_KEEPALIVE, PG_PRUNE_LOCK_SQL, PG_PRUNE_SQL, CursorExpired,
+                     AsyncChangeNotifier, parse_changes_args, pg_changes_query, pg_changes_args, changes_page,
+                     sse_event)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DB_CONFIG = {
+    'host': os.getenv('DB_HOST', 'postgres-service'),
+    'user': os.getenv('DB_USER', 'postgres'),
+    'password': os.getenv('DB_PASSWORD', 'agenda123'),
+    'database': os.getenv('DB_NAME', 'agendaapp'),
+    'port': int(os.getenv('DB_PORT', 5432))
+}
+
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', 10))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 5))
+
+EXPORT_FIELDS = ['id', 'title', 'done', 'due_date', 'created_at', 'updated_at']
+
+db_pool = None
+search_trigram = False
+read_cache = ReadCache()
+# Identical concurrent cache misses share one load (see single_flight.py)
+read_flights = AsyncSingleFlight()
+change_notifier = AsyncChangeNotifier()
+readiness = ReadinessChecker(AsyncPgReadinessCheck(lambda **options: asyncpg.connect(**DB_CONFIG, **options)))
+background_tasks = []
+
+# Optional streaming replicas for reads (see replicas.py); writes stay on DB_CONFIG
+REPLICA_CONFIGS = {f"{host}:{port}": {**DB_CONFIG, 'host': host, 'port': port}
+                   for host, port in replica_hosts(os.getenv('DB_REPLICA_HOSTS'), DB_CONFIG['port'])}
+replica_pools = {}
+replicas = ReplicaRouter(REPLICA_CONFIGS)
+replica_monitor = ReplicaMonitor(replicas, AsyncPgReplicaCheck(
+    partial(asyncpg.connect, **DB_CONFIG),
+    {name: partial(asyncpg.connect, **config) for name, config in REPLICA_CONFIGS.items()}))
+
+
+def get_db_connection():
+    # asyncio.TimeoutError when every connection stays busy for DB_POOL_TIMEOUT
+    return db_pool.acquire(timeout=DB_POOL_TIMEOUT)
+
+
+def read_after_position(request):
+    """Position of this client's last write (READ_AFTER_COOKIE), None without one."""
+    return read_after(request.cookies.get(READ_AFTER_COOKIE))
+
+
+def choose_replica(request):
+    """Replica for this request's reads, None for the primary."""
+    if not replicas.enabled:
+        return None
+    return replicas.choose(read_after_position(request))
+
+
+@contextlib.asynccontextmanager
+async def get_read_connection(replica=None):
+    """Connection on replica; on the primary for None, or if the replica fails."""
+    async with contextlib.AsyncExitStack() as stack:
+        conn = None
+        if replica is not None:
+            try:
+                conn = await stack.enter_async_context(
+                    replica_pools[replica.name].acquire(timeout=DB_POOL_TIMEOUT))
+            except asyncio.TimeoutError:
+                pass  # a busy replica spills over to the primary
+            except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+                replicas.mark_down(replica.name, e)
+        if conn is None:
+            conn = await stack.enter_async_context(get_db_connection())
+        yield conn
+
+
+def json_response(data, status=200, headers=None):
+    return Response(json.dumps(data), status_code=status, headers=headers, media_type='application/json')
+
+
+def pool_exhausted(e):
+    logger.warning(f"Database pool exhausted: {str(e) or 'acquire timed out'}")
+    return json_response({"error": "Database busy, try again later"}, 503, {'Retry-After': '1'})
+
+
+def not_modified(request, etag):
+    if not client_has(request.headers.get('if-none-match'), etag):
+        return None
+    return Response(status_code=304, headers=etag_headers(etag))
+
+
+def pool_stats():
+    if db_pool is None:
+        return {"min": DB_POOL_MIN, "max": DB_POOL_MAX, "size": 0, "idle": 0, "in_use": 0}
+    size, idle = db_pool.get_size(), db_pool.get_idle_size()
+    return {"min": DB_POOL_MIN, "max": DB_POOL_MAX, "size": size, "idle": idle, "in_use": size - idle}
+
+
+async def read_counters(conn, owner):
+    """Return (stats, version) of owner."""
+    row = await conn.fetchrow(PG_OWNER_COUNTERS_SQL.format('$1'), owner)
+    return stats_dict(row[0], row[1]), row[2]
+
+
+async def read_stats(replica, owner):
+    async with get_read_connection(replica) as conn:
+        return await read_counters(conn, owner)
+
+
+async def reconcile_counters():
+    async with get_db_connection() as conn:
+        async with conn.transaction():
+            # Same locking order as counters.pg_reconcile
+            await conn.execute(PG_RECONCILE_LOCK_SQL)
+            owners, before_total, before_completed = await conn.fetchrow(PG_COUNTERS_TOTALS_SQL)
+            total, completed = await conn.fetchrow(PG_RECOUNT_SQL)
+    before = stats_dict(before_total, before_completed) if owners else None
+    return reconcile_report(before, stats_dict(total, completed))
+
+
+async def reconcile_periodically():
+    while True:
+        await asyncio.sleep(COUNTERS_RECONCILE_INTERVAL)
+        try:
+            await reconcile_counters()
+        except Exception as e:
+            logger.error(f"Counter reconciliation failed: {str(e)}")
+
+
+async def prune_changes():
+    async with get_db_connection() as conn:
+        async with conn.transaction():
+            # Same locking order as changes.pg_prune_changes
+            await conn.execute(PG_PRUNE_LOCK_SQL.format('$1'), CHANGES_RETENTION_DAYS)
+            return await conn.fetchval(PG_PRUNE_SQL.format('$1'), CHANGES_RETENTION_DAYS)
+
+
+async def prune_changes_periodically():
+    while True:
+        await asyncio.sleep(CHANGES_PRUNE_INTERVAL)
+        try:
+            await prune_changes()
+        except Exception as e:
+            logger.error(f"Pruning the change feed failed: {str(e)}")
+
+
+async def archive_tasks():
+    """Async counterpart of archive.pg_archive: one autocommit UPDATE per batch."""
+    args = [ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE]
+    if ARCHIVE_KEEP_DONE > 0:
+        args.append(ARCHIVE_KEEP_DONE)
+    sql = pg_archive_query({'days': '$1', 'limit': '$2', 'keep': '$3'}, ARCHIVE_KEEP_DONE)
+    moved = 0
+    async with get_db_connection() as conn:
+        while True:
+            batch = int((await conn.execute(sql, *args)).split()[-1])
+            moved += batch
+            if batch < ARCHIVE_BATCH_SIZE:
+                return archive_report(moved)
+
+
+async def archive_periodically():
+    while True:
+        await asyncio.sleep(ARCHIVE_INTERVAL)
+        try:
+            await archive_tasks()
+        except Exception as e:
+            logger.error(f"Archiving tasks failed: {str(e)}")
+
+
+def on_tasks_changed(owner=None):
+    # The trigger names the owner written in the NOTIFY payload
+    read_cache.invalidate(owner)
+    change_notifier.notify()
+
+
+def on_notify(conn, pid, channel, payload):
+    on_tasks_changed(payload or None)
+
+
+def on_listener_state(listening):
+    read_cache.set_listening(listening)
+    change_notifier.set_listening(listening)
+
+
+async def listen_for_changes(retry=5.0):
+    """Async counterpart of read_cache.PgNotifyListener."""
+    while True:
+        conn = None
+        try:
+            conn = await asyncpg.connect(**DB_CONFIG)
+            await conn.add_listener(PG_NOTIFY_CHANNEL, on_notify)
+            on_listener_state(True)
+            on_tasks_changed()
+            while not conn.is_closed():
+                await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Cache invalidation listener disconnected: {str(e)}")
+        finally:
+            # Entries cached while listening could now miss an invalidation
+            on_listener_state(False)
+            on_tasks_changed()
+            if conn is not None:
+                conn.terminate()
+        await asyncio.sleep(retry)
+
+
+async def init_connection(conn):
+    # Times every query into agendaapp_db_duration_seconds
+    conn.add_query_logger(asyncpg_query_timer)
+
+
+async def reset_connection(conn):
+    # Routes leave no session state (LISTEN, advisory locks, SET) on pooled
+    # connections, so skip asyncpg's default RESET ALL round trip on release
+    if conn.is_in_transaction():
+        await conn.execute('ROLLBACK')
+
+
+async def init_database():
+    global db_pool, search_trigram
+    db_pool = await asyncpg.create_pool(min_size=DB_POOL_MIN, max_size=DB_POOL_MAX,
+                                        init=init_connection, reset=reset_connection, **DB_CONFIG)
+    for name, config in REPLICA_CONFIGS.items():
+        # Lazy (min_size=0): a replica that is down must not stop the app
+        replica_pools[name] = await asyncpg.create_pool(min_size=0, max_size=DB_POOL_MAX,
+                                                        init=init_connection, reset=reset_connection, **config)
+    async with get_db_connection() as conn:
+        # No DDL here: migrate.py applies the schema once per deploy
+        try:
+            versions, search_trigram = await conn.fetchrow(PG_SCHEMA_CHECK_SQL)
+        except asyncpg.UndefinedTableError:
+            versions = None
+        check_schema_versions(versions)
+        if not search_trigram:
+            logger.warning("pg_trgm index missing: /tasks/search matches whole words only")
+        for statement in PG_WARMUP_SQL:
+            await conn.fetch(statement)
+    if COUNTERS_RECONCILE_INTERVAL > 0:
+        background_tasks.append(asyncio.create_task(reconcile_periodically()))
+    background_tasks.append(asyncio.create_task(readiness.run_async()))
+    if replicas.enabled:
+        background_tasks.append(asyncio.create_task(replica_monitor.run_async()))
+    if CHANGES_PRUNE_INTERVAL > 0:
+        background_tasks.append(asyncio.create_task(prune_changes_periodically()))
+    if ARCHIVE_INTERVAL > 0:
+        # Moves old completed tasks out of the hot partition (see archive.py)
+        background_tasks.append(asyncio.create_task(archive_periodically()))
+    # Writes on any replica NOTIFY us so this pod drops its cached reads and
+    # wakes up its change streams
+    background_tasks.append(asyncio.create_task(listen_for_changes()))
+    logger.info("Database initialized")
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    logger.info("Starting ASGI app with PostgreSQL")
+    await init_database()
+    yield
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    await db_pool.close()
+    for pool in replica_pools.values():
+        await pool.close()
+    replica_pools.clear()
+
+
+def serialize_task(task):
+    task_dict = dict(task)
+    # Storage detail of the hot/cold split (archive.py), not part of a task;
+    # the owner is the caller's (owners.py)
+    task_dict.pop('archived', None)
+    task_dict.pop('owner_id', None)
+    if task_dict['created_at']:
+        task_dict['created_at'] = task_dict['created_at'].isoformat()
+    if task_dict['updated_at']:
+        task_dict['updated_at'] = task_dict['updated_at'].isoformat()
+    if task_dict['due_date']:
+        task_dict['due_date'] = task_dict['due_date'].isoformat()
+    return task_dict
+
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+# Probes: /livez does no I/O, /readyz reads the cached background check
+async def live_check(request):
+    return json_response(liveness())
+
+
+async def ready_check(request):
+    ready, body = readiness.status()
+    return json_response(body, 200 if ready else 503)
+
+
+# Detailed report for humans; probes should use /livez and /readyz
+async def health_check(request):
+    try:
+        # The caller's tasks only, like every other count (see owners.py)
+        stats, _ = await read_stats(choose_replica(request), request.state.owner)
+        body = {
+            "status": "healthy",
+            "database": "connected",
+            "tasks_count": stats['total'],
+            "pool": pool_stats(),
+            "cache": read_cache.stats(),
+            "timestamp": datetime.now().isoformat()
+        }
+        if replicas.enabled:
+            body["replicas"] = [status._asdict() for status in replicas.status()]
+        return json_response(body)
+    except asyncio.TimeoutError as e:
+        return json_response({
+            "status": "unhealthy",
+            "database": "pool exhausted",
+            "error": str(e),
+            "pool": pool_stats()
+        }, 500)
+    except Exception as e:
+        return json_response({
+            "status": "unhealthy",
+            "database": "error",
+            "error": str(e),
+            "pool": pool_stats()
+        }, 500)
+
+
+async def load_stats_entry(request):
+    """((etag, stats), position of the replica read, None for the primary)."""
+    replica = choose_replica(request)
+    owner = request.state.owner
+    stats, version = await read_stats(replica, owner)
+    return (make_etag(version, 'stats', owner), stats), replica.position if replica else None
+
+
+async def get_stats(request):
+    try:
+        owner = request.state.owner
+        client_position = read_after_position(request)
+        entry = read_cache.get(('stats', owner), client_position)
+        if entry is None:
+            generation = read_cache.generation_for(owner)
+            # Clients that just wrote never share a read that may predate their write
+            entry, position = await read_flights.do(('stats', owner, generation, client_position),
+                                                    lambda: load_stats_entry(request))
+            read_cache.set(('stats', owner), entry, generation, position, client_position)
+        etag, stats = entry
+        return not_modified(request, etag) or json_response(stats, headers=etag_headers(etag))
+    except asyncio.TimeoutError as e:
+        return pool_exhausted(e)
+    except Exception as e:
+        logger.error(f"Error getting stats: {str(e)}")
+        return json_response({"error": str(e)}, 500)
+
+
+async def reconcile_stats(request):
+    try:
+        return json_response(await reconcile_counters())
+    except asyncio.TimeoutError as e:
+        return pool_exhausted(e)
+    except Exception as e:
+        logger.error(f"Error reconciling stats: {str(e)}")
+        return json_response({"error": str(e)}, 500)
+
+
+async def archive_now(request):
+    try:
+        return json_response(await archive_tasks())
+    except asyncio.TimeoutError as e:
+        return pool_exhausted(e)
+    except Exception as e:
+        logger.error(f"Error archiving tasks: {str(e)}")
+        return json_response({"error": str(e)}, 500)
+
+
+async def get_pool_stats(request):
+    return json_response(pool_stats())
+
+
+async def get_cache_stats(request):
+    return json_response({**read_cache.stats(), "single_flight": read_flights.stats()})
+
+
+async def load_tasks_page(request, where, values, limit, wire_format, revalidate=True):
+    """((etag, encoded body, next cursor), replica position) of one page of GET /tasks; see app_postgres.py."""
+    replica = choose_replica(request)
+    position = replica.position if replica else None
+    async with get_read_connection(replica) as conn:
+        etag = make_etag((await read_counters(conn, request.state.owner))[1], 'tasks', request.state.owner, wire_format,
+                         query_key(request.query_params))
+        if revalidate and not_modified(request, etag):
+            return (etag, None, None), position
+        if FAST_JSON and wire_format == WIRE_JSON:
+            # PostgreSQL encodes the page; the text goes out as is
+            body, has_more, last_created_at, last_id = await conn.fetchrow(pg_page_query(where, '$1'), *values)
+            next_cursor = encode_cursor(last_created_at.isoformat(), last_id) if has_more else None
+        else:
+            # One extra row tells us whether there is a next page
+            tasks = await conn.fetch(
+                f"SELECT * FROM tasks {where} ORDER BY created_at DESC, id DESC LIMIT $1::int + 1", *values)
+            next_cursor = None
+            if len(tasks) > limit:
+                tasks = tasks[:limit]
+                next_cursor = encode_cursor(tasks[-1]['created_at'].isoformat(), tasks[-1]['id'])
+            body = encode_wire(wire_tasks([serialize_task(task) for task in tasks], wire_format), wire_format,
+                               json.dumps)
+    # The encoded body is cached so hits skip serialization too
+    return (etag, body, next_cursor), position
+
+
+async def get_tasks(request):
+    try:
+        try:
+            filters = parse_list_args(request.query_params)
+            # $1 is the page size, $2 the owner that leads every owner-scoped index (see owners.py)
+            values = [filters['limit'], request.state.owner]
+            conditions = ["owner_id = $2"]
+            if filters['done'] is not None:
+                values.append(filters['done'])
+                conditions.append(f"done = ${len(values)}")
+            if filters['due_from']:
+                values.append(filters['due_from'])
+                conditions.append(f"due_date >= ${len(values)}")
+            if filters['due_to']:
+                values.append(filters['due_to'])
+                conditions.append(f"due_date <= ${len(values)}")
+            if filters['cursor']:
+                created_at, last_id = decode_cursor(filters['cursor'], 2)
+                values.extend([datetime.fromisoformat(created_at), str(last_id)])
+                conditions.append(f"(created_at, id) < (${len(values) - 1}, ${len(values)})")
+            if not filters['include_archived']:
+                # Only the hot partition is scanned (see archive.py)
+                conditions.append("NOT archived")
+        except (ValueError, TypeError) as e:
+            return json_response({"error": str(e)}, 400)
+
+        where = f"WHERE {' AND '.join(conditions)}"
+        # JSON, columnar JSON or MessagePack, by the Accept header (see wire_format.py)
+        wire_format = negotiate_format(request.headers.get('accept'))
+
+        cache_key = ('tasks', request.state.owner, wire_format, query_key(request.query_params))
+        client_position = read_after_position(request)
+        page = read_cache.get(cache_key, client_position)
+        if page is None:
+            generation = read_cache.generation_for(request.state.owner)
+            page, position = await read_flights.do((cache_key, generation, client_position),
+                                                   lambda: load_tasks_page(request, where, values, filters['limit'],
+                                                                           wire_format))
+            if page[1] is None:
+                # The leader's client already had this version, so no rows were read
+                cached = not_modified(request, page[0])
+                if cached:
+                    cached.headers['Vary'] = 'Accept'
+                    return cached
+                page, position = await load_tasks_page(request, where, values, filters['limit'], wire_format,
+                                                       revalidate=False)
+            read_cache.set(cache_key, page, generation, position, client_position)
+
+        etag, body, next_cursor = page
+        cached = not_modified(request, etag)
+        if cached:
+            cached.headers['Vary'] = 'Accept'
+            return cached
+
+        headers = {**etag_headers(etag), 'Vary': 'Accept'}
+        if next_cursor:
+            headers['X-Next-Cursor'] = next_cursor
+            next_args = dict(request.query_params)
+            next_args['cursor'] = next_cursor
+            headers['Link'] = f'</tasks?{urlencode(next_args)}>; rel="next"'
+        return Response(body, headers=headers, media_type=wire_format)
+    except asyncio.TimeoutError as e:
+        return pool_exhausted(e)
+    except Exception as e:
+        logger.error(f"Error getting tasks: {str(e)}")
+        return json_response({"error": str(e)}, 500)
+
+
+async def get_agenda(request):
+    try:
+        try:
+            params = parse_agenda_args(request.query_params)
+        except ValueError as e:
+            return json_response({"error": str(e)}, 400)
+
+        async with get_read_connection(choose_replica(request)) as conn:
+            tasks = await conn.fetch(pg_agenda_query({'owner': '$1', 'from': '$2', 'to': '$3', 'limit': '$4'},
+                                                     params['include_done']),
+                                     request.state.owner, params['from'], params['to'], AGENDA_MAX_TASKS + 1)
+            overdue = await conn.fetchval(pg_overdue_query({'owner': '$1', 'today': '$2'}),
+                                          request.state.owner, params['today'])
+
+        days = group_by_day([serialize_task(task) for task in tasks[:AGENDA_MAX_TASKS]])
+        return json_response(agenda_body(params, days, overdue, len(tasks) > AGENDA_MAX_TASKS))
+    except asyncio.TimeoutError as e:
+        return pool_exhausted(e)
+    except Exception as e:
+        logger.error(f"Error getting agenda: {str(e)}")
+        return json_response({"error": str(e)}, 500)
+
+
+async def search_tasks(request):
+    try:
+        try:
+            params = parse_search_args(request.query_params)
+            prefix = prefix_tsquery(params['q']) if params['mode'] == 'autocomplete' else None
+        except (ValueError, TypeError) as e:
+            return json_response({"error": str(e)}, 400)
+
+        async with get_read_connection(choose_replica(request)) as conn:
+            if prefix:
+                tasks = await conn.fetch(pg_autocomplete_query({'owner': '$1', 'prefix': '$2', 'limit': '$3'}),
+                                         request.state.owner, prefix, params['limit'])
+                return json_response([dict(task) for task in tasks])
+            # One extra row tells us whether there is a next page
+            tasks = await conn.fetch(pg_search_query({'owner': '$1', 'q': '$2', 'limit': '$3', 'offset': '$4'},
+                                                     search_trigram),
+                                     request.state.owner, params['q'], params['limit'] + 1, params['offset'])
+
+        headers = {}
+        next_cursor = next_search_cursor(params, len(tasks))
+        if next_cursor:
+            headers['X-Next-Cursor'] = next_cursor
+            next_args = dict(request.query_params)
+            next_args['cursor'] = next_cursor
+            headers['Link'] = f'</tasks/search?{urlencode(next_args)}>; rel="next"'
+        return json_response([serialize_task(task) for task in tasks[:params['limit']]], headers=headers)
+    except asyncio.TimeoutError as e:
+        return pool_exhausted(e)
+    except Exception as e:
+        logger.error(f"Error searching tasks: {str(e)}")
+        return json_response({"error": str(e)}, 500)
+
+
+async def read_changes(params, owner):
+    """One page of owner's change feed (see changes.py); raises CursorExpired."""
+    # On the primary: streams are woken by NOTIFY, a replica may not have the change yet
+    async with get_db_connection() as conn:
+        rows = await conn.fetch(pg_changes_query({'owner': '$1', 'version': '$2', 'task_id': '$3', 'start': '$4',
+                                                  'limit': '$5'}),
+                                *pg_changes_args(params, owner))
+    return changes_page([dict(row) for row in rows], params, serialize_task)
+
+
+async def get_changes(request):
+    try:
+        try:
+            params = parse_changes_args(request.query_params)
+        except (ValueError, TypeError) as e:
+            return json_response({"error": str(e)}, 400)
+        return json_response(await read_changes(params, request.state.owner))
+    except CursorExpired as e:
+        return json_response({"error": str(e), "reset": True}, 410)
+    except asyncio.TimeoutError as e:
+        return pool_exhausted(e)
+    except Exception as e:
+        logger.error(f"Error getting changes: {str(e)}")
+        return json_response({"error": str(e)}, 500)
+
+
+async def stream_changes(request):
+    try:
+        params = parse_changes_args(request.query_params, request.headers.get('last-event-id'))
+    except (ValueError, TypeError) as e:
+        return json_response({"error": str(e)}, 400)
+
+    async def events(params):
+        # Same loop as app_postgres.stream_changes
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + CHANGES_STREAM_MAX
+        quiet_since = loop.time()
+        generation = change_notifier.generation
+        while True:
+            try:
+                page = await read_changes(params, request.state.owner)
+            except CursorExpired as e:
+                yield sse_event('reset', {"error": str(e)})
+                return
+            except Exception as e:
+                logger.error(f"Error streaming changes: {str(e)}")
+                yield sse_event('error', {"error": str(e)})
+                return
+            if page['changes']:
+                yield sse_event('changes', page, page['cursor'])
+                quiet_since = loop.time()
+            elif loop.time() - quiet_since >= CHANGES_HEARTBEAT:
+                yield SSE_KEEPALIVE
+                quiet_since = loop.time()
+            params = parse_changes_args({'since': page['cursor'], 'limit': params['limit']})
+            if page['has_more']:
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            generation = await change_notifier.wait(generation, min(CHANGES_HEARTBEAT, remaining))
+
+    return StreamingResponse(events(params), media_type='text/event-stream', headers=SSE_HEADERS)
+
+
+async def export_tasks(request):
+    fmt = request.query_params.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return json_response({"error": f"Unsupported export format: {fmt}"}, 400)
+
+    # On the primary: recovery conflicts would cancel a long export on a hot standby
+    try:
+        conn = await db_pool.acquire(timeout=DB_POOL_TIMEOUT)
+    except asyncio.TimeoutError as e:
+        return pool_exhausted(e)
+
+    async def finish():
+        # Cursors only live inside a transaction; it only ever read
+        try:
+            if conn.is_in_transaction():
+                await transaction.rollback()
+        finally:
+            await db_pool.release(conn)
+
+    # First batch before the response starts, so query errors are still a 500
+    transaction = conn.transaction()
+    try:
+        await transaction.start()
+        # Server-side cursor: rows arrive EXPORT_BATCH_SIZE at a time
+        cursor = await conn.cursor("SELECT * FROM tasks WHERE owner_id = $1 ORDER BY created_at, id",
+                                   request.state.owner)
+        rows = await cursor.fetch(EXPORT_BATCH_SIZE)
+    except Exception as e:
+        await finish()
+        logger.error(f"Error exporting tasks: {str(e)}")
+        return json_response({"error": str(e)}, 500)
+
+    async def body(rows):
+        try:
+            header = True
+            while True:
+                for chunk in encode_rows([dict(row) for row in rows], fmt, EXPORT_FIELDS, header=header):
+                    yield chunk
+                if len(rows) < EXPORT_BATCH_SIZE:
+                    break
+                rows, header = await cursor.fetch(EXPORT_BATCH_SIZE), False
+        finally:
+            await finish()
+
+    return StreamingResponse(body(rows), media_type=EXPORT_FORMATS[fmt], headers={
+        'Content-Disposition': f'attachment; filename={export_filename(fmt)}'
+    })
+
+
+async def create_task(request):
+    try:
+        data = await read_json(request)
+        if not data or 'title' not in data:
+            return json_response({"error": "Title is required"}, 400)
+
+        now = datetime.now()
+        async with get_db_connection() as conn:
+            new_task = await conn.fetchrow('''
+                INSERT INTO tasks (id, title, done, due_date, created_at, updated_at, owner_id)
+                VALUES ($1, $2, $3, $4, $5, $6, $7)
+                RETURNING *
+            ''', str(uuid.uuid4()), data['title'], data.get('done', False),
+                parse_due_date(data.get('due_date')), now, now, request.state.owner)
+
+        return json_response(serialize_task(new_task), 201)
+    except asyncio.TimeoutError as e:
+        return pool_exhausted(e)
+    except Exception as e:
+        logger.error(f"Error creating task: {str(e)}")
+        return json_response({"error": str(e)}, 500)
+
+
+async def batch_tasks(request):
+    try:
+        creates, updates, deletes, results = parse_batch(await read_json(request))
+    except BatchError as e:
+        return json_response({"error": str(e)}, e.status)
+
+    now = datetime.now()
+    owner = request.state.owner
+    try:
+        # Whole batch in one transaction; arrays + unnest stand in for execute_values
+        async with get_db_connection() as conn:
+            async with conn.transaction():
+                if creates:
+                    new_ids = [str(uuid.uuid4()) for _ in creates]
+                    rows = await conn.fetch('''
+                        INSERT INTO tasks (id, title, done, due_date, created_at, updated_at, owner_id)
+                        SELECT v.id, v.title, v.done, v.due_date, $5, $5, $6
+                        FROM unnest($1::varchar[], $2::varchar[], $3::boolean[], $4::date[])
+                            AS v (id, title, done, due_date)
+                        RETURNING *
+                    ''', new_ids, [fields['title'] for _, fields in creates],
+                        [fields['done'] for _, fields in creates],
+                        [fields['due_date'] for _, fields in creates], now, owner)
+                    created = {row['id']: row for row in rows}
+                    for task_id, (index, _) in zip(new_ids, creates):
+                        results[index] = item_result(index, 'create', 201, task=serialize_task(created[task_id]))
+
+                if updates:
+                    rows = await conn.fetch('''
+                        UPDATE tasks AS t SET
+                            title = CASE WHEN v.set_title THEN v.title ELSE t.title END,
+                            done = CASE WHEN v.set_done THEN v.done ELSE t.done END,
+                            due_date = CASE WHEN v.set_due_date THEN v.due_date ELSE t.due_date END,
+                            updated_at = $8,
+                            archived = FALSE
+                        FROM unnest($1::varchar[], $2::boolean[], $3::varchar[], $4::boolean[],
+                                    $5::boolean[], $6::boolean[], $7::date[])
+                            AS v (id, set_title, title, set_done, done, set_due_date, due_date)
+                        WHERE t.id = v.id AND t.owner_id = $9
+                        RETURNING t.*
+                    ''', [task_id for _, task_id, _ in updates],
+                        ['title' in fields for _, _, fields in updates],
+                        [fields.get('title') for _, _, fields in updates],
+                        ['done' in fields for _, _, fields in updates],
+                        [fields.get('done') for _, _, fields in updates],
+                        ['due_date' in fields for _, _, fields in updates],
+                        [fields.get('due_date') for _, _, fields in updates], now, owner)
+                    updated = {row['id']: row for row in rows}
+                    for index, task_id, _ in updates:
+                        if task_id in updated:
+                            results[index] = item_result(index, 'update', 200, task=serialize_task(updated[task_id]))
+                        else:
+                            results[index] = item_result(index, 'update', 404, error="Task not found")
+
+                if deletes:
+                    rows = await conn.fetch("DELETE FROM tasks WHERE id = ANY($1::varchar[]) AND owner_id = $2 RETURNING id",
+                                            [task_id for _, task_id in deletes], owner)
+                    deleted = {row['id'] for row in rows}
+                    for index, task_id in deletes:
+                        if task_id in deleted:
+                            results[index] = item_result(index, 'delete', 200)
+                        else:
+                            results[index] = item_result(index, 'delete', 404, error="Task not found")
+
+        return json_response({"results": results})
+    except asyncio.TimeoutError as e:
+        return pool_exhausted(e)
+    except Exception as e:
+        logger.error(f"Error applying batch: {str(e)}")
+        return json_response({"error": str(e)}, 500)
+
+
+async def get_task(request):
+    task_id = request.path_params['task_id']
+    try:
+        async with get_read_connection(choose_replica(request)) as conn:
+            # Version and row in one query; a 304 just ignores the row
+            row = await conn.fetchrow('''
+                SELECT coalesce(c.version, 0) AS counters_version, t.*
+                FROM (SELECT 1) AS one
+                LEFT JOIN owner_counters c ON c.owner_id = $2
+                LEFT JOIN tasks t ON t.id = $1 AND t.owner_id = $2
+            ''', task_id, request.state.owner)
+
+        task = dict(row)
+        etag = make_etag(task.pop('counters_version'), 'task', request.state.owner, task_id)
+        cached = not_modified(request, etag)
+        if cached:
+            return cached
+
+        if task['id'] is None:
+            return json_response({"error": "Task not found"}, 404)
+
+        return json_response(serialize_task(task), headers=etag_headers(etag))
+    except asyncio.TimeoutError as e:
+        return pool_exhausted(e)
+    except Exception as e:
+        logger.error(f"Error getting task: {str(e)}")
+        return json_response({"error": str(e)}, 500)
+
+
+async def update_task(request):
+    task_id = request.path_params['task_id']
+    try:
+        data = await read_json(request)
+        if not data:
+            return json_response({"error": "No data to update"}, 400)
+
+        updates = []
+        values = []
+
+        if 'title' in data:
+            values.append(data['title'])
+            updates.append(f"title = ${len(values)}")
+
+        if 'done' in data:
+            values.append(data['done'])
+            updates.append(f"done = ${len(values)}")
+
+        if 'due_date' in data:
+            values.append(parse_due_date(data['due_date']))
+            updates.append(f"due_date = ${len(values)}")
+
+        if not updates:
+            return json_response({"error": "No data to update"}, 400)
+
+        # Writing to an archived task brings it back to the hot partition
+        updates.append("archived = FALSE")
+        values.append(datetime.now())
+        updates.append(f"updated_at = ${len(values)}")
+        values.extend([task_id, request.state.owner])
+
+        async with get_db_connection() as conn:
+            updated_task = await conn.fetchrow(
+                f"UPDATE tasks SET {', '.join(updates)} WHERE id = ${len(values) - 1} AND owner_id = ${len(values)}"
+                f" RETURNING *", *values)
+
+        if not updated_task:
+            return json_response({"error": "Task not found"}, 404)
+
+        return json_response(serialize_task(updated_task))
+    except asyncio.TimeoutError as e:
+        return pool_exhausted(e)
+    except Exception as e:
+        logger.error(f"Error updating task: {str(e)}")
+        return json_response({"error": str(e)}, 500)
+
+
+async def delete_task(request):
+    task_id = request.path_params['task_id']
+    try:
+        async with get_db_connection() as conn:
+            status = await conn.execute("DELETE FROM tasks WHERE id = $1 AND owner_id = $2",
+                                        task_id, request.state.owner)
+
+        # Command tag: "DELETE <rowcount>"
+        if status.split()[-1] == '0':
+            return json_response({"error": "Task not found"}, 404)
+
+        return json_response({"message": "Task deleted successfully"})
+    except asyncio.TimeoutError as e:
+        return pool_exhausted(e)
+    except Exception as e:
+        logger.error(f"Error deleting task: {str(e)}")
+        return json_response({"error": str(e)}, 500)
+
+
+async def read_after_headers():
+    """Set-Cookie header with the primary's position, so the client's next reads include its write."""
+    try:
+        async with get_db_connection() as conn:
+            position = parse_lsn(await conn.fetchval(PG_PRIMARY_POSITION_SQL))
+    except Exception as e:
+        logger.warning(f"Could not read the primary WAL position: {str(e)}")
+        return []
+    response = Response()
+    name, value, options = read_after_cookie(position)
+    response.set_cookie(name, value, **options)
+    return [header for header in response.raw_headers if header[0] == b'set-cookie']
+
+
+class InvalidateCacheOnWrite:
+    """ASGI counterpart of the after_request hook in app_postgres.py."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] not in ('POST', 'PUT', 'DELETE'):
+            return await self.app(scope, receive, send)
+
+        async def send_wrapper(message):
+            # Before the client sees the response, so its next read misses
+            if message['type'] == 'http.response.start':
+                on_tasks_changed(scope.get('state', {}).get('owner'))
+                if replicas.enabled and message['status'] < 400:
+                    message['headers'] = [*message.get('headers', []), *await read_after_headers()]
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+register_stats('agendaapp_db_pool', 'Connection pool stats (see /database/pool)', pool_stats)
+register_stats('agendaapp_cache', 'Read cache stats (see /cache/stats)', read_cache.stats)
+register_stats('agendaapp_single_flight', 'Coalesced concurrent reads (see /cache/stats)', read_flights.stats)
+register_stats('agendaapp_readiness', 'Last background database check (see /readyz)', readiness.stats)
+
+# Sheds load with 503 + Retry-After when the database slows down (see admission.py)
+admission = AdmissionController(AsyncConcurrencyLimiter)
+add_db_observer(admission.observe)
+register_stats('agendaapp_admission', 'Admission control limits and shed requests', admission.stats)
+register_stats('agendaapp_replicas', 'Read replica routing (see replicas.py)', replicas.stats)
+
+routes = [
+    Route('/livez', live_check, methods=['GET']),
+    Route('/readyz', ready_check, methods=['GET']),
+    Route('/health', health_check, methods=['GET']),
+    Route('/metrics', metrics_endpoint, methods=['GET']),
+    Route('/stats', get_stats, methods=['GET']),
+    Route('/stats/reconcile', reconcile_stats, methods=['POST']),
+    Route('/database/pool', get_pool_stats, methods=['GET']),
+    Route('/cache/stats', get_cache_stats, methods=['GET']),
+    Route('/tasks', get_tasks, methods=['GET']),
+    Route('/tasks', create_task, methods=['POST']),
+    Route('/agenda', get_agenda, methods=['GET']),
+    Route('/tasks/search', search_tasks, methods=['GET']),
+    Route('/tasks/changes', get_changes, methods=['GET']),
+    Route('/tasks/changes/stream', stream_changes, methods=['GET']),
+    Route('/tasks/export', export_tasks, methods=['GET']),
+    Route('/tasks/batch', batch_tasks, methods=['POST']),
+    Route('/tasks/archive', archive_now, methods=['POST']),
+    Route('/tasks/{task_id}', get_task, methods=['GET']),
+    Route('/tasks/{task_id}', update_task, methods=['PUT']),
+    Route('/tasks/{task_id}', delete_task, methods=['DELETE']),
+]
+
+# Same budgets as app_postgres.py; asyncpg runs single statements without BEGIN/COMMIT
+ROUNDTRIP_BUDGETS = {
+    'live_check': 0,
+    'ready_check': 0,
+    'health_check': 1,
+    'get_stats': 1,
+    'get_tasks': 2,
+    'get_task': 1,
+    'search_tasks': 1,
+    'get_agenda': 2,
+    'get_changes': 1,
+    'create_task': 1,
+    'update_task': 1,
+    'delete_task': 1,
+    'batch_tasks': 5,
+}
+if replicas.enabled:
+    # Writes also read the primary's position for the read-after cookie
+    for route in ('create_task', 'update_task', 'delete_task', 'batch_tasks'):
+        ROUNDTRIP_BUDGETS[route] += 1
+
+app = Starlette(routes=routes, lifespan=lifespan, middleware=[
+    Middleware(CORSMiddleware,
+               allow_origins=["*"],
+               allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+               allow_headers=["Content-Type", "Authorization", OWNER_HEADER],
+               expose_headers=["X-Next-Cursor", "Link", "ETag"],
+               allow_credentials=True),
+    # gzip/brotli by Accept-Encoding for JSON, CSV and MessagePack bodies (see compression.py)
+    Middleware(CompressionMiddleware),
+    Middleware(InvalidateCacheOnWrite),
+    Middleware(MetricsMiddleware, roundtrip_budgets=ROUNDTRIP_BUDGETS),
+    Middleware(AdmissionMiddleware, controller=admission),
+    # Every task route acts for the owner in OWNER_HEADER, in request.state.owner (see owners.py)
+    Middleware(OwnerMiddleware),
+])
@@ -1,12 +1,42 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, url_for
 from flask_cors import CORS
 import psycopg2
 import psycopg2.extras
 import os
+import time
 import uuid
+from contextlib import ExitStack, contextmanager
 from datetime import datetime
+from functools import partial
 import logging
 
+from db_pool import ConnectionPool, PoolTimeout
+from pagination import parse_list_args, encode_cursor, decode_cursor
+from counters import pg_read_counters, pg_reconcile, start_reconciler
+from conditional import make_etag, query_key, not_modified, with_etag
+from read_cache import ReadCache, PgNotifyListener
+from single_flight import SingleFlight
+from schema import PG_SCHEMA_CHECK_SQL, PG_WARMUP_SQL, check_schema_versions
+from batch_ops import BatchError, parse_batch, item_result
+from export_stream import EXPORT_BATCH_SIZE, EXPORT_FORMATS, encode_rows, primed, export_filename
+from probes import ReadinessChecker, PgReadinessCheck, liveness
+from metrics import TimedExecuteMixin, TimedTransactionMixin, instrument_flask, register_stats, add_db_observer
+from admission import AdmissionController, install_flask as install_admission
+from owners import OWNER_HEADER, install_flask as install_owners
+from archive import ARCHIVE_INTERVAL, pg_archive
+from replicas import (READ_AFTER_COOKIE, PG_PRIMARY_POSITION_SQL, ReplicaRouter, ReplicaMonitor, PgReplicaCheck,
+                      replica_hosts, parse_lsn, read_after, read_after_cookie)
+from fast_json import FAST_JSON, pg_page_query, install_json_provider
+from wire_format import WIRE_JSON, negotiate_format, wire_tasks, encode as encode_wire
+from compression import install_flask as install_compression
+from group_commit import GROUP_COMMIT, GroupCommitter, GroupCommitTimeout
+from agenda import AGENDA_MAX_TASKS, parse_agenda_args, group_by_day, agenda_body, pg_agenda_query, pg_overdue_query
+from search import (parse_search_args, next_search_cursor, prefix_tsquery, pg_search_query,
+                    pg_autocomplete_query)
+from changes import (CHANGES_PRUNE_INTERVAL, CHANGES_HEARTBEAT, CHANGES_STREAM_MAX, SSE_HEADERS, SSE_KEEPALIVE,
+                     CursorExpired, ChangeNotifier, parse_changes_args, pg_changes_query, pg_changes_args,
+                     changes_page, pg_prune_changes, sse_event)
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -14,103 +44,667 @@ app = Flask(__name__)
 CORS(app, 
      origins=["*"],
      methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-     allow_headers=["Content-Type", "Authorization"],
+     allow_headers=["Content-Type", "Authorization", OWNER_HEADER],
+     expose_headers=["X-Next-Cursor", "Link", "ETag"],
      supports_credentials=True)
+install_json_provider(app)
+
+# gzip/brotli by Accept-Encoding for JSON, CSV and MessagePack bodies (see compression.py)
+install_compression(app)
 
 DB_CONFIG = {
     'host': os.getenv('DB_HOST', 'postgres-service'),
     'user': os.getenv('DB_USER', 'postgres'),
     'password': os.getenv('DB_PASSWORD', 'agenda123'),
     'database': os.getenv('DB_NAME', 'agendaapp'),
-    'port': 5432
+    'port': int(os.getenv('DB_PORT', 5432))
 }
 
-def get_db_connection():
-    try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        return conn
-    except Exception as e:
-        logger.error(f"Error connecting to PostgreSQL: {str(e)}")
+# Every cursor times its execute() calls into agendaapp_db_duration_seconds
+class TimedCursor(TimedExecuteMixin, psycopg2.extensions.cursor):
+    pass
+
+class TimedDictCursor(TimedExecuteMixin, psycopg2.extras.RealDictCursor):
+    pass
+
+class TimedConnection(TimedTransactionMixin, psycopg2.extensions.connection):
+    pass
+
+def make_pool(config):
+    return ConnectionPool(
+        lambda: psycopg2.connect(**config, connection_factory=TimedConnection, cursor_factory=TimedCursor),
+        minconn=int(os.getenv('DB_POOL_MIN', 1)),
+        maxconn=int(os.getenv('DB_POOL_MAX', 10)),
+        timeout=float(os.getenv('DB_POOL_TIMEOUT', 5)),
+        validate_idle=float(os.getenv('DB_POOL_VALIDATE_IDLE', 30))
+    )
+
+db_pool = make_pool(DB_CONFIG)
+
+# Optional streaming replicas for reads (see replicas.py); writes stay on DB_CONFIG
+REPLICA_CONFIGS = {f"{host}:{port}": {**DB_CONFIG, 'host': host, 'port': port}
+                   for host, port in replica_hosts(os.getenv('DB_REPLICA_HOSTS'), DB_CONFIG['port'])}
+replica_pools = {name: make_pool(config) for name, config in REPLICA_CONFIGS.items()}
+replicas = ReplicaRouter(REPLICA_CONFIGS)
+replica_monitor = ReplicaMonitor(replicas, PgReplicaCheck(
+    partial(psycopg2.connect, **DB_CONFIG),
+    {name: partial(psycopg2.connect, **config) for name, config in REPLICA_CONFIGS.items()}))
+
+def get_db_connection(autocommit=False):
+    # Borrowed connections go back to the pool when the with-block exits
+    return db_pool.connection(autocommit=autocommit)
+
+def read_after_position():
+    """Position of this client's last write (READ_AFTER_COOKIE), None without one."""
+    return read_after(request.cookies.get(READ_AFTER_COOKIE))
+
+def choose_replica():
+    """Replica for this request's reads, None for the primary."""
+    if not replicas.enabled:
         return None
+    return replicas.choose(read_after_position())
 
-def init_database():
-    conn = get_db_connection()
-    if conn:
+@contextmanager
+def get_read_connection(replica=None):
+    """Autocommit connection on replica; on the primary for None, or if the replica fails."""
+    with ExitStack() as stack:
+        conn = None
+        if replica is not None:
+            try:
+                conn = stack.enter_context(replica_pools[replica.name].connection(autocommit=True))
+            except psycopg2.OperationalError as e:
+                replicas.mark_down(replica.name, e)
+            except PoolTimeout:
+                pass  # a busy replica spills over to the primary
+        if conn is None:
+            conn = stack.enter_context(get_db_connection(autocommit=True))
+        yield conn
+
+def pool_exhausted(e):
+    logger.warning(f"Database pool exhausted: {str(e)}")
+    response = jsonify({"error": "Database busy, try again later"})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+counters_reconciler = None
+changes_pruner = None
+tasks_archiver = None
+search_trigram = False
+read_cache = ReadCache()
+# Identical concurrent cache misses share one load (see single_flight.py)
+read_flights = SingleFlight()
+change_notifier = ChangeNotifier()
+change_listener = None
+readiness = ReadinessChecker(PgReadinessCheck(lambda **options: psycopg2.connect(**DB_CONFIG, **options)))
+
+# Most DB round trips each route should need; see X-DB-Roundtrips in tests.
+# Single-statement routes run in autocommit, so BEGIN/COMMIT cost nothing.
+ROUNDTRIP_BUDGETS = {
+    'live_check': 0,
+    'ready_check': 0,
+    'health_check': 1,
+    'get_stats': 1,
+    'get_tasks': 2,
+    'get_task': 1,
+    'search_tasks': 1,
+    'get_agenda': 2,
+    'get_changes': 1,
+    'create_task': 1,
+    'update_task': 1,
+    'delete_task': 1,
+    'batch_tasks': 5,
+}
+if replicas.enabled:
+    # Writes also read the primary's position for the read-after cookie
+    for route in ('create_task', 'update_task', 'delete_task', 'batch_tasks'):
+        ROUNDTRIP_BUDGETS[route] += 1
+
+instrument_flask(app, ROUNDTRIP_BUDGETS)
+# Sheds load with 503 + Retry-After when the database slows down (see admission.py)
+admission = AdmissionController()
+add_db_observer(admission.observe)
+install_admission(app, admission)
+# Every task route acts for the owner in OWNER_HEADER, in g.owner (see owners.py)
+install_owners(app)
+register_stats('agendaapp_db_pool', 'Connection pool stats (see /database/pool)', db_pool.stats)
+register_stats('agendaapp_cache', 'Read cache stats (see /cache/stats)', read_cache.stats)
+register_stats('agendaapp_single_flight', 'Coalesced concurrent reads (see /cache/stats)', read_flights.stats)
+register_stats('agendaapp_readiness', 'Last background database check (see /readyz)', readiness.stats)
+register_stats('agendaapp_admission', 'Admission control limits and shed requests', admission.stats)
+register_stats('agendaapp_replicas', 'Read replica routing (see replicas.py)', replicas.stats)
+
+def read_version(conn, owner):
+    # Bumped by every write of owner only (see counters.py)
+    cur = conn.cursor()
+    version = pg_read_counters(cur, owner)[1]
+    cur.close()
+    return version
+
+def read_stats(replica, owner):
+    """Return (stats, version) from owner's counters row."""
+    with get_read_connection(replica) as conn:
+        cur = conn.cursor()
+        stats, version = pg_read_counters(cur, owner)
+        cur.close()
+    return stats, version
+
+def reconcile_counters():
+    with get_db_connection() as conn:
+        return pg_reconcile(conn)
+
+def prune_changes():
+    with get_db_connection() as conn:
+        return pg_prune_changes(conn)
+
+def archive_tasks():
+    with get_db_connection() as conn:
+        return pg_archive(conn)
+
+def on_tasks_changed(owner=None):
+    # The trigger names the owner written in the NOTIFY payload
+    read_cache.invalidate(owner)
+    change_notifier.notify()
+
+def on_listener_state(listening):
+    read_cache.set_listening(listening)
+    change_notifier.set_listening(listening)
+
+INSERT_TASK_SQL = '''
+    INSERT INTO tasks (id, title, done, due_date, created_at, updated_at, owner_id)
+    VALUES %s
+    RETURNING *
+'''
+
+def insert_task_rows(rows):
+    """GroupCommitter flush: every queued create in one INSERT and one commit."""
+    with get_db_connection() as conn:
+        cur = conn.cursor()
         try:
-            cur = conn.cursor()
-            cur.execute('''
-                CREATE TABLE IF NOT EXISTS tasks (
-                    id VARCHAR(50) PRIMARY KEY,
-                    title VARCHAR(255) NOT NULL,
-                    done BOOLEAN DEFAULT FALSE,
-                    due_date DATE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
+            inserted = psycopg2.extras.execute_values(cur, INSERT_TASK_SQL, rows,
+                                                      page_size=len(rows), fetch=True)
             conn.commit()
+            by_id = {row[0]: row for row in inserted}
+            return [by_id[row[0]] for row in rows]
+        except (psycopg2.DataError, psycopg2.IntegrityError):
+            # One bad row fails the whole INSERT; retry one by one so only its request fails
+            conn.rollback()
+            conn.autocommit = True
+            results = []
+            for row in rows:
+                try:
+                    cur.execute(INSERT_TASK_SQL, (row,))
+                    results.append(cur.fetchone())
+                except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+                    results.append(e)
+            return results
+        finally:
+            cur.close()
+
+task_committer = GroupCommitter(insert_task_rows) if GROUP_COMMIT else None
+
+def warm_up():
+    with get_db_connection(autocommit=True) as conn:
+        cur = conn.cursor()
+        for statement in PG_WARMUP_SQL:
+            cur.execute(statement)
+            cur.fetchall()
+        cur.close()
+
+def shutdown():
+    """Close idle connections on the way out (gunicorn worker_exit)."""
+    if change_listener is not None:
+        change_listener.stop()
+    db_pool.closeall()
+    for pool in replica_pools.values():
+        pool.closeall()
+
+def check_schema():
+    """Fail unless migrate.py has applied every migration this code needs."""
+    global search_trigram
+    with get_db_connection(autocommit=True) as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(PG_SCHEMA_CHECK_SQL)
+            versions, search_trigram = cur.fetchone()
+        except psycopg2.errors.UndefinedTable:
+            versions = None
+        finally:
             cur.close()
-            conn.close()
-            logger.info("Database initialized")
-            return True
-        except Exception as e:
-            logger.error(f"Error initializing database: {str(e)}")
-            return False
-    return False
+    check_schema_versions(versions)
+    if not search_trigram:
+        logger.warning("pg_trgm index missing: /tasks/search matches whole words only")
+
+def init_database():
+    """Check the schema and start the background work; no DDL (see migrate.py)."""
+    global counters_reconciler, changes_pruner, tasks_archiver, change_listener
+    try:
+        check_schema()
+        db_pool.prefill()
+        warm_up()
+        readiness.start()
+        if replicas.enabled:
+            replica_monitor.start()
+        if counters_reconciler is None:
+            counters_reconciler = start_reconciler(reconcile_counters)
+        if changes_pruner is None:
+            changes_pruner = start_reconciler(prune_changes, CHANGES_PRUNE_INTERVAL)
+        if tasks_archiver is None:
+            # Moves old completed tasks out of the hot partition (see archive.py)
+            tasks_archiver = start_reconciler(archive_tasks, ARCHIVE_INTERVAL)
+        if change_listener is None:
+            # Writes on any replica NOTIFY us so this pod drops its cached
+            # reads and wakes up its change streams
+            change_listener = PgNotifyListener(lambda: psycopg2.connect(**DB_CONFIG),
+                                               on_tasks_changed, on_listener_state).start()
+        logger.info("Database initialized")
+        return True
+    except Exception as e:
+        logger.error(f"Error initializing database: {str(e)}")
+        return False
 
+# Probes: /livez does no I/O, /readyz reads the cached background check
+@app.route('/livez', methods=['GET'])
+def live_check():
+    return jsonify(liveness())
+
+@app.route('/readyz', methods=['GET'])
+def ready_check():
+    ready, body = readiness.status()
+    return jsonify(body), 200 if ready else 503
+
+# Detailed report for humans; probes should use /livez and /readyz
 @app.route('/health', methods=['GET'])
 def health_check():
-    conn = get_db_connection()
-    if conn:
-        try:
+    try:
+        # The caller's tasks only, like every other count (see owners.py)
+        stats, _ = read_stats(choose_replica(), g.owner)
+        body = {
+            "status": "healthy", 
+            "database": "connected",
+            "tasks_count": stats['total'],
+            "pool": db_pool.stats(),
+            "cache": read_cache.stats(),
+            "timestamp": datetime.now().isoformat()
+        }
+        if replicas.enabled:
+            body["replicas"] = [status._asdict() for status in replicas.status()]
+        return jsonify(body)
+    except PoolTimeout as e:
+        return jsonify({
+            "status": "unhealthy", 
+            "database": "pool exhausted",
+            "error": str(e),
+            "pool": db_pool.stats()
+        }), 500
+    except Exception as e:
+        return jsonify({
+            "status": "unhealthy", 
+            "database": "error",
+            "error": str(e),
+            "pool": db_pool.stats()
+        }), 500
+
+def load_stats_entry(owner):
+    """((etag, stats), position of the replica read, None for the primary)."""
+    replica = choose_replica()
+    stats, version = read_stats(replica, owner)
+    return (make_etag(version, 'stats', owner), stats), replica.position if replica else None
+
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    try:
+        owner = g.owner
+        client_position = read_after_position()
+        entry = read_cache.get(('stats', owner), client_position)
+        if entry is None:
+            generation = read_cache.generation_for(owner)
+            # Clients that just wrote never share a read that may predate their write
+            entry, position = read_flights.do(('stats', owner, generation, client_position),
+                                              lambda: load_stats_entry(owner))
+            read_cache.set(('stats', owner), entry, generation, position, client_position)
+        etag, stats = entry
+        return not_modified(etag) or with_etag(jsonify(stats), etag)
+    except PoolTimeout as e:
+        return pool_exhausted(e)
+    except Exception as e:
+        logger.error(f"Error getting stats: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/stats/reconcile', methods=['POST'])
+def reconcile_stats():
+    try:
+        return jsonify(reconcile_counters())
+    except PoolTimeout as e:
+        return pool_exhausted(e)
+    except Exception as e:
+        logger.error(f"Error reconciling stats: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/tasks/archive', methods=['POST'])
+def archive_now():
+    try:
+        return jsonify(archive_tasks())
+    except PoolTimeout as e:
+        return pool_exhausted(e)
+    except Exception as e:
+        logger.error(f"Error archiving tasks: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/database/pool', methods=['GET'])
+def get_pool_stats():
+    return jsonify(db_pool.stats())
+
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify({**read_cache.stats(), "single_flight": read_flights.stats()})
+
+def set_read_after(response):
+    """Send the primary's position so this client's next reads include its write."""
+    try:
+        with get_db_connection(autocommit=True) as conn:
+            cur = conn.cursor()
+            cur.execute(PG_PRIMARY_POSITION_SQL)
+            position = parse_lsn(cur.fetchone()[0])
+            cur.close()
+    except Exception as e:
+        logger.warning(f"Could not read the primary WAL position: {str(e)}")
+        return
+    name, value, options = read_after_cookie(position)
+    response.set_cookie(name, value, **options)
+
+@app.after_request
+def invalidate_cache_after_write(response):
+    # Local writes are visible to this pod's next read without waiting for NOTIFY
+    if request.method in ('POST', 'PUT', 'DELETE'):
+        on_tasks_changed(g.get('owner'))
+        if replicas.enabled and response.status_code < 400:
+            set_read_after(response)
+    return response
+
+def serialize_task(task):
+    task_dict = dict(task)
+    # Storage detail of the hot/cold split (archive.py), not part of a task;
+    # the owner is the caller's (owners.py)
+    task_dict.pop('archived', None)
+    task_dict.pop('owner_id', None)
+    if task_dict['created_at']:
+        task_dict['created_at'] = task_dict['created_at'].isoformat()
+    if task_dict['updated_at']:
+        task_dict['updated_at'] = task_dict['updated_at'].isoformat()
+    if task_dict['due_date']:
+        task_dict['due_date'] = task_dict['due_date'].isoformat()
+    return task_dict
+
+def load_tasks_page(where, values, limit, wire_format, revalidate=True):
+    """((etag, encoded body, next cursor), replica position) of one page of GET /tasks.
+
+    With revalidate, a client that already holds the version gets
+    (etag, None, None) without the rows being read.
+    """
+    replica = choose_replica()
+    position = replica.position if replica else None
+    with get_read_connection(replica) as conn:
+        etag = make_etag(read_version(conn, g.owner), 'tasks', g.owner, wire_format, query_key(request.args))
+        if revalidate and not_modified(etag):
+            return (etag, None, None), position
+        if FAST_JSON and wire_format == WIRE_JSON:
+            # PostgreSQL encodes the page; the text goes out as is
             cur = conn.cursor()
-            cur.execute("SELECT COUNT(*) FROM tasks")
-            count = cur.fetchone()[0]
+            cur.execute(pg_page_query(where, '%s'), [limit] + values)
+            body, has_more, last_created_at, last_id = cur.fetchone()
             cur.close()
-            conn.close()
-            return jsonify({
-                "status": "healthy", 
-                "database": "connected",
-                "tasks_count": count,
-                "timestamp": datetime.now().isoformat()
-            })
-        except Exception as e:
-            return jsonify({
-                "status": "unhealthy", 
-                "database": "error",
-                "error": str(e)
-            }), 500
-    return jsonify({"status": "unhealthy", "database": "disconnected"}), 500
+            next_cursor = encode_cursor(last_created_at.isoformat(), last_id) if has_more else None
+        else:
+            # One extra row tells us whether there is a next page
+            cur = conn.cursor(cursor_factory=TimedDictCursor)
+            cur.execute(f"SELECT * FROM tasks {where} ORDER BY created_at DESC, id DESC LIMIT %s",
+                        values + [limit + 1])
+            tasks = cur.fetchall()
+            cur.close()
+            next_cursor = None
+            if len(tasks) > limit:
+                tasks = tasks[:limit]
+                next_cursor = encode_cursor(tasks[-1]['created_at'].isoformat(), tasks[-1]['id'])
+            body = encode_wire(wire_tasks([serialize_task(task) for task in tasks], wire_format), wire_format,
+                               app.json.dumps)
+    # The encoded body is cached so hits skip serialization too
+    return (etag, body, next_cursor), position
 
 @app.route('/tasks', methods=['GET'])
 def get_tasks():
     try:
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({"error": "Database connection failed"}), 500
-        
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cur.execute("SELECT * FROM tasks ORDER BY created_at DESC")
-        tasks = cur.fetchall()
-        
-        tasks_list = []
-        for task in tasks:
-            task_dict = dict(task)
-            if task_dict['created_at']:
-                task_dict['created_at'] = task_dict['created_at'].isoformat()
-            if task_dict['updated_at']:
-                task_dict['updated_at'] = task_dict['updated_at'].isoformat()
-            if task_dict['due_date']:
-                task_dict['due_date'] = task_dict['due_date'].isoformat()
-            tasks_list.append(task_dict)
+        try:
+            filters = parse_list_args(request.args)
+            # Leads every owner-scoped index (see owners.py)
+            conditions = ["owner_id = %s"]
+            values = [g.owner]
+            if filters['done'] is not None:
+                conditions.append("done = %s")
+                values.append(filters['done'])
+            if filters['due_from']:
+                conditions.append("due_date >= %s")
+                values.append(filters['due_from'])
+            if filters['due_to']:
+                conditions.append("due_date <= %s")
+                values.append(filters['due_to'])
+            if filters['cursor']:
+                created_at, last_id = decode_cursor(filters['cursor'], 2)
+                conditions.append("(created_at, id) < (%s, %s)")
+                values.extend([datetime.fromisoformat(created_at), str(last_id)])
+            if not filters['include_archived']:
+                # Only the hot partition is scanned (see archive.py)
+                conditions.append("NOT archived")
+        except (ValueError, TypeError) as e:
+            return jsonify({"error": str(e)}), 400
         
-        cur.close()
-        conn.close()
-        return jsonify(tasks_list)
+        where = f"WHERE {' AND '.join(conditions)}"
+        # JSON, columnar JSON or MessagePack, by the Accept header (see wire_format.py)
+        wire_format = negotiate_format(request.headers.get('Accept'))
+        
+        cache_key = ('tasks', g.owner, wire_format, query_key(request.args))
+        client_position = read_after_position()
+        page = read_cache.get(cache_key, client_position)
+        if page is None:
+            generation = read_cache.generation_for(g.owner)
+            page, position = read_flights.do((cache_key, generation, client_position),
+                                             lambda: load_tasks_page(where, values, filters['limit'], wire_format))
+            if page[1] is None:
+                # The leader's client already had this version, so no rows were read
+                cached = not_modified(page[0])
+                if cached:
+                    cached.vary.add('Accept')
+                    return cached
+                page, position = load_tasks_page(where, values, filters['limit'], wire_format, revalidate=False)
+            read_cache.set(cache_key, page, generation, position, client_position)
+        
+        etag, body, next_cursor = page
+        cached = not_modified(etag)
+        if cached:
+            cached.vary.add('Accept')
+            return cached
+        
+        response = app.response_class(body, mimetype=wire_format)
+        response.vary.add('Accept')
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+            next_args = request.args.to_dict()
+            next_args['cursor'] = next_cursor
+            response.headers['Link'] = f'<{url_for("get_tasks", **next_args)}>; rel="next"'
+        return with_etag(response, etag)
+    except PoolTimeout as e:
+        return pool_exhausted(e)
     except Exception as e:
         logger.error(f"Error getting tasks: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/tasks/search', methods=['GET'])
+def search_tasks():
+    try:
+        try:
+            params = parse_search_args(request.args)
+            prefix = prefix_tsquery(params['q']) if params['mode'] == 'autocomplete' else None
+        except (ValueError, TypeError) as e:
+            return jsonify({"error": str(e)}), 400
+        
+        with get_read_connection(choose_replica()) as conn:
+            cur = conn.cursor(cursor_factory=TimedDictCursor)
+            if prefix:
+                cur.execute(pg_autocomplete_query({'owner': '%(owner)s', 'prefix': '%(prefix)s',
+                                                   'limit': '%(limit)s'}),
+                            {'owner': g.owner, 'prefix': prefix, 'limit': params['limit']})
+            else:
+                # One extra row tells us whether there is a next page
+                cur.execute(pg_search_query({'owner': '%(owner)s', 'q': '%(q)s', 'limit': '%(limit)s',
+                                             'offset': '%(offset)s'}, search_trigram),
+                            {**params, 'owner': g.owner, 'limit': params['limit'] + 1})
+            tasks = cur.fetchall()
+            cur.close()
+        
+        if prefix:
+            return jsonify(tasks)
+        
+        next_cursor = next_search_cursor(params, len(tasks))
+        response = jsonify([serialize_task(task) for task in tasks[:params['limit']]])
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+            next_args = request.args.to_dict()
+            next_args['cursor'] = next_cursor
+            response.headers['Link'] = f'<{url_for("search_tasks", **next_args)}>; rel="next"'
+        return response
+    except PoolTimeout as e:
+        return pool_exhausted(e)
+    except Exception as e:
+        logger.error(f"Error searching tasks: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/agenda', methods=['GET'])
+def get_agenda():
+    try:
+        try:
+            params = parse_agenda_args(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        with get_read_connection(choose_replica()) as conn:
+            cur = conn.cursor(cursor_factory=TimedDictCursor)
+            cur.execute(pg_agenda_query({'owner': '%(owner)s', 'from': '%(from)s', 'to': '%(to)s',
+                                         'limit': '%(limit)s'}, params['include_done']),
+                        {**params, 'owner': g.owner, 'limit': AGENDA_MAX_TASKS + 1})
+            tasks = cur.fetchall()
+            cur.execute(pg_overdue_query({'owner': '%(owner)s', 'today': '%(today)s'}), {**params, 'owner': g.owner})
+            overdue = cur.fetchone()['count']
+            cur.close()
+        
+        days = group_by_day([serialize_task(task) for task in tasks[:AGENDA_MAX_TASKS]])
+        return jsonify(agenda_body(params, days, overdue, len(tasks) > AGENDA_MAX_TASKS))
+    except PoolTimeout as e:
+        return pool_exhausted(e)
+    except Exception as e:
+        logger.error(f"Error getting agenda: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+def read_changes(params, owner):
+    """One page of owner's change feed (see changes.py); raises CursorExpired."""
+    # On the primary: streams are woken by NOTIFY, a replica may not have the change yet
+    with get_db_connection(autocommit=True) as conn:
+        cur = conn.cursor(cursor_factory=TimedDictCursor)
+        cur.execute(pg_changes_query({'owner': '%s', 'version': '%s', 'task_id': '%s', 'start': '%s',
+                                      'limit': '%s'}),
+                    pg_changes_args(params, owner))
+        rows = cur.fetchall()
+        cur.close()
+    return changes_page(rows, params, serialize_task)
+
+def changes_gone(e):
+    return jsonify({"error": str(e), "reset": True}), 410
+
+@app.route('/tasks/changes', methods=['GET'])
+def get_changes():
+    try:
+        try:
+            params = parse_changes_args(request.args)
+        except (ValueError, TypeError) as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify(read_changes(params, g.owner))
+    except CursorExpired as e:
+        return changes_gone(e)
+    except PoolTimeout as e:
+        return pool_exhausted(e)
+    except Exception as e:
+        logger.error(f"Error getting changes: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/tasks/changes/stream', methods=['GET'])
+def stream_changes():
+    try:
+        params = parse_changes_args(request.args, request.headers.get('Last-Event-ID'))
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": str(e)}), 400
+    
+    def events(params, owner):
+        # A connection is only borrowed per page, never while waiting
+        deadline = time.monotonic() + CHANGES_STREAM_MAX
+        quiet_since = time.monotonic()
+        generation = change_notifier.generation
+        while True:
+            try:
+                page = read_changes(params, owner)
+            except CursorExpired as e:
+                yield sse_event('reset', {"error": str(e)})
+                return
+            except Exception as e:
+                logger.error(f"Error streaming changes: {str(e)}")
+                yield sse_event('error', {"error": str(e)})
+                return
+            if page['changes']:
+                yield sse_event('changes', page, page['cursor'])
+                quiet_since = time.monotonic()
+            elif time.monotonic() - quiet_since >= CHANGES_HEARTBEAT:
+                yield SSE_KEEPALIVE
+                quiet_since = time.monotonic()
+            params = parse_changes_args({'since': page['cursor'], 'limit': params['limit']})
+            if page['has_more']:
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            # Woken by NOTIFY or a local write; re-reads on timeout anyway
+            generation = change_notifier.wait(generation, min(CHANGES_HEARTBEAT, remaining))
+    
+    # The body outlives the request context: the owner goes in as an argument
+    return Response(events(params, g.owner), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+EXPORT_FIELDS = ['id', 'title', 'done', 'due_date', 'created_at', 'updated_at']
+
+@app.route('/tasks/export', methods=['GET'])
+def export_tasks():
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": f"Unsupported export format: {fmt}"}), 400
+    
+    def rows(owner):
+        # On the primary: recovery conflicts would cancel a long export on a hot standby
+        with get_db_connection() as conn:
+            # Named cursor: rows stay on the server and arrive itersize at a time
+            cur = conn.cursor(name='tasks_export', cursor_factory=TimedDictCursor)
+            cur.itersize = EXPORT_BATCH_SIZE
+            cur.execute("SELECT * FROM tasks WHERE owner_id = %s ORDER BY created_at, id", (owner,))
+            for task in cur:
+                yield task
+            cur.close()
+    
+    try:
+        body = primed(encode_rows(rows(g.owner), fmt, EXPORT_FIELDS))
+    except PoolTimeout as e:
+        return pool_exhausted(e)
+    except Exception as e:
+        logger.error(f"Error exporting tasks: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+    
+    response = Response(body, mimetype=EXPORT_FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename={export_filename(fmt)}'
+    return response
+
 @app.route('/tasks', methods=['POST'])
 def create_task():
     try:
@@ -118,12 +712,7 @@ def create_task():
         if not data or 'title' not in data:
             return jsonify({"error": "Title is required"}), 400
         
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({"error": "Database connection failed"}), 500
-        
         task_id = str(uuid.uuid4())
-        cur = conn.cursor()
         
         due_date = data.get('due_date')
         if due_date:
@@ -132,16 +721,16 @@ def create_task():
             except:
                 due_date = None
         
-        cur.execute('''
-            INSERT INTO tasks (id, title, done, due_date, created_at, updated_at)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            RETURNING *
-        ''', (task_id, data['title'], data.get('done', False), due_date, datetime.now(), datetime.now()))
-        
-        new_task = cur.fetchone()
-        conn.commit()
-        cur.close()
-        conn.close()
+        row = (task_id, data['title'], data.get('done', False), due_date, datetime.now(), datetime.now(), g.owner)
+        if task_committer is not None:
+            # Waits for the background flusher to commit this row with the rest of its batch
+            new_task = task_committer.submit(row)
+        else:
+            with get_db_connection(autocommit=True) as conn:
+                cur = conn.cursor()
+                cur.execute(INSERT_TASK_SQL, (row,))
+                new_task = cur.fetchone()
+                cur.close()
         
         task_dict = {
             "id": new_task[0],
@@ -153,19 +742,122 @@ def create_task():
         }
         
         return jsonify(task_dict), 201
+    except PoolTimeout as e:
+        return pool_exhausted(e)
+    except GroupCommitTimeout as e:
+        # Not retryable blindly: the row may still be committed
+        logger.warning(f"Error creating task: {str(e)}")
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         logger.error(f"Error creating task: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/tasks/batch', methods=['POST'])
+def batch_tasks():
+    try:
+        creates, updates, deletes, results = parse_batch(request.get_json(silent=True))
+    except BatchError as e:
+        return jsonify({"error": str(e)}), e.status
+    
+    now = datetime.now()
+    try:
+        # Whole batch in one transaction: one INSERT, one UPDATE and one DELETE at most
+        with get_db_connection() as conn:
+            cur = conn.cursor(cursor_factory=TimedDictCursor)
+            
+            if creates:
+                new_ids = [str(uuid.uuid4()) for _ in creates]
+                rows = psycopg2.extras.execute_values(cur, INSERT_TASK_SQL,
+                    [(task_id, fields['title'], fields['done'], fields['due_date'], now, now, g.owner)
+                     for task_id, (_, fields) in zip(new_ids, creates)],
+                    page_size=len(creates), fetch=True)
+                created = {row['id']: row for row in rows}
+                for task_id, (index, _) in zip(new_ids, creates):
+                    results[index] = item_result(index, 'create', 201, task=serialize_task(created[task_id]))
+            
+            if updates:
+                rows = psycopg2.extras.execute_values(cur, """
+                    UPDATE tasks AS t SET
+                        title = CASE WHEN v.set_title THEN v.title ELSE t.title END,
+                        done = CASE WHEN v.set_done THEN v.done ELSE t.done END,
+                        due_date = CASE WHEN v.set_due_date THEN v.due_date ELSE t.due_date END,
+                        updated_at = v.updated_at,
+                        archived = FALSE
+                    FROM (VALUES %s) AS v (id, set_title, title, set_done, done, set_due_date, due_date, updated_at,
+                                           owner_id)
+                    WHERE t.id = v.id AND t.owner_id = v.owner_id
+                    RETURNING t.*
+                """, [(task_id,
+                       'title' in fields, fields.get('title'),
+                       'done' in fields, fields.get('done'),
+                       'due_date' in fields, fields.get('due_date'),
+                       now, g.owner) for _, task_id, fields in updates],
+                    template="(%s, %s, %s::varchar, %s, %s::boolean, %s, %s::date, %s::timestamp, %s::varchar)",
+                    page_size=len(updates), fetch=True)
+                updated = {row['id']: row for row in rows}
+                for index, task_id, _ in updates:
+                    if task_id in updated:
+                        results[index] = item_result(index, 'update', 200, task=serialize_task(updated[task_id]))
+                    else:
+                        results[index] = item_result(index, 'update', 404, error="Task not found")
+            
+            if deletes:
+                cur.execute("DELETE FROM tasks WHERE id = ANY(%s) AND owner_id = %s RETURNING id",
+                            ([task_id for _, task_id in deletes], g.owner))
+                deleted = {row['id'] for row in cur.fetchall()}
+                for index, task_id in deletes:
+                    if task_id in deleted:
+                        results[index] = item_result(index, 'delete', 200)
+                    else:
+                        results[index] = item_result(index, 'delete', 404, error="Task not found")
+            
+            conn.commit()
+            cur.close()
+        
+        return jsonify({"results": results})
+    except PoolTimeout as e:
+        return pool_exhausted(e)
+    except Exception as e:
+        logger.error(f"Error applying batch: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/tasks/<task_id>', methods=['GET'])
+def get_task(task_id):
+    try:
+        with get_read_connection(choose_replica()) as conn:
+            cur = conn.cursor(cursor_factory=TimedDictCursor)
+            # Version and row in one query; a 304 just ignores the row
+            cur.execute('''
+                SELECT coalesce(c.version, 0) AS counters_version, t.*
+                FROM (SELECT 1) AS one
+                LEFT JOIN owner_counters c ON c.owner_id = %(owner)s
+                LEFT JOIN tasks t ON t.id = %(id)s AND t.owner_id = %(owner)s
+            ''', {'id': task_id, 'owner': g.owner})
+            task = cur.fetchone()
+            cur.close()
+        
+        etag = make_etag(task.pop('counters_version'), 'task', g.owner, task_id)
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        
+        if task['id'] is None:
+            return jsonify({"error": "Task not found"}), 404
+        
+        return with_etag(jsonify(serialize_task(task)), etag)
+    except PoolTimeout as e:
+        return pool_exhausted(e)
+    except Exception as e:
+        logger.error(f"Error getting task: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/tasks/<task_id>', methods=['PUT'])
 def update_task(task_id):
     try:
         data = request.get_json()
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({"error": "Database connection failed"}), 500
+        if not data:
+            return jsonify({"error": "No data to update"}), 400
         
-        cur = conn.cursor()
         updates = []
         values = []
         
@@ -187,33 +879,38 @@ def update_task(task_id):
             updates.append("due_date = %s")
             values.append(due_date)
         
-        if updates:
-            updates.append("updated_at = %s")
-            values.append(datetime.now())
-            values.append(task_id)
-            
-            query = f"UPDATE tasks SET {', '.join(updates)} WHERE id = %s RETURNING *"
+        if not updates:
+            return jsonify({"error": "No data to update"}), 400
+        
+        # Writing to an archived task brings it back to the hot partition
+        updates.append("archived = FALSE")
+        updates.append("updated_at = %s")
+        values.append(datetime.now())
+        values.extend([task_id, g.owner])
+        
+        with get_db_connection(autocommit=True) as conn:
+            cur = conn.cursor()
+            query = f"UPDATE tasks SET {', '.join(updates)} WHERE id = %s AND owner_id = %s RETURNING *"
             cur.execute(query, values)
             
             updated_task = cur.fetchone()
-            if not updated_task:
-                return jsonify({"error": "Task not found"}), 404
-            
-            conn.commit()
-            
-            task_dict = {
-                "id": updated_task[0],
-                "title": updated_task[1],
-                "done": updated_task[2],
-                "due_date": updated_task[3].isoformat() if updated_task[3] else None,
-                "created_at": updated_task[4].isoformat(),
-                "updated_at": updated_task[5].isoformat()
-            }
-            
             cur.close()
-            conn.close()
-            return jsonify(task_dict)
-        return jsonify({"error": "No data to update"}), 400
+        
+        if not updated_task:
+            return jsonify({"error": "Task not found"}), 404
+        
+        task_dict = {
+            "id": updated_task[0],
+            "title": updated_task[1],
+            "done": updated_task[2],
+            "due_date": updated_task[3].isoformat() if updated_task[3] else None,
+            "created_at": updated_task[4].isoformat(),
+            "updated_at": updated_task[5].isoformat()
+        }
+        
+        return jsonify(task_dict)
+    except PoolTimeout as e:
+        return pool_exhausted(e)
     except Exception as e:
         logger.error(f"Error updating task: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -221,20 +918,18 @@ def update_task(task_id):
 @app.route('/tasks/<task_id>', methods=['DELETE'])
 def delete_task(task_id):
     try:
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({"error": "Database connection failed"}), 500
-        
-        cur = conn.cursor()
-        cur.execute("DELETE FROM tasks WHERE id = %s", (task_id,))
+        with get_db_connection(autocommit=True) as conn:
+            cur = conn.cursor()
+            cur.execute("DELETE FROM tasks WHERE id = %s AND owner_id = %s", (task_id, g.owner))
+            deleted = cur.rowcount
+            cur.close()
         
-        if cur.rowcount == 0:
+        if deleted == 0:
             return jsonify({"error": "Task not found"}), 404
         
-        conn.commit()
-        cur.close()
-        conn.close()
         return jsonify({"message": "Task deleted successfully"})
+    except PoolTimeout as e:
+        return pool_exhausted(e)
     except Exception as e:
         logger.error(f"Error deleting task: {str(e)}")
         return jsonify({"error": str(e)}), 500
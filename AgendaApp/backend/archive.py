@@ -0,0 +1,269 @@
+"""Hot/cold split of the tasks, shared by every backend.
+
+Completed tasks were never removed, so lists, search, the agenda and the
+overdue count ran over an ever-growing table although users mostly look at
+pending work. A background job now archives completed tasks last updated
+more than ARCHIVE_AFTER_DAYS ago, plus the oldest completed ones beyond
+the newest ARCHIVE_KEEP_DONE of their owner (owners.py), so the hot set is
+the pending tasks and a bounded tail of done ones per owner; a busy owner
+never pushes another's recent work into the archive:
+
+- PostgreSQL: tasks is partitioned by LIST (archived) into tasks_hot and
+  tasks_archive (migrations/0004_archive_partition.sql). Archiving sets the
+  flag, which moves the row; the counters and change-feed triggers see an
+  ordinary update. Queries that say NOT archived only touch tasks_hot.
+- MongoDB: documents move to the tasks_archive collection. A batch is
+  copied first and each task is then removed from tasks only if it did not
+  change since it was read (one unordered bulk_write per batch), so neither
+  an interrupted run nor a concurrent write loses a task. A task deleted by
+  a user between the two steps cannot be told apart from a moved one and
+  stays archived.
+
+GET /tasks?include_archived=true lists both sets; GET /tasks/<id>, the
+export and the counters (/stats) always cover every task. A write to an
+archived task (update, delete, batch) brings it back to the hot set, and
+the job archives it again once it qualifies. Search, the agenda and the
+overdue count only look at hot tasks.
+"""
+import heapq
+import itertools
+import logging
+import os
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', 30))
+# Completed tasks kept hot per owner whatever their age; 0 only archives by age
+ARCHIVE_KEEP_DONE = int(os.getenv('ARCHIVE_KEEP_DONE', 10000))
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', 500))
+# Seconds between runs of the background job (0 disables it)
+ARCHIVE_INTERVAL = float(os.getenv('ARCHIVE_INTERVAL', 3600))
+
+
+def archive_report(moved):
+    if moved:
+        logger.info(f"Archived {moved} completed task(s)")
+    return {"archived": moved}
+
+
+# ----------------------------------------------------------------------
+# PostgreSQL
+# ----------------------------------------------------------------------
+
+def pg_archive_query(ph, keep_done=ARCHIVE_KEEP_DONE):
+    """One batch of the job; ph maps days, keep and limit to placeholders.
+
+    Rows locked by a writer are skipped, so concurrent runs on several
+    pods never wait for each other; the rowcount tells whether to go on.
+    """
+    beyond_keep = ""
+    if keep_done > 0:
+        # Each owner's completed tasks ranked from the newest (migrations/0010_owner_keep_done.sql)
+        beyond_keep = f'''
+               OR id IN (SELECT id FROM (
+                             SELECT id, row_number() OVER (PARTITION BY owner_id ORDER BY updated_at DESC) AS newer
+                             FROM tasks WHERE NOT archived AND done
+                         ) AS ranked WHERE newer > {ph['keep']})'''
+    return f'''
+        WITH batch AS (
+            SELECT id FROM tasks
+            WHERE NOT archived AND done
+              AND (updated_at < CURRENT_TIMESTAMP - make_interval(days => {ph['days']}){beyond_keep})
+            ORDER BY updated_at
+            LIMIT {ph['limit']}
+            FOR UPDATE SKIP LOCKED
+        )
+        UPDATE tasks SET archived = TRUE
+        WHERE id IN (SELECT id FROM batch) AND NOT archived
+    '''
+
+
+def pg_archive(conn, after_days=ARCHIVE_AFTER_DAYS, keep_done=ARCHIVE_KEEP_DONE, batch_size=ARCHIVE_BATCH_SIZE):
+    """Archive every task that qualifies (psycopg2), one transaction per batch."""
+    cur = conn.cursor()
+    sql = pg_archive_query({'days': '%(days)s', 'keep': '%(keep)s', 'limit': '%(limit)s'}, keep_done)
+    moved = 0
+    try:
+        while True:
+            cur.execute(sql, {'days': after_days, 'keep': keep_done, 'limit': batch_size})
+            conn.commit()
+            moved += cur.rowcount
+            if cur.rowcount < batch_size:
+                return archive_report(moved)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+# ----------------------------------------------------------------------
+# MongoDB
+# ----------------------------------------------------------------------
+
+MONGO_ARCHIVE_COLLECTION = 'tasks_archive'
+
+# (keys, options) for create_index on tasks: completed tasks by age
+MONGO_ARCHIVE_INDEX = ([("updated_at", 1)], {"name": "done_updated_at",
+                                              "partialFilterExpression": {"done": True}})
+# Completed tasks of an owner from the newest, for ARCHIVE_KEEP_DONE
+MONGO_KEEP_DONE_INDEX = ([("owner_id", 1), ("updated_at", -1)], {"name": "done_owner_id_1_updated_at_-1",
+                                                                  "partialFilterExpression": {"done": True}})
+# Keyset order of GET /tasks?include_archived=true and its date filter, per
+# owner (owners.py); archived tasks are all done, so no done index there
+MONGO_ARCHIVED_INDEXES = [
+    ([("owner_id", 1), ("_id", -1)], {"name": "owner_id_1__id_-1"}),
+    ([("owner_id", 1), ("due_date", 1), ("_id", -1)], {"name": "owner_id_1_due_date_1__id_-1"}),
+]
+
+
+def mongo_keep_owners(keep_done=ARCHIVE_KEEP_DONE):
+    """aggregate() pipeline of the owners with more than keep_done completed tasks, or None without a bound."""
+    if keep_done <= 0:
+        return None
+    return [{"$match": {"done": True}},
+            {"$group": {"_id": "$owner_id", "done": {"$sum": 1}}},
+            {"$match": {"done": {"$gt": keep_done}}}]
+
+
+def mongo_keep_cutoff_find(owner, keep_done=ARCHIVE_KEEP_DONE):
+    """find() arguments of owner's newest completed task beyond keep_done (MONGO_KEEP_DONE_INDEX)."""
+    return {"filter": {"owner_id": owner, "done": True}, "projection": {"updated_at": 1},
+            "sort": [("updated_at", -1)], "skip": keep_done, "limit": 1}
+
+
+def mongo_archive_filter(keep_cutoffs=None, after_days=ARCHIVE_AFTER_DAYS, now=None):
+    """Tasks the job moves; keep_cutoffs maps owner -> the updated_at found by mongo_keep_cutoff_find()."""
+    old = {"updated_at": {"$lt": (now or datetime.now()) - timedelta(days=after_days)}}
+    if not keep_cutoffs:
+        return {"done": True, **old}
+    beyond_keep = [{"owner_id": owner, "updated_at": {"$lte": cutoff}} for owner, cutoff in keep_cutoffs.items()]
+    return {"done": True, "$or": [old, *beyond_keep]}
+
+
+def mongo_unchanged(task):
+    """Filter matching task only while nobody has written it (every write sets updated_at)."""
+    return {"_id": task["_id"], "updated_at": task.get("updated_at")}
+
+
+def mongo_remove_unchanged(batch):
+    """bulk_write operations removing the tasks of batch that nobody wrote since they were read."""
+    from pymongo import DeleteOne
+
+    return [DeleteOne(mongo_unchanged(task)) for task in batch]
+
+
+def mongo_written_meanwhile(moved, batch, found):
+    """_ids of the batch to drop from the archive: the tasks still in tasks (found), written meanwhile."""
+    if moved < len(batch) - len(found):
+        logger.warning(f"{len(batch) - len(found) - moved} task(s) deleted while being archived stay archived")
+    return [task["_id"] for task in found]
+
+
+def ignore_duplicates(e):
+    """Re-raise a BulkWriteError unless it only reports copies left by an earlier run."""
+    if any(error.get('code') != 11000 for error in e.details.get('writeErrors', [])):
+        raise e
+
+
+def mongo_archive(tasks_collection, archive_collection, stats_collection, after_days=ARCHIVE_AFTER_DAYS,
+                  keep_done=ARCHIVE_KEEP_DONE, batch_size=ARCHIVE_BATCH_SIZE):
+    """Move every task that qualifies (pymongo); returns archive_report()."""
+    from pymongo.errors import BulkWriteError
+    from counters import mongo_delta_requests
+
+    keep_cutoffs = {}
+    keep_owners = mongo_keep_owners(keep_done)
+    if keep_owners is not None:
+        for row in tasks_collection.aggregate(keep_owners):
+            newest = next(iter(tasks_collection.find(**mongo_keep_cutoff_find(row["_id"], keep_done))), None)
+            if newest is not None:
+                keep_cutoffs[row["_id"]] = newest.get("updated_at")
+    query = mongo_archive_filter(keep_cutoffs, after_days)
+
+    moved = 0
+    owners = set()
+    while True:
+        batch = list(tasks_collection.find(query).sort("updated_at", 1).limit(batch_size))
+        if not batch:
+            break
+        owners.update(task["owner_id"] for task in batch)
+        try:
+            archive_collection.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            ignore_duplicates(e)
+        removed = tasks_collection.bulk_write(mongo_remove_unchanged(batch), ordered=False).deleted_count
+        moved += removed
+        if removed < len(batch):
+            # Written meanwhile: the task in tasks wins
+            found = tasks_collection.find({"_id": {"$in": [task["_id"] for task in batch]}}, {"_id": 1})
+            gone = mongo_written_meanwhile(removed, batch, list(found))
+            if gone:
+                archive_collection.delete_many({"_id": {"$in": gone}})
+        if len(batch) < batch_size:
+            break
+    if moved:
+        # Totals do not change, but the hot lists of these owners did: new ETags
+        stats_collection.bulk_write(mongo_delta_requests(dict.fromkeys(owners, (0, 0))), ordered=False)
+    return archive_report(moved)
+
+
+def mongo_restored(archived, now=None):
+    """Archived tasks as they go back to tasks.
+
+    A fresh updated_at means a job that copied them meanwhile finds them
+    changed and drops its copy instead of removing them from tasks.
+    """
+    now = now or datetime.now()
+    return {task["_id"]: {**task, "updated_at": now} for task in archived}
+
+
+def mongo_restore_filter(ids, owner=None):
+    """Archived tasks among ids, only owner's if given."""
+    query = {"_id": {"$in": list(ids)}}
+    if owner is not None:
+        query["owner_id"] = owner
+    return query
+
+
+def mongo_restore(tasks_collection, archive_collection, ids, now=None, owner=None):
+    """Bring the archived tasks among ids (owner's) back to tasks before a write; returns {_id: task}."""
+    from pymongo.errors import BulkWriteError
+
+    restored = mongo_restored(archive_collection.find(mongo_restore_filter(ids, owner)), now)
+    if restored:
+        try:
+            tasks_collection.insert_many(list(restored.values()), ordered=False)
+        except BulkWriteError as e:
+            ignore_duplicates(e)
+        archive_collection.delete_many({"_id": {"$in": list(restored)}})
+    return restored
+
+
+def newest_first(pages, limit):
+    """The first limit tasks of several pages sorted by _id descending, merged."""
+    return list(itertools.islice(heapq.merge(*pages, key=lambda task: task["_id"], reverse=True), limit))
+
+
+def oldest_first(cursors):
+    """Several cursors sorted by _id ascending, merged lazily (the export)."""
+    return heapq.merge(*cursors, key=lambda task: task["_id"])
+
+
+async def oldest_first_async(cursors):
+    """oldest_first() for motor cursors."""
+    heap = []
+    for index, cursor in enumerate(cursors):
+        async for task in cursor:
+            heap.append((task["_id"], index, task))
+            break
+    heapq.heapify(heap)
+    while heap:
+        _, index, task = heap[0]
+        yield task
+        async for following in cursors[index]:
+            heapq.heapreplace(heap, (following["_id"], index, following))
+            break
+        else:
+            heapq.heappop(heap)
@@ -0,0 +1,117 @@
+"""Validation and result bookkeeping for POST /tasks/batch.
+
+Request body:
+
+    {"operations": [
+        {"op": "create", "title": "...", "done": false, "due_date": "2025-01-31"},
+        {"op": "update", "id": "...", "done": true},
+        {"op": "delete", "id": "..."}
+    ]}
+
+Each backend applies all creates, then all updates, then all deletes with
+set-based statements. The response lists one result per operation, in
+request order, with its own HTTP-like status.
+"""
+import os
+from datetime import datetime
+
+BATCH_MAX_SIZE = int(os.getenv('TASKS_BATCH_MAX', 500))
+
+UPDATABLE_FIELDS = ('title', 'done', 'due_date')
+
+
+class BatchError(ValueError):
+    """The batch as a whole is invalid (not a per-operation error)."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_due_date(value):
+    # Same leniency as the single-task routes: unparseable dates become None
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).date()
+    except (AttributeError, ValueError):
+        return None
+
+
+def item_result(index, op, status, task=None, error=None):
+    result = {"index": index, "op": op, "status": status}
+    if task is not None:
+        result["task"] = task
+    if error is not None:
+        result["error"] = error
+    return result
+
+
+def parse_batch(payload, max_size=BATCH_MAX_SIZE):
+    """Split a batch into creates, updates and deletes.
+
+    Returns (creates, updates, deletes, results). creates holds
+    (index, fields), updates (index, task_id, fields) and deletes
+    (index, task_id). results is a list with one slot per operation; invalid
+    operations are already filled with a 400 result, the rest are None.
+    """
+    if not isinstance(payload, dict) or not isinstance(payload.get('operations'), list):
+        raise BatchError("Body must be an object with an 'operations' list")
+    operations = payload['operations']
+    if not operations:
+        raise BatchError("'operations' must not be empty")
+    if len(operations) > max_size:
+        raise BatchError(f"Batch too large: {len(operations)} operations (max {max_size})", status=413)
+
+    creates, updates, deletes = [], [], []
+    results = [None] * len(operations)
+    touched = set()
+
+    for index, operation in enumerate(operations):
+        op = operation.get('op') if isinstance(operation, dict) else None
+        if op not in ('create', 'update', 'delete'):
+            results[index] = item_result(index, op, 400, error="'op' must be create, update or delete")
+            continue
+
+        if op == 'create':
+            title = operation.get('title')
+            if not isinstance(title, str) or not title.strip():
+                results[index] = item_result(index, op, 400, error="Title is required")
+                continue
+            creates.append((index, {
+                'title': title.strip(),
+                'done': bool(operation.get('done', False)),
+                'due_date': parse_due_date(operation.get('due_date')),
+            }))
+            continue
+
+        task_id = operation.get('id')
+        if not isinstance(task_id, str) or not task_id:
+            results[index] = item_result(index, op, 400, error="'id' is required")
+            continue
+        # Set-based UPDATE/DELETE cannot express two changes to one row
+        if task_id in touched:
+            results[index] = item_result(index, op, 400, error="Task appears more than once in the batch")
+            continue
+        touched.add(task_id)
+
+        if op == 'delete':
+            deletes.append((index, task_id))
+            continue
+
+        fields = {}
+        if 'title' in operation:
+            if not isinstance(operation['title'], str) or not operation['title'].strip():
+                results[index] = item_result(index, op, 400, error="Title must not be empty")
+                continue
+            fields['title'] = operation['title'].strip()
+        if 'done' in operation:
+            fields['done'] = bool(operation['done'])
+        if 'due_date' in operation:
+            fields['due_date'] = parse_due_date(operation['due_date'])
+        if not fields:
+            results[index] = item_result(index, op, 400, error="No data to update")
+            continue
+        updates.append((index, task_id, fields))
+
+    return creates, updates, deletes, results
@@ -0,0 +1,368 @@
+"""Load test / benchmark harness for the task API.
+
+Seeds the database up to N tasks through POST /tasks/batch, then drives a
+mixed read/write workload from concurrent threads and prints a JSON report
+with throughput and p50/p95/p99 latency per operation.
+
+Targets:
+    --app postgres     app_postgres.py in-process (Flask test client, DB_* env)
+    --app mongo        app.py in-process (MONGO_* env)
+    --app mongo-mock   app.py in-process on mongomock, no server needed
+    --url URL          any running backend over HTTP, sync or async
+
+Examples:
+    python bench.py --app postgres --seed 100000 --concurrency 16 --duration 30 --output bench.json
+    python bench.py --url http://localhost:5000 --mix list=70,get=20,create=10
+    python bench.py --app postgres --compare bench.json --tolerance 0.15
+
+With --compare the run fails (exit 1) when an operation's throughput drops
+or its p95 grows by more than the tolerance against the stored report.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+DEFAULT_MIX = "list=60,get=20,create=10,update=8,delete=2"
+SEED_BATCH_SIZE = 500
+PERCENTILES = (50, 95, 99)
+
+
+# ----------------------------------------------------------------------
+# Targets
+# ----------------------------------------------------------------------
+
+class HttpTarget:
+    def __init__(self, base_url, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def client(self):
+        return self
+
+    def request(self, method, path, payload=None):
+        data = json.dumps(payload).encode() if payload is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method,
+                                     headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+class FlaskTarget:
+    """In-process target; each worker thread gets its own test client."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def client(self):
+        return _FlaskClient(self.app.test_client())
+
+
+class _FlaskClient:
+    def __init__(self, client):
+        self._client = client
+
+    def request(self, method, path, payload=None):
+        response = self._client.open(path, method=method, json=payload)
+        return response.status_code, response.get_data()
+
+
+def load_app(name):
+    if name == 'postgres':
+        import app_postgres
+        if not app_postgres.init_database():
+            sys.exit("Could not initialize PostgreSQL (check DB_* env)")
+        return app_postgres.app
+    if name == 'mongo-mock':
+        import mongomock
+        import pymongo
+        pymongo.MongoClient = mongomock.MongoClient
+    import app
+    return app.app
+
+
+# ----------------------------------------------------------------------
+# API shapes: app.py wraps tasks in {"task": ...} and uses _id
+# ----------------------------------------------------------------------
+
+def task_id(task):
+    return task.get('id') or task.get('_id')
+
+
+def unwrap_task(body):
+    data = json.loads(body)
+    return data.get('task', data)
+
+
+def unwrap_tasks(body):
+    data = json.loads(body)
+    return data['tasks'] if isinstance(data, dict) else data
+
+
+def read_total(client):
+    status, body = client.request('GET', '/stats')
+    data = json.loads(body)
+    return data.get('stats', data)['total']
+
+
+def seed(client, target_total, rng):
+    """Top the table up to target_total tasks; returns how many were added."""
+    missing = max(0, target_total - read_total(client))
+    added = 0
+    while added < missing:
+        size = min(SEED_BATCH_SIZE, missing - added)
+        operations = [{'op': 'create', 'title': f'bench task {rng.getrandbits(32):08x}',
+                       'done': rng.random() < 0.3,
+                       'due_date': f'2030-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}'}
+                      for _ in range(size)]
+        status, body = client.request('POST', '/tasks/batch', {'operations': operations})
+        if status != 200:
+            raise RuntimeError(f"Seeding failed with HTTP {status}: {body[:200]!r}")
+        added += size
+    return added
+
+
+# ----------------------------------------------------------------------
+# Workload
+# ----------------------------------------------------------------------
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Unknown operation in mix: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def op_list(client, state, rng):
+    return client.request('GET', f'/tasks?limit={state["page_size"]}')
+
+
+def op_get(client, state, rng):
+    return client.request('GET', f'/tasks/{state["pick"](rng)}')
+
+
+def op_create(client, state, rng):
+    status, body = client.request('POST', '/tasks', {'title': f'bench create {rng.getrandbits(32):08x}'})
+    if status == 201:
+        state['add'](task_id(unwrap_task(body)))
+    return status, body
+
+
+def op_update(client, state, rng):
+    return client.request('PUT', f'/tasks/{state["pick"](rng)}', {'done': rng.random() < 0.5})
+
+
+def op_delete(client, state, rng):
+    # Only delete tasks this run created, so repeated runs keep the seeded size
+    victim = state['take'](rng)
+    if victim is None:
+        return op_create(client, state, rng)
+    return client.request('DELETE', f'/tasks/{victim}')
+
+
+OPERATIONS = {
+    'list': op_list,
+    'get': op_get,
+    'create': op_create,
+    'update': op_update,
+    'delete': op_delete,
+}
+
+
+def make_state(client, page_size):
+    status, body = client.request('GET', '/tasks?limit=500')
+    known = [task_id(task) for task in unwrap_tasks(body)] or ['missing']
+    created = []
+    lock = threading.Lock()
+
+    def add(task):
+        with lock:
+            created.append(task)
+
+    def take(rng):
+        with lock:
+            return created.pop(rng.randrange(len(created))) if created else None
+
+    return {
+        'page_size': page_size,
+        'pick': lambda rng: rng.choice(known),
+        'add': add,
+        'take': take,
+    }
+
+
+def run_workload(target, mix, concurrency, duration, requests, page_size, random_seed):
+    samples = {name: [] for name in mix}
+    errors = {name: 0 for name in mix}
+    names, weights = list(mix), list(mix.values())
+    state = make_state(target.client(), page_size)
+    deadline = time.perf_counter() + duration if duration else None
+    remaining = [requests] if requests else None
+    lock = threading.Lock()
+
+    def take_ticket():
+        if remaining is None:
+            return time.perf_counter() < deadline
+        with lock:
+            if remaining[0] <= 0:
+                return False
+            remaining[0] -= 1
+            return True
+
+    def worker(index):
+        client = target.client()
+        rng = random.Random(random_seed * 1000 + index)
+        while take_ticket():
+            name = rng.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                status, _ = OPERATIONS[name](client, state, rng)
+                failed = status >= 500
+            except Exception:
+                failed = True
+            samples[name].append(time.perf_counter() - start)
+            if failed:
+                with lock:
+                    errors[name] += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, errors, time.perf_counter() - started
+
+
+# ----------------------------------------------------------------------
+# Report
+# ----------------------------------------------------------------------
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(latencies, errors, elapsed):
+    ordered = sorted(latencies)
+    summary = {
+        "count": len(ordered),
+        "errors": errors,
+        "throughput_rps": round(len(ordered) / elapsed, 2) if elapsed else 0.0,
+    }
+    for pct in PERCENTILES:
+        value = percentile(ordered, pct)
+        summary[f"p{pct}_ms"] = round(value * 1000, 3) if value is not None else None
+    summary["max_ms"] = round(ordered[-1] * 1000, 3) if ordered else None
+    return summary
+
+
+def build_report(samples, errors, elapsed, meta):
+    operations = {name: summarize(samples[name], errors[name], elapsed) for name in samples}
+    everything = [value for values in samples.values() for value in values]
+    return {
+        "meta": meta,
+        "elapsed_s": round(elapsed, 3),
+        "overall": summarize(everything, sum(errors.values()), elapsed),
+        "operations": operations,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """List regressions of report against baseline (empty when within tolerance)."""
+    regressions = []
+    sections = [('overall', report['overall'], baseline.get('overall'))]
+    sections += [(name, stats, baseline.get('operations', {}).get(name))
+                 for name, stats in report['operations'].items()]
+    for name, current, previous in sections:
+        if not previous or not current['count'] or not previous.get('count'):
+            continue
+        if current['throughput_rps'] < previous['throughput_rps'] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {previous['throughput_rps']} -> {current['throughput_rps']} rps")
+        if previous.get('p95_ms') and current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {previous['p95_ms']} -> {current['p95_ms']} ms")
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    target_group = parser.add_mutually_exclusive_group(required=True)
+    target_group.add_argument('--app', choices=['postgres', 'mongo', 'mongo-mock'])
+    target_group.add_argument('--url')
+    parser.add_argument('--seed', type=int, default=1000, help='tasks to have in the table before the run')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX))
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds (ignored with --requests)')
+    parser.add_argument('--requests', type=int, help='fixed number of requests instead of a duration')
+    parser.add_argument('--warmup', type=int, default=50, help='untimed list requests before the run')
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--random-seed', type=int, default=42)
+    parser.add_argument('--output', help='write the JSON report here as well as to stdout')
+    parser.add_argument('--compare', help='baseline report to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.10)
+    args = parser.parse_args(argv)
+
+    target = HttpTarget(args.url) if args.url else FlaskTarget(load_app(args.app))
+    client = target.client()
+    seeded = seed(client, args.seed, random.Random(args.random_seed))
+    for _ in range(args.warmup):
+        client.request('GET', f'/tasks?limit={args.page_size}')
+
+    samples, errors, elapsed = run_workload(target, args.mix, args.concurrency,
+                                            None if args.requests else args.duration,
+                                            args.requests, args.page_size, args.random_seed)
+    report = build_report(samples, errors, elapsed, {
+        "target": args.url or args.app,
+        "tasks": read_total(client),
+        "seeded": seeded,
+        "mix": args.mix,
+        "concurrency": args.concurrency,
+        "page_size": args.page_size,
+        "random_seed": args.random_seed,
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "timestamp": datetime.now().isoformat(),
+    })
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""Micro-benchmark for the task-list serialization paths (see fast_json.py).
+
+    python bench_json.py                  # Flask providers on 10k Mongo-style documents
+    python bench_json.py --pg             # plus Python vs json_agg pages from PostgreSQL (DB_* env)
+
+The PostgreSQL comparison reads the first --rows tasks of the real table;
+seed it first if needed (python bench.py --app postgres --seed 10000 --requests 1).
+Prints a JSON report with the best of --repeat timings in milliseconds.
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+import fast_json
+
+
+def best_of(repeat, fn):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return round(min(timings) * 1000, 3)
+
+
+def mongo_documents(rows):
+    now = datetime(2025, 1, 1)
+    return [{
+        "_id": ObjectId(),
+        "title": f"Task {i}",
+        "done": i % 3 == 0,
+        "created_at": now + timedelta(seconds=i),
+        "updated_at": now + timedelta(seconds=i),
+    } for i in range(rows)]
+
+
+def bench_providers(rows, repeat):
+    app = Flask(__name__)
+    documents = mongo_documents(rows)
+
+    def serialize(documents):
+        return [{**task, "_id": str(task["_id"])} for task in documents]
+
+    payload = {"success": True, "tasks": serialize(documents), "total": rows}
+    default = DefaultJSONProvider(app)
+    result = {"default_ms": best_of(repeat, lambda: default.dumps(payload))}
+    if fast_json.orjson is not None:
+        fast = fast_json.OrjsonProvider(app)
+        assert json.loads(fast.dumps(payload)) == json.loads(default.dumps(payload))
+        result["orjson_ms"] = best_of(repeat, lambda: fast.dumps(payload))
+        result["speedup"] = round(result["default_ms"] / result["orjson_ms"], 2)
+    return result
+
+
+def bench_postgres(rows, repeat):
+    import psycopg2
+    import psycopg2.extras
+    from app_postgres import DB_CONFIG, serialize_task
+
+    app = Flask(__name__)
+    conn = psycopg2.connect(**DB_CONFIG)
+    cur = conn.cursor()
+    cur.execute("SELECT count(*) FROM tasks")
+    available = cur.fetchone()[0]
+
+    def python_path():
+        dict_cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        dict_cur.execute("SELECT * FROM tasks ORDER BY created_at DESC, id DESC LIMIT %s", (rows + 1,))
+        tasks = dict_cur.fetchall()[:rows]
+        dict_cur.close()
+        return app.json.dumps([serialize_task(task) for task in tasks])
+
+    def sql_path():
+        cur.execute(fast_json.pg_page_query("", "%s"), (rows,))
+        return cur.fetchone()[0]
+
+    assert json.loads(sql_path()) == json.loads(python_path())
+    result = {
+        "rows": min(rows, available),
+        "python_ms": best_of(repeat, python_path),
+        "json_agg_ms": best_of(repeat, sql_path),
+    }
+    result["speedup"] = round(result["python_ms"] / result["json_agg_ms"], 2)
+    conn.close()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--pg', action='store_true', help='also compare the PostgreSQL page paths')
+    args = parser.parse_args(argv)
+
+    report = {"rows": args.rows, "flask_provider": bench_providers(args.rows, args.repeat)}
+    if args.pg:
+        report["postgres_page"] = bench_postgres(args.rows, args.repeat)
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,267 @@
+"""Change feed for delta sync (PostgreSQL backends).
+
+    GET /tasks/changes                       every live task, then a cursor
+    GET /tasks/changes?since=<cursor>        what changed after the cursor
+    GET /tasks/changes/stream?since=...      the same pages as Server-Sent Events
+
+Every write to tasks bumps the version of its owner in owner_counters
+under that row's lock (see counters.py), so an owner's versions are handed
+out in commit order and writers of other owners never wait on it. The
+same trigger upserts one row per task into task_changes with the version
+of its last write, and flags deletes as tombstones instead of losing them.
+The feed is a keyset scan of the caller's rows of task_changes (owners.py)
+by (version, task_id) joined to the current task rows; the cursor is the key of the last change sent, so
+clients download what changed since, never the whole list again.
+
+A task only keeps its latest change, so the table holds one row per live
+task plus the tombstones. Tombstones older than CHANGES_RETENTION_DAYS are
+pruned and owner_counters.pruned_version remembers how far; a client whose
+cursor is older gets 410 Gone and has to start over without since.
+
+The first pages (no since) are a snapshot: they skip tombstones that
+predate it and carry its start version in the cursor, so paging through a
+large list is never cut short by pruning.
+
+The feed covers the hot set only (archive.py): archiving a task is an
+ordinary update of its row, which the feed sends as a delete, and a write
+that brings it back sends it again as an upsert. Snapshots skip archived
+tasks like tombstones.
+"""
+import asyncio
+import json
+import os
+import threading
+
+from pagination import encode_cursor, decode_cursor
+
+CHANGES_PAGE_SIZE = int(os.getenv('CHANGES_PAGE_SIZE', 500))
+CHANGES_PAGE_MAX = int(os.getenv('CHANGES_PAGE_MAX', 1000))
+CHANGES_RETENTION_DAYS = int(os.getenv('CHANGES_RETENTION_DAYS', 30))
+CHANGES_PRUNE_INTERVAL = float(os.getenv('CHANGES_PRUNE_INTERVAL', 3600))
+# Streams: poll this often while no NOTIFY listener is connected, send a
+# comment line after this long without changes, and end after the maximum
+# (EventSource reconnects on its own with Last-Event-ID)
+CHANGES_POLL_INTERVAL = float(os.getenv('CHANGES_POLL_INTERVAL', 2))
+CHANGES_HEARTBEAT = float(os.getenv('CHANGES_HEARTBEAT', 15))
+CHANGES_STREAM_MAX = float(os.getenv('CHANGES_STREAM_MAX', 300))
+
+class CursorExpired(Exception):
+    """The tombstones after the cursor have been pruned (410 Gone)."""
+
+
+def parse_changes_args(args, last_event_id=None):
+    """Validate the query string of GET /tasks/changes(/stream).
+
+    last_event_id (the header EventSource sends when it reconnects) wins
+    over since, which still holds the cursor of the first connection.
+    Returns a dict with since (version, task_id) or None, start (snapshot
+    start version or None) and limit. Raises ValueError with a message
+    suitable for a 400 response.
+    """
+    try:
+        limit = int(args.get('limit', CHANGES_PAGE_SIZE))
+    except ValueError:
+        raise ValueError("'limit' must be an integer")
+    if limit < 1:
+        raise ValueError("'limit' must be positive")
+
+    token = last_event_id or args.get('since')
+    since, start = None, None
+    if token:
+        version, task_id, start = decode_cursor(token, 3)
+        if (not isinstance(version, int) or not isinstance(task_id, str)
+                or not (start is None or isinstance(start, int))):
+            raise ValueError("Invalid cursor")
+        since = (version, task_id)
+    return {'since': since, 'start': start, 'limit': min(limit, CHANGES_PAGE_MAX)}
+
+
+def pg_changes_query(ph):
+    """One page of the feed plus the counters it was read against.
+
+    ph maps owner, version, task_id, start and limit to placeholders. Returns at
+    least one row (change columns NULL when nothing changed) with
+    feed_version, pruned_version, change_version, change_task_id,
+    change_deleted and the task columns; limit + 1 changes at most.
+    """
+    return f'''
+        WITH feed AS (
+            SELECT me.owner_id, coalesce(o.version, 0) AS version, coalesce(o.pruned_version, 0) AS pruned_version
+            FROM (SELECT {ph['owner']}::varchar AS owner_id) AS me
+            LEFT JOIN owner_counters o ON o.owner_id = me.owner_id
+        )
+        SELECT feed.version AS feed_version, feed.pruned_version, page.*
+        FROM feed LEFT JOIN LATERAL (
+            SELECT c.version AS change_version, c.task_id AS change_task_id,
+                   c.deleted AS change_deleted, t.*
+            FROM task_changes c LEFT JOIN tasks t ON t.id = c.task_id AND NOT t.archived
+            WHERE c.owner_id = feed.owner_id
+              AND (c.version, c.task_id) > ({ph['version']}::bigint, {ph['task_id']}::varchar)
+              -- Deleted or archived (no hot row): a removal, skipped by snapshots that postdate it
+              AND ((NOT c.deleted AND t.id IS NOT NULL) OR c.version > coalesce({ph['start']}::bigint, feed.version))
+            ORDER BY c.version, c.task_id
+            LIMIT {ph['limit']}
+        ) AS page ON TRUE
+        ORDER BY page.change_version, page.change_task_id
+    '''
+
+
+def pg_changes_args(params, owner):
+    """(owner, version, task_id, start, limit) for pg_changes_query()."""
+    version, task_id = params['since'] or (-1, '')
+    start = params['start']
+    if params['since'] is not None and start is None:
+        start = -1  # caught up: every tombstone after the cursor
+    return owner, version, task_id, start, params['limit'] + 1
+
+
+def changes_page(rows, params, serialize):
+    """Response body for the rows of pg_changes_query(); rows are dicts.
+
+    Raises CursorExpired when the client has to start over.
+    """
+    feed_version = rows[0]['feed_version'] if rows else 0
+    pruned_version = rows[0]['pruned_version'] if rows else 0
+    since = params['since']
+    if since is not None and params['start'] is None and since[0] < pruned_version:
+        raise CursorExpired(f"Changes before version {pruned_version} are no longer available")
+
+    rows = [row for row in rows if row['change_version'] is not None]
+    has_more = len(rows) > params['limit']
+    rows = rows[:params['limit']]
+
+    changes = []
+    for row in rows:
+        if row['change_deleted'] or row['id'] is None:
+            changes.append({'op': 'delete', 'id': row['change_task_id']})
+        else:
+            task = {key: value for key, value in row.items()
+                    if key not in ('feed_version', 'pruned_version', 'change_version',
+                                   'change_task_id', 'change_deleted')}
+            changes.append({'op': 'upsert', 'task': serialize(task)})
+
+    if has_more:
+        key = (rows[-1]['change_version'], rows[-1]['change_task_id'])
+    else:
+        # Everything up to feed_version has been sent (or skipped on purpose):
+        # continue after it, so pruning can't expire an idle client's cursor
+        key = max((feed_version + 1, ''), since or (0, ''))
+    # Still inside the first snapshot: remember where it started
+    start = (feed_version if since is None else params['start']) if has_more else None
+    return {'changes': changes, 'cursor': encode_cursor(key[0], key[1], start), 'has_more': has_more}
+
+
+def sse_event(event, data, event_id=None):
+    """One Server-Sent Events message; data is JSON-encoded."""
+    lines = [f"event: {event}"]
+    if event_id:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return '\n'.join(lines) + '\n\n'
+
+
+SSE_KEEPALIVE = ': keepalive\n\n'
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+
+# Placeholders are filled per driver: '%s' for psycopg2, '$1' for asyncpg.
+# The counters rows of the owners involved are locked first, in owner order
+# like the trigger does, to avoid deadlocks.
+PG_PRUNE_LOCK_SQL = '''
+    SELECT owner_id FROM owner_counters
+    WHERE owner_id IN (SELECT owner_id FROM task_changes
+                       WHERE deleted AND changed_at < CURRENT_TIMESTAMP - make_interval(days => {0}))
+    ORDER BY owner_id
+    FOR UPDATE
+'''
+PG_PRUNE_SQL = '''
+    WITH gone AS (
+        DELETE FROM task_changes
+        WHERE deleted AND changed_at < CURRENT_TIMESTAMP - make_interval(days => {0})
+        RETURNING owner_id, version
+    ), expired AS (
+        UPDATE owner_counters o
+           SET pruned_version = greatest(o.pruned_version, g.version)
+          FROM (SELECT owner_id, max(version) + 1 AS version FROM gone GROUP BY owner_id) AS g
+         WHERE o.owner_id = g.owner_id
+    )
+    SELECT count(*) FROM gone
+'''
+
+
+def pg_prune_changes(conn, retention_days=CHANGES_RETENTION_DAYS):
+    """Drop old tombstones (psycopg2). Returns the number of rows removed."""
+    cur = conn.cursor()
+    try:
+        cur.execute(PG_PRUNE_LOCK_SQL.format('%s'), (retention_days,))
+        cur.execute(PG_PRUNE_SQL.format('%s'), (retention_days,))
+        pruned = cur.fetchone()[0]
+        conn.commit()
+        return pruned
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+class ChangeNotifier:
+    """Wakes up change streams when tasks change (threads).
+
+    notify() is called for every NOTIFY tasks_changed and for local writes.
+    While no listener is connected, waiters fall back to polling.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self.generation = 0
+        self.listening = False
+
+    def set_listening(self, listening):
+        self.listening = listening
+
+    def notify(self):
+        with self._condition:
+            self.generation += 1
+            self._condition.notify_all()
+
+    def wait(self, generation, timeout):
+        """Block until generation moves past the given one; returns the new one."""
+        if not self.listening:
+            timeout = min(timeout, CHANGES_POLL_INTERVAL)
+        with self._condition:
+            self._condition.wait_for(lambda: self.generation != generation, timeout)
+            return self.generation
+
+
+class AsyncChangeNotifier:
+    """ChangeNotifier for coroutines; notify() must run on the event loop."""
+
+    def __init__(self):
+        self._waiters = set()
+        self.generation = 0
+        self.listening = False
+
+    def set_listening(self, listening):
+        self.listening = listening
+
+    def notify(self):
+        self.generation += 1
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._waiters.clear()
+
+    async def wait(self, generation, timeout):
+        if not self.listening:
+            timeout = min(timeout, CHANGES_POLL_INTERVAL)
+        if self.generation == generation:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.add(waiter)
+            try:
+                await asyncio.wait_for(waiter, timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self._waiters.discard(waiter)
+        return self.generation
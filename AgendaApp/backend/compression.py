@@ -0,0 +1,222 @@
+"""Negotiated response compression, shared by every backend.
+
+Task lists and exports went out as plain JSON/CSV, although the keys of
+every row repeat and compress very well. Responses are now compressed with
+the best encoding the client offers in Accept-Encoding:
+
+- br (brotli, quality BROTLI_QUALITY) when the brotli package is
+  installed; it is optional and without it only gzip is offered.
+- gzip (level COMPRESS_LEVEL).
+
+Only text-like media types (COMPRESSIBLE_TYPES, any +json type and
+MessagePack) are compressed, never the change stream (text/event-stream,
+whose events must go out as they happen). Whole bodies under
+COMPRESS_MIN_SIZE bytes stay as they are, since the headers would cost
+more than the saving; streamed bodies (the export) are compressed chunk
+by chunk and flushed after each one, so rows still reach the client as
+they are read. A compressed response gets Vary: Accept-Encoding and its
+ETag becomes weak (If-None-Match compares weakly, see conditional.py), as
+the bytes differ from the identity representation.
+
+install_flask() is the Flask hook and CompressionMiddleware the ASGI one;
+both apply the same rules. COMPRESSION=false turns it off, e.g. when an
+ingress already compresses.
+"""
+import os
+import zlib
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional encoding
+    brotli = None
+
+COMPRESSION = os.getenv('COMPRESSION', 'true').lower() == 'true'
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+# gzip level (1-9) and brotli quality (0-11); the defaults favour CPU over the last bytes
+COMPRESS_LEVEL = int(os.getenv('COMPRESS_LEVEL', 6))
+BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', 4))
+
+COMPRESSIBLE_TYPES = frozenset(['application/json', 'application/x-ndjson', 'application/msgpack', 'text/csv',
+                                'text/plain'])
+
+# In order of preference when the client accepts several equally
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def choose_encoding(accept_encoding):
+    """Encoding to use for an Accept-Encoding header value, or None for identity."""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name.lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[coding.strip().lower()] = q
+    best, best_q = None, 0.0
+    for encoding in ENCODINGS:
+        q = weights.get(encoding, weights.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compressible(media_type):
+    media_type = (media_type or '').split(';')[0].strip().lower()
+    return media_type in COMPRESSIBLE_TYPES or media_type.endswith('+json')
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return zlib.compress(body, COMPRESS_LEVEL, wbits=16 + zlib.MAX_WBITS)
+
+
+class StreamCompressor:
+    """Compresses a body chunk by chunk; each chunk is flushed so it can be sent at once."""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def chunk(self, data):
+        if self.encoding == 'br':
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+def weak_etag(value):
+    """The quoted ETag header value as a weak tag."""
+    return value if value.startswith('W/') else f'W/{value}'
+
+
+def _compressed_chunks(chunks, encoding):
+    compressor = StreamCompressor(encoding)
+    try:
+        for chunk in chunks:
+            data = compressor.chunk(chunk.encode() if isinstance(chunk, str) else chunk)
+            if data:
+                yield data
+        yield compressor.finish()
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+# ----------------------------------------------------------------------
+# Flask
+# ----------------------------------------------------------------------
+
+def install_flask(app):
+    """Compress the responses of app as described above."""
+    from flask import request
+
+    @app.after_request
+    def _compress(response):
+        if (not COMPRESSION or response.status_code < 200 or response.status_code in (204, 304)
+                or 'Content-Encoding' in response.headers or not compressible(response.mimetype)):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+        if encoding is None:
+            return response
+        if response.is_streamed:
+            response.response = _compressed_chunks(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            body = response.get_data()
+            if len(body) < COMPRESS_MIN_SIZE:
+                return response
+            response.set_data(compress(body, encoding))
+        response.headers['Content-Encoding'] = encoding
+        if 'ETag' in response.headers:
+            response.headers['ETag'] = weak_etag(response.headers['ETag'])
+        return response
+
+
+# ----------------------------------------------------------------------
+# ASGI (Starlette)
+# ----------------------------------------------------------------------
+
+class CompressionMiddleware:
+    """ASGI counterpart of install_flask."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not COMPRESSION:
+            return await self.app(scope, receive, send)
+        accept_encoding = next((v.decode('latin-1') for k, v in scope['headers'] if k == b'accept-encoding'), None)
+        encoding = choose_encoding(accept_encoding)
+        await self.app(scope, receive, _CompressingSend(send, encoding))
+
+
+class _CompressingSend:
+    """send() of one response: holds the start message until the first body chunk says how to send it."""
+
+    def __init__(self, send, encoding):
+        self.send = send
+        self.encoding = encoding
+        self.start = None
+        self.compressor = None
+        self.passthrough = False
+
+    async def __call__(self, message):
+        from starlette.datastructures import MutableHeaders
+
+        if message['type'] == 'http.response.start':
+            headers = MutableHeaders(raw=message.setdefault('headers', []))
+            status = message['status']
+            if (status < 200 or status in (204, 304) or 'content-encoding' in headers
+                    or not compressible(headers.get('content-type'))):
+                self.passthrough = True
+                return await self.send(message)
+            headers.add_vary_header('Accept-Encoding')
+            if self.encoding is None:
+                self.passthrough = True
+                return await self.send(message)
+            self.start = message
+            return None
+        if message['type'] != 'http.response.body' or self.passthrough:
+            return await self.send(message)
+
+        body = message.get('body', b'')
+        more_body = message.get('more_body', False)
+        if self.start is not None:
+            start, self.start = self.start, None
+            if not more_body and len(body) < COMPRESS_MIN_SIZE:
+                self.passthrough = True
+                await self.send(start)
+                return await self.send(message)
+            headers = MutableHeaders(raw=start['headers'])
+            headers['Content-Encoding'] = self.encoding
+            if 'etag' in headers:
+                headers['ETag'] = weak_etag(headers['etag'])
+            if not more_body:
+                body = compress(body, self.encoding)
+                headers['Content-Length'] = str(len(body))
+                await self.send(start)
+                return await self.send({'type': 'http.response.body', 'body': body})
+            del headers['Content-Length']
+            self.compressor = StreamCompressor(self.encoding)
+            await self.send(start)
+        data = self.compressor.chunk(body) if body else b''
+        if not more_body:
+            data += self.compressor.finish()
+        await self.send({'type': 'http.response.body', 'body': data, 'more_body': more_body})
@@ -0,0 +1,56 @@
+"""Conditional GET support (ETag / If-None-Match).
+
+Tags are derived from the caller's owner version, kept next to its task
+counters (see counters.py), plus whatever distinguishes the representation (query
+string, task id). Routes read the version first, which is a primary key
+lookup, and only query and serialize rows when the client's tag is stale.
+"""
+import hashlib
+
+from flask import current_app, request
+from werkzeug.http import parse_etags, quote_etag
+
+
+def make_etag(version, *parts):
+    if version is None:
+        return None
+    digest = hashlib.sha1(repr(parts).encode()).hexdigest()[:12]
+    return f"{version}-{digest}"
+
+
+def query_key(args):
+    """Order-independent representation of a query string (Flask or Starlette)."""
+    items = args.multi_items() if hasattr(args, 'multi_items') else args.items(multi=True)
+    return tuple(sorted(items))
+
+
+def client_has(if_none_match, etag):
+    """True if an If-None-Match header value contains etag.
+
+    The comparison is weak (RFC 9110): compressed responses carry the tag
+    as W/"..." (see compression.py) and still revalidate.
+    """
+    return etag is not None and bool(if_none_match) and parse_etags(if_none_match).contains_weak(etag)
+
+
+def not_modified(etag):
+    """Return a 304 response if the client already holds this tag, else None."""
+    if not client_has(request.headers.get('If-None-Match'), etag):
+        return None
+    response = current_app.response_class(status=304)
+    return with_etag(response, etag)
+
+
+def with_etag(response, etag):
+    if etag is not None:
+        response.set_etag(etag)
+        # Cacheable, but always revalidated with If-None-Match
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def etag_headers(etag):
+    """The headers with_etag sets, for responses that are not Flask's (ASGI variants)."""
+    if etag is None:
+        return {}
+    return {'ETag': quote_etag(etag), 'Cache-Control': 'no-cache'}
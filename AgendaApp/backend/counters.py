@@ -0,0 +1,260 @@
+"""Incrementally maintained task counters.
+
+Stats reads (/stats, /health, the envelope of GET /tasks) used to count the
+whole collection on every call. Both backends now keep counters that every
+mutation adjusts, so a stats read is one primary key lookup. Each owner
+(owners.py) has its own counters with a version number bumped by every
+write of that owner, which the ETags of the read routes, the read cache
+and the change feed (changes.py) are derived from, so one owner's writes
+never touch another owner's:
+
+- PostgreSQL: table owner_counters, kept in sync by statement-level
+  triggers on tasks (migrations/0008_owner_versions.sql). Covers every
+  write path, batches included, in the same transaction as the write.
+  task_counters only keeps the last version handed out before versions
+  were per owner; owners count up from it.
+- MongoDB: documents {_id: "owner:<owner_id>"} in task_stats, adjusted
+  with $inc by the routes after each write. The document {_id: "tasks"}
+  holds the overall counts of the last reconcile, and its version (no
+  longer bumped) is added to every owner's for the same reason.
+
+reconcile recounts from the source of truth and repairs any drift. It runs
+on demand (POST /stats/reconcile) and every COUNTERS_RECONCILE_INTERVAL
+seconds in a background thread (0 disables the thread).
+"""
+import logging
+import os
+import threading
+from datetime import datetime
+
+from owners import DEFAULT_OWNER
+
+logger = logging.getLogger(__name__)
+
+COUNTERS_RECONCILE_INTERVAL = float(os.getenv('COUNTERS_RECONCILE_INTERVAL', 600))
+
+MONGO_COUNTERS_ID = "tasks"
+
+# Placeholders are filled per driver: '%s' for psycopg2, '$1'/'$2' for asyncpg
+# An owner without a row has no tasks yet: zeros, version 0
+PG_OWNER_COUNTERS_SQL = '''
+    SELECT coalesce(o.total, 0), coalesce(o.completed, 0), coalesce(o.version, 0)
+    FROM (SELECT 1) AS one LEFT JOIN owner_counters o ON o.owner_id = {0}
+'''
+
+# Writers wait while reconcile counts: the lock conflicts with their row updates
+PG_RECONCILE_LOCK_SQL = "LOCK TABLE owner_counters IN EXCLUSIVE MODE"
+PG_COUNTERS_TOTALS_SQL = "SELECT count(*), coalesce(sum(total), 0), coalesce(sum(completed), 0) FROM owner_counters"
+
+# Recounts every owner in one scan and returns the overall (total, completed).
+# Owners whose counts change get a new version; rows are kept (zeroed), as
+# their version must never start over.
+PG_RECOUNT_SQL = '''
+    WITH counted AS (
+        SELECT owner_id, count(*) AS total, count(*) FILTER (WHERE done) AS completed
+        FROM tasks GROUP BY owner_id
+    ), upserted AS (
+        INSERT INTO owner_counters AS o (owner_id, total, completed, version)
+        SELECT owner_id, total, completed, (SELECT version FROM task_counters WHERE id = 1) + 1 FROM counted
+        ON CONFLICT (owner_id) DO UPDATE
+            SET total = EXCLUDED.total, completed = EXCLUDED.completed, version = o.version + 1
+            WHERE (o.total, o.completed) <> (EXCLUDED.total, EXCLUDED.completed)
+    ), emptied AS (
+        UPDATE owner_counters SET total = 0, completed = 0, version = version + 1
+        WHERE owner_id NOT IN (SELECT owner_id FROM counted) AND (total, completed) <> (0, 0)
+    )
+    SELECT coalesce(sum(total), 0), coalesce(sum(completed), 0) FROM counted
+'''
+
+
+def stats_dict(total, completed):
+    return {
+        "total": int(total),
+        "completed": int(completed),
+        "pending": int(total) - int(completed)
+    }
+
+
+# ----------------------------------------------------------------------
+# PostgreSQL
+# ----------------------------------------------------------------------
+
+def pg_read_counters(cur, owner):
+    """Return (stats, version) of owner."""
+    cur.execute(PG_OWNER_COUNTERS_SQL.format('%s'), (owner,))
+    row = cur.fetchone()
+    return stats_dict(row[0], row[1]), row[2]
+
+
+def pg_reconcile(conn):
+    """Recount tasks and overwrite every owner's counters; returns the drift found."""
+    cur = conn.cursor()
+    # Lock first: writers that already touched the counters finish before
+    # we count, the rest queue behind us and apply their delta after.
+    cur.execute(PG_RECONCILE_LOCK_SQL)
+    cur.execute(PG_COUNTERS_TOTALS_SQL)
+    owners, before_total, before_completed = cur.fetchone()
+    cur.execute(PG_RECOUNT_SQL)
+    total, completed = cur.fetchone()
+    conn.commit()
+    cur.close()
+    before = stats_dict(before_total, before_completed) if owners else None
+    return reconcile_report(before, stats_dict(total, completed))
+
+
+# ----------------------------------------------------------------------
+# MongoDB
+# ----------------------------------------------------------------------
+
+def mongo_delta_update(owner, total=0, completed=0):
+    return {"$inc": {"total": total, "completed": completed, "version": 1},
+            "$set": {"owner_id": owner, "updated_at": datetime.now()}}
+
+
+def mongo_owner_counters_id(owner):
+    return f"owner:{owner}"
+
+
+def mongo_changed_owner(change):
+    """Owner whose counters document a change stream event is about, or None."""
+    _id = str(change.get("documentKey", {}).get("_id", ""))
+    return _id[len("owner:"):] if _id.startswith("owner:") else None
+
+
+def mongo_counters_from_docs(docs, owner):
+    """(owner's stats, version) from the documents of mongo_counters_query(); (None, None) before reconcile ran."""
+    docs = {doc["_id"]: doc for doc in docs}
+    if MONGO_COUNTERS_ID not in docs:
+        return None, None
+    doc = docs.get(mongo_owner_counters_id(owner), {})
+    version = docs[MONGO_COUNTERS_ID].get("version", 0) + doc.get("version", 0)
+    return stats_dict(doc.get("total", 0), doc.get("completed", 0)), version
+
+
+def mongo_counters_query(owner):
+    return {"_id": {"$in": [MONGO_COUNTERS_ID, mongo_owner_counters_id(owner)]}}
+
+
+def mongo_delta_requests(owner_deltas):
+    """Write models recording a write; owner_deltas maps owner -> (total, completed).
+
+    Every owner listed gets its counts moved and its version bumped, even
+    with a (0, 0) delta: its lists changed all the same.
+    """
+    from pymongo import UpdateOne
+
+    return [UpdateOne({"_id": mongo_owner_counters_id(owner)}, mongo_delta_update(owner, total, completed),
+                      upsert=True)
+            for owner, (total, completed) in owner_deltas.items()]
+
+
+def mongo_apply_delta(stats_collection, total=0, completed=0, *, owner):
+    """Record a write of owner. Call it after the write so the version never runs ahead of the data."""
+    stats_collection.update_one({"_id": mongo_owner_counters_id(owner)}, mongo_delta_update(owner, total, completed),
+                                upsert=True)
+
+
+def mongo_read_counters(stats_collection, session=None, *, owner):
+    """Return owner's (stats, version), or (None, None) before reconcile created the global document."""
+    return mongo_counters_from_docs(stats_collection.find(mongo_counters_query(owner), session=session), owner)
+
+
+# Counts per owner; tasks written before owners group under None
+MONGO_OWNER_COUNTS = [
+    {"$group": {"_id": "$owner_id", "total": {"$sum": 1},
+                "completed": {"$sum": {"$cond": [{"$eq": ["$done", True]}, 1, 0]}}}},
+]
+
+
+def mongo_owner_totals(*results):
+    """{owner: [total, completed]} summed over MONGO_OWNER_COUNTS results."""
+    totals = {}
+    for result in results:
+        for row in result:
+            counts = totals.setdefault(row["_id"] or DEFAULT_OWNER, [0, 0])
+            counts[0] += row["total"]
+            counts[1] += row["completed"]
+    return totals
+
+
+def mongo_counted(docs):
+    """(overall stats or None before the first reconcile, {owner: (total, completed)}) of the counters documents."""
+    counted = {doc["owner_id"]: (doc.get("total", 0), doc.get("completed", 0))
+               for doc in docs if doc["_id"] != MONGO_COUNTERS_ID and "owner_id" in doc}
+    if not any(doc["_id"] == MONGO_COUNTERS_ID for doc in docs):
+        return None, counted
+    return stats_dict(sum(t for t, _ in counted.values()), sum(c for _, c in counted.values())), counted
+
+
+def mongo_reconcile_requests(totals, counted):
+    """Write models overwriting the counters documents with totals (from mongo_owner_totals).
+
+    counted comes from mongo_counted(); owners whose counts change get a new
+    version. The global document's version stays where it is.
+    """
+    from pymongo import UpdateOne
+
+    now = datetime.now()
+    requests = [UpdateOne(
+        {"_id": MONGO_COUNTERS_ID},
+        {"$set": {"total": sum(t for t, _ in totals.values()), "completed": sum(c for _, c in totals.values()),
+                  "updated_at": now},
+         "$setOnInsert": {"version": 0}},
+        upsert=True
+    )]
+    # Owners whose last task is gone keep their document, so their version never starts over
+    totals = {**{owner: (0, 0) for owner in counted}, **{owner: tuple(t) for owner, t in totals.items()}}
+    for owner, (total, completed) in totals.items():
+        requests.append(UpdateOne({"_id": mongo_owner_counters_id(owner)},
+                                  {"$set": {"owner_id": owner, "total": total, "completed": completed,
+                                            "updated_at": now},
+                                   "$inc": {"version": 0 if counted.get(owner) == (total, completed) else 1}},
+                                  upsert=True))
+    return requests
+
+
+def mongo_reconcile(tasks_collection, stats_collection, archive_collection=None):
+    # Without multi-document transactions a write landing between the count
+    # and the $set can still drift; the next run repairs it.
+    before, counted = mongo_counted(list(stats_collection.find()))
+    results = [tasks_collection.aggregate(MONGO_OWNER_COUNTS)]
+    if archive_collection is not None:
+        # Archived tasks (archive.py) still count
+        results.append(archive_collection.aggregate(MONGO_OWNER_COUNTS))
+    totals = mongo_owner_totals(*results)
+    after = stats_dict(sum(t for t, _ in totals.values()), sum(c for _, c in totals.values()))
+    stats_collection.bulk_write(mongo_reconcile_requests(totals, counted), ordered=False)
+    return reconcile_report(before, after)
+
+
+# ----------------------------------------------------------------------
+# Reconciliation job
+# ----------------------------------------------------------------------
+
+def reconcile_report(before, after):
+    drift = None
+    if before is not None:
+        drift = {key: after[key] - before[key] for key in ("total", "completed")}
+        if any(drift.values()):
+            logger.warning(f"Task counters drifted, repaired: {drift}")
+    return {"before": before, "after": after, "drift": drift}
+
+
+def start_reconciler(reconcile, interval=COUNTERS_RECONCILE_INTERVAL):
+    """Call reconcile() every interval seconds from a daemon thread.
+
+    Returns an Event that stops the loop when set, or None if disabled.
+    """
+    if interval <= 0:
+        return None
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            try:
+                reconcile()
+            except Exception as e:
+                logger.error(f"Counter reconciliation failed: {str(e)}")
+
+    threading.Thread(target=loop, name="counters-reconciler", daemon=True).start()
+    return stop
@@ -0,0 +1,248 @@
+"""Thread-safe PostgreSQL connection pool used by app_postgres.py.
+
+psycopg2.pool.ThreadedConnectionPool raises immediately when it is empty and
+never checks the connections it hands out, so this pool adds a bounded
+checkout wait, validation on borrow and counters that /database/pool exposes.
+
+Connections never cross a fork: a child process (gunicorn worker) starts
+with an empty pool and opens its own, see _after_fork().
+"""
+import logging
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    """No connection became available within the checkout timeout."""
+
+
+class ConnectionPool:
+    def __init__(self, connect, minconn=1, maxconn=10, timeout=5.0, validate_idle=30.0):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError(f"Invalid pool size min={minconn} max={maxconn}")
+        self._connect = connect
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        # Connections idle longer than this are pinged with SELECT 1 on borrow
+        self.validate_idle = validate_idle
+
+        self._lock = threading.Condition()
+        self._idle = []          # [(conn, returned_at)], LIFO
+        self._in_use = set()
+        self._opening = 0
+        self._waiting = 0
+        self._closed = False
+        self._counters = {
+            "created": 0,
+            "discarded": 0,
+            "checkouts": 0,
+            "timeouts": 0,
+            "wait_seconds": 0.0,
+        }
+        self._inherited = []
+        if hasattr(os, 'register_at_fork'):
+            after_fork = weakref.WeakMethod(self._after_fork)
+            os.register_at_fork(after_in_child=lambda: after_fork() and after_fork()())
+
+    # ------------------------------------------------------------------
+    # Checkout / return
+    # ------------------------------------------------------------------
+
+    def getconn(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+
+        while True:
+            conn = None
+            with self._lock:
+                if self._closed:
+                    raise psycopg2.InterfaceError("connection pool is closed")
+                while not self._idle and self._size() >= self.maxconn:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._counters["timeouts"] += 1
+                        raise PoolTimeout(
+                            f"No database connection available after {timeout:.1f}s "
+                            f"(max={self.maxconn})"
+                        )
+                    self._waiting += 1
+                    try:
+                        self._lock.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    self._in_use.add(conn)
+                else:
+                    self._opening += 1
+
+            if conn is None:
+                conn = self._open()
+            elif not self._is_usable(conn, returned_at):
+                self._discard(conn)
+                continue
+
+            with self._lock:
+                self._counters["checkouts"] += 1
+                self._counters["wait_seconds"] += time.monotonic() - started
+            return conn
+
+    def putconn(self, conn, discard=False):
+        with self._lock:
+            self._in_use.discard(conn)
+
+        if not discard and not conn.closed:
+            try:
+                status = conn.get_transaction_status()
+                if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                    discard = True
+                elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    # Never hand out a connection with a half-finished transaction
+                    conn.rollback()
+            except Exception as e:
+                logger.warning(f"Discarding pooled connection: {str(e)}")
+                discard = True
+
+        if discard or conn.closed:
+            self._close_quietly(conn)
+            with self._lock:
+                self._counters["discarded"] += 1
+                self._lock.notify()
+            return
+
+        with self._lock:
+            if self._closed:
+                self._close_quietly(conn)
+                return
+            self._idle.append((conn, time.monotonic()))
+            self._lock.notify()
+
+    @contextmanager
+    def connection(self, timeout=None, autocommit=False):
+        """Borrow a connection and always give it back, whatever the route does.
+
+        autocommit=True suits single-statement routes: psycopg2 then sends
+        neither BEGIN nor COMMIT, so the statement is the only round trip.
+        """
+        conn = self.getconn(timeout)
+        broken = False
+        try:
+            if conn.autocommit != autocommit:
+                conn.autocommit = autocommit
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self.putconn(conn, discard=broken)
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+
+    def prefill(self):
+        """Open connections up to minconn so the first requests skip the handshake."""
+        conns = []
+        try:
+            while len(conns) < self.minconn:
+                conns.append(self.getconn())
+        finally:
+            for conn in conns:
+                self.putconn(conn)
+
+    def closeall(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._lock.notify_all()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        with self._lock:
+            checkouts = self._counters["checkouts"]
+            return {
+                "min": self.minconn,
+                "max": self.maxconn,
+                "size": self._size(),
+                "idle": len(self._idle),
+                "in_use": len(self._in_use),
+                "waiting": self._waiting,
+                "created": self._counters["created"],
+                "discarded": self._counters["discarded"],
+                "checkouts": checkouts,
+                "timeouts": self._counters["timeouts"],
+                "avg_wait_ms": round(self._counters["wait_seconds"] * 1000 / checkouts, 3)
+                if checkouts else 0.0,
+            }
+
+    # ------------------------------------------------------------------
+    # Internals
+    # ------------------------------------------------------------------
+
+    def _after_fork(self):
+        # The parent keeps using these sockets: never use them here, and keep
+        # the objects referenced so the child doesn't close them under it
+        self._inherited.extend(conn for conn, _ in self._idle)
+        self._inherited.extend(self._in_use)
+        self._lock = threading.Condition()
+        self._idle = []
+        self._in_use = set()
+        self._opening = 0
+        self._waiting = 0
+
+    def _size(self):
+        return len(self._idle) + len(self._in_use) + self._opening
+
+    def _open(self):
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._lock:
+                self._opening -= 1
+                self._lock.notify()
+            raise
+        with self._lock:
+            self._opening -= 1
+            self._in_use.add(conn)
+            self._counters["created"] += 1
+        return conn
+
+    def _is_usable(self, conn, returned_at):
+        if conn.closed:
+            return False
+        if time.monotonic() - returned_at < self.validate_idle:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+            return True
+        except Exception as e:
+            logger.warning(f"Pooled connection failed validation: {str(e)}")
+            return False
+
+    def _discard(self, conn):
+        with self._lock:
+            self._in_use.discard(conn)
+            self._counters["discarded"] += 1
+            self._lock.notify()
+        self._close_quietly(conn)
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
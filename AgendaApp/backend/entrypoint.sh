@@ -0,0 +1,25 @@
+#!/bin/sh
+# Selects the backend at deploy time:
+#   BACKEND_MODE=sync  (default) Flask app on gunicorn, WORKER_MODEL=threads|sync|gevent
+#   BACKEND_MODE=async ASGI variant on asyncpg, gunicorn with uvicorn workers
+#   BACKEND_MODE=dev   Flask development server, one process, migrates first
+#   BACKEND_MODE=migrate  apply the schema migrations and exit (one-shot job)
+# Worker counts, timeouts and draining are set in gunicorn.conf.py
+set -e
+
+case "${BACKEND_MODE:-sync}" in
+    sync|async)
+        exec gunicorn -c gunicorn.conf.py
+        ;;
+    dev)
+        python migrate.py
+        exec python app.py
+        ;;
+    migrate)
+        exec python migrate.py
+        ;;
+    *)
+        echo "Unknown BACKEND_MODE: ${BACKEND_MODE} (expected sync, async, dev or migrate)" >&2
+        exit 1
+        ;;
+esac
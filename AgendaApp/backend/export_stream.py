@@ -0,0 +1,78 @@
+"""Streaming encoders for GET /tasks/export.
+
+Rows come from a server-side cursor and leave as NDJSON or CSV chunks of
+EXPORT_BATCH_SIZE rows, so memory stays flat regardless of table size.
+"""
+import csv
+import io
+import json
+import os
+from datetime import date, datetime
+
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 1000))
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def _plain(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def encode_rows(rows, fmt, fields, header=True):
+    """Yield text chunks for an iterable of task dicts."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == 'csv' else None
+    if writer and header:
+        writer.writerow(fields)
+
+    pending = 0
+    for row in rows:
+        if writer:
+            writer.writerow([_plain(row.get(field)) for field in fields])
+        else:
+            buffer.write(json.dumps({field: row.get(field) for field in fields},
+                                    default=_json_default, separators=(',', ':')))
+            buffer.write('\n')
+        pending += 1
+        if pending >= EXPORT_BATCH_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def primed(chunks):
+    """Run a chunk generator up to its first chunk before the response starts.
+
+    That way connection and query errors still become a 500/503 instead of a
+    truncated 200. The returned generator closes the source on exit, which
+    hands the DB connection back.
+    """
+    first = next(chunks, None)
+
+    def body():
+        try:
+            if first is not None:
+                yield first
+            yield from chunks
+        finally:
+            chunks.close()
+    return body()
+
+
+def export_filename(fmt):
+    return f"tasks-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{fmt}"
@@ -0,0 +1,107 @@
+"""Fast JSON paths for task lists.
+
+- PostgreSQL: pg_page_query() has the database encode the page with
+  json_agg, so rows never become Python dicts and the route sends the text
+  it gets back untouched.
+- Flask: OrjsonProvider plugs orjson into app.json. It encodes the same
+  values as Flask's default provider (sorted keys, dates as HTTP dates) as
+  compact UTF-8 text.
+
+Both are on unless FAST_JSON=false. orjson is optional: without it
+install_json_provider() leaves Flask's default provider in place.
+bench_json.py measures both paths.
+"""
+import os
+from datetime import date, datetime, time, timezone
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+FAST_JSON = os.getenv('FAST_JSON', 'true').lower() == 'true'
+
+def _pg_isoformat(column):
+    # datetime.isoformat(): microseconds only when non-zero, never trimmed
+    return (f"to_char({column}, 'YYYY-MM-DD\"T\"HH24:MI:SS') || CASE "
+            f"WHEN mod(extract(microseconds FROM {column})::int, 1000000) = 0 THEN '' "
+            f"ELSE to_char({column}, '.US') END")
+
+
+# Same keys and values as serialize_task(), in the order jsonify sorts them;
+# row_to_json output is compact, unlike json_build_object/json_agg
+PG_TASK_COLUMNS = (f"{_pg_isoformat('page.created_at')} AS created_at, page.done, page.due_date, "
+                   f"page.id, page.title, {_pg_isoformat('page.updated_at')} AS updated_at")
+
+
+def pg_page_query(where, limit_param):
+    """SQL returning one row (body, has_more, last_created_at, last_id).
+
+    limit_param is the placeholder for the page size; it comes before the
+    placeholders in where ('%s' first for psycopg2, or '$n'). One extra row
+    is fetched to know whether there is a next page; the body and the
+    cursor columns only cover the first limit rows.
+    """
+    return f'''
+        WITH args AS (SELECT {limit_param}::int AS lim),
+        page AS (
+            SELECT t.*, row_number() OVER (ORDER BY t.created_at DESC, t.id DESC) AS rn
+            FROM (SELECT * FROM tasks {where}
+                  ORDER BY created_at DESC, id DESC
+                  LIMIT (SELECT lim + 1 FROM args)) AS t
+        )
+        SELECT '[' || coalesce(string_agg(row_to_json(r)::text, ',' ORDER BY rn)
+                                   FILTER (WHERE rn <= lim), '') || ']',
+               count(*) > min(lim),
+               max(page.created_at) FILTER (WHERE rn = lim),
+               max(page.id) FILTER (WHERE rn = lim)
+        FROM page CROSS JOIN args
+             CROSS JOIN LATERAL (SELECT {PG_TASK_COLUMNS}) AS r
+    '''
+
+
+_DAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def http_date(value):
+    """werkzeug.http.http_date() without its overhead; naive values are UTC."""
+    if not isinstance(value, datetime):
+        value = datetime.combine(value, time())
+    elif value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return (f"{_DAYS[value.weekday()]}, {value.day:02d} {_MONTHS[value.month - 1]} {value.year:04d} "
+            f"{value.hour:02d}:{value.minute:02d}:{value.second:02d} GMT")
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson.
+
+    Dates go through default() like in Flask; formatting them is most of the
+    cost of a task list, hence the local http_date().
+    """
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, date):
+            return http_date(o)
+        return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if kwargs.get('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=kwargs.get('default', self.default), option=option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+def install_json_provider(app):
+    if FAST_JSON and orjson is not None:
+        app.json = OrjsonProvider(app)
+    return app.json
@@ -0,0 +1,100 @@
+"""Group commit for POST /tasks bursts (GROUP_COMMIT=true).
+
+Request threads hand their new row to GroupCommitter.submit() and wait.
+One background thread collects rows until GROUP_COMMIT_MAX_BATCH are
+queued or GROUP_COMMIT_WINDOW_MS have passed since the first one, writes
+them with a single flush() call (one multi-row INSERT / insert_many, one
+commit) and gives every caller its own result or its own error.
+
+A burst of N creates then costs about N / batch transactions and fsyncs
+instead of N, for at most one window of extra latency per request. Batch
+sizes and queue waits are exported as agendaapp_group_commit_* metrics.
+
+A caller waits GROUP_COMMIT_TIMEOUT seconds at most and then gets
+GroupCommitTimeout; its item stays queued and may still be committed.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from metrics import observe_group_commit
+
+logger = logging.getLogger(__name__)
+
+GROUP_COMMIT = os.getenv('GROUP_COMMIT', 'false').lower() == 'true'
+GROUP_COMMIT_WINDOW_MS = float(os.getenv('GROUP_COMMIT_WINDOW_MS', 5))
+GROUP_COMMIT_MAX_BATCH = int(os.getenv('GROUP_COMMIT_MAX_BATCH', 200))
+GROUP_COMMIT_TIMEOUT = float(os.getenv('GROUP_COMMIT_TIMEOUT', 10))
+
+
+class GroupCommitTimeout(Exception):
+    """The item's batch was not committed in time; it may still be."""
+
+
+class GroupCommitter:
+    """Batch items from many threads into one flush(items) call.
+
+    flush returns one result per item, in order; a result that is an
+    exception is raised in that item's caller only. If flush itself raises,
+    every caller of the batch gets the error.
+    """
+
+    def __init__(self, flush, window_ms=GROUP_COMMIT_WINDOW_MS, max_batch=GROUP_COMMIT_MAX_BATCH):
+        if max_batch < 1 or window_ms < 0:
+            raise ValueError(f"Invalid group commit settings window={window_ms}ms batch={max_batch}")
+        self._flush = flush
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, item, timeout=GROUP_COMMIT_TIMEOUT):
+        """Queue item and block until its batch is committed; returns its result."""
+        self._start()
+        future = Future()
+        self._queue.put((item, future, time.perf_counter()))
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            raise GroupCommitTimeout(f"Group commit did not finish within {timeout}s") from None
+
+    def _start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get(timeout=max(0, deadline - time.perf_counter())))
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def _write(self, batch):
+        started = time.perf_counter()
+        try:
+            # Inside the try: an error here must reach the callers, not end the flusher thread
+            observe_group_commit(len(batch), [started - queued for _, _, queued in batch])
+            results = self._flush([item for item, _, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"flush returned {len(results)} results for {len(batch)} items")
+        except Exception as e:
+            logger.error(f"Group commit of {len(batch)} items failed: {str(e)}")
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        for (_, future, _), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -0,0 +1,79 @@
+"""gunicorn settings for the production image (see entrypoint.sh).
+
+    BACKEND_MODE=sync   Flask app (app.py), WORKER_MODEL picks the worker:
+                          threads  (default) WEB_CONCURRENCY processes x GUNICORN_THREADS threads
+                          sync     pre-fork, one request at a time per process
+                          gevent   green threads, GEVENT_CONNECTIONS per process
+    BACKEND_MODE=async  ASGI app (app_async_postgres.py) on uvicorn workers
+
+The app is imported in each worker after the fork (no preload_app), so every
+worker opens its own database pool, listener and background threads. A
+worker initializes the database (schema version check, pool, index warm-up)
+before it accepts its first request; migrations run separately (migrate.py).
+On SIGTERM workers stop accepting, finish the requests in flight for up to
+GRACEFUL_TIMEOUT seconds and close their connections. Each worker has its own DB_POOL_MAX connections.
+
+Change streams (/tasks/changes/stream) hold a thread or greenlet each; the
+sync model can serve at most one per process.
+"""
+import logging
+import os
+import sys
+
+BACKEND_MODE = os.getenv('BACKEND_MODE', 'sync')
+WORKER_MODEL = os.getenv('WORKER_MODEL', 'threads')
+
+WORKER_CLASSES = {
+    'sync': 'sync',
+    'threads': 'gthread',
+    'gevent': 'gevent',
+}
+
+if BACKEND_MODE == 'async':
+    wsgi_app = 'app_async_postgres:app'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+elif WORKER_MODEL in WORKER_CLASSES:
+    wsgi_app = os.getenv('APP_MODULE', 'app:app')
+    worker_class = WORKER_CLASSES[WORKER_MODEL]
+else:
+    raise ValueError(f"Unknown WORKER_MODEL: {WORKER_MODEL} (expected {', '.join(WORKER_CLASSES)})")
+
+bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"
+# Not cpu_count(): in a container it reports the node's cores, not the CPU limit
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+worker_connections = int(os.getenv('GEVENT_CONNECTIONS', 100))
+timeout = int(os.getenv('WORKER_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('GRACEFUL_TIMEOUT', 25))
+keepalive = int(os.getenv('KEEPALIVE', 5))
+# Recycle workers now and then; jitter keeps them from restarting together
+max_requests = int(os.getenv('MAX_REQUESTS', 0))
+max_requests_jitter = max(1, max_requests // 10) if max_requests else 0
+preload_app = False
+forwarded_allow_ips = '*'
+accesslog = None
+
+
+def post_fork(server, worker):
+    if worker_class == 'gevent':
+        # psycopg2 blocks the whole process unless it waits through gevent
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+
+
+def post_worker_init(worker):
+    # The ASGI app initializes in its lifespan instead
+    if BACKEND_MODE == 'async':
+        return
+    init_database = getattr(sys.modules[wsgi_app.split(':')[0]], 'init_database', None)
+    if init_database is not None and not init_database():
+        logging.getLogger(__name__).error("Database initialization failed, stopping")
+        # gunicorn's WORKER_BOOT_ERROR: the arbiter halts instead of respawning
+        sys.exit(3)
+
+
+def worker_exit(server, worker):
+    module = sys.modules.get(wsgi_app.split(':')[0])
+    shutdown = getattr(module, 'shutdown', None)
+    if BACKEND_MODE != 'async' and shutdown is not None:
+        shutdown()
@@ -0,0 +1,402 @@
+"""Prometheus metrics for both backends (GET /metrics).
+
+- agendaapp_http_requests_total{method, route, status}
+- agendaapp_http_request_duration_seconds{method, route}   (histogram)
+- agendaapp_http_requests_in_flight                         (gauge)
+- agendaapp_db_duration_seconds{operation}                  (histogram)
+- agendaapp_db_roundtrips_per_request{route}                (histogram)
+- agendaapp_db_roundtrip_budget_exceeded_total{route}
+- agendaapp_group_commit_batch_size, _queue_wait_seconds   (histograms, group_commit.py)
+- agendaapp_replica_lag_seconds{replica}                     (gauge, replicas.py)
+- agendaapp_db_pool{stat} / agendaapp_cache{stat}           (gauges read at scrape time)
+
+route is the endpoint name, never the raw path, so ids in URLs do not
+create new series. Hot-path cost is a perf_counter() pair and a few
+lock-protected increments per request and per DB call; pool and cache
+stats are only read when Prometheus scrapes.
+
+DB time comes from driver hooks instead of wrapping call sites:
+TimedExecuteMixin and TimedTransactionMixin for psycopg2 cursors and
+connections, MongoCommandTimer (pymongo command monitoring, also used by
+motor) and asyncpg_query_timer (asyncpg query loggers). Mongo pool gauges come from mongo_pool_listener.
+
+The same hooks count round trips for the request that made them (a
+ContextVar, so it works for threads and asyncio tasks alike). Apps pass
+per-route budgets; going over one logs a warning and bumps the counter
+above, and test/debug apps report the count in X-DB-Roundtrips. Only
+those calls go to the DB observers (admission control): background work
+such as cache listeners, reconciliation or archiving is not request
+latency, and neither is a change stream waiting for events.
+"""
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+# Requests are expected in the low milliseconds; the tail buckets catch pool waits
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+REQUESTS = Counter('agendaapp_http_requests_total', 'HTTP requests served',
+                   ['method', 'route', 'status'])
+REQUEST_LATENCY = Histogram('agendaapp_http_request_duration_seconds', 'Time to produce a response',
+                            ['method', 'route'], buckets=LATENCY_BUCKETS)
+IN_FLIGHT = Gauge('agendaapp_http_requests_in_flight', 'Requests being served right now')
+DB_LATENCY = Histogram('agendaapp_db_duration_seconds', 'Time spent inside database calls',
+                       ['operation'], buckets=LATENCY_BUCKETS)
+DB_ROUNDTRIPS = Histogram('agendaapp_db_roundtrips_per_request', 'Database round trips made by one request',
+                          ['route'], buckets=(0, 1, 2, 3, 4, 6, 8, 12, 20))
+ROUNDTRIP_BUDGET_EXCEEDED = Counter('agendaapp_db_roundtrip_budget_exceeded_total',
+                                    'Requests that made more round trips than their route budget', ['route'])
+GROUP_COMMIT_BATCH = Histogram('agendaapp_group_commit_batch_size', 'Rows written per group commit',
+                               buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+GROUP_COMMIT_WAIT = Histogram('agendaapp_group_commit_queue_wait_seconds',
+                              'Time a row waited in the group commit queue', buckets=LATENCY_BUCKETS)
+REPLICA_LAG = Gauge('agendaapp_replica_lag_seconds', 'How far each read replica is behind the primary',
+                    ['replica'])
+
+logger = logging.getLogger(__name__)
+
+# [count] of the request being served, None outside requests
+_roundtrips = ContextVar('agendaapp_db_roundtrips', default=None)
+
+# Called with the duration of every DB call made by a request (see add_db_observer)
+_db_observers = []
+
+
+def observe_request(method, route, status, seconds):
+    REQUESTS.labels(method, route, str(status)).inc()
+    REQUEST_LATENCY.labels(method, route).observe(seconds)
+
+
+def observe_db(operation, seconds, roundtrips=1, waited=False):
+    """waited: the call blocked for new data on purpose (an awaitable getMore), so its
+    duration is not latency."""
+    counter = _roundtrips.get()
+    if not waited:
+        DB_LATENCY.labels(operation).observe(seconds)
+        # Background work (listeners, reconciler, archive, group commit) is not request latency
+        if counter is not None:
+            for observer in _db_observers:
+                observer(seconds)
+    if counter is not None:
+        counter[0] += roundtrips
+
+
+def observe_group_commit(size, waits):
+    GROUP_COMMIT_BATCH.observe(size)
+    for seconds in waits:
+        GROUP_COMMIT_WAIT.observe(seconds)
+
+
+def add_db_observer(observer):
+    """Also send the duration of every DB call made by a request to observer(seconds), e.g. admission control."""
+    if observer not in _db_observers:
+        _db_observers.append(observer)
+
+
+@contextmanager
+def count_roundtrips():
+    """Count the round trips made inside the block: with count_roundtrips() as n: ... n[0]"""
+    counter = [0]
+    token = _roundtrips.set(counter)
+    try:
+        yield counter
+    finally:
+        _roundtrips.reset(token)
+
+
+def observe_roundtrips(route, count, budgets):
+    DB_ROUNDTRIPS.labels(route).observe(count)
+    budget = budgets.get(route)
+    if budget is not None and count > budget:
+        ROUNDTRIP_BUDGET_EXCEEDED.labels(route).inc()
+        logger.warning(f"{route} made {count} database round trips (budget {budget})")
+
+
+class StatsCollector:
+    """Expose the numeric values of a stats() dict as one labelled gauge."""
+
+    def __init__(self, name, documentation, stats):
+        self.name = name
+        self.documentation = documentation
+        self.stats = stats
+
+    def collect(self):
+        family = GaugeMetricFamily(self.name, self.documentation, labels=['stat'])
+        try:
+            values = self.stats()
+        except Exception:
+            values = {}
+        for key, value in values.items():
+            if isinstance(value, (int, float)):
+                family.add_metric([key], float(value))
+        yield family
+
+
+_stats_collectors = {}
+
+
+def register_stats(name, documentation, stats):
+    """Register once per name; registering again just swaps the stats source."""
+    collector = _stats_collectors.get(name)
+    if collector is None:
+        collector = _stats_collectors[name] = StatsCollector(name, documentation, stats)
+        REGISTRY.register(collector)
+    collector.stats = stats
+
+
+def render():
+    """(body, content type) for the /metrics route."""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+# ----------------------------------------------------------------------
+# Flask
+# ----------------------------------------------------------------------
+
+def instrument_flask(app, roundtrip_budgets=None):
+    """Count and time every request. Streamed bodies are timed to the first byte.
+
+    roundtrip_budgets maps endpoint names to the most DB round trips they
+    should need; round trips made by a streamed body are not counted.
+    """
+    from flask import g, request
+
+    budgets = roundtrip_budgets or {}
+
+    @app.before_request
+    def _metrics_start():
+        g.metrics_start = time.perf_counter()
+        g.db_roundtrips = [0]
+        _roundtrips.set(g.db_roundtrips)
+        IN_FLIGHT.inc()
+
+    @app.after_request
+    def _metrics_observe(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            route = request.endpoint or 'unmatched'
+            observe_request(request.method, route, response.status_code, time.perf_counter() - start)
+            count = g.db_roundtrips[0]
+            observe_roundtrips(route, count, budgets)
+            if app.testing or app.debug:
+                response.headers['X-DB-Roundtrips'] = str(count)
+        return response
+
+    @app.teardown_request
+    def _metrics_done(exc):
+        _roundtrips.set(None)
+        IN_FLIGHT.dec()
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        body, content_type = render()
+        return app.response_class(body, content_type=content_type)
+
+
+# ----------------------------------------------------------------------
+# ASGI (Starlette)
+# ----------------------------------------------------------------------
+
+class MetricsMiddleware:
+    """ASGI counterpart of instrument_flask; times until the last body chunk."""
+
+    def __init__(self, app, roundtrip_budgets=None):
+        self.app = app
+        self.budgets = roundtrip_budgets or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        status = 500
+        counter = [0]
+        _roundtrips.set(counter)
+        IN_FLIGHT.inc()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            IN_FLIGHT.dec()
+            route = getattr(scope.get('endpoint'), '__name__', 'unmatched')
+            observe_request(scope['method'], route, status, time.perf_counter() - start)
+            observe_roundtrips(route, counter[0], self.budgets)
+
+
+async def metrics_endpoint(request):
+    from starlette.responses import Response
+
+    body, content_type = render()
+    return Response(body, headers={'Content-Type': content_type})
+
+
+# ----------------------------------------------------------------------
+# Driver hooks
+# ----------------------------------------------------------------------
+
+# psycopg2.extensions.TRANSACTION_STATUS_IDLE
+_PG_IDLE = 0
+
+
+def _pg_roundtrips(conn, statements=1):
+    # Outside autocommit psycopg2 sends BEGIN on its own before the first statement
+    return statements + (not conn.autocommit and conn.info.transaction_status == _PG_IDLE)
+
+
+class TimedExecuteMixin:
+    """psycopg2 cursor mixin: time execute() and executemany()."""
+
+    def execute(self, query, vars=None):
+        roundtrips = _pg_roundtrips(self.connection)
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            observe_db('execute', time.perf_counter() - start, roundtrips)
+
+    def executemany(self, query, vars_list):
+        vars_list = list(vars_list)
+        roundtrips = _pg_roundtrips(self.connection, len(vars_list))
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            observe_db('executemany', time.perf_counter() - start, roundtrips)
+
+
+class TimedTransactionMixin:
+    """psycopg2 connection mixin: time commit() and rollback().
+
+    Without an open transaction both are no-ops that never reach the server.
+    """
+
+    def commit(self):
+        if self.info.transaction_status == _PG_IDLE:
+            return super().commit()
+        start = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            observe_db('commit', time.perf_counter() - start)
+
+    def rollback(self):
+        if self.info.transaction_status == _PG_IDLE:
+            return super().rollback()
+        start = time.perf_counter()
+        try:
+            return super().rollback()
+        finally:
+            observe_db('rollback', time.perf_counter() - start)
+
+
+def mongo_command_timer():
+    """pymongo CommandListener; pass it as MongoClient(event_listeners=[...])."""
+    from pymongo import monitoring
+
+    class MongoCommandTimer(monitoring.CommandListener):
+        """Change stream getMores wait for new events (about 1s when idle), so they are
+        counted as round trips but not timed."""
+
+        def __init__(self):
+            self._opening = set()     # request_id of the aggregates opening a change stream
+            self._streams = set()     # cursor ids of open change streams
+            self._awaiting = {}       # request_id of their getMores in flight -> cursor id
+
+        def started(self, event):
+            command = event.command
+            if event.command_name == 'aggregate' and any('$changeStream' in stage
+                                                         for stage in command.get('pipeline', [])):
+                self._opening.add(event.request_id)
+            elif event.command_name == 'getMore' and command.get('getMore') in self._streams:
+                self._awaiting[event.request_id] = command['getMore']
+            elif event.command_name == 'killCursors':
+                self._streams.difference_update(command.get('cursors', []))
+
+        def succeeded(self, event):
+            if event.request_id in self._opening:
+                cursor = event.reply.get('cursor', {}).get('id')
+                if cursor:
+                    self._streams.add(cursor)
+            elif event.request_id in self._awaiting and not event.reply.get('cursor', {}).get('id'):
+                # Exhausted
+                self._streams.discard(self._awaiting[event.request_id])
+            self._observe(event)
+
+        def failed(self, event):
+            if event.request_id in self._awaiting:
+                self._streams.discard(self._awaiting[event.request_id])
+            self._observe(event)
+
+        def _observe(self, event):
+            self._opening.discard(event.request_id)
+            waited = self._awaiting.pop(event.request_id, None) is not None
+            observe_db(event.command_name, event.duration_micros / 1e6, waited=waited)
+
+    return MongoCommandTimer()
+
+
+def mongo_pool_listener():
+    """pymongo ConnectionPoolListener that counts open and checked-out connections.
+
+    Pass it with event_listeners as well; its stats() feeds agendaapp_db_pool.
+    """
+    from pymongo import monitoring
+
+    class MongoPoolStats(monitoring.ConnectionPoolListener):
+        def __init__(self):
+            self.counts = {"size": 0, "in_use": 0, "created": 0, "checkouts": 0, "timeouts": 0}
+
+        def stats(self):
+            return dict(self.counts)
+
+        def connection_created(self, event):
+            self.counts["size"] += 1
+            self.counts["created"] += 1
+
+        def connection_closed(self, event):
+            self.counts["size"] -= 1
+
+        def connection_checked_out(self, event):
+            self.counts["in_use"] += 1
+            self.counts["checkouts"] += 1
+
+        def connection_checked_in(self, event):
+            self.counts["in_use"] -= 1
+
+        def connection_check_out_failed(self, event):
+            self.counts["timeouts"] += 1
+
+        def pool_created(self, event):
+            pass
+
+        def pool_ready(self, event):
+            pass
+
+        def pool_cleared(self, event):
+            pass
+
+        def pool_closed(self, event):
+            pass
+
+        def connection_ready(self, event):
+            pass
+
+        def connection_check_out_started(self, event):
+            pass
+
+    return MongoPoolStats()
+
+
+def asyncpg_query_timer(record):
+    """asyncpg query logger (Connection.add_query_logger)."""
+    observe_db('execute', record.elapsed)
@@ -0,0 +1,214 @@
+"""Versioned schema migrations for the PostgreSQL backends.
+
+    python migrate.py            apply pending migrations, then exit
+    python migrate.py --status   list applied and pending migrations
+
+Migrations are the files migrations/NNNN_name.sql, applied in version
+order and recorded in schema_migrations. They run once per deploy as a
+one-shot job (the Helm pre-install/pre-upgrade hook, BACKEND_MODE=migrate),
+never at app startup: app pods only check that every required version is
+recorded (see schema.py). A session advisory lock makes concurrent runs
+take turns, so a second job just finds nothing left to do.
+
+A file runs in one transaction unless its first lines say otherwise:
+
+    -- migrate: no-transaction    statements run one by one in autocommit,
+                                  needed for CREATE INDEX CONCURRENTLY
+    -- migrate: optional          a failure is logged and the migration
+                                  stays pending instead of failing the run
+
+Statements of no-transaction files are split on a ';' at the end of a line.
+They must be safe to re-run (IF NOT EXISTS), since a failure halfway leaves
+the earlier ones applied; an index left INVALID by an interrupted
+CREATE INDEX CONCURRENTLY is dropped before the statement runs again.
+"""
+import argparse
+import logging
+import os
+import re
+import sys
+from collections import namedtuple
+
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+DB_CONFIG = {
+    'host': os.getenv('DB_HOST', 'postgres-service'),
+    'user': os.getenv('DB_USER', 'postgres'),
+    'password': os.getenv('DB_PASSWORD', 'agenda123'),
+    'database': os.getenv('DB_NAME', 'agendaapp'),
+    'port': int(os.getenv('DB_PORT', 5432))
+}
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+# Same key the apps used to serialize their startup DDL, so an old pod
+# still running it and a migration job never overlap
+PG_SCHEMA_LOCK_KEY = "hashtext('agendaapp.schema')"
+
+PG_MIGRATIONS_DDL = '''
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+PG_INVALID_INDEX_SQL = '''
+    SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+    WHERE c.relname = %s AND NOT i.indisvalid
+'''
+
+Migration = namedtuple('Migration', 'version name sql transactional optional')
+
+_FILENAME = re.compile(r'^(\d{4})_(\w+)\.sql$')
+_DIRECTIVE = re.compile(r'^--\s*migrate:\s*(.+)$')
+_CONCURRENT_INDEX = re.compile(r'CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)', re.I)
+
+
+def load_migrations(directory=MIGRATIONS_DIR):
+    """Every migration file in directory, sorted by version."""
+    migrations = {}
+    for filename in sorted(os.listdir(directory)):
+        match = _FILENAME.match(filename)
+        if not match:
+            continue
+        version = int(match.group(1))
+        if version in migrations:
+            raise ValueError(f"Duplicate migration version {version}: {filename}")
+        with open(os.path.join(directory, filename)) as f:
+            sql = f.read()
+        options = set()
+        for line in sql.splitlines():
+            directive = _DIRECTIVE.match(line.strip())
+            if directive:
+                options.update(option.strip() for option in directive.group(1).split(','))
+            elif line.strip() and not line.startswith('--'):
+                break
+        unknown = options - {'no-transaction', 'optional'}
+        if unknown:
+            raise ValueError(f"{filename}: unknown migrate option(s) {', '.join(sorted(unknown))}")
+        migrations[version] = Migration(version, match.group(2), sql,
+                                        'no-transaction' not in options, 'optional' in options)
+    return [migrations[version] for version in sorted(migrations)]
+
+
+def required_versions(migrations):
+    """Versions the apps refuse to start without."""
+    return {m.version for m in migrations if not m.optional}
+
+
+def split_statements(sql):
+    """Statements of a no-transaction file, comments removed."""
+    body = '\n'.join(line for line in sql.splitlines() if not line.lstrip().startswith('--'))
+    return [statement.strip() for statement in re.split(r';\s*$', body, flags=re.M) if statement.strip()]
+
+
+def applied_versions(cur):
+    cur.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cur.fetchall()}
+
+
+def _drop_invalid_index(cur, statement):
+    match = _CONCURRENT_INDEX.search(statement)
+    if match:
+        cur.execute(PG_INVALID_INDEX_SQL, (match.group(1),))
+        if cur.fetchone():
+            logger.warning(f"Dropping invalid index {match.group(1)} left by an interrupted build")
+            cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {match.group(1)}")
+
+
+def _apply(conn, migration):
+    cur = conn.cursor()
+    try:
+        if migration.transactional:
+            conn.autocommit = False
+            cur.execute(migration.sql)
+        else:
+            for statement in split_statements(migration.sql):
+                _drop_invalid_index(cur, statement)
+                cur.execute(statement)
+            conn.autocommit = False
+        cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                    (migration.version, migration.name))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.autocommit = True
+        cur.close()
+
+
+def migrate(conn, migrations=None):
+    """Apply the pending migrations on conn (psycopg2); returns their versions.
+
+    Waits for any other run to finish first. A failing migration stops the
+    run and raises, unless it is optional.
+    """
+    if migrations is None:
+        migrations = load_migrations()
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute(f"SELECT pg_advisory_lock({PG_SCHEMA_LOCK_KEY})")
+    try:
+        cur.execute(PG_MIGRATIONS_DDL)
+        done = applied_versions(cur)
+        applied = []
+        for migration in migrations:
+            if migration.version in done:
+                continue
+            try:
+                _apply(conn, migration)
+            except Exception as e:
+                if not migration.optional:
+                    logger.error(f"Migration {migration.version} ({migration.name}) failed: {e}")
+                    raise
+                logger.warning(f"Optional migration {migration.version} ({migration.name}) skipped: {e}")
+                continue
+            logger.info(f"Applied migration {migration.version} ({migration.name})")
+            applied.append(migration.version)
+        return applied
+    finally:
+        cur.execute(f"SELECT pg_advisory_unlock({PG_SCHEMA_LOCK_KEY})")
+        cur.close()
+
+
+def status(conn, migrations=None):
+    """[(migration, applied)] for --status."""
+    if migrations is None:
+        migrations = load_migrations()
+    cur = conn.cursor()
+    cur.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+    done = applied_versions(cur) if cur.fetchone()[0] else set()
+    cur.close()
+    conn.rollback()
+    return [(m, m.version in done) for m in migrations]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply the PostgreSQL schema migrations")
+    parser.add_argument('--status', action='store_true', help="list migrations without applying any")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    conn = psycopg2.connect(**DB_CONFIG, connect_timeout=10)
+    try:
+        if args.status:
+            for migration, applied in status(conn):
+                flags = ' (optional)' if migration.optional else ''
+                print(f"{migration.version:04d} {migration.name}{flags}: {'applied' if applied else 'pending'}")
+            return 0
+        applied = migrate(conn)
+        logger.info(f"Schema up to date ({len(applied)} migration(s) applied)")
+        return 0
+    except Exception as e:
+        logger.error(f"Migration failed: {e}")
+        return 1
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+-- Tables, counters and change-feed triggers of the PostgreSQL backends.
+-- Idempotent: databases created before migrations existed already have
+-- most of this and only get what they are missing.
+
+CREATE TABLE IF NOT EXISTS tasks (
+    id VARCHAR(50) PRIMARY KEY,
+    title VARCHAR(255) NOT NULL,
+    done BOOLEAN DEFAULT FALSE,
+    due_date DATE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Counters row kept in sync by the triggers below (counters.py)
+CREATE TABLE IF NOT EXISTS task_counters (
+    id SMALLINT PRIMARY KEY CHECK (id = 1),
+    total BIGINT NOT NULL DEFAULT 0,
+    completed BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+ALTER TABLE task_counters ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE task_counters ADD COLUMN IF NOT EXISTS pruned_version BIGINT NOT NULL DEFAULT 0;
+
+-- Change feed (changes.py): one row per task with the version of its last write
+CREATE TABLE IF NOT EXISTS task_changes (
+    task_id VARCHAR(50) PRIMARY KEY,
+    version BIGINT NOT NULL,
+    deleted BOOLEAN NOT NULL DEFAULT FALSE,
+    changed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE OR REPLACE FUNCTION tasks_counters_sync() RETURNS trigger AS $$
+DECLARE
+    touched BIGINT := 0;
+    d_total BIGINT := 0;
+    d_completed BIGINT := 0;
+    new_version BIGINT;
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        SELECT count(*), d_total + count(*), d_completed + count(*) FILTER (WHERE done)
+          INTO touched, d_total, d_completed FROM new_rows;
+    ELSE
+        SELECT count(*) INTO touched FROM old_rows;
+    END IF;
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        SELECT d_total - count(*), d_completed - count(*) FILTER (WHERE done)
+          INTO d_total, d_completed FROM old_rows;
+    END IF;
+    IF touched > 0 THEN
+        UPDATE task_counters
+           SET total = total + d_total,
+               completed = completed + d_completed,
+               version = version + 1,
+               updated_at = CURRENT_TIMESTAMP
+         WHERE id = 1
+        RETURNING version INTO new_version;
+        -- Change feed: the row lock above orders versions by commit
+        IF TG_OP = 'DELETE' THEN
+            INSERT INTO task_changes (task_id, version, deleted)
+            SELECT id, coalesce(new_version, 0), TRUE FROM old_rows
+            ON CONFLICT (task_id) DO UPDATE
+                SET version = EXCLUDED.version, deleted = TRUE, changed_at = CURRENT_TIMESTAMP;
+        ELSE
+            INSERT INTO task_changes (task_id, version, deleted)
+            SELECT id, coalesce(new_version, 0), FALSE FROM new_rows
+            ON CONFLICT (task_id) DO UPDATE
+                SET version = EXCLUDED.version, deleted = FALSE, changed_at = CURRENT_TIMESTAMP;
+        END IF;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS tasks_counters_insert ON tasks;
+DROP TRIGGER IF EXISTS tasks_counters_update ON tasks;
+DROP TRIGGER IF EXISTS tasks_counters_delete ON tasks;
+
+CREATE TRIGGER tasks_counters_insert AFTER INSERT ON tasks
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION tasks_counters_sync();
+CREATE TRIGGER tasks_counters_update AFTER UPDATE ON tasks
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION tasks_counters_sync();
+CREATE TRIGGER tasks_counters_delete AFTER DELETE ON tasks
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION tasks_counters_sync();
+
+INSERT INTO task_counters (id, total, completed)
+SELECT 1, count(*), count(*) FILTER (WHERE done) FROM tasks
+ON CONFLICT (id) DO NOTHING;
+
+-- Tasks written before the feed existed
+INSERT INTO task_changes (task_id, version)
+SELECT id, 0 FROM tasks
+WHERE NOT EXISTS (SELECT 1 FROM task_changes)
+ON CONFLICT (task_id) DO NOTHING;
+
+-- Cache invalidation and change streams on every replica (read_cache.py)
+CREATE OR REPLACE FUNCTION tasks_notify_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('tasks_changed', '');
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS tasks_notify_change ON tasks;
+CREATE TRIGGER tasks_notify_change AFTER INSERT OR UPDATE OR DELETE ON tasks
+    FOR EACH STATEMENT EXECUTE FUNCTION tasks_notify_change();
@@ -0,0 +1,17 @@
+-- migrate: no-transaction
+-- Built without blocking writes; a build that failed halfway leaves an
+-- INVALID index, which migrate.py drops before trying again.
+
+-- Keyset order of GET /tasks and its filters
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tasks_created_id ON tasks (created_at DESC, id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tasks_done_created_id ON tasks (done, created_at DESC, id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tasks_due_date_created_id ON tasks (due_date, created_at DESC, id DESC);
+
+-- Full-text search (search.py)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tasks_title_fts ON tasks USING gin (to_tsvector('simple', title));
+
+-- Open tasks of the agenda (agenda.py)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tasks_due_date_open ON tasks (due_date) WHERE NOT done;
+
+-- Keyset scan of the change feed (changes.py)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_task_changes_version_id ON task_changes (version, task_id);
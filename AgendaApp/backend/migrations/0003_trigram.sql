@@ -0,0 +1,9 @@
+-- migrate: no-transaction, optional
+-- Typo-tolerant search (search.py). Creating the extension needs a
+-- privileged role on some servers; without it this migration stays
+-- pending and search is full-text only.
+--
+-- The index used to be built here, on what was then a plain table; since
+-- 0004 partitions tasks it is built per partition by 0009_trigram_partitions.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
@@ -0,0 +1,41 @@
+-- Hot/cold split (archive.py): tasks becomes a table partitioned by
+-- LIST (archived). The existing table is kept as the hot partition, so
+-- its rows, indexes and primary key stay where they are; ATTACH checks
+-- its rows once under an exclusive lock, so run this off-peak.
+--
+-- Ids stay unique per partition; the parent has no primary key, which
+-- would have to include archived and rebuild the index of every row.
+-- The trigram index of 0003 is built per partition by 0009 from now on.
+
+ALTER TABLE tasks RENAME TO tasks_hot;
+
+-- Statement triggers fire on the table a statement names, i.e. the parent
+DROP TRIGGER tasks_counters_insert ON tasks_hot;
+DROP TRIGGER tasks_counters_update ON tasks_hot;
+DROP TRIGGER tasks_counters_delete ON tasks_hot;
+DROP TRIGGER tasks_notify_change ON tasks_hot;
+
+ALTER TABLE tasks_hot ADD COLUMN archived BOOLEAN NOT NULL DEFAULT FALSE;
+
+CREATE TABLE tasks (LIKE tasks_hot INCLUDING DEFAULTS) PARTITION BY LIST (archived);
+ALTER TABLE tasks ATTACH PARTITION tasks_hot FOR VALUES IN (FALSE);
+CREATE TABLE tasks_archive PARTITION OF tasks (PRIMARY KEY (id)) FOR VALUES IN (TRUE);
+
+-- GET /tasks?include_archived=true and its date filter; archived tasks are
+-- all done, and search and the agenda only read tasks_hot
+CREATE INDEX idx_tasks_archive_created_id ON tasks_archive (created_at DESC, id DESC);
+CREATE INDEX idx_tasks_archive_due_date_created_id ON tasks_archive (due_date, created_at DESC, id DESC);
+
+-- Archiving is an UPDATE that moves rows between partitions; the
+-- transition tables of the parent still see it as one
+CREATE TRIGGER tasks_counters_insert AFTER INSERT ON tasks
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION tasks_counters_sync();
+CREATE TRIGGER tasks_counters_update AFTER UPDATE ON tasks
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION tasks_counters_sync();
+CREATE TRIGGER tasks_counters_delete AFTER DELETE ON tasks
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION tasks_counters_sync();
+CREATE TRIGGER tasks_notify_change AFTER INSERT OR UPDATE OR DELETE ON tasks
+    FOR EACH STATEMENT EXECUTE FUNCTION tasks_notify_change();
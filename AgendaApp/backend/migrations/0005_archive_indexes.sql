@@ -0,0 +1,4 @@
+-- migrate: no-transaction
+-- Completed hot tasks by age, for the archive job (archive.py)
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tasks_hot_done_updated ON tasks_hot (updated_at) WHERE done;
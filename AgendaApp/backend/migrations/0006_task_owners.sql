@@ -0,0 +1,85 @@
+-- Owner-scoped tasks (owners.py). Every existing task goes to the default
+-- owner; adding a column with a constant default rewrites no rows, but it
+-- holds an exclusive lock on tasks until the backfill below commits.
+-- Owner-leading indexes come in 0007, built concurrently.
+
+ALTER TABLE tasks ADD COLUMN owner_id VARCHAR(64) NOT NULL DEFAULT 'default';
+
+-- Per-owner counts for /stats, kept with task_counters by the trigger below
+CREATE TABLE owner_counters (
+    owner_id VARCHAR(64) PRIMARY KEY,
+    total BIGINT NOT NULL DEFAULT 0,
+    completed BIGINT NOT NULL DEFAULT 0
+);
+
+-- The change feed of an owner only scans its own changes
+ALTER TABLE task_changes ADD COLUMN owner_id VARCHAR(64) NOT NULL DEFAULT 'default';
+
+CREATE OR REPLACE FUNCTION tasks_counters_sync() RETURNS trigger AS $$
+DECLARE
+    touched BIGINT := 0;
+    d_total BIGINT := 0;
+    d_completed BIGINT := 0;
+    new_version BIGINT;
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        SELECT count(*), d_total + count(*), d_completed + count(*) FILTER (WHERE done)
+          INTO touched, d_total, d_completed FROM new_rows;
+    ELSE
+        SELECT count(*) INTO touched FROM old_rows;
+    END IF;
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        SELECT d_total - count(*), d_completed - count(*) FILTER (WHERE done)
+          INTO d_total, d_completed FROM old_rows;
+    END IF;
+    IF touched > 0 THEN
+        UPDATE task_counters
+           SET total = total + d_total,
+               completed = completed + d_completed,
+               version = version + 1,
+               updated_at = CURRENT_TIMESTAMP
+         WHERE id = 1
+        RETURNING version INTO new_version;
+        -- Per-owner counts, in the order the row lock above gives writers.
+        -- Each branch only names the transition tables its event has.
+        IF TG_OP = 'INSERT' THEN
+            INSERT INTO owner_counters AS o (owner_id, total, completed)
+            SELECT owner_id, count(*), count(*) FILTER (WHERE done) FROM new_rows GROUP BY owner_id
+            ON CONFLICT (owner_id) DO UPDATE
+                SET total = o.total + EXCLUDED.total, completed = o.completed + EXCLUDED.completed;
+        ELSIF TG_OP = 'DELETE' THEN
+            INSERT INTO owner_counters AS o (owner_id, total, completed)
+            SELECT owner_id, -count(*), -count(*) FILTER (WHERE done) FROM old_rows GROUP BY owner_id
+            ON CONFLICT (owner_id) DO UPDATE
+                SET total = o.total + EXCLUDED.total, completed = o.completed + EXCLUDED.completed;
+        ELSE
+            INSERT INTO owner_counters AS o (owner_id, total, completed)
+            SELECT owner_id, sum(d.total), sum(d.completed) FROM (
+                SELECT owner_id, 1 AS total, CASE WHEN done THEN 1 ELSE 0 END AS completed FROM new_rows
+                UNION ALL
+                SELECT owner_id, -1, CASE WHEN done THEN -1 ELSE 0 END FROM old_rows
+            ) AS d
+            GROUP BY owner_id
+            HAVING sum(d.total) <> 0 OR sum(d.completed) <> 0
+            ON CONFLICT (owner_id) DO UPDATE
+                SET total = o.total + EXCLUDED.total, completed = o.completed + EXCLUDED.completed;
+        END IF;
+        -- Change feed: the row lock above orders versions by commit
+        IF TG_OP = 'DELETE' THEN
+            INSERT INTO task_changes (task_id, owner_id, version, deleted)
+            SELECT id, owner_id, coalesce(new_version, 0), TRUE FROM old_rows
+            ON CONFLICT (task_id) DO UPDATE
+                SET version = EXCLUDED.version, deleted = TRUE, changed_at = CURRENT_TIMESTAMP;
+        ELSE
+            INSERT INTO task_changes (task_id, owner_id, version, deleted)
+            SELECT id, owner_id, coalesce(new_version, 0), FALSE FROM new_rows
+            ON CONFLICT (task_id) DO UPDATE
+                SET version = EXCLUDED.version, deleted = FALSE, changed_at = CURRENT_TIMESTAMP;
+        END IF;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+INSERT INTO owner_counters (owner_id, total, completed)
+SELECT owner_id, count(*), count(*) FILTER (WHERE done) FROM tasks GROUP BY owner_id;
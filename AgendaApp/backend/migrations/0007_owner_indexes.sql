@@ -0,0 +1,26 @@
+-- migrate: no-transaction
+-- Owner-leading indexes for every owner-scoped query (owners.py), built on
+-- each partition of tasks (archive.py) without blocking writes. They
+-- replace the indexes of 0002 and 0004 that had no owner_id, which are
+-- dropped once the new ones exist.
+
+-- Keyset order of GET /tasks and its filters, hot and archived
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tasks_hot_owner_created_id ON tasks_hot (owner_id, created_at DESC, id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tasks_hot_owner_done_created_id ON tasks_hot (owner_id, done, created_at DESC, id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tasks_hot_owner_due_date_created_id ON tasks_hot (owner_id, due_date, created_at DESC, id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tasks_archive_owner_created_id ON tasks_archive (owner_id, created_at DESC, id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tasks_archive_owner_due_date_created_id ON tasks_archive (owner_id, due_date, created_at DESC, id DESC);
+
+-- Open tasks of the agenda (agenda.py)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tasks_hot_owner_due_date_open ON tasks_hot (owner_id, due_date) WHERE NOT done;
+
+-- Keyset scan of an owner's change feed (changes.py)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_task_changes_owner_version_id ON task_changes (owner_id, version, task_id);
+
+DROP INDEX CONCURRENTLY IF EXISTS idx_tasks_created_id;
+DROP INDEX CONCURRENTLY IF EXISTS idx_tasks_done_created_id;
+DROP INDEX CONCURRENTLY IF EXISTS idx_tasks_due_date_created_id;
+DROP INDEX CONCURRENTLY IF EXISTS idx_tasks_due_date_open;
+DROP INDEX CONCURRENTLY IF EXISTS idx_tasks_archive_created_id;
+DROP INDEX CONCURRENTLY IF EXISTS idx_tasks_archive_due_date_created_id;
+DROP INDEX CONCURRENTLY IF EXISTS idx_task_changes_version_id;
@@ -0,0 +1,84 @@
+-- Per-owner versions (owners.py). ETags, the read cache and the change
+-- feed of an owner follow that owner's writes only, and writers of
+-- different owners no longer queue on the single task_counters row.
+--
+-- task_counters keeps the last global version handed out: owners start
+-- from it (new ones just after it), so every cursor and ETag issued
+-- before stays behind the owner's own version.
+
+ALTER TABLE owner_counters
+    ADD COLUMN version BIGINT NOT NULL DEFAULT 0,
+    ADD COLUMN pruned_version BIGINT NOT NULL DEFAULT 0;
+
+UPDATE owner_counters o
+   SET version = c.version, pruned_version = c.pruned_version
+  FROM task_counters c
+ WHERE c.id = 1;
+
+CREATE OR REPLACE FUNCTION tasks_counters_sync() RETURNS trigger AS $$
+BEGIN
+    -- Every owner the statement touched gets its counts moved and its
+    -- version bumped, rows locked in owner order so multi-owner statements
+    -- (archive, reconcile) cannot deadlock. The row lock orders an owner's
+    -- versions by commit; its changes get the new version. Each branch only
+    -- names the transition tables its event has.
+    IF TG_OP = 'INSERT' THEN
+        WITH bumped AS (
+            INSERT INTO owner_counters AS o (owner_id, total, completed, version)
+            SELECT owner_id, count(*), count(*) FILTER (WHERE done),
+                   (SELECT version FROM task_counters WHERE id = 1) + 1
+            FROM new_rows GROUP BY owner_id ORDER BY owner_id
+            ON CONFLICT (owner_id) DO UPDATE
+                SET total = o.total + EXCLUDED.total, completed = o.completed + EXCLUDED.completed,
+                    version = o.version + 1
+            RETURNING owner_id, version
+        )
+        INSERT INTO task_changes (task_id, owner_id, version, deleted)
+        SELECT n.id, n.owner_id, b.version, FALSE FROM new_rows n JOIN bumped b USING (owner_id)
+        ON CONFLICT (task_id) DO UPDATE
+            SET version = EXCLUDED.version, deleted = FALSE, changed_at = CURRENT_TIMESTAMP;
+        PERFORM pg_notify('tasks_changed', owner_id) FROM (SELECT DISTINCT owner_id FROM new_rows) AS n;
+    ELSIF TG_OP = 'DELETE' THEN
+        WITH bumped AS (
+            INSERT INTO owner_counters AS o (owner_id, total, completed, version)
+            SELECT owner_id, -count(*), -count(*) FILTER (WHERE done),
+                   (SELECT version FROM task_counters WHERE id = 1) + 1
+            FROM old_rows GROUP BY owner_id ORDER BY owner_id
+            ON CONFLICT (owner_id) DO UPDATE
+                SET total = o.total + EXCLUDED.total, completed = o.completed + EXCLUDED.completed,
+                    version = o.version + 1
+            RETURNING owner_id, version
+        )
+        INSERT INTO task_changes (task_id, owner_id, version, deleted)
+        SELECT d.id, d.owner_id, b.version, TRUE FROM old_rows d JOIN bumped b USING (owner_id)
+        ON CONFLICT (task_id) DO UPDATE
+            SET version = EXCLUDED.version, deleted = TRUE, changed_at = CURRENT_TIMESTAMP;
+        PERFORM pg_notify('tasks_changed', owner_id) FROM (SELECT DISTINCT owner_id FROM old_rows) AS d;
+    ELSE
+        WITH bumped AS (
+            INSERT INTO owner_counters AS o (owner_id, total, completed, version)
+            SELECT owner_id, sum(d.total), sum(d.completed), (SELECT version FROM task_counters WHERE id = 1) + 1
+            FROM (
+                SELECT owner_id, 1 AS total, CASE WHEN done THEN 1 ELSE 0 END AS completed FROM new_rows
+                UNION ALL
+                SELECT owner_id, -1, CASE WHEN done THEN -1 ELSE 0 END FROM old_rows
+            ) AS d
+            GROUP BY owner_id ORDER BY owner_id
+            ON CONFLICT (owner_id) DO UPDATE
+                SET total = o.total + EXCLUDED.total, completed = o.completed + EXCLUDED.completed,
+                    version = o.version + 1
+            RETURNING owner_id, version
+        )
+        INSERT INTO task_changes (task_id, owner_id, version, deleted)
+        SELECT n.id, n.owner_id, b.version, FALSE FROM new_rows n JOIN bumped b USING (owner_id)
+        ON CONFLICT (task_id) DO UPDATE
+            SET version = EXCLUDED.version, deleted = FALSE, changed_at = CURRENT_TIMESTAMP;
+        PERFORM pg_notify('tasks_changed', owner_id) FROM (SELECT DISTINCT owner_id FROM new_rows) AS n;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+-- The counters trigger now notifies, with the owner as payload (read_cache.py)
+DROP TRIGGER IF EXISTS tasks_notify_change ON tasks;
+DROP FUNCTION IF EXISTS tasks_notify_change();
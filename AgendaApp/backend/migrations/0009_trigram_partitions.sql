@@ -0,0 +1,19 @@
+-- migrate: no-transaction, optional
+-- Trigram index of search.py on the partitioned tasks (0004), for the hot
+-- set and for include_archived searches alike. CREATE INDEX CONCURRENTLY
+-- does not work on a partitioned table, so each partition gets its own,
+-- then the parent index is created ON ONLY tasks (no build) and becomes
+-- valid once both are attached. Stays pending like 0003 without pg_trgm.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Built by 0003 before 0004 renamed its table: it is already the hot one
+DO $$ BEGIN IF EXISTS (SELECT 1 FROM pg_index WHERE indexrelid = to_regclass('idx_tasks_title_trgm') AND indrelid = 'tasks_hot'::regclass)
+THEN ALTER INDEX idx_tasks_title_trgm RENAME TO idx_tasks_hot_title_trgm; END IF; END $$;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tasks_hot_title_trgm ON tasks_hot USING gin (lower(title) gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tasks_archive_title_trgm ON tasks_archive USING gin (lower(title) gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_tasks_title_trgm ON ONLY tasks USING gin (lower(title) gin_trgm_ops);
+ALTER INDEX idx_tasks_title_trgm ATTACH PARTITION idx_tasks_hot_title_trgm;
+ALTER INDEX idx_tasks_title_trgm ATTACH PARTITION idx_tasks_archive_title_trgm;
@@ -0,0 +1,5 @@
+-- migrate: no-transaction
+-- ARCHIVE_KEEP_DONE is a bound per owner (archive.py): the archive job
+-- ranks each owner's completed hot tasks from the newest.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tasks_hot_owner_done_updated ON tasks_hot (owner_id, updated_at DESC) WHERE done;
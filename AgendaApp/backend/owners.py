@@ -0,0 +1,152 @@
+"""Task owners, shared by every backend.
+
+Every task belongs to one owner (owner_id) and every request acts for one.
+Lists, counts (/stats and the envelope of GET /tasks), search, the agenda,
+the change feed, the export and every write only see the caller's tasks,
+through indexes that lead with owner_id, so a request costs what its
+owner's tasks cost however many teams share the database.
+
+The owner comes from the OWNER_HEADER request header (X-Owner-Id), set by
+whatever authenticates callers in front of the backends (ingress, API
+gateway, auth proxy): the backends trust it and do not verify tokens
+themselves. Requests without it act for DEFAULT_OWNER, which also owns
+every task written before owners existed; with OWNER_REQUIRED they get
+401 instead.
+
+- PostgreSQL: tasks.owner_id, per-owner counts and versions in
+  owner_counters kept by the counters triggers, and task_changes.owner_id
+  for the change feed (migrations/0006_task_owners.sql through
+  0008_owner_versions.sql).
+- MongoDB: an owner_id field on every task, and one counters document per
+  owner next to the global one in task_stats (counters.py).
+
+ETags, the read cache and the change feed follow the caller's owner
+version, so a write by one owner never makes the others revalidate or
+reload. Maintenance routes (OWNER_GLOBAL_PATHS) work on every owner.
+"""
+import os
+import re
+
+OWNER_HEADER = os.getenv('OWNER_HEADER', 'X-Owner-Id')
+DEFAULT_OWNER = os.getenv('DEFAULT_OWNER', 'default')
+OWNER_REQUIRED = os.getenv('OWNER_REQUIRED', 'false').lower() == 'true'
+OWNER_MAX_LENGTH = 64
+
+OWNER_GLOBAL_PATHS = frozenset(['/stats/reconcile', '/tasks/archive'])
+
+_OWNER = re.compile(r'[A-Za-z0-9_.@:-]+')
+
+
+class OwnerError(Exception):
+    """The request names no valid owner; status is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def owner_scoped(method, path):
+    """True for the requests that act for an owner."""
+    if method == 'OPTIONS' or path in OWNER_GLOBAL_PATHS:
+        return False
+    return path in ('/tasks', '/stats', '/agenda', '/health', '/database/info') or path.startswith('/tasks/')
+
+
+def parse_owner(value):
+    """Owner named by an OWNER_HEADER value (None when absent); raises OwnerError."""
+    value = (value or '').strip()
+    if not value:
+        if OWNER_REQUIRED:
+            raise OwnerError(f"The {OWNER_HEADER} header is required", 401)
+        return DEFAULT_OWNER
+    if len(value) > OWNER_MAX_LENGTH or not _OWNER.fullmatch(value):
+        raise OwnerError(f"Invalid {OWNER_HEADER} header")
+    return value
+
+
+def error_body(message):
+    return {"error": message}
+
+
+# ----------------------------------------------------------------------
+# Flask
+# ----------------------------------------------------------------------
+
+def install_flask(app, body=error_body):
+    """Resolve the owner of every scoped request into g.owner, or answer the OwnerError."""
+    from flask import g, jsonify, request
+
+    @app.before_request
+    def _resolve_owner():
+        if not owner_scoped(request.method, request.path):
+            return None
+        try:
+            g.owner = parse_owner(request.headers.get(OWNER_HEADER))
+        except OwnerError as e:
+            return jsonify(body(str(e))), e.status
+        return None
+
+
+# ----------------------------------------------------------------------
+# ASGI (Starlette)
+# ----------------------------------------------------------------------
+
+class OwnerMiddleware:
+    """ASGI counterpart of install_flask; routes read request.state.owner."""
+
+    def __init__(self, app, body=error_body):
+        self.app = app
+        self.body = body
+        self.header = OWNER_HEADER.lower().encode('latin-1')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not owner_scoped(scope['method'], scope['path']):
+            return await self.app(scope, receive, send)
+        value = next((v.decode('latin-1') for k, v in scope['headers'] if k == self.header), None)
+        try:
+            owner = parse_owner(value)
+        except OwnerError as e:
+            from starlette.responses import JSONResponse
+            return await JSONResponse(self.body(str(e)), e.status)(scope, receive, send)
+        scope.setdefault('state', {})['owner'] = owner
+        await self.app(scope, receive, send)
+
+
+# ----------------------------------------------------------------------
+# MongoDB
+# ----------------------------------------------------------------------
+
+# (keys, options) for create_index on tasks: GET /tasks in _id order, alone
+# and with its done and due_date filters
+MONGO_OWNER_INDEXES = [
+    ([("owner_id", 1), ("_id", -1)], {"name": "owner_id_1__id_-1"}),
+    ([("owner_id", 1), ("done", 1), ("_id", -1)], {"name": "owner_id_1_done_1__id_-1"}),
+    ([("owner_id", 1), ("due_date", 1), ("_id", -1)], {"name": "owner_id_1_due_date_1__id_-1"}),
+]
+# Indexes without owner_id that the ones above, the agenda's, search's and
+# the archive's (archive.MONGO_ARCHIVED_INDEXES) replace; dropped at
+# startup. Only one text index fits per collection, so title_text has to go
+# before the owner-scoped one is created
+MONGO_UNSCOPED_INDEXES = ['done_1__id_-1', 'due_date_1__id_-1', 'due_date_open', 'title_text', 'title_1']
+MONGO_ARCHIVED_UNSCOPED_INDEXES = ['due_date_1__id_-1']
+
+
+def mongo_owned(query, owner):
+    """query restricted to owner's tasks."""
+    return {**query, "owner_id": owner}
+
+
+def mongo_drop_indexes(collection, names):
+    """Drop the indexes named (pymongo); the ones already gone are skipped."""
+    from pymongo.errors import OperationFailure
+
+    for name in names:
+        try:
+            collection.drop_index(name)
+        except OperationFailure:
+            pass
+
+
+def mongo_backfill(collection):
+    """Give DEFAULT_OWNER the tasks written before owners; returns how many (pymongo)."""
+    return collection.update_many({"owner_id": None}, {"$set": {"owner_id": DEFAULT_OWNER}}).modified_count
@@ -0,0 +1,82 @@
+"""Keyset pagination and list filters shared by app.py and app_postgres.py.
+
+Cursors are opaque to clients: the sort key of the last row of a page,
+JSON-encoded and base64url'd. The next page starts strictly after that key,
+so every page is an index range scan no matter how deep the client goes.
+"""
+import base64
+import binascii
+import json
+import os
+from datetime import date
+
+DEFAULT_PAGE_SIZE = int(os.getenv('TASKS_PAGE_SIZE', 100))
+MAX_PAGE_SIZE = int(os.getenv('TASKS_PAGE_MAX', 500))
+
+
+def encode_cursor(*values):
+    raw = json.dumps(list(values), separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token, size):
+    """Return the list of key values stored in a cursor, or raise ValueError."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def parse_bool(value, name):
+    lowered = value.strip().lower()
+    if lowered in ('true', '1', 'yes'):
+        return True
+    if lowered in ('false', '0', 'no'):
+        return False
+    raise ValueError(f"'{name}' must be true or false")
+
+
+def parse_date(value, name):
+    try:
+        return date.fromisoformat(value.strip()[:10])
+    except ValueError:
+        raise ValueError(f"'{name}' must be a date (YYYY-MM-DD)")
+
+
+def parse_list_args(args):
+    """Validate the query string of GET /tasks.
+
+    Returns a dict with limit, cursor (raw token or None), done (bool or None),
+    due_from / due_to (date or None) and include_archived (bool, see
+    archive.py). Raises ValueError with a message suitable for a 400 response.
+    """
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValueError("'limit' must be an integer")
+    if limit < 1:
+        raise ValueError("'limit' must be positive")
+
+    filters = {
+        'limit': min(limit, MAX_PAGE_SIZE),
+        'cursor': args.get('cursor') or None,
+        'done': None,
+        'due_from': None,
+        'due_to': None,
+        'include_archived': False,
+    }
+    if args.get('done'):
+        filters['done'] = parse_bool(args['done'], 'done')
+    if args.get('due_from'):
+        filters['due_from'] = parse_date(args['due_from'], 'due_from')
+    if args.get('due_to'):
+        filters['due_to'] = parse_date(args['due_to'], 'due_to')
+    if args.get('include_archived'):
+        filters['include_archived'] = parse_bool(args['include_archived'], 'include_archived')
+    if filters['due_from'] and filters['due_to'] and filters['due_from'] > filters['due_to']:
+        raise ValueError("'due_from' must not be after 'due_to'")
+    return filters
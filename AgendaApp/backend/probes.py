@@ -0,0 +1,189 @@
+"""Liveness and readiness probes, shared by every backend.
+
+    GET /livez     the process answers; no I/O at all
+    GET /readyz    the last background database check passed recently
+    GET /health    detailed report for humans (unchanged, hits the database)
+
+Kubernetes and the Docker HEALTHCHECK used to poll /health, so every probe
+was a database round trip and a slow database failed the liveness check of
+every pod at once, restarting them all. Now a ReadinessChecker checks the
+database every READINESS_INTERVAL seconds in the background and /readyz
+only reads its last result. A result older than READINESS_TTL counts as a
+failure, so a check that hangs takes the pod out of rotation without
+restarting it.
+
+The check reads the planner's row estimate (pg_class.reltuples) or
+estimated_document_count(), never a count of the table. PostgreSQL checks
+run on a dedicated connection with a statement timeout, so they neither
+wait for nor take a slot of the request pool.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+READINESS_INTERVAL = float(os.getenv('READINESS_INTERVAL', 5))
+READINESS_TTL = float(os.getenv('READINESS_TTL', 15))
+READINESS_TIMEOUT = float(os.getenv('READINESS_TIMEOUT', 2))
+
+# -1 until the table has been analyzed (PostgreSQL 14+). The hot partition
+# (archive.py): a partitioned table has no estimate of its own
+PG_ESTIMATED_COUNT_SQL = ("SELECT greatest(reltuples, 0)::bigint FROM pg_class"
+                          " WHERE oid = coalesce(to_regclass('tasks_hot'), 'tasks'::regclass)")
+
+_started = time.monotonic()
+
+
+def liveness():
+    return {"status": "alive", "uptime_seconds": round(time.monotonic() - _started, 3)}
+
+
+class ReadinessChecker:
+    """Runs check() periodically and caches whether it passed.
+
+    check returns a dict of details for /readyz (or a coroutine of one with
+    run_async) and raises when the database is not usable.
+    """
+
+    def __init__(self, check, interval=READINESS_INTERVAL, ttl=READINESS_TTL):
+        self._check = check
+        self.interval = interval
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._result = None  # (ok, details or error, monotonic time, latency)
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="readiness-checker", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            self.run_once()
+            time.sleep(self.interval)
+
+    def run_once(self):
+        started = time.monotonic()
+        try:
+            self._record(True, self._check(), started)
+        except Exception as e:
+            self._record(False, str(e), started)
+
+    async def run_async(self):
+        """Coroutine counterpart of start(); run it as a background task."""
+        while True:
+            started = time.monotonic()
+            try:
+                self._record(True, await self._check(), started)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._record(False, str(e), started)
+            await asyncio.sleep(self.interval)
+
+    def _record(self, ok, outcome, started):
+        now = time.monotonic()
+        if not ok and (self._result is None or self._result[0]):
+            logger.warning(f"Readiness check failed: {outcome}")
+        with self._lock:
+            self._result = (ok, outcome, now, now - started)
+
+    def status(self):
+        """(ready, body) for /readyz."""
+        with self._lock:
+            result = self._result
+        if result is None:
+            return False, {"status": "not ready", "error": "no database check yet"}
+        ok, outcome, checked, latency = result
+        age = time.monotonic() - checked
+        body = {"checked_seconds_ago": round(age, 3), "latency_ms": round(latency * 1000, 3)}
+        if not ok:
+            return False, {"status": "not ready", "error": outcome, **body}
+        if age > self.ttl:
+            return False, {"status": "not ready", "error": "database check is stale", **body}
+        return True, {"status": "ready", **outcome, **body}
+
+    def stats(self):
+        """Numeric view for /metrics."""
+        ready, body = self.status()
+        return {"ready": int(ready), "check_latency_ms": body.get('latency_ms', 0)}
+
+
+# ----------------------------------------------------------------------
+# PostgreSQL
+# ----------------------------------------------------------------------
+
+class PgReadinessCheck:
+    """check() for psycopg2 on its own connection, reopened after errors."""
+
+    def __init__(self, connect, timeout=READINESS_TIMEOUT):
+        self._connect = connect
+        self._timeout = timeout
+        self._conn = None
+
+    def __call__(self):
+        try:
+            if self._conn is None or self._conn.closed:
+                ms = int(self._timeout * 1000)
+                self._conn = self._connect(connect_timeout=max(1, round(self._timeout)),
+                                           options=f'-c statement_timeout={ms}')
+                self._conn.autocommit = True
+            cur = self._conn.cursor()
+            cur.execute(PG_ESTIMATED_COUNT_SQL)
+            estimate = cur.fetchone()[0]
+            cur.close()
+            return {"database": "connected", "tasks_estimate": estimate,
+                    "timestamp": datetime.now().isoformat()}
+        except Exception:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            raise
+
+
+class AsyncPgReadinessCheck:
+    """check() for asyncpg; connect is asyncpg.connect with the DB settings bound."""
+
+    def __init__(self, connect, timeout=READINESS_TIMEOUT):
+        self._connect = connect
+        self._timeout = timeout
+        self._conn = None
+
+    async def __call__(self):
+        try:
+            if self._conn is None or self._conn.is_closed():
+                self._conn = await self._connect(timeout=self._timeout,
+                                                 command_timeout=self._timeout)
+            estimate = await self._conn.fetchval(PG_ESTIMATED_COUNT_SQL, timeout=self._timeout)
+            return {"database": "connected", "tasks_estimate": estimate,
+                    "timestamp": datetime.now().isoformat()}
+        except Exception:
+            if self._conn is not None:
+                self._conn.terminate()
+                self._conn = None
+            raise
+
+
+# ----------------------------------------------------------------------
+# MongoDB
+# ----------------------------------------------------------------------
+
+def mongo_readiness_check(collection):
+    """check() for pymongo: one metadata count of the tasks collection."""
+    def check():
+        return {"mongodb": "connected", "tasks_estimate": collection.estimated_document_count(),
+                "timestamp": datetime.now().isoformat()}
+    return check
+
+
+def motor_readiness_check(collection):
+    async def check():
+        return {"mongodb": "connected", "tasks_estimate": await collection.estimated_document_count(),
+                "timestamp": datetime.now().isoformat()}
+    return check
@@ -0,0 +1,259 @@
+"""In-process LRU + TTL cache for the task-list and stats reads.
+
+Every replica keeps its own cache, so writes must reach all of them:
+
+- PostgreSQL: a statement-level trigger on tasks sends NOTIFY tasks_changed
+  on commit, with each owner written as payload; PgNotifyListener LISTENs
+  on a dedicated connection.
+- MongoDB: MongoChangeListener follows a change stream on the per-owner
+  counters documents every write bumps (needs a replica set).
+
+Either listener invalidates the entries of the owner an event names (see
+owners.py), so a write leaves the other owners' entries alone, and the
+whole cache on events without one and on (re)connect, since events may
+have been missed. While no listener is
+connected the cache falls back to the short CACHE_FALLBACK_TTL, so a
+missed invalidation can only serve stale data for that long. Writes made
+by this process invalidate locally right away (see the after_request hooks).
+
+Values read on a replica (see replicas.py) carry the replica's position:
+they are kept for CACHE_FALLBACK_TTL at most, since the replica may have
+been behind the write that invalidated the cache, and get() with a
+client's read-after position skips the ones older than it. A value read on
+the primary includes every write before the read, so it carries the
+read-after position of the client it was loaded for; loaded without one,
+its position is unknown and clients with a read-after position skip it
+(the invalidation of their write may not have reached this process yet).
+"""
+import logging
+import os
+import select
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+CACHE_ENABLED = os.getenv('CACHE_ENABLED', 'true').lower() == 'true'
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 256))
+CACHE_TTL = float(os.getenv('CACHE_TTL', 30))
+CACHE_FALLBACK_TTL = float(os.getenv('CACHE_FALLBACK_TTL', 2))
+
+PG_NOTIFY_CHANNEL = 'tasks_changed'
+
+class ReadCache:
+    def __init__(self, maxsize=CACHE_MAX_ENTRIES, ttl=CACHE_TTL, fallback_ttl=CACHE_FALLBACK_TTL,
+                 enabled=CACHE_ENABLED, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.fallback_ttl = fallback_ttl
+        self.enabled = enabled
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()    # key -> (expires_at, value, position, owner)
+        self._generation = 0
+        # Last invalidation of each owner, oldest first; forgetting one raises _floor
+        self._tick = 0
+        self._invalidated = OrderedDict()
+        self._floor = 0
+        self._listening = False
+        self._counters = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+        }
+
+    @property
+    def generation(self):
+        """generation_for() a value no single owner invalidates."""
+        return self.generation_for(None)
+
+    def generation_for(self, owner):
+        """Take this before loading owner's data; pass it to set() so stale loads are dropped."""
+        with self._lock:
+            return self._generation, self._tick, owner
+
+    def get(self, key, read_after=None):
+        """The cached value, or None; read_after skips values not known to include it."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+            expires_at, value, position, _ = entry
+            if self._clock() >= expires_at:
+                del self._entries[key]
+                self._counters["expirations"] += 1
+                self._counters["misses"] += 1
+                return None
+            if read_after is not None and (position is None or position < read_after):
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return value
+
+    def set(self, key, value, generation, position=None, read_after=None):
+        """position: where a replica was when value was read on it; None for the primary.
+
+        read_after: the read-after position of the client value was loaded
+        for, which a value read on the primary includes.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            # An invalidation happened while this value was being loaded
+            generation, tick, owner = generation
+            if (generation != self._generation or tick < self._floor
+                    or self._invalidated.get(owner, 0) > tick):
+                return
+            ttl = self.ttl if self._listening and position is None else self.fallback_ttl
+            self._entries[key] = (self._clock() + ttl, value, read_after if position is None else position, owner)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def invalidate(self, owner):
+        """Drop what was cached for owner; None drops everything."""
+        if owner is None:
+            return self.invalidate_all()
+        with self._lock:
+            self._tick += 1
+            self._invalidated[owner] = self._tick
+            self._invalidated.move_to_end(owner)
+            while len(self._invalidated) > self.maxsize:
+                # Loads that started before the forgotten invalidation are dropped
+                self._floor = self._invalidated.popitem(last=False)[1]
+            for key in [key for key, entry in self._entries.items() if entry[3] == owner]:
+                del self._entries[key]
+            self._counters["invalidations"] += 1
+
+    def invalidate_all(self):
+        with self._lock:
+            self._generation += 1
+            self._invalidated.clear()
+            self._floor = self._tick
+            self._entries.clear()
+            self._counters["invalidations"] += 1
+
+    def set_listening(self, listening):
+        """Called by the listeners; without one, entries use the fallback TTL."""
+        with self._lock:
+            self._listening = listening
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "max_entries": self.maxsize,
+                "ttl": self.ttl if self._listening else self.fallback_ttl,
+                "invalidation": "listening" if self._listening else "ttl-only",
+                **self._counters,
+            }
+
+
+class PgNotifyListener:
+    """LISTEN on a dedicated connection and call on_event(payload) for every NOTIFY.
+
+    The payload is None on (re)connect and for notifications without one.
+    """
+
+    def __init__(self, connect, on_event, on_state=None, channel=PG_NOTIFY_CHANNEL, retry=5.0):
+        self._connect = connect
+        self._on_event = on_event
+        self._on_state = on_state or (lambda listening: None)
+        self._channel = channel
+        self._retry = retry
+        self._stop = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, name="cache-pg-listener", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = self._connect()
+                conn.autocommit = True
+                cur = conn.cursor()
+                cur.execute(f"LISTEN {self._channel}")
+                self._on_state(True)
+                self._on_event(None)
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    # One event per owner, however many writes it made
+                    payloads = {notify.payload or None for notify in conn.notifies}
+                    conn.notifies.clear()
+                    for payload in payloads:
+                        self._on_event(payload)
+            except Exception as e:
+                logger.warning(f"Cache invalidation listener disconnected: {str(e)}")
+            finally:
+                # Entries cached while listening could now miss an invalidation
+                self._on_state(False)
+                self._on_event(None)
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            self._stop.wait(self._retry)
+
+
+class MongoChangeListener:
+    """Follow a change stream and call on_event(owner_of(change)) for every change.
+
+    owner_of defaults to None for every change; on_event(None) is also
+    called on (re)connect.
+    """
+
+    def __init__(self, collection, on_event, on_state=None, retry=5.0, owner_of=None):
+        self._collection = collection
+        self._on_event = on_event
+        self._owner_of = owner_of or (lambda change: None)
+        self._on_state = on_state or (lambda listening: None)
+        self._retry = retry
+        self._stop = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, name="cache-mongo-listener", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        from pymongo.errors import OperationFailure
+
+        while not self._stop.is_set():
+            try:
+                with self._collection.watch(max_await_time_ms=1000) as stream:
+                    self._on_state(True)
+                    self._on_event(None)
+                    while not self._stop.is_set() and stream.alive:
+                        change = stream.try_next()
+                        if change is not None:
+                            self._on_event(self._owner_of(change))
+            except (OperationFailure, NotImplementedError) as e:
+                # Standalone servers have no change streams: stay on TTL only
+                logger.warning(f"Change streams unavailable, cache is TTL-only: {e}")
+                return
+            except Exception as e:
+                logger.warning(f"Cache change stream disconnected: {e}")
+            finally:
+                # Entries cached while listening could now miss an invalidation
+                self._on_state(False)
+                self._on_event(None)
+            self._stop.wait(self._retry)
@@ -0,0 +1,376 @@
+"""Read-replica routing with read-your-writes consistency.
+
+Reads are most of the load, so they can go to read replicas while writes
+stay on the primary:
+
+- PostgreSQL: DB_REPLICA_HOSTS lists streaming replicas (host[:port],
+  comma separated; user, password and database are the primary's). Each
+  read picks a replica through ReplicaRouter.
+- MongoDB: MONGO_READ_PREFERENCE=secondaryPreferred (or any other mode);
+  the driver picks the member.
+
+Both databases number their writes with a position that only grows: the
+WAL LSN in PostgreSQL, the cluster time in MongoDB (a Timestamp, kept as
+seconds << 32 | increment). After a write the response sets the
+READ_AFTER_COOKIE to the primary's current position, which costs one extra
+round trip and only happens when replica reads are on. Reads of a client
+that sends the cookie only see nodes that have reached that position:
+
+- PostgreSQL: a replica whose last checked position is at least the
+  cookie's, else the primary;
+- MongoDB: a causally consistent session advanced to the cookie's cluster
+  time, so the member waits until it has caught up (afterClusterTime).
+
+Everyone else may read data up to REPLICA_MAX_LAG seconds old. The change
+feed and exports stay on the primary: streams are woken by NOTIFY before a
+replica may have the change, and recovery conflicts can cancel a long
+export on a hot standby.
+
+A ReplicaMonitor checks every replica in the background every
+REPLICA_CHECK_INTERVAL seconds, so routing needs no I/O. A replica that
+fails its check or lags more than REPLICA_MAX_LAG gets no reads until it
+recovers. The lag is exported as agendaapp_replica_lag_seconds{replica}.
+
+Cached reads remember the position they were read at (see ReadCache.set),
+so the cache never serves a client data older than its own last write.
+"""
+import asyncio
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+from metrics import REPLICA_LAG
+
+logger = logging.getLogger(__name__)
+
+REPLICA_CHECK_INTERVAL = float(os.getenv('REPLICA_CHECK_INTERVAL', 1))
+REPLICA_CHECK_TIMEOUT = float(os.getenv('REPLICA_CHECK_TIMEOUT', 2))
+REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', 5))
+
+READ_AFTER_COOKIE = 'agendaapp_read_after'
+# Replicas catch up in milliseconds; the cookie only has to outlive a bad spell
+READ_AFTER_MAX_AGE = int(os.getenv('READ_AFTER_MAX_AGE', 300))
+
+
+def replica_hosts(value, default_port):
+    """[(host, port)] from 'host[:port],host[:port]'."""
+    hosts = []
+    for item in (value or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        host, _, port = item.partition(':')
+        hosts.append((host, int(port) if port else default_port))
+    return hosts
+
+
+def parse_lsn(text):
+    """'16/B374D848' -> int, comparable with other LSNs."""
+    high, low = text.split('/')
+    return int(high, 16) << 32 | int(low, 16)
+
+
+def read_after(cookie):
+    """Position from the READ_AFTER_COOKIE value, None when absent or invalid."""
+    try:
+        return int(cookie, 16) if cookie else None
+    except ValueError:
+        return None
+
+
+def read_after_cookie(position):
+    """(name, value, options) to set on the response to a write."""
+    return READ_AFTER_COOKIE, format(position, 'x'), {'max_age': READ_AFTER_MAX_AGE, 'httponly': True,
+                                                       'samesite': 'Lax'}
+
+
+# A replica as of its last check; position is None until it has one
+ReplicaStatus = namedtuple('ReplicaStatus', 'name position lag_seconds error')
+
+
+class ReplicaRouter:
+    """Last known state of every replica, and which one serves a read."""
+
+    def __init__(self, names, max_lag=REPLICA_MAX_LAG):
+        self.max_lag = max_lag
+        self._lock = threading.Lock()
+        self._status = {name: ReplicaStatus(name, None, None, "not checked yet") for name in names}
+        self._turn = itertools.count()
+        self._counters = {
+            "replica_reads": 0,
+            "primary_reads": 0,
+            "read_after_reads": 0,
+            "failovers": 0,
+        }
+
+    @property
+    def enabled(self):
+        return bool(self._status)
+
+    def update(self, name, position, lag_seconds):
+        with self._lock:
+            previous = self._status.get(name)
+            if previous is not None and previous.error is not None:
+                logger.info(f"Replica {name} is back (lag {lag_seconds:.3f}s)")
+            self._status[name] = ReplicaStatus(name, position, lag_seconds, None)
+        REPLICA_LAG.labels(name).set(lag_seconds)
+
+    def mark_down(self, name, error):
+        """No reads for this replica until its next successful check."""
+        with self._lock:
+            status = self._status.get(name, ReplicaStatus(name, None, None, None))
+            if status.error is None:
+                logger.warning(f"Replica {name} taken out of rotation: {error}")
+                self._counters["failovers"] += 1
+            self._status[name] = status._replace(error=str(error))
+
+    def choose(self, read_after=None):
+        """ReplicaStatus of the replica to read from, or None for the primary.
+
+        With read_after only replicas known to have reached that position
+        qualify; the status is a snapshot, so its position stays a lower
+        bound of what the read will see.
+        """
+        with self._lock:
+            usable = [status for status in self._status.values()
+                      if status.error is None and status.lag_seconds <= self.max_lag
+                      and (read_after is None or status.position >= read_after)]
+            if read_after is not None:
+                self._counters["read_after_reads"] += 1
+            if not usable:
+                self._counters["primary_reads"] += 1
+                return None
+            self._counters["replica_reads"] += 1
+            return usable[next(self._turn) % len(usable)]
+
+    def status(self):
+        with self._lock:
+            return list(self._status.values())
+
+    def stats(self):
+        """Numeric view for /metrics; per-replica lag is agendaapp_replica_lag_seconds."""
+        statuses = self.status()
+        healthy = [status for status in statuses if status.error is None]
+        with self._lock:
+            return {
+                "replicas": len(statuses),
+                "healthy": len(healthy),
+                "max_lag_seconds": max((status.lag_seconds for status in healthy), default=0),
+                **self._counters,
+            }
+
+
+class ReplicaMonitor:
+    """Runs check() periodically and feeds the results to a ReplicaRouter.
+
+    check returns {name: (position, lag_seconds) or the exception of that
+    replica} (or a coroutine of it with run_async).
+    """
+
+    def __init__(self, router, check, interval=REPLICA_CHECK_INTERVAL):
+        self.router = router
+        self._check = check
+        self.interval = interval
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="replica-monitor", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            self.run_once()
+            time.sleep(self.interval)
+
+    def run_once(self):
+        try:
+            self._record(self._check())
+        except Exception as e:
+            self._record({status.name: e for status in self.router.status()})
+
+    async def run_async(self):
+        """Coroutine counterpart of start(); run it as a background task."""
+        while True:
+            try:
+                self._record(await self._check())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._record({status.name: e for status in self.router.status()})
+            await asyncio.sleep(self.interval)
+
+    def _record(self, results):
+        for name, result in results.items():
+            if isinstance(result, Exception):
+                self.router.mark_down(name, result)
+            else:
+                self.router.update(name, *result)
+
+
+# ----------------------------------------------------------------------
+# PostgreSQL
+# ----------------------------------------------------------------------
+
+PG_PRIMARY_POSITION_SQL = "SELECT pg_current_wal_lsn()::text"
+
+# A server that is not in recovery (a promoted replica, or the primary
+# itself in development) is as current as it gets
+PG_REPLICA_POSITION_SQL = """
+    SELECT CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn() ELSE pg_current_wal_lsn() END::text,
+           COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)::float8
+"""
+
+
+def replica_lag(position, primary_position, replay_age):
+    """Seconds behind the primary: 0 once it has replayed everything.
+
+    The age of the last replayed transaction alone would grow while the
+    primary is idle, so it only counts when WAL is still missing.
+    """
+    return 0.0 if position >= primary_position else max(replay_age, 0.0)
+
+
+class PgReplicaCheck:
+    """check() for psycopg2; one dedicated connection per server, reopened after errors."""
+
+    def __init__(self, primary_connect, replica_connects, timeout=REPLICA_CHECK_TIMEOUT):
+        self._connects = {None: primary_connect, **replica_connects}
+        self._timeout = timeout
+        self._conns = {}
+
+    def _fetch(self, name, sql):
+        conn = self._conns.get(name)
+        try:
+            if conn is None or conn.closed:
+                ms = int(self._timeout * 1000)
+                conn = self._conns[name] = self._connects[name](connect_timeout=max(1, round(self._timeout)),
+                                                                options=f'-c statement_timeout={ms}')
+                conn.autocommit = True
+            cur = conn.cursor()
+            cur.execute(sql)
+            row = cur.fetchone()
+            cur.close()
+            return row
+        except Exception:
+            if conn is not None:
+                conn.close()
+                self._conns.pop(name, None)
+            raise
+
+    def __call__(self):
+        primary_position = parse_lsn(self._fetch(None, PG_PRIMARY_POSITION_SQL)[0])
+        results = {}
+        for name in self._connects:
+            if name is None:
+                continue
+            try:
+                lsn, replay_age = self._fetch(name, PG_REPLICA_POSITION_SQL)
+                position = parse_lsn(lsn)
+                results[name] = (position, replica_lag(position, primary_position, replay_age))
+            except Exception as e:
+                results[name] = e
+        return results
+
+
+class AsyncPgReplicaCheck:
+    """check() for asyncpg; connects are asyncpg.connect with each server's settings bound."""
+
+    def __init__(self, primary_connect, replica_connects, timeout=REPLICA_CHECK_TIMEOUT):
+        self._connects = {None: primary_connect, **replica_connects}
+        self._timeout = timeout
+        self._conns = {}
+
+    async def _fetch(self, name, sql):
+        conn = self._conns.get(name)
+        try:
+            if conn is None or conn.is_closed():
+                conn = self._conns[name] = await self._connects[name](timeout=self._timeout,
+                                                                      command_timeout=self._timeout)
+            return await conn.fetchrow(sql, timeout=self._timeout)
+        except Exception:
+            if conn is not None:
+                conn.terminate()
+                self._conns.pop(name, None)
+            raise
+
+    async def __call__(self):
+        primary_position = parse_lsn((await self._fetch(None, PG_PRIMARY_POSITION_SQL))[0])
+        results = {}
+        for name in self._connects:
+            if name is None:
+                continue
+            try:
+                lsn, replay_age = await self._fetch(name, PG_REPLICA_POSITION_SQL)
+                position = parse_lsn(lsn)
+                results[name] = (position, replica_lag(position, primary_position, replay_age))
+            except Exception as e:
+                results[name] = e
+        return results
+
+
+# ----------------------------------------------------------------------
+# MongoDB
+# ----------------------------------------------------------------------
+
+MONGO_READ_PREFERENCE = os.getenv('MONGO_READ_PREFERENCE', 'primary')
+
+
+def mongo_read_preference(mode=MONGO_READ_PREFERENCE):
+    """pymongo read preference for a mode name such as 'secondaryPreferred'."""
+    from pymongo.read_preferences import ReadPreference
+
+    modes = {
+        'primary': ReadPreference.PRIMARY,
+        'primaryPreferred': ReadPreference.PRIMARY_PREFERRED,
+        'secondary': ReadPreference.SECONDARY,
+        'secondaryPreferred': ReadPreference.SECONDARY_PREFERRED,
+        'nearest': ReadPreference.NEAREST,
+    }
+    if mode not in modes:
+        raise ValueError(f"Unknown MONGO_READ_PREFERENCE: {mode}")
+    return modes[mode]
+
+
+def mongo_position(timestamp):
+    """bson Timestamp (cluster time) -> int position; None stays None."""
+    return None if timestamp is None else timestamp.time << 32 | timestamp.inc
+
+
+def mongo_timestamp(position):
+    from bson.timestamp import Timestamp
+
+    return Timestamp(position >> 32, position & 0xFFFFFFFF)
+
+
+def mongo_replica_check(client):
+    """check() for pymongo (or motor's delegate): lag from the driver's heartbeats, no I/O.
+
+    The driver learns every member's last write time from its monitoring
+    connections; a secondary's lag is how far it is behind the primary's.
+    Positions are not needed: sessions make members wait (see above).
+    """
+    from pymongo.server_type import SERVER_TYPE
+
+    def check():
+        servers = client.topology_description.server_descriptions()
+        primary = next((server for server in servers.values() if server.server_type == SERVER_TYPE.RSPrimary),
+                       None)
+        results = {}
+        for (host, port), server in servers.items():
+            if server.server_type in (SERVER_TYPE.RSPrimary, SERVER_TYPE.RSArbiter):
+                continue
+            name = f"{host}:{port}"
+            if server.server_type != SERVER_TYPE.RSSecondary or server.last_write_date is None:
+                results[name] = RuntimeError(f"not a readable secondary ({server.server_type_name})")
+            elif primary is None or primary.last_write_date is None:
+                results[name] = (None, 0.0)
+            else:
+                lag = (primary.last_write_date - server.last_write_date).total_seconds()
+                results[name] = (None, max(lag, 0.0))
+        return results
+    return check
@@ -0,0 +1,39 @@
+"""PostgreSQL schema checks shared by app_postgres.py and app_async_postgres.py.
+
+The schema lives in migrations/ and is applied by migrate.py, once per
+deploy. At startup an app only runs PG_SCHEMA_CHECK_SQL: it refuses to
+start while a required migration is missing, and learns whether the
+optional trigram index is there.
+"""
+from migrate import load_migrations, required_versions
+
+REQUIRED_VERSIONS = required_versions(load_migrations())
+
+# Fails with undefined_table until migrate.py has run once
+PG_SCHEMA_CHECK_SQL = '''
+    SELECT (SELECT array_agg(version) FROM schema_migrations) AS versions,
+           EXISTS (SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                   WHERE c.relname = 'idx_tasks_title_trgm' AND i.indisvalid) AS trigram
+'''
+
+
+class SchemaOutdated(Exception):
+    """The database lacks migrations this code needs."""
+
+
+def check_schema_versions(versions):
+    """Raise SchemaOutdated unless every required version is in versions."""
+    missing = REQUIRED_VERSIONS - set(versions or ())
+    if missing:
+        raise SchemaOutdated(f"Database schema is missing migration(s) {', '.join(map(str, sorted(missing)))};"
+                             f" run python migrate.py first")
+
+
+# Run before serving: pulls the upper levels of the hot indexes into
+# shared_buffers so the first requests don't pay for the disk reads
+PG_WARMUP_SQL = [
+    "SELECT owner_id, version FROM owner_counters ORDER BY owner_id LIMIT 100",
+    "SELECT id FROM tasks WHERE NOT archived ORDER BY owner_id, created_at DESC, id DESC LIMIT 100",
+    "SELECT due_date FROM tasks WHERE NOT archived AND NOT done ORDER BY owner_id, due_date LIMIT 100",
+    "SELECT task_id FROM task_changes ORDER BY owner_id, version, task_id LIMIT 100",
+]
@@ -0,0 +1,145 @@
+"""Title search for GET /tasks/search, shared by every backend.
+
+    GET /tasks/search?q=dentist&limit=20            ranked matches, paginated
+    GET /tasks/search?q=dent&mode=autocomplete      ids and titles only
+
+PostgreSQL: full-text search over an expression GIN index on
+to_tsvector('simple', title), ranked with ts_rank. When migration 0003
+could create the pg_trgm extension, a trigram index also catches typos and partial
+words ('dentst') and similarity() is added to the rank; without it search
+is full-text only. Autocomplete turns the last word into a prefix query
+('dent:*') on the same full-text index.
+
+MongoDB: a text index on title ranked by textScore; autocomplete is an
+anchored case-insensitive regex on title.
+
+Only hot tasks are searched; archived ones (archive.py) are left out.
+Searches only match the caller's tasks (owners.py): in MongoDB both
+indexes lead with owner_id.
+
+Ranked pages are deep-linked with an offset cursor: every match has to be
+ranked before the first page anyway, so keyset buys nothing here.
+"""
+import os
+import re
+
+from pagination import encode_cursor, decode_cursor
+
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', 20))
+SEARCH_PAGE_MAX = int(os.getenv('SEARCH_PAGE_MAX', 100))
+AUTOCOMPLETE_SIZE = int(os.getenv('AUTOCOMPLETE_SIZE', 10))
+MAX_QUERY_LENGTH = 200
+SEARCH_MODES = ('full', 'autocomplete')
+
+# 'simple': no stemming, titles are written in more than one language
+PG_TSVECTOR = "to_tsvector('simple', title)"
+
+_WORD = re.compile(r'\w+')
+
+
+def parse_search_args(args):
+    """Validate the query string of GET /tasks/search.
+
+    Returns a dict with q, mode, limit and offset. Raises ValueError with a
+    message suitable for a 400 response.
+    """
+    q = (args.get('q') or '').strip()
+    if not q:
+        raise ValueError("'q' is required")
+    if len(q) > MAX_QUERY_LENGTH:
+        raise ValueError(f"'q' must be at most {MAX_QUERY_LENGTH} characters")
+
+    mode = args.get('mode', 'full')
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"'mode' must be one of: {', '.join(SEARCH_MODES)}")
+
+    default = AUTOCOMPLETE_SIZE if mode == 'autocomplete' else SEARCH_PAGE_SIZE
+    try:
+        limit = int(args.get('limit', default))
+    except ValueError:
+        raise ValueError("'limit' must be an integer")
+    if limit < 1:
+        raise ValueError("'limit' must be positive")
+
+    offset = 0
+    if args.get('cursor'):
+        offset, = decode_cursor(args['cursor'], 1)
+        if not isinstance(offset, int) or offset < 0:
+            raise ValueError("Invalid cursor")
+
+    return {'q': q, 'mode': mode, 'limit': min(limit, SEARCH_PAGE_MAX), 'offset': offset}
+
+
+def next_search_cursor(params, returned):
+    """Cursor for the page after this one, or None. returned may hold limit + 1 rows."""
+    if returned > params['limit']:
+        return encode_cursor(params['offset'] + params['limit'])
+    return None
+
+
+def prefix_tsquery(q):
+    """'buy mil' -> "buy & mil:*" for to_tsquery; raises ValueError without words."""
+    words = _WORD.findall(q.lower())
+    if not words:
+        raise ValueError("'q' must contain at least one letter or digit")
+    return ' & '.join(words[:-1] + [words[-1] + ':*'])
+
+
+# ----------------------------------------------------------------------
+# PostgreSQL
+# ----------------------------------------------------------------------
+
+def pg_search_query(ph, trigram):
+    """Ranked search; ph maps owner, q, limit and offset to placeholders.
+
+    Fetch limit + 1 rows to know whether there is a next page.
+    """
+    query = f"websearch_to_tsquery('simple', {ph['q']})"
+    match = f"{PG_TSVECTOR} @@ {query}"
+    rank = f"ts_rank({PG_TSVECTOR}, {query})"
+    if trigram:
+        # pg_trgm's similarity operator is '%', which psycopg2 wants doubled
+        operator = '%%' if '%' in ph['q'] else '%'
+        match = f"({match} OR lower(title) {operator} lower({ph['q']}))"
+        rank = f"{rank} + similarity(lower(title), lower({ph['q']}))"
+    return f'''
+        SELECT id, title, done, due_date, created_at, updated_at, {rank} AS rank
+        FROM tasks
+        WHERE NOT archived AND owner_id = {ph['owner']} AND {match}
+        ORDER BY rank DESC, created_at DESC, id DESC
+        LIMIT {ph['limit']} OFFSET {ph['offset']}
+    '''
+
+
+def pg_autocomplete_query(ph):
+    """ids and titles matching prefix_tsquery(); shortest titles first."""
+    return f'''
+        SELECT id, title FROM tasks
+        WHERE NOT archived AND owner_id = {ph['owner']} AND {PG_TSVECTOR} @@ to_tsquery('simple', {ph['prefix']})
+        ORDER BY length(title), id
+        LIMIT {ph['limit']}
+    '''
+
+
+# ----------------------------------------------------------------------
+# MongoDB
+# ----------------------------------------------------------------------
+
+# (keys, options) for create_index. Only one text index per collection;
+# language 'none' means no stemming or stop words. $text needs an equality
+# match on the owner_id prefix, which every search has
+MONGO_SEARCH_INDEXES = [
+    ([("owner_id", 1), ("title", "text")], {"name": "owner_id_1_title_text", "default_language": "none"}),
+    ([("owner_id", 1), ("title", 1)], {"name": "owner_id_1_title_1"}),
+]
+
+
+def mongo_search_find(params, owner):
+    """(filter, projection, sort) for a ranked page; skip/limit come from params."""
+    return ({"owner_id": owner, "$text": {"$search": params['q']}},
+            {"rank": {"$meta": "textScore"}},
+            [("rank", {"$meta": "textScore"}), ("_id", -1)])
+
+
+def mongo_autocomplete_filter(q, owner):
+    return {"owner_id": owner, "title": {"$regex": "^" + re.escape(q), "$options": "i"}}
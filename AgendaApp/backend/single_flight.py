@@ -0,0 +1,141 @@
+"""Request coalescing ("single flight") for identical concurrent reads.
+
+When many clients open the app together, dozens of identical GET /tasks
+and GET /stats arrive within milliseconds, all miss the read cache and all
+run the same queries. With single flight the first of them (the leader)
+runs the load and the others wait for its result; an exception raised by
+the leader is raised in every waiter too. A waiter gives up after
+SINGLE_FLIGHT_WAIT seconds and loads on its own, so one stuck query can't
+hold everyone.
+
+This is not a cache: nothing is kept once a flight lands, the next request
+starts a new one (the ReadCache in read_cache.py is what keeps results).
+Routes put the read cache generation in the key, so a read that starts
+after a write never joins a flight that may have read the data before it.
+"""
+import asyncio
+import os
+import threading
+
+SINGLE_FLIGHT_ENABLED = os.getenv('SINGLE_FLIGHT_ENABLED', 'true').lower() == 'true'
+SINGLE_FLIGHT_WAIT = float(os.getenv('SINGLE_FLIGHT_WAIT', 5))
+
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error', 'landed')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.landed = False   # False when the leader died without an outcome
+
+
+class _FlightGroup:
+    def __init__(self, enabled, wait):
+        self.enabled = enabled
+        self.wait = wait
+        self._flights = {}    # key -> flight in progress
+        self._counters = {
+            "leaders": 0,
+            "shared": 0,
+            "timeouts": 0,
+            "errors": 0,
+        }
+
+    def stats(self):
+        return {"enabled": self.enabled, "wait": self.wait, "in_flight": len(self._flights), **self._counters}
+
+
+class SingleFlight(_FlightGroup):
+    """Single flight for threads (and gevent greenlets)."""
+
+    def __init__(self, wait=SINGLE_FLIGHT_WAIT, enabled=SINGLE_FLIGHT_ENABLED):
+        super().__init__(enabled, wait)
+        self._lock = threading.Lock()
+
+    def do(self, key, load):
+        """load() once for every concurrent caller with the same key."""
+        if not self.enabled:
+            return load()
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self._counters["leaders"] += 1
+            else:
+                self._counters["shared"] += 1
+        if leader:
+            return self._lead(key, flight, load)
+
+        if not flight.done.wait(self.wait):
+            with self._lock:
+                self._counters["timeouts"] += 1
+            return load()
+        if not flight.landed:
+            return load()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def _lead(self, key, flight, load):
+        try:
+            flight.result = load()
+            flight.landed = True
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            flight.landed = True
+            with self._lock:
+                self._counters["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+
+class AsyncSingleFlight(_FlightGroup):
+    """SingleFlight for coroutines; load is a coroutine function."""
+
+    def __init__(self, wait=SINGLE_FLIGHT_WAIT, enabled=SINGLE_FLIGHT_ENABLED):
+        super().__init__(enabled, wait)
+
+    async def do(self, key, load):
+        if not self.enabled:
+            return await load()
+        flight = self._flights.get(key)
+        if flight is None:
+            return await self._lead(key, load)
+
+        self._counters["shared"] += 1
+        try:
+            # shield: a waiter timing out or going away must not cancel the leader
+            return await asyncio.wait_for(asyncio.shield(flight), self.wait)
+        except asyncio.TimeoutError:
+            self._counters["timeouts"] += 1
+        except asyncio.CancelledError:
+            # The leader was cancelled (its client went away), not us
+            if not flight.cancelled():
+                raise
+        return await load()
+
+    async def _lead(self, key, load):
+        flight = self._flights[key] = asyncio.get_running_loop().create_future()
+        self._counters["leaders"] += 1
+        try:
+            result = await load()
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except Exception as e:
+            self._counters["errors"] += 1
+            flight.set_exception(e)
+            flight.exception()  # retrieved: no "never retrieved" warning without waiters
+            raise
+        else:
+            flight.set_result(result)
+            return result
+        finally:
+            del self._flights[key]
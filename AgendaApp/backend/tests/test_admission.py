@@ -0,0 +1,177 @@
+import pytest
+import sys
+import os
+import asyncio
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import admission
+import metrics
+from types import SimpleNamespace
+from admission import (AdmissionController, ConcurrencyLimiter, AsyncConcurrencyLimiter, request_class,
+                       ADMISSION_MIN_LIMIT, ADMISSION_MAX_LIMIT)
+
+
+def test_request_classes():
+    assert request_class('GET', '/tasks') == 'read'
+    assert request_class('HEAD', '/stats') == 'read'
+    assert request_class('POST', '/tasks/batch') == 'write'
+    assert request_class('DELETE', '/tasks/abc') == 'write'
+    for path in ('/livez', '/readyz', '/metrics', '/tasks/changes/stream'):
+        assert request_class('GET', path) is None
+    assert request_class('OPTIONS', '/tasks') is None
+
+
+def test_limiter_queues_then_sheds():
+    limiter = ConcurrencyLimiter(2, queue_size=1, queue_timeout=5)
+    assert limiter.acquire() and limiter.acquire()
+
+    # The third waits in the queue and gets the slot released by the first
+    admitted = []
+    waiter = threading.Thread(target=lambda: admitted.append(limiter.acquire()))
+    waiter.start()
+    while not limiter.waiting:
+        threading.Event().wait(0.001)
+    # Queue full: shed at once
+    assert limiter.acquire() is False
+    limiter.release()
+    waiter.join(5)
+    assert admitted == [True]
+    assert limiter.stats() == {'limit': 2, 'in_flight': 2, 'waiting': 0,
+                               'admitted': 3, 'queued': 1, 'rejected': 1, 'timeouts': 0}
+
+
+def test_limiter_wait_is_bounded():
+    limiter = ConcurrencyLimiter(1, queue_size=5, queue_timeout=0.02)
+    assert limiter.acquire()
+    assert limiter.acquire() is False
+    assert limiter.stats()['timeouts'] == 1
+    limiter.release()
+    assert limiter.acquire()
+
+
+def test_limits_follow_db_latency():
+    now = [0.0]
+    controller = AdmissionController(read_limit=16, write_limit=8, target_latency=0.05, interval=1,
+                                     clock=lambda: now[0])
+    read = controller.limiters['read']
+
+    # Slow database: every limit is cut, down to the minimum
+    for _ in range(20):
+        controller.observe(0.2)
+        now[0] += 1
+        controller.observe(0.2)
+    assert read.limit == ADMISSION_MIN_LIMIT
+    assert controller.limiters['write'].limit == ADMISSION_MIN_LIMIT
+
+    # Fast again: only limits that were reached grow back, one step per interval
+    read.saturated = True
+    now[0] += 1
+    controller.observe(0.001)
+    assert read.limit == ADMISSION_MIN_LIMIT + 1
+    assert controller.limiters['write'].limit == ADMISSION_MIN_LIMIT
+    now[0] += 1
+    controller.observe(0.001)
+    assert read.limit == ADMISSION_MIN_LIMIT + 1
+
+    read.set_limit(ADMISSION_MAX_LIMIT)
+    read.saturated = True
+    now[0] += 1
+    controller.observe(0.001)
+    assert read.limit == ADMISSION_MAX_LIMIT
+    assert controller.stats()['read_limit'] == ADMISSION_MAX_LIMIT
+
+
+def test_background_db_calls_leave_the_limits_alone(monkeypatch):
+    """Only DB calls made by a request count as latency"""
+    now = [0.0]
+    controller = AdmissionController(read_limit=16, write_limit=8, target_latency=0.05, interval=1,
+                                     clock=lambda: now[0])
+    monkeypatch.setattr(metrics, '_db_observers', [controller.observe])
+
+    # An idle pod: listeners and jobs make slow calls, no request is in flight
+    for _ in range(5):
+        metrics.observe_db('getMore', 1.0)
+        now[0] += 1
+    assert controller.limiters['read'].limit == 16 and controller.limiters['write'].limit == 8
+
+    # A change stream waiting for events inside a request is not latency either
+    timer = metrics.mongo_command_timer()
+    def command(name, request_id, body, reply=None, seconds=0.001):
+        timer.started(SimpleNamespace(command_name=name, request_id=request_id, command=body))
+        timer.succeeded(SimpleNamespace(command_name=name, request_id=request_id, reply=reply or {},
+                                        duration_micros=int(seconds * 1e6)))
+    with metrics.count_roundtrips() as roundtrips:
+        command('aggregate', 1, {'pipeline': [{'$changeStream': {}}]}, {'cursor': {'id': 42}})
+        for request_id in range(2, 6):
+            command('getMore', request_id, {'getMore': 42}, {'cursor': {'id': 42}}, seconds=1.0)
+            now[0] += 1
+    assert roundtrips[0] == 5
+    assert controller.limiters['read'].limit == 16
+
+    # Slow calls made by requests still cut the limits
+    with metrics.count_roundtrips():
+        metrics.observe_db('execute', 0.2)
+        now[0] += 1
+        metrics.observe_db('execute', 0.2)
+    assert controller.limiters['read'].limit < 16
+
+
+def test_disabled_controller_limits_nothing():
+    controller = AdmissionController(enabled=False)
+    assert controller.limiter('GET', '/tasks') is None
+
+
+def test_async_limiter_hands_slots_over_in_order():
+    async def scenario():
+        limiter = AsyncConcurrencyLimiter(1, queue_size=2, queue_timeout=1)
+        assert await limiter.acquire()
+        order = []
+
+        async def wait(name):
+            if await limiter.acquire():
+                order.append(name)
+
+        waiters = [asyncio.create_task(wait('a')), asyncio.create_task(wait('b'))]
+        await asyncio.sleep(0.01)
+        assert await limiter.acquire() is False   # queue full
+        limiter.release()
+        await asyncio.sleep(0.01)
+        assert order == ['a'] and limiter.in_flight == 1
+        limiter.release()
+        await asyncio.gather(*waiters)
+        assert order == ['a', 'b']
+        limiter.release()
+        assert limiter.in_flight == 0
+
+        # A lowered limit makes requests wait; raising it lets them in without a release
+        limiter.set_limit(0)
+        limiter.queue_timeout = 0.02
+        assert await limiter.acquire() is False
+        assert limiter.stats()['timeouts'] == 1
+        limiter.queue_timeout = 1
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0.01)
+        limiter.set_limit(1)
+        assert await waiter is True
+    asyncio.run(scenario())
+
+
+def test_flask_sheds_with_503_and_retry_after():
+    from flask import Flask
+    app = Flask(__name__)
+    controller = AdmissionController(read_limit=0)
+    controller.limiters['read'].queue_timeout = 0.01
+    admission.install_flask(app, controller)
+    app.add_url_rule('/tasks', 'tasks', lambda: 'ok')
+    app.add_url_rule('/livez', 'livez', lambda: 'alive')
+    app.add_url_rule('/tasks', 'create', lambda: ('created', 201), methods=['POST'])
+
+    with app.test_client() as client:
+        response = client.get('/tasks')
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
+        assert client.get('/livez').status_code == 200
+        assert client.post('/tasks').status_code == 201
+    assert controller.limiters['write'].in_flight == 0
@@ -4,7 +4,7 @@ import os
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app import app
+from app import app, readiness, ROUNDTRIP_BUDGETS
 import json
 
 
@@ -26,6 +26,18 @@ def test_health_endpoint(client):
     assert 'timestamp' in data
 
 
+def test_probes(client):
+    """/livez no toca MongoDB; /readyz devuelve la última comprobación"""
+    response = client.get('/livez')
+    assert response.status_code == 200
+    assert response.headers['X-DB-Roundtrips'] == '0'
+
+    readiness.run_once()
+    response = client.get('/readyz')
+    assert response.status_code == 200
+    assert json.loads(response.data)['status'] == 'ready'
+
+
 def test_get_tasks_endpoint(client):
     """Test the tasks endpoint returns valid JSON"""
     response = client.get('/tasks')
@@ -118,4 +130,343 @@ def test_delete_nonexistent_task(client):
     assert response.status_code == 404
     
     data = json.loads(response.data)
-    assert data['success'] is False
\ No newline at end of file
+    assert data['success'] is False
+
+def test_get_tasks_pagination(client):
+    """Test cursor pagination over the task list"""
+    created = []
+    for i in range(3):
+        response = client.post('/tasks',
+                              data=json.dumps({'title': f'Page task {i}'}),
+                              content_type='application/json')
+        created.append(json.loads(response.data)['task']['_id'])
+
+    response = client.get('/tasks?limit=2')
+    data = json.loads(response.data)
+    assert len(data['tasks']) == 2
+    assert data['next'] is not None
+
+    response = client.get(f"/tasks?limit=2&cursor={data['next']}")
+    assert response.status_code == 200
+    page_ids = [task['_id'] for task in json.loads(response.data)['tasks']]
+    assert not set(page_ids) & {task['_id'] for task in data['tasks']}
+
+    for task_id in created:
+        client.delete(f'/tasks/{task_id}')
+
+
+def test_get_tasks_invalid_cursor(client):
+    """Test that a malformed cursor is rejected"""
+    response = client.get('/tasks?cursor=not-a-cursor')
+    assert response.status_code == 400
+
+
+def test_export_tasks_ndjson(client):
+    """Test the streaming NDJSON export"""
+    response = client.post('/tasks',
+                          data=json.dumps({'title': 'Export task'}),
+                          content_type='application/json')
+    task_id = json.loads(response.data)['task']['_id']
+
+    response = client.get('/tasks/export?format=ndjson')
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert task_id in [row['_id'] for row in rows]
+
+    response = client.get('/tasks/export?format=xml')
+    assert response.status_code == 400
+
+    client.delete(f'/tasks/{task_id}')
+
+
+def test_batch_tasks(client):
+    """Test mixed create/update/delete operations in one batch"""
+    response = client.post('/tasks/batch',
+                          data=json.dumps({'operations': [
+                              {'op': 'create', 'title': 'Batch task'},
+                              {'op': 'delete', 'id': '507f1f77bcf86cd799439011'},
+                          ]}),
+                          content_type='application/json')
+    assert response.status_code == 200
+
+    data = json.loads(response.data)
+    assert [r['status'] for r in data['results']] == [201, 404]
+    task_id = data['results'][0]['task']['_id']
+
+    response = client.post('/tasks/batch',
+                          data=json.dumps({'operations': [
+                              {'op': 'update', 'id': task_id, 'done': True},
+                          ]}),
+                          content_type='application/json')
+    data = json.loads(response.data)
+    assert data['results'][0]['task']['done'] is True
+
+    client.delete(f'/tasks/{task_id}')
+
+
+def test_stats_follow_mutations(client):
+    """Test that stats counters are updated on create, toggle and delete"""
+    before = json.loads(client.get('/stats').data)['stats']
+
+    response = client.post('/tasks',
+                          data=json.dumps({'title': 'Counted task'}),
+                          content_type='application/json')
+    task_id = json.loads(response.data)['task']['_id']
+    client.put(f'/tasks/{task_id}',
+               data=json.dumps({'done': True}),
+               content_type='application/json')
+
+    stats = json.loads(client.get('/stats').data)['stats']
+    assert stats['total'] == before['total'] + 1
+    assert stats['completed'] == before['completed'] + 1
+
+    client.delete(f'/tasks/{task_id}')
+    assert json.loads(client.get('/stats').data)['stats'] == before
+
+    response = client.post('/stats/reconcile')
+    assert response.status_code == 200
+    assert json.loads(response.data)['after'] == before
+
+
+def test_conditional_get(client):
+    """Test ETag / If-None-Match on the task list and stats"""
+    response = client.get('/tasks')
+    etag = response.headers['ETag']
+
+    response = client.get('/tasks', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+    response = client.post('/tasks',
+                          data=json.dumps({'title': 'ETag task'}),
+                          content_type='application/json')
+    task_id = json.loads(response.data)['task']['_id']
+
+    response = client.get('/tasks', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+
+    response = client.get(f'/tasks/{task_id}')
+    assert response.status_code == 200
+    response = client.get(f'/tasks/{task_id}', headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+
+    client.delete(f'/tasks/{task_id}')
+
+
+def test_metrics_endpoint(client):
+    """Test /metrics exposes per-route request counters"""
+    client.get('/stats')
+    
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    
+    body = response.data.decode()
+    assert 'agendaapp_http_requests_total{method="GET",route="get_stats",status="200"}' in body
+    assert 'agendaapp_http_requests_in_flight' in body
+
+
+def test_routes_stay_within_roundtrip_budget(client):
+    """Test each route stays within its MongoDB round-trip budget"""
+    def check(response, route):
+        count = int(response.headers['X-DB-Roundtrips'])
+        assert count <= ROUNDTRIP_BUDGETS[route], f"{route} made {count} round trips"
+        return response
+
+    response = check(client.post('/tasks', json={'title': 'Budget task'}), 'create_task')
+    task_id = json.loads(response.data)['task']['_id']
+
+    check(client.get('/tasks?limit=5'), 'get_all_tasks')
+    check(client.get(f'/tasks/{task_id}'), 'get_task')
+    check(client.get('/stats'), 'get_stats')
+    check(client.put(f'/tasks/{task_id}', json={'done': True}), 'update_task')
+    check(client.delete(f'/tasks/{task_id}'), 'delete_task')
+
+
+def test_group_commit_creates(client, monkeypatch):
+    """Test grouped creates return their own task and keep the counters right"""
+    import app as mongo_app
+    from group_commit import GroupCommitter
+    monkeypatch.setattr(mongo_app, 'task_committer', GroupCommitter(mongo_app.insertar_tareas, window_ms=20))
+
+    before = json.loads(client.get('/stats').data)['stats']
+    response = client.post('/tasks', json={'title': 'Grouped task', 'done': True})
+    assert response.status_code == 201
+    task = json.loads(response.data)['task']
+    assert task['title'] == 'Grouped task'
+
+    after = json.loads(client.get('/stats').data)['stats']
+    assert after['total'] == before['total'] + 1
+    assert after['completed'] == before['completed'] + 1
+    client.delete(f"/tasks/{task['_id']}")
+
+
+def test_search_autocomplete_and_validation(client):
+    """Test autocomplete returns only ids and titles; bad queries are rejected"""
+    response = client.post('/tasks', json={'title': 'Zqx autocomplete target'})
+    task_id = json.loads(response.data)['task']['_id']
+
+    response = client.get('/tasks/search?q=zqx+auto&mode=autocomplete')
+    assert response.status_code == 200
+    assert json.loads(response.data)['tasks'] == [{'_id': task_id, 'title': 'Zqx autocomplete target'}]
+
+    assert client.get('/tasks/search').status_code == 400
+    assert client.get('/tasks/search?q=x&limit=0').status_code == 400
+    client.delete(f'/tasks/{task_id}')
+
+
+def test_agenda_and_due_date(client):
+    """Test due_date is stored and /agenda groups open tasks by day"""
+    response = client.post('/tasks', json={'title': 'Agenda task', 'due_date': '2041-02-03'})
+    task = json.loads(response.data)['task']
+    assert task['due_date'] == '2041-02-03'
+
+    data = json.loads(client.get('/agenda?from=2041-02-01&to=2041-02-07').data)
+    assert data['success'] is True
+    assert [day['date'] for day in data['days']] == ['2041-02-03']
+    assert [t['_id'] for t in data['days'][0]['tasks']] == [task['_id']]
+
+    client.put(f"/tasks/{task['_id']}", json={'done': True})
+    data = json.loads(client.get('/agenda?from=2041-02-01&to=2041-02-07').data)
+    assert data['days'] == []
+
+    assert client.get('/agenda?to=not-a-date').status_code == 400
+    client.delete(f"/tasks/{task['_id']}")
+
+
+def test_archive_and_restore(client):
+    """Test old completed tasks move to the archive and come back on write"""
+    from datetime import datetime, timedelta
+    from bson import ObjectId
+    import app as app_module
+
+    before = json.loads(client.get('/stats').data)['stats']
+    task = json.loads(client.post('/tasks', json={'title': 'Archivada', 'done': True}).data)['task']
+    app_module.tasks_collection.update_one({'_id': ObjectId(task['_id'])},
+                                           {'$set': {'updated_at': datetime.now() - timedelta(days=90)}})
+
+    assert json.loads(client.post('/tasks/archive').data)['archived'] == 1
+    assert app_module.archive_collection.count_documents({'_id': ObjectId(task['_id'])}) == 1
+    hot = json.loads(client.get('/tasks?limit=200').data)['tasks']
+    assert task['_id'] not in [t['_id'] for t in hot]
+    everything = json.loads(client.get('/tasks?limit=200&include_archived=true').data)['tasks']
+    assert task['_id'] in [t['_id'] for t in everything]
+    assert client.get(f"/tasks/{task['_id']}").status_code == 200
+    assert json.loads(client.get('/stats').data)['stats']['total'] == before['total'] + 1
+
+    response = client.put(f"/tasks/{task['_id']}", json={'title': 'De vuelta'})
+    assert response.status_code == 200
+    assert app_module.archive_collection.count_documents({}) == 0
+    client.delete(f"/tasks/{task['_id']}")
+    assert json.loads(client.get('/stats').data)['stats'] == before
+
+
+def test_archive_keeps_tasks_written_meanwhile(client, monkeypatch):
+    """Test a task written between the copy and the removal stays in tasks only"""
+    from datetime import datetime, timedelta
+    from bson import ObjectId
+    import app as app_module
+
+    tasks = [json.loads(client.post('/tasks', json={'title': f'Vieja {i}', 'done': True}).data)['task']
+             for i in range(2)]
+    ids = [ObjectId(task['_id']) for task in tasks]
+    app_module.tasks_collection.update_many({'_id': {'$in': ids}},
+                                            {'$set': {'updated_at': datetime.now() - timedelta(days=90)}})
+
+    bulk_write = app_module.tasks_collection.bulk_write
+    def written_meanwhile(operations, **options):
+        app_module.tasks_collection.update_one({'_id': ids[0]}, {'$set': {'updated_at': datetime.now()}})
+        return bulk_write(operations, **options)
+    monkeypatch.setattr(app_module.tasks_collection, 'bulk_write', written_meanwhile)
+
+    assert json.loads(client.post('/tasks/archive').data)['archived'] == 1
+    assert app_module.tasks_collection.count_documents({'_id': {'$in': ids}}) == 1
+    assert [t['_id'] for t in app_module.archive_collection.find({'_id': {'$in': ids}})] == [ids[1]]
+    for task in tasks:
+        client.delete(f"/tasks/{task['_id']}")
+
+
+def test_archive_keeps_done_tasks_per_owner(client):
+    """Test ARCHIVE_KEEP_DONE acota las completadas de cada dueño, no las de todos"""
+    import app as app_module
+    from archive import mongo_archive
+
+    ocupado, tranquilo = {'X-Owner-Id': 'keep-ocupado'}, {'X-Owner-Id': 'keep-tranquilo'}
+    tareas = [(ocupado, json.loads(client.post('/tasks', json={'title': f'Hecha {i}', 'done': True},
+                                               headers=ocupado).data)['task']) for i in range(3)]
+    tareas.append((tranquilo, json.loads(client.post('/tasks', json={'title': 'Hecha', 'done': True},
+                                                     headers=tranquilo).data)['task']))
+
+    mongo_archive(app_module.tasks_collection, app_module.archive_collection, app_module.stats_collection,
+                  after_days=3650, keep_done=1)
+    assert app_module.tasks_collection.count_documents({'owner_id': 'keep-ocupado'}) == 1
+    assert app_module.tasks_collection.count_documents({'owner_id': 'keep-tranquilo'}) == 1
+    for owner, tarea in tareas:
+        client.delete(f"/tasks/{tarea['_id']}", headers=owner)
+
+
+def test_owners_and_tasks_written_before_them(client):
+    """Test each owner sees its own tasks; tasks without owner_id go to the default owner"""
+    from datetime import datetime
+    import app as app_module
+    from owners import mongo_backfill
+    from counters import mongo_reconcile
+
+    before = json.loads(client.get('/stats').data)['stats']
+    legacy = app_module.tasks_collection.insert_one({'title': 'Sin dueño', 'done': False,
+                                                     'created_at': datetime.now(), 'updated_at': datetime.now()})
+    assert mongo_backfill(app_module.tasks_collection) == 1
+    mongo_reconcile(app_module.tasks_collection, app_module.stats_collection, app_module.archive_collection)
+    app_module.read_cache.invalidate_all()
+    assert json.loads(client.get('/stats').data)['stats']['total'] == before['total'] + 1
+    assert client.get(f'/tasks/{legacy.inserted_id}').status_code == 200
+
+    ana = {'X-Owner-Id': 'equipo-ana'}
+    task = json.loads(client.post('/tasks', json={'title': 'De Ana'}, headers=ana).data)['task']
+    assert [t['_id'] for t in json.loads(client.get('/tasks', headers=ana).data)['tasks']] == [task['_id']]
+    assert json.loads(client.get('/stats', headers=ana).data)['stats']['total'] == 1
+    assert client.get(f'/tasks/{legacy.inserted_id}', headers=ana).status_code == 404
+    assert client.delete(f"/tasks/{task['_id']}").status_code == 404
+
+    client.delete(f"/tasks/{task['_id']}", headers=ana)
+    client.delete(f'/tasks/{legacy.inserted_id}')
+    assert json.loads(client.get('/stats').data)['stats'] == before
+
+
+def test_wire_formats_and_compression(client):
+    """Test the columnar layout and MessagePack carry the same list as JSON, compressed on request"""
+    import gzip
+    from wire_format import WIRE_COLUMNS, WIRE_MSGPACK, WIRE_FORMATS, columns
+
+    equipo = {'X-Owner-Id': 'equipo-formatos'}
+    for i in range(15):
+        client.post('/tasks', json={'title': f'Tarea comprimible {i}'}, headers=equipo)
+
+    plain = json.loads(client.get('/tasks?limit=50', headers=equipo).data)
+    response = client.get('/tasks?limit=50', headers={**equipo, 'Accept': WIRE_COLUMNS, 'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.mimetype == WIRE_COLUMNS
+    data = json.loads(gzip.decompress(response.data))
+    assert data == {**plain, 'tasks': columns(plain['tasks'])}
+
+    if WIRE_MSGPACK in WIRE_FORMATS:
+        import msgpack
+        response = client.get('/tasks?limit=50', headers={**equipo, 'Accept': WIRE_MSGPACK})
+        assert msgpack.unpackb(response.data) == plain
+
+    for task_id in data['tasks']['_id']:
+        client.delete(f'/tasks/{task_id}', headers=equipo)
+
+
+def test_database_info_only_shows_the_callers_tasks(client, monkeypatch):
+    """Test /database/info samples and counts only the caller's tasks"""
+    import app as app_module
+    # mongomock no implementa dbstats ni collstats
+    monkeypatch.setattr(app_module.db, 'command', lambda *args: {'dataSize': 0, 'size': 0, 'count': 99})
+
+    otro = {'X-Owner-Id': 'equipo-info'}
+    task = json.loads(client.post('/tasks', json={'title': 'Solo mía'}, headers=otro).data)['task']
+    data = json.loads(client.get('/database/info', headers=otro).data)
+    assert [t['_id'] for t in data['sample_tasks']] == [task['_id']]
+    assert data['stats']['total'] == 1
+    assert 'count' not in data['database_info']['tasks_collection']
+    assert client.get('/database/info', headers={'X-Owner-Id': 'no valido!'}).status_code == 400
+    client.delete(f"/tasks/{task['_id']}", headers=otro)
@@ -0,0 +1,113 @@
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from starlette.testclient import TestClient
+
+from app_async import app
+
+
+@pytest.fixture(scope='module')
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+def test_health_endpoint(client):
+    response = client.get('/health')
+    assert response.status_code == 200
+
+    data = response.json()
+    assert data['status'] == 'healthy'
+    assert 'service' in data
+
+
+def test_task_lifecycle(client):
+    response = client.post('/tasks', json={'title': '  Tarea async  '})
+    assert response.status_code == 201
+    task = response.json()['task']
+    assert task['title'] == 'Tarea async'
+
+    response = client.put(f"/tasks/{task['_id']}", json={'done': True})
+    assert response.status_code == 200
+    assert response.json()['task']['done'] is True
+
+    response = client.get(f"/tasks/{task['_id']}")
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert client.get(f"/tasks/{task['_id']}", headers={'If-None-Match': etag}).status_code == 304
+
+    assert client.delete(f"/tasks/{task['_id']}").status_code == 200
+    assert client.delete(f"/tasks/{task['_id']}").status_code == 404
+    assert client.get('/tasks/no-es-un-id').status_code == 404
+
+
+def test_pagination_and_stats(client):
+    before = client.get('/stats').json()['stats']
+    ids = [client.post('/tasks', json={'title': f'Página {i}', 'done': i == 0}).json()['task']['_id']
+           for i in range(3)]
+
+    data = client.get('/tasks', params={'limit': 2}).json()
+    assert len(data['tasks']) == 2
+    assert data['next']
+    rest = client.get('/tasks', params={'limit': 2, 'cursor': data['next']}).json()
+    assert not {t['_id'] for t in data['tasks']} & {t['_id'] for t in rest['tasks']}
+
+    stats = client.get('/stats').json()['stats']
+    assert stats['total'] == before['total'] + 3
+    assert stats['completed'] == before['completed'] + 1
+
+    response = client.post('/tasks/batch', json={'operations': [{'op': 'delete', 'id': i} for i in ids]})
+    assert [r['status'] for r in response.json()['results']] == [200, 200, 200]
+    assert client.get('/stats').json()['stats'] == before
+
+
+def test_export_and_unknown_route(client):
+    response = client.get('/tasks/export', params={'format': 'csv'})
+    assert response.status_code == 200
+    assert response.text.splitlines()[0] == '_id,title,done,due_date,created_at,updated_at'
+
+    response = client.get('/no-existe')
+    assert response.status_code == 404
+    assert response.json()['success'] is False
+
+
+def test_archive_export_and_delete(client):
+    from datetime import datetime, timedelta
+    from bson import ObjectId
+    import app_async
+
+    task = client.post('/tasks', json={'title': 'Archivada async', 'done': True}).json()['task']
+
+    async def envejecer():
+        await app_async.tasks_collection.update_one({'_id': ObjectId(task['_id'])},
+                                                    {'$set': {'updated_at': datetime.now() - timedelta(days=90)}})
+    client.portal.call(envejecer)
+
+    assert client.post('/tasks/archive').json()['archived'] == 1
+    assert task['_id'] not in [t['_id'] for t in client.get('/tasks', params={'limit': 200}).json()['tasks']]
+    listed = client.get('/tasks', params={'limit': 200, 'include_archived': 'true'}).json()['tasks']
+    assert task['_id'] in [t['_id'] for t in listed]
+    assert task['_id'] in client.get('/tasks/export').text
+    assert client.get(f"/tasks/{task['_id']}").status_code == 200
+    assert client.delete(f"/tasks/{task['_id']}").status_code == 200
+    assert client.get(f"/tasks/{task['_id']}").status_code == 404
+
+
+def test_owners_are_isolated(client):
+    alice, bob = {'X-Owner-Id': 'equipo-alice'}, {'X-Owner-Id': 'equipo-bob'}
+    task = client.post('/tasks', json={'title': 'Tarea de Alice', 'done': True}, headers=alice).json()['task']
+    assert client.get('/stats', headers=alice).json()['stats'] == {'total': 1, 'completed': 1, 'pending': 0}
+    assert client.get('/stats', headers=bob).json()['stats']['total'] == 0
+    assert [t['_id'] for t in client.get('/tasks', headers=alice).json()['tasks']] == [task['_id']]
+    assert client.get('/tasks', headers=bob).json()['tasks'] == []
+
+    assert client.get(f"/tasks/{task['_id']}", headers=bob).status_code == 404
+    assert client.put(f"/tasks/{task['_id']}", json={'done': False}, headers=bob).status_code == 404
+    assert client.delete(f"/tasks/{task['_id']}", headers=bob).status_code == 404
+    response = client.get('/tasks', headers={'X-Owner-Id': 'no valido'})
+    assert response.status_code == 400 and response.json()['success'] is False
+    assert client.delete(f"/tasks/{task['_id']}", headers=alice).status_code == 200
+    assert client.get('/stats', headers=alice).json()['stats']['total'] == 0
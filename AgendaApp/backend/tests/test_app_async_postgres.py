@@ -0,0 +1,331 @@
+import pytest
+import sys
+import os
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from starlette.testclient import TestClient
+
+import app_async_postgres
+from app_async_postgres import app, DB_CONFIG
+from migrate import migrate
+import json
+import psycopg2
+from prometheus_client import REGISTRY
+
+
+@pytest.fixture(scope='module')
+def client():
+    conn = psycopg2.connect(**DB_CONFIG)
+    migrate(conn)
+    conn.close()
+    # Entering the client runs the lifespan: pool, schema check, listener
+    with TestClient(app) as client:
+        yield client
+
+
+def test_health_reports_pool(client):
+    response = client.get('/health')
+    assert response.status_code == 200
+
+    data = response.json()
+    assert data['status'] == 'healthy'
+    assert data['pool']['max'] >= data['pool']['size'] >= 1
+
+
+def test_create_update_delete_task(client):
+    response = client.post('/tasks', json={'title': 'Async task', 'due_date': '2030-01-15'})
+    assert response.status_code == 201
+    task = response.json()
+    assert task['due_date'] == '2030-01-15'
+    assert task['done'] is False
+
+    response = client.put(f"/tasks/{task['id']}", json={'done': True})
+    assert response.status_code == 200
+    assert response.json()['done'] is True
+
+    response = client.get(f"/tasks/{task['id']}")
+    assert response.status_code == 200
+    assert response.json()['title'] == 'Async task'
+
+    assert client.delete(f"/tasks/{task['id']}").status_code == 200
+    assert client.delete(f"/tasks/{task['id']}").status_code == 404
+    assert client.get(f"/tasks/{task['id']}").status_code == 404
+    assert client.put(f"/tasks/{task['id']}", json={'title': 'x'}).status_code == 404
+
+
+def test_create_requires_title(client):
+    response = client.post('/tasks', content='not json', headers={'Content-Type': 'application/json'})
+    assert response.status_code == 400
+
+
+def test_keyset_pagination(client):
+    created = [client.post('/tasks', json={'title': f'Async page {i}'}).json()['id'] for i in range(3)]
+
+    response = client.get('/tasks', params={'limit': 2})
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+    cursor = response.headers['X-Next-Cursor']
+    assert 'rel="next"' in response.headers['Link']
+
+    response = client.get('/tasks', params={'limit': 2, 'cursor': cursor})
+    assert response.status_code == 200
+    first_page_ids = {task['id'] for task in client.get('/tasks', params={'limit': 2}).json()}
+    assert not first_page_ids & {task['id'] for task in response.json()}
+
+    assert client.get('/tasks', params={'cursor': 'garbage'}).status_code == 400
+
+    for task_id in created:
+        client.delete(f'/tasks/{task_id}')
+
+
+def test_batch_and_counters(client):
+    before = client.get('/stats').json()
+    existing = client.post('/tasks', json={'title': 'Async batch target'}).json()
+
+    response = client.post('/tasks/batch', json={'operations': [
+        {'op': 'create', 'title': 'Async batch new', 'done': True},
+        {'op': 'update', 'id': existing['id'], 'done': True, 'title': 'Renamed'},
+        {'op': 'delete', 'id': 'missing'},
+        {'op': 'bogus'},
+    ]})
+    assert response.status_code == 200
+    results = response.json()['results']
+    assert [r['status'] for r in results] == [201, 200, 404, 400]
+    assert results[1]['task']['title'] == 'Renamed'
+
+    after = client.get('/stats').json()
+    assert after['total'] == before['total'] + 2
+    assert after['completed'] == before['completed'] + 2
+
+    response = client.post('/tasks/batch', json={'operations': [
+        {'op': 'delete', 'id': existing['id']},
+        {'op': 'delete', 'id': results[0]['task']['id']},
+    ]})
+    assert [r['status'] for r in response.json()['results']] == [200, 200]
+    assert client.get('/stats').json() == before
+
+
+def test_conditional_get(client):
+    task = client.post('/tasks', json={'title': 'Async etag'}).json()
+
+    response = client.get(f"/tasks/{task['id']}")
+    etag = response.headers['ETag']
+    response = client.get(f"/tasks/{task['id']}", headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+    client.put(f"/tasks/{task['id']}", json={'done': True})
+    response = client.get(f"/tasks/{task['id']}", headers={'If-None-Match': etag})
+    assert response.status_code == 200
+
+    client.delete(f"/tasks/{task['id']}")
+
+
+def test_export_csv(client):
+    task = client.post('/tasks', json={'title': 'Async export'}).json()
+
+    response = client.get('/tasks/export', params={'format': 'csv'})
+    assert response.status_code == 200
+    lines = response.text.splitlines()
+    assert lines[0] == 'id,title,done,due_date,created_at,updated_at'
+    assert lines.count(lines[0]) == 1
+    assert any(line.startswith(task['id']) for line in lines[1:])
+
+    response = client.get('/tasks/export', params={'format': 'ndjson'})
+    assert task['id'] in [json.loads(line)['id'] for line in response.text.splitlines()]
+
+    assert client.get('/tasks/export', params={'format': 'xml'}).status_code == 400
+    client.delete(f"/tasks/{task['id']}")
+
+
+def test_metrics_endpoint(client):
+    client.get('/stats')
+
+    body = client.get('/metrics').text
+    assert 'agendaapp_http_requests_total{method="GET",route="get_stats",status="200"}' in body
+    assert 'agendaapp_db_duration_seconds_count{operation="execute"}' in body
+    assert 'agendaapp_db_pool{stat="size"}' in body
+
+
+def test_roundtrips_are_recorded(client):
+    # The metrics are process-wide: other test files may have recorded these routes
+    def exceeded(route):
+        return REGISTRY.get_sample_value('agendaapp_db_roundtrip_budget_exceeded_total', {'route': route}) or 0
+    before = {route: exceeded(route) for route in ('create_task', 'delete_task')}
+
+    task = client.post('/tasks', json={'title': 'Async budget'}).json()
+    client.delete(f"/tasks/{task['id']}")
+
+    body = client.get('/metrics').text
+    assert 'agendaapp_db_roundtrips_per_request_count{route="create_task"}' in body
+    assert {route: exceeded(route) for route in before} == before
+
+
+def test_search(client):
+    task = client.post('/tasks', json={'title': 'Zqy async search target'}).json()
+
+    response = client.get('/tasks/search', params={'q': 'zqy search'})
+    assert response.status_code == 200
+    assert [t['id'] for t in response.json()] == [task['id']]
+
+    response = client.get('/tasks/search', params={'q': 'zqy asy', 'mode': 'autocomplete'})
+    assert response.json() == [{'id': task['id'], 'title': task['title']}]
+
+    assert client.get('/tasks/search', params={'q': ''}).status_code == 400
+    client.delete(f"/tasks/{task['id']}")
+
+
+def test_agenda(client):
+    task = client.post('/tasks', json={'title': 'Async agenda', 'due_date': '2042-03-04'}).json()
+
+    data = client.get('/agenda', params={'from': '2042-03-01', 'to': '2042-03-07'}).json()
+    assert [day['date'] for day in data['days']] == ['2042-03-04']
+    assert data['days'][0]['tasks'][0]['id'] == task['id']
+    assert isinstance(data['overdue'], int)
+
+    client.delete(f"/tasks/{task['id']}")
+
+
+def test_change_feed(client, monkeypatch):
+    feed = client.get('/tasks/changes', params={'limit': 1000}).json()
+    while feed['has_more']:
+        feed = client.get('/tasks/changes', params={'since': feed['cursor']}).json()
+
+    task = client.post('/tasks', json={'title': 'Async feed'}).json()
+    client.delete(f"/tasks/{task['id']}")
+
+    data = client.get('/tasks/changes', params={'since': feed['cursor']}).json()
+    assert data['changes'] == [{'op': 'delete', 'id': task['id']}]
+
+    # TestClient reads the whole body, so end the stream early
+    monkeypatch.setattr(app_async_postgres, 'CHANGES_STREAM_MAX', 0.5)
+    response = client.get('/tasks/changes/stream', params={'since': feed['cursor']})
+    assert response.headers['content-type'].startswith('text/event-stream')
+    event, event_id, payload = response.text.split('\n\n')[0].split('\n')
+    assert event == 'event: changes' and event_id.startswith('id: ')
+    assert json.loads(payload[len('data: '):])['changes'] == data['changes']
+
+
+def test_prune_changes_counts_the_tombstones_removed(client):
+    task = client.post('/tasks', json={'title': 'Async pruned'}).json()
+    client.delete(f"/tasks/{task['id']}")
+    conn = psycopg2.connect(**DB_CONFIG)
+    cur = conn.cursor()
+    cur.execute("UPDATE task_changes SET changed_at = changed_at - INTERVAL '400 days' WHERE task_id = %s",
+                (task['id'],))
+    conn.commit()
+    conn.close()
+
+    # The pool lives on the app's event loop
+    assert client.portal.call(app_async_postgres.prune_changes) == 1
+    assert client.portal.call(app_async_postgres.prune_changes) == 0
+
+
+def test_probes(client):
+    assert client.get('/livez').json()['status'] == 'alive'
+    # The first background check runs as soon as the app starts
+    for _ in range(50):
+        response = client.get('/readyz')
+        if response.status_code == 200:
+            break
+        time.sleep(0.1)
+    assert response.json()['status'] == 'ready'
+
+
+def test_overload_is_shed_with_retry_after(client, monkeypatch):
+    read = app_async_postgres.admission.limiters['read']
+    monkeypatch.setattr(read, 'limit', 0)
+    monkeypatch.setattr(read, 'queue_timeout', 0.01)
+
+    response = client.get('/tasks')
+    assert response.status_code == 503
+    assert response.headers['retry-after'] == '1'
+    assert client.get('/livez').status_code == 200
+    assert read.stats()['timeouts'] >= 1
+
+
+def test_replica_reads_and_read_after_cookie(client, monkeypatch):
+    from functools import partial
+    import asyncpg
+    from replicas import READ_AFTER_COOKIE, ReplicaRouter, parse_lsn, read_after
+
+    # The test server plays its own replica
+    router = ReplicaRouter(['replica'])
+    monkeypatch.setattr(app_async_postgres, 'replicas', router)
+    pool = client.portal.call(partial(asyncpg.create_pool, min_size=0, max_size=2, **DB_CONFIG))
+    monkeypatch.setitem(app_async_postgres.replica_pools, 'replica', pool)
+    conn = psycopg2.connect(**DB_CONFIG)
+    cur = conn.cursor()
+    cur.execute("SELECT pg_current_wal_lsn()::text")
+    position = parse_lsn(cur.fetchone()[0])
+    conn.close()
+    router.update('replica', position, 0.0)
+
+    app_async_postgres.read_cache.invalidate_all()
+    assert client.get('/stats').status_code == 200
+    assert router.stats()['replica_reads'] == 1
+
+    response = client.post('/tasks', json={'title': 'Async read your writes'})
+    task = response.json()
+    assert read_after(response.cookies[READ_AFTER_COOKIE]) >= position
+
+    # Behind the write: this client (the cookie is in its jar) reads from the primary
+    router.update('replica', position - 1, 0.0)
+    assert client.get(f"/tasks/{task['id']}").status_code == 200
+    assert router.stats()['primary_reads'] == 1
+    client.cookies.clear()
+    client.delete(f"/tasks/{task['id']}")
+    client.portal.call(pool.close)
+
+
+def test_archive_and_include_archived(client):
+    task = client.post('/tasks', json={'title': 'Async archive me', 'done': True}).json()
+    conn = psycopg2.connect(**DB_CONFIG)
+    cur = conn.cursor()
+    cur.execute("UPDATE tasks SET updated_at = CURRENT_TIMESTAMP - INTERVAL '90 days' WHERE id = %s", (task['id'],))
+    conn.commit()
+    conn.close()
+
+    assert client.post('/tasks/archive').json()['archived'] >= 1
+    assert task['id'] not in [t['id'] for t in client.get('/tasks?limit=200').json()]
+    assert task['id'] in [t['id'] for t in client.get('/tasks?limit=200&include_archived=true').json()]
+    assert client.get(f"/tasks/{task['id']}").status_code == 200
+    assert client.delete(f"/tasks/{task['id']}").status_code == 200
+
+
+def test_owners_are_isolated(client):
+    alice, bob = {'X-Owner-Id': 'async-alice'}, {'X-Owner-Id': 'async-bob'}
+    task = client.post('/tasks', json={'title': 'Async owned'}, headers=alice).json()
+    assert client.get('/stats', headers=alice).json()['total'] == 1
+    assert client.get('/stats', headers=bob).json()['total'] == 0
+    assert client.get('/health', headers=bob).json()['tasks_count'] == 0
+    assert [t['id'] for t in client.get('/tasks', headers=alice).json()] == [task['id']]
+    assert client.get('/tasks', headers=bob).json() == []
+
+    assert client.get(f"/tasks/{task['id']}", headers=bob).status_code == 404
+    assert client.put(f"/tasks/{task['id']}", json={'done': True}, headers=bob).status_code == 404
+    assert client.delete(f"/tasks/{task['id']}", headers=bob).status_code == 404
+    assert client.get('/tasks', headers={'X-Owner-Id': 'x' * 65}).status_code == 400
+    assert client.delete(f"/tasks/{task['id']}", headers=alice).status_code == 200
+
+
+def test_columnar_list_and_compression(client):
+    from wire_format import WIRE_COLUMNS, columns
+
+    owner = {'X-Owner-Id': 'async-wire'}
+    ids = [client.post('/tasks', json={'title': f'Async compressible {i}'}, headers=owner).json()['id']
+           for i in range(15)]
+    # httpx asks for gzip and decodes it
+    plain = client.get('/tasks?limit=50', headers=owner)
+    assert plain.headers['Content-Encoding'] == 'gzip'
+    assert plain.headers['ETag'].startswith('W/')
+    assert client.get('/tasks?limit=50', headers={**owner, 'If-None-Match': plain.headers['ETag']}).status_code == 304
+    identity = client.get('/tasks?limit=50', headers={**owner, 'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in identity.headers and identity.json() == plain.json()
+
+    response = client.get('/tasks?limit=50', headers={**owner, 'Accept': WIRE_COLUMNS})
+    assert response.headers['Content-Type'] == WIRE_COLUMNS
+    assert response.json() == columns(plain.json())
+    for task_id in ids:
+        client.delete(f'/tasks/{task_id}', headers=owner)
@@ -0,0 +1,780 @@
+import pytest
+import sys
+import os
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app_postgres import app, init_database, db_pool, prune_changes, readiness, ROUNDTRIP_BUDGETS, DB_CONFIG
+from migrate import migrate
+import json
+import psycopg2
+from prometheus_client import REGISTRY
+
+
+@pytest.fixture(scope='module', autouse=True)
+def database():
+    conn = psycopg2.connect(**DB_CONFIG)
+    migrate(conn)
+    conn.close()
+    assert init_database()
+    yield
+
+
+@pytest.fixture
+def client():
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+
+def test_health_reports_pool(client):
+    """Health includes the connection pool stats"""
+    response = client.get('/health')
+    assert response.status_code == 200
+
+    data = json.loads(response.data)
+    assert data['status'] == 'healthy'
+    assert data['pool']['max'] >= data['pool']['size'] >= 1
+
+
+def test_probes_do_no_database_work(client):
+    """/livez and /readyz answer from memory; /readyz reflects the background check"""
+    readiness.run_once()
+    for path in ('/livez', '/readyz'):
+        response = client.get(path)
+        assert response.status_code == 200
+        assert response.headers['X-DB-Roundtrips'] == '0'
+    data = json.loads(client.get('/readyz').data)
+    assert data['status'] == 'ready'
+    assert data['tasks_estimate'] >= 0
+
+
+def test_missing_task_does_not_leak_connections(client):
+    """404 paths hand their connection back to the pool"""
+    for _ in range(db_pool.maxconn + 2):
+        response = client.put('/tasks/does-not-exist',
+                              data=json.dumps({'title': 'x'}),
+                              content_type='application/json')
+        assert response.status_code == 404
+        response = client.delete('/tasks/does-not-exist')
+        assert response.status_code == 404
+
+    stats = json.loads(client.get('/database/pool').data)
+    assert stats['in_use'] == 0
+    assert stats['timeouts'] == 0
+
+
+def test_create_update_delete_task(client):
+    response = client.post('/tasks',
+                           data=json.dumps({'title': 'Pooled task', 'due_date': '2030-01-15'}),
+                           content_type='application/json')
+    assert response.status_code == 201
+    task = json.loads(response.data)
+    assert task['due_date'] == '2030-01-15'
+
+    response = client.put(f"/tasks/{task['id']}",
+                          data=json.dumps({'done': True}),
+                          content_type='application/json')
+    assert response.status_code == 200
+    assert json.loads(response.data)['done'] is True
+
+    response = client.delete(f"/tasks/{task['id']}")
+    assert response.status_code == 200
+
+
+def test_keyset_pagination(client):
+    """Pages follow X-Next-Cursor without repeating or skipping tasks"""
+    created = []
+    for i in range(5):
+        response = client.post('/tasks',
+                               data=json.dumps({'title': f'Page task {i}'}),
+                               content_type='application/json')
+        created.append(json.loads(response.data)['id'])
+
+    seen = []
+    url = '/tasks?limit=2'
+    while url:
+        response = client.get(url)
+        assert response.status_code == 200
+        page = json.loads(response.data)
+        assert len(page) <= 2
+        seen.extend(task['id'] for task in page)
+        cursor = response.headers.get('X-Next-Cursor')
+        url = f'/tasks?limit=2&cursor={cursor}' if cursor else None
+
+    assert len(seen) == len(set(seen))
+    assert set(created) <= set(seen)
+
+    for task_id in created:
+        client.delete(f'/tasks/{task_id}')
+
+
+def test_tasks_filters(client):
+    response = client.post('/tasks',
+                           data=json.dumps({'title': 'Due task', 'due_date': '2031-03-10', 'done': True}),
+                           content_type='application/json')
+    task = json.loads(response.data)
+
+    response = client.get('/tasks?done=true&due_from=2031-03-01&due_to=2031-03-31')
+    tasks = json.loads(response.data)
+    assert task['id'] in [t['id'] for t in tasks]
+    assert all(t['done'] and '2031-03-01' <= t['due_date'] <= '2031-03-31' for t in tasks)
+
+    response = client.get('/tasks?done=false&due_from=2031-03-01&due_to=2031-03-31')
+    assert task['id'] not in [t['id'] for t in json.loads(response.data)]
+
+    client.delete(f"/tasks/{task['id']}")
+
+
+def test_invalid_list_arguments(client):
+    assert client.get('/tasks?limit=abc').status_code == 400
+    assert client.get('/tasks?cursor=not-a-cursor').status_code == 400
+    assert client.get('/tasks?due_from=2031-02-01&due_to=2031-01-01').status_code == 400
+
+
+def test_export_ndjson_and_csv(client):
+    """Export streams every task and returns the connection to the pool"""
+    response = client.post('/tasks',
+                           data=json.dumps({'title': 'Export, me'}),
+                           content_type='application/json')
+    task = json.loads(response.data)
+
+    response = client.get('/tasks/export?format=ndjson')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    rows = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert task['id'] in [row['id'] for row in rows]
+
+    response = client.get('/tasks/export?format=csv')
+    assert response.status_code == 200
+    lines = response.data.decode().splitlines()
+    assert lines[0] == 'id,title,done,due_date,created_at,updated_at'
+    assert any('"Export, me"' in line for line in lines)
+
+    assert client.get('/tasks/export?format=xml').status_code == 400
+    assert db_pool.stats()['in_use'] == 0
+
+    client.delete(f"/tasks/{task['id']}")
+
+
+def test_batch_mixed_operations(client):
+    """Creates, updates and deletes in one request with per-item results"""
+    response = client.post('/tasks',
+                           data=json.dumps({'title': 'Batch target'}),
+                           content_type='application/json')
+    target = json.loads(response.data)
+
+    response = client.post('/tasks/batch', data=json.dumps({'operations': [
+        {'op': 'create', 'title': 'Batch new', 'due_date': '2030-05-01'},
+        {'op': 'update', 'id': target['id'], 'done': True},
+        {'op': 'delete', 'id': 'missing-id'},
+        {'op': 'create'},
+        {'op': 'delete', 'id': target['id']},
+    ]}), content_type='application/json')
+    assert response.status_code == 200
+    results = json.loads(response.data)['results']
+    assert [r['status'] for r in results] == [201, 200, 404, 400, 400]
+    assert results[0]['task']['due_date'] == '2030-05-01'
+    assert results[1]['task']['done'] is True
+
+    client.delete(f"/tasks/{target['id']}")
+    client.delete(f"/tasks/{results[0]['task']['id']}")
+
+
+def test_batch_size_limit(client):
+    from batch_ops import BATCH_MAX_SIZE
+    operations = [{'op': 'create', 'title': 'x'}] * (BATCH_MAX_SIZE + 1)
+    response = client.post('/tasks/batch', data=json.dumps({'operations': operations}),
+                           content_type='application/json')
+    assert response.status_code == 413
+
+
+def test_stats_counters_follow_mutations(client):
+    """Counters track creates, done toggles, batches and deletes"""
+    before = json.loads(client.get('/stats').data)
+
+    response = client.post('/tasks/batch', data=json.dumps({'operations': [
+        {'op': 'create', 'title': 'Counted 1', 'done': True},
+        {'op': 'create', 'title': 'Counted 2'},
+    ]}), content_type='application/json')
+    ids = [r['task']['id'] for r in json.loads(response.data)['results']]
+    client.put(f'/tasks/{ids[1]}', data=json.dumps({'done': True}), content_type='application/json')
+
+    stats = json.loads(client.get('/stats').data)
+    assert stats['total'] == before['total'] + 2
+    assert stats['completed'] == before['completed'] + 2
+
+    for task_id in ids:
+        client.delete(f'/tasks/{task_id}')
+    assert json.loads(client.get('/stats').data) == before
+
+
+def test_reconcile_repairs_drift(client):
+    with db_pool.connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO owner_counters (owner_id, total, completed) VALUES ('default', 7, 0)
+            ON CONFLICT (owner_id) DO UPDATE SET total = owner_counters.total + 7
+        """)
+        conn.commit()
+
+    report = json.loads(client.post('/stats/reconcile').data)
+    assert report['drift']['total'] == -7
+    assert json.loads(client.get('/stats').data) == report['after']
+
+
+def test_conditional_get(client):
+    """Unchanged lists, stats and tasks answer 304; a write invalidates the tag"""
+    response = client.post('/tasks',
+                           data=json.dumps({'title': 'ETag task'}),
+                           content_type='application/json')
+    task = json.loads(response.data)
+
+    for url in ('/tasks?limit=5', '/stats', f"/tasks/{task['id']}"):
+        response = client.get(url)
+        assert response.status_code == 200
+        etag = response.headers['ETag']
+        response = client.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == b''
+
+    etag = client.get('/stats').headers['ETag']
+    client.put(f"/tasks/{task['id']}", data=json.dumps({'title': 'Renamed'}),
+               content_type='application/json')
+    assert client.get('/stats', headers={'If-None-Match': etag}).status_code == 200
+
+    client.delete(f"/tasks/{task['id']}")
+    assert client.get(f"/tasks/{task['id']}").status_code == 404
+
+
+def test_conditional_get_is_per_owner(client):
+    """A write by one owner leaves the tags of the others valid"""
+    alice, bob = {'X-Owner-Id': 'etag-alice'}, {'X-Owner-Id': 'etag-bob'}
+    tags = {url: client.get(url, headers=bob).headers['ETag'] for url in ('/tasks?limit=5', '/stats')}
+
+    task = json.loads(client.post('/tasks', json={'title': 'Alice only'}, headers=alice).data)
+    for url, etag in tags.items():
+        assert client.get(url, headers={**bob, 'If-None-Match': etag}).status_code == 304
+    etag = client.get('/stats', headers=alice).headers['ETag']
+    client.delete(f"/tasks/{task['id']}", headers=alice)
+    assert client.get('/stats', headers={**alice, 'If-None-Match': etag}).status_code == 200
+
+
+def test_read_cache_invalidation(client):
+    """Cached lists are dropped by local writes and by NOTIFY from other replicas"""
+    import threading
+    import psycopg2
+    from app_postgres import DB_CONFIG, read_cache
+    from read_cache import PgNotifyListener
+
+    client.get('/stats')
+    hits = read_cache.stats()['hits']
+    client.get('/stats')
+    assert read_cache.stats()['hits'] == hits + 1
+
+    response = client.post('/tasks', data=json.dumps({'title': 'Cache task'}),
+                           content_type='application/json')
+    task = json.loads(response.data)
+    assert read_cache.get(('stats', 'default')) is None
+
+    # Another replica sees the write through LISTEN/NOTIFY
+    events = []
+    connected = threading.Event()
+    notified = threading.Event()
+
+    def on_event(owner):
+        # The first event is the invalidation done on connect
+        events.append(owner)
+        if len(events) > 1:
+            notified.set()
+        else:
+            connected.set()
+
+    listener = PgNotifyListener(lambda: psycopg2.connect(**DB_CONFIG), on_event).start()
+    assert connected.wait(5)
+    client.delete(f"/tasks/{task['id']}")
+    assert notified.wait(5)
+    listener.stop()
+    # The payload names the owner written, whose entries are the only ones dropped
+    assert events[:2] == [None, 'default']
+
+
+def test_concurrent_identical_reads_share_one_query(monkeypatch):
+    """A burst of identical cache misses runs the page query once (single flight)"""
+    import app_postgres
+
+    callers = 6
+    versions = []
+    read_version = app_postgres.read_version
+
+    def slow_read_version(conn, owner):
+        # Hold the leader until every other request is waiting on its flight
+        versions.append(1)
+        for _ in range(500):
+            if app_postgres.read_flights.stats()['in_flight'] and shared() >= callers - 1:
+                break
+            threading.Event().wait(0.01)
+        return read_version(conn, owner)
+
+    shared_before = app_postgres.read_flights.stats()['shared']
+    shared = lambda: app_postgres.read_flights.stats()['shared'] - shared_before
+    monkeypatch.setattr(app_postgres, 'read_version', slow_read_version)
+    app_postgres.read_cache.invalidate_all()
+
+    responses = [None] * callers
+    def get(i):
+        with app.test_client() as client:
+            responses[i] = client.get('/tasks?limit=7&done=false')
+    threads = [threading.Thread(target=get, args=(i,)) for i in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert len(versions) == 1
+    assert shared() == callers - 1
+    assert all(response.status_code == 200 for response in responses)
+    assert len({response.data for response in responses}) == 1
+    with app.test_client() as client:
+        assert client.get('/cache/stats').get_json()['single_flight']['in_flight'] == 0
+
+
+def test_metrics_endpoint(client):
+    """Requests and DB calls show up in the Prometheus exposition"""
+    client.get('/tasks?limit=1')
+    client.get('/tasks/does-not-exist')
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+
+    body = response.data.decode()
+    assert 'agendaapp_http_requests_total{method="GET",route="get_tasks",status="200"}' in body
+    assert 'agendaapp_http_requests_total{method="GET",route="get_task",status="404"}' in body
+    assert 'agendaapp_http_request_duration_seconds_bucket{le="0.001",method="GET",route="get_tasks"}' in body
+    assert 'agendaapp_db_duration_seconds_count{operation="execute"}' in body
+    assert 'agendaapp_http_requests_in_flight' in body
+    assert 'agendaapp_db_pool{stat="in_use"}' in body
+    assert 'agendaapp_cache{stat="hits"}' in body
+
+
+def test_sql_encoded_page_matches_python_serialization(client):
+    """The json_agg page is byte-for-byte what serialize_task + jsonify produce"""
+    import psycopg2.extras
+    from datetime import datetime
+    from app_postgres import serialize_task
+    from fast_json import pg_page_query
+
+    for when in (datetime(2031, 1, 1, 9, 30), datetime(2031, 1, 1, 9, 30, 0, 120)):
+        response = client.post('/tasks', data=json.dumps({'title': 'Encoded "quote" ñ'}),
+                               content_type='application/json')
+        task_id = json.loads(response.data)['id']
+        with db_pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("UPDATE tasks SET created_at = %s WHERE id = %s", (when, task_id))
+            conn.commit()
+            cur.execute(pg_page_query("WHERE id = %s", '%s'), (1, task_id))
+            body, has_more, _, last_id = cur.fetchone()
+            dict_cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            dict_cur.execute("SELECT * FROM tasks WHERE id = %s", (task_id,))
+            expected = client.application.json.dumps([serialize_task(dict_cur.fetchone())])
+            cur.close()
+            dict_cur.close()
+        client.delete(f'/tasks/{task_id}')
+
+        assert body == expected
+        assert has_more is False
+        assert last_id == task_id
+
+
+def test_routes_stay_within_roundtrip_budget(client):
+    """Each route makes at most its budgeted DB round trips; writes make exactly one"""
+    def roundtrips(response, route):
+        count = int(response.headers['X-DB-Roundtrips'])
+        assert count <= ROUNDTRIP_BUDGETS[route], f"{route} made {count} round trips"
+        return count
+
+    response = client.post('/tasks', json={'title': 'Budget task', 'due_date': '2030-05-01'})
+    assert roundtrips(response, 'create_task') == 1
+    task_id = json.loads(response.data)['id']
+
+    roundtrips(client.get('/tasks?limit=5'), 'get_tasks')
+    response = client.get(f'/tasks/{task_id}')
+    assert response.status_code == 200
+    roundtrips(response, 'get_task')
+    roundtrips(client.get('/tasks/missing-id'), 'get_task')
+    roundtrips(client.get('/stats'), 'get_stats')
+    roundtrips(client.get('/health'), 'health_check')
+
+    assert roundtrips(client.put(f'/tasks/{task_id}', json={'done': True}), 'update_task') == 1
+    response = client.post('/tasks/batch', json={'operations': [
+        {'op': 'create', 'title': 'Budget batch'},
+        {'op': 'update', 'id': task_id, 'title': 'Budget renamed'},
+    ]})
+    roundtrips(response, 'batch_tasks')
+    batch_id = json.loads(response.data)['results'][0]['task']['id']
+
+    assert roundtrips(client.delete(f'/tasks/{task_id}'), 'delete_task') == 1
+    assert roundtrips(client.delete(f'/tasks/{batch_id}'), 'delete_task') == 1
+
+
+def test_group_commit_creates(client, monkeypatch):
+    """Grouped creates each get their own row, or their own error"""
+    import app_postgres
+    from group_commit import GroupCommitter
+    monkeypatch.setattr(app_postgres, 'task_committer',
+                        GroupCommitter(app_postgres.insert_task_rows, window_ms=50, max_batch=10))
+
+    titles = [f'Grouped {i}' for i in range(5)] + ['x' * 300]
+    responses = [None] * len(titles)
+
+    def create(index):
+        with app.test_client() as thread_client:
+            responses[index] = thread_client.post('/tasks', json={'title': titles[index]})
+
+    threads = [threading.Thread(target=create, args=(i,)) for i in range(len(titles))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [r.status_code for r in responses] == [201] * 5 + [500]
+    created = [json.loads(r.data) for r in responses[:5]]
+    assert [task['title'] for task in created] == titles[:5]
+    for task in created:
+        assert client.get(f"/tasks/{task['id']}").status_code == 200
+        client.delete(f"/tasks/{task['id']}")
+
+
+def test_search_ranks_and_paginates(client):
+    """Full-text search ranks matches and pages with a cursor; autocomplete returns ids and titles"""
+    titles = ['Zqx dentist appointment', 'Call zqx dentist about zqx invoice', 'Zqx groceries']
+    ids = [json.loads(client.post('/tasks', json={'title': t}).data)['id'] for t in titles]
+
+    response = client.get('/tasks/search?q=zqx+dentist&limit=1')
+    assert response.status_code == 200
+    first = json.loads(response.data)
+    assert len(first) == 1 and first[0]['id'] in ids[:2]
+    assert 'rank' in first[0]
+
+    response = client.get(f"/tasks/search?q=zqx+dentist&limit=1&cursor={response.headers['X-Next-Cursor']}")
+    second = json.loads(response.data)
+    assert {first[0]['id'], second[0]['id']} == set(ids[:2])
+    assert 'X-Next-Cursor' not in response.headers
+
+    response = client.get('/tasks/search?q=zqx+dent&mode=autocomplete')
+    assert json.loads(response.data) == [{'id': ids[0], 'title': titles[0]},
+                                         {'id': ids[1], 'title': titles[1]}]
+
+    assert client.get('/tasks/search').status_code == 400
+    assert client.get('/tasks/search?q=x&mode=fuzzy').status_code == 400
+    assert client.get('/tasks/search?q=...&mode=autocomplete').status_code == 400
+    for task_id in ids:
+        client.delete(f'/tasks/{task_id}')
+
+
+def test_agenda_groups_by_day_and_counts_overdue(client):
+    """/agenda returns the window grouped by day and the overdue count"""
+    overdue_before = json.loads(client.get('/agenda?from=2041-01-01').data)['overdue']
+    created = [json.loads(client.post('/tasks', json={'title': title, 'due_date': due, 'done': done}).data)['id']
+               for title, due, done in [('Agenda a', '2041-01-02', False), ('Agenda b', '2041-01-02', False),
+                                        ('Agenda c', '2041-01-04', True), ('Agenda late', '2000-01-01', False)]]
+
+    response = client.get('/agenda?from=2041-01-01&to=2041-01-07')
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert [day['date'] for day in data['days']] == ['2041-01-02']
+    assert [task['title'] for task in data['days'][0]['tasks']] == ['Agenda a', 'Agenda b']
+    assert data['overdue'] == overdue_before + 1
+    assert data['truncated'] is False
+
+    data = json.loads(client.get('/agenda?from=2041-01-01&to=2041-01-07&include_done=true').data)
+    assert [day['date'] for day in data['days']] == ['2041-01-02', '2041-01-04']
+
+    assert client.get('/agenda?from=2041-01-07&to=2041-01-01').status_code == 400
+    assert client.get('/agenda?from=2041-01-01&to=2042-01-01').status_code == 400
+    for task_id in created:
+        client.delete(f'/tasks/{task_id}')
+
+
+def changes_since(client, cursor):
+    response = client.get(f'/tasks/changes?since={cursor}')
+    assert response.status_code == 200
+    return json.loads(response.data)
+
+
+def caught_up_cursor(client):
+    feed = json.loads(client.get('/tasks/changes?limit=1000').data)
+    while feed['has_more']:
+        feed = changes_since(client, feed['cursor'])
+    return feed['cursor']
+
+
+def test_change_feed_sends_deltas_and_tombstones(client):
+    """/tasks/changes returns only what changed after the cursor, deletes included"""
+    cursor = caught_up_cursor(client)
+    assert changes_since(client, cursor)['changes'] == []
+
+    kept = json.loads(client.post('/tasks', json={'title': 'Feed kept'}).data)
+    gone = json.loads(client.post('/tasks', json={'title': 'Feed gone'}).data)
+    client.put(f"/tasks/{kept['id']}", json={'done': True})
+    client.delete(f"/tasks/{gone['id']}")
+
+    response = client.get(f'/tasks/changes?since={cursor}')
+    assert int(response.headers['X-DB-Roundtrips']) <= ROUNDTRIP_BUDGETS['get_changes']
+    feed = json.loads(response.data)
+    assert feed['changes'] == [
+        {'op': 'upsert', 'task': {**kept, 'done': True, 'updated_at': feed['changes'][0]['task']['updated_at']}},
+        {'op': 'delete', 'id': gone['id']},
+    ]
+    assert feed['has_more'] is False
+    assert changes_since(client, feed['cursor'])['changes'] == []
+
+    # One change per page, same result
+    ops, page = [], {'cursor': cursor, 'has_more': True}
+    while page['has_more']:
+        page = json.loads(client.get(f"/tasks/changes?since={page['cursor']}&limit=1").data)
+        ops += [change['op'] for change in page['changes']]
+    assert ops == ['upsert', 'delete']
+
+    assert client.get('/tasks/changes?since=bogus').status_code == 400
+    client.delete(f"/tasks/{kept['id']}")
+
+
+def test_change_feed_expires_pruned_cursors(client):
+    """Cursors older than the pruned tombstones get 410 and a reset"""
+    tasks = [json.loads(client.post('/tasks', json={'title': f'Feed pruned {i}'}).data) for i in range(2)]
+    old = caught_up_cursor(client)
+    for task in tasks:
+        client.delete(f"/tasks/{task['id']}")
+
+    with db_pool.connection() as conn:
+        cur = conn.cursor()
+        cur.execute("UPDATE task_changes SET changed_at = changed_at - interval '400 days' WHERE task_id = ANY(%s)",
+                    ([task['id'] for task in tasks],))
+        conn.commit()
+    # The number of tombstones removed, not of counter rows updated
+    assert prune_changes() == 2
+    assert prune_changes() == 0
+
+    response = client.get(f'/tasks/changes?since={old}')
+    assert response.status_code == 410
+    assert json.loads(response.data)['reset'] is True
+    # A snapshot (no since) always works
+    assert client.get('/tasks/changes?limit=1').status_code == 200
+
+
+def test_change_stream_pushes_pages(client):
+    """The SSE variant sends each page as an event with the cursor as its id"""
+    cursor = caught_up_cursor(client)
+    task = json.loads(client.post('/tasks', json={'title': 'Streamed'}).data)
+
+    response = client.get('/tasks/changes/stream', headers={'Last-Event-ID': cursor}, buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    event = next(response.response)
+    response.close()
+    event = event.decode() if isinstance(event, bytes) else event
+    fields = dict(line.split(': ', 1) for line in event.strip().split('\n'))
+    assert fields['event'] == 'changes'
+    data = json.loads(fields['data'])
+    assert data['changes'] == [{'op': 'upsert', 'task': task}]
+    assert fields['id'] == data['cursor']
+    client.delete(f"/tasks/{task['id']}")
+
+
+def test_reads_use_replicas_and_writers_read_their_writes(client, monkeypatch):
+    """GETs go to a caught-up replica; after a write the cookie keeps that client off lagging ones"""
+    import app_postgres
+    from functools import partial
+    from replicas import READ_AFTER_COOKIE, ReplicaRouter, ReplicaMonitor, PgReplicaCheck, read_after
+
+    # The test server plays its own replica (not in recovery: never behind)
+    router = ReplicaRouter(['replica'])
+    monkeypatch.setattr(app_postgres, 'replicas', router)
+    # The budgets the app builds when started with replicas
+    for route in ('create_task', 'update_task', 'delete_task', 'batch_tasks'):
+        monkeypatch.setitem(ROUNDTRIP_BUDGETS, route, ROUNDTRIP_BUDGETS[route] + 1)
+    exceeded = REGISTRY.get_sample_value('agendaapp_db_roundtrip_budget_exceeded_total',
+                                         {'route': 'create_task'}) or 0
+    monkeypatch.setitem(app_postgres.replica_pools, 'replica', app_postgres.make_pool(DB_CONFIG))
+    connect = partial(psycopg2.connect, **DB_CONFIG)
+    ReplicaMonitor(router, PgReplicaCheck(connect, {'replica': connect})).run_once()
+    [status] = router.status()
+    assert status.error is None and status.lag_seconds == 0
+
+    app_postgres.read_cache.invalidate_all()
+    assert client.get('/stats').status_code == 200
+    assert client.get('/tasks?limit=1').status_code == 200
+    assert router.stats()['replica_reads'] == 2
+
+    response = client.post('/tasks', json={'title': 'Read your writes'})
+    cookie = response.headers['Set-Cookie']
+    assert cookie.startswith(f'{READ_AFTER_COOKIE}=') and 'HttpOnly' in cookie
+    task = json.loads(response.data)
+    written = read_after(client.get_cookie(READ_AFTER_COOKIE).value)
+    assert written >= status.position
+
+    # The replica now looks behind the write: this client reads from the primary
+    router.update('replica', status.position - 1, 0.0)
+    before = router.stats()
+    ids = [t['id'] for t in json.loads(client.get('/tasks').data)]
+    assert task['id'] in ids
+    after = router.stats()
+    assert after['primary_reads'] == before['primary_reads'] + 1
+    assert after['read_after_reads'] == before['read_after_reads'] + 1
+
+    # A failing replica is taken out of rotation until its next good check
+    router.mark_down('replica', 'connection refused')
+    client.delete_cookie(READ_AFTER_COOKIE)
+    assert client.get(f"/tasks/{task['id']}").status_code == 200
+    assert router.stats()['healthy'] == 0 and router.stats()['failovers'] == 1
+    client.delete(f"/tasks/{task['id']}")
+    app_postgres.replica_pools['replica'].closeall()
+    assert (REGISTRY.get_sample_value('agendaapp_db_roundtrip_budget_exceeded_total',
+                                      {'route': 'create_task'}) or 0) == exceeded
+
+
+def test_archive_moves_old_done_tasks_out_of_the_hot_set(client):
+    """Archived tasks leave the default list but stay readable, counted and writable"""
+    response = client.post('/tasks/batch', json={'operations': [
+        {'op': 'create', 'title': 'Archive me', 'done': True},
+        {'op': 'create', 'title': 'Still pending'},
+    ]})
+    old, pending = [r['task']['id'] for r in json.loads(response.data)['results']]
+    with db_pool.connection() as conn:
+        cur = conn.cursor()
+        cur.execute("UPDATE tasks SET updated_at = CURRENT_TIMESTAMP - INTERVAL '90 days' WHERE id IN (%s, %s)",
+                    (old, pending))
+        conn.commit()
+    before = json.loads(client.get('/stats').data)
+
+    assert json.loads(client.post('/tasks/archive').data)['archived'] >= 1
+    with db_pool.connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT tableoid::regclass::text FROM tasks WHERE id = %s", (old,))
+        assert cur.fetchone()[0] == 'tasks_archive'
+
+    hot = [t['id'] for t in json.loads(client.get('/tasks?limit=200').data)]
+    assert pending in hot and old not in hot
+    everything = [t['id'] for t in json.loads(client.get('/tasks?limit=200&include_archived=true').data)]
+    assert old in everything
+    assert json.loads(client.get(f'/tasks/{old}').data)['title'] == 'Archive me'
+    assert json.loads(client.get('/stats').data) == before
+
+    # A write brings it back
+    client.put(f'/tasks/{old}', json={'title': 'Back again'})
+    assert old in [t['id'] for t in json.loads(client.get('/tasks?limit=200').data)]
+    for task_id in (old, pending):
+        client.delete(f'/tasks/{task_id}')
+
+
+def test_archive_keeps_done_tasks_per_owner(client):
+    """ARCHIVE_KEEP_DONE bounds each owner's completed tasks, not all of them"""
+    from archive import pg_archive
+
+    busy, quiet = {'X-Owner-Id': 'keep-busy'}, {'X-Owner-Id': 'keep-quiet'}
+    ids = {}
+    for name, owner, count in (('busy', busy, 3), ('quiet', quiet, 1)):
+        response = client.post('/tasks/batch', headers=owner, json={'operations': [
+            {'op': 'create', 'title': f'Done {name} {i}', 'done': True} for i in range(count)]})
+        ids[name] = [r['task']['id'] for r in json.loads(response.data)['results']]
+
+    with db_pool.connection() as conn:
+        pg_archive(conn, after_days=3650, keep_done=1)
+        cur = conn.cursor()
+        cur.execute("SELECT owner_id, count(*) FROM tasks WHERE id = ANY(%s) AND NOT archived GROUP BY owner_id",
+                    (ids['busy'] + ids['quiet'],))
+        assert dict(cur.fetchall()) == {'keep-busy': 1, 'keep-quiet': 1}
+        conn.commit()
+    for name, owner in (('busy', busy), ('quiet', quiet)):
+        for task_id in ids[name]:
+            client.delete(f'/tasks/{task_id}', headers=owner)
+
+
+def test_owners_only_see_their_own_tasks(client):
+    """Lists, counts, search and writes are scoped to the X-Owner-Id header"""
+    alice, bob = {'X-Owner-Id': 'team-alice'}, {'X-Owner-Id': 'team-bob'}
+    task = json.loads(client.post('/tasks', json={'title': 'Owned quarterly report', 'done': True},
+                                  headers=alice).data)
+    assert 'owner_id' not in task
+    assert json.loads(client.get('/stats', headers=alice).data) == {'total': 1, 'completed': 1, 'pending': 0}
+    assert json.loads(client.get('/stats', headers=bob).data)['total'] == 0
+    assert json.loads(client.get('/health', headers=alice).data)['tasks_count'] == 1
+    assert json.loads(client.get('/health', headers=bob).data)['tasks_count'] == 0
+
+    assert [t['id'] for t in json.loads(client.get('/tasks', headers=alice).data)] == [task['id']]
+    assert json.loads(client.get('/tasks', headers=bob).data) == []
+    assert task['id'] not in [t['id'] for t in json.loads(client.get('/tasks?limit=200').data)]
+    assert json.loads(client.get('/tasks/search?q=quarterly', headers=bob).data) == []
+
+    assert client.get(f"/tasks/{task['id']}", headers=bob).status_code == 404
+    assert client.put(f"/tasks/{task['id']}", json={'title': 'Mine now'}, headers=bob).status_code == 404
+    assert client.delete(f"/tasks/{task['id']}", headers=bob).status_code == 404
+    for operation in ({'op': 'update', 'id': task['id'], 'done': False}, {'op': 'delete', 'id': task['id']}):
+        response = client.post('/tasks/batch', headers=bob, json={'operations': [operation]})
+        assert json.loads(response.data)['results'][0]['status'] == 404
+    assert json.loads(client.get(f"/tasks/{task['id']}", headers=alice).data)['title'] == 'Owned quarterly report'
+
+    assert client.get('/tasks', headers={'X-Owner-Id': 'not a valid owner!'}).status_code == 400
+    assert client.delete(f"/tasks/{task['id']}", headers=alice).status_code == 200
+    assert json.loads(client.get('/stats', headers=alice).data)['total'] == 0
+
+
+def test_compression_and_wire_formats(client):
+    """gzip by Accept-Encoding, columnar JSON by Accept, same content either way"""
+    import gzip
+    from wire_format import WIRE_COLUMNS, columns
+
+    owner = {'X-Owner-Id': 'wire-format'}
+    response = client.post('/tasks/batch', headers=owner, json={'operations': [
+        {'op': 'create', 'title': f'Compressible task {i}', 'due_date': '2031-03-04'} for i in range(20)]})
+    ids = [r['task']['id'] for r in json.loads(response.data)['results']]
+
+    plain = client.get('/tasks?limit=50', headers=owner)
+    assert 'Content-Encoding' not in plain.headers
+    assert 'Accept-Encoding' in plain.headers['Vary'] and 'Accept' in plain.headers['Vary']
+
+    compressed = client.get('/tasks?limit=50', headers={**owner, 'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert len(compressed.data) < len(plain.data)
+    assert gzip.decompress(compressed.data) == plain.data
+    etag = compressed.headers['ETag']
+    assert etag.startswith('W/')
+    response = client.get('/tasks?limit=50', headers={**owner, 'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert response.status_code == 304
+
+    response = client.get('/tasks?limit=50', headers={**owner, 'Accept': WIRE_COLUMNS})
+    assert response.mimetype == WIRE_COLUMNS
+    assert response.headers['ETag'] != plain.headers['ETag']
+    assert json.loads(response.data) == columns(json.loads(plain.data))
+
+    csv_plain = client.get('/tasks/export?format=csv', headers=owner).data
+    csv_gzip = client.get('/tasks/export?format=csv', headers={**owner, 'Accept-Encoding': 'gzip'})
+    assert csv_gzip.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(csv_gzip.data) == csv_plain
+
+    client.post('/tasks/batch', headers=owner, json={'operations': [{'op': 'delete', 'id': i} for i in ids]})
+
+
+def test_change_feed_sends_archived_tasks_as_removals(client):
+    """The feed covers the hot set: archiving is a delete, a write brings the task back"""
+    owner = {'X-Owner-Id': 'feed-archive'}
+    task = json.loads(client.post('/tasks', json={'title': 'Feed archived', 'done': True}, headers=owner).data)
+    feed = json.loads(client.get('/tasks/changes', headers=owner).data)
+    assert [change['op'] for change in feed['changes']] == ['upsert']
+    with db_pool.connection() as conn:
+        cur = conn.cursor()
+        cur.execute("UPDATE tasks SET updated_at = CURRENT_TIMESTAMP - INTERVAL '90 days' WHERE id = %s",
+                    (task['id'],))
+        conn.commit()
+    assert json.loads(client.post('/tasks/archive').data)['archived'] >= 1
+
+    changes = json.loads(client.get(f"/tasks/changes?since={feed['cursor']}", headers=owner).data)
+    assert changes['changes'] == [{'op': 'delete', 'id': task['id']}]
+    assert json.loads(client.get('/tasks/changes', headers=owner).data)['changes'] == []
+
+    client.put(f"/tasks/{task['id']}", json={'title': 'Feed restored'}, headers=owner)
+    changes = json.loads(client.get(f"/tasks/changes?since={changes['cursor']}", headers=owner).data)
+    assert [(c['op'], c['task']['title']) for c in changes['changes']] == [('upsert', 'Feed restored')]
+    client.delete(f"/tasks/{task['id']}", headers=owner)
@@ -0,0 +1,66 @@
+import pytest
+import sys
+import os
+import json
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bench
+
+
+class FakeTarget:
+    """Answers the few routes the workload touches, without a database."""
+
+    def __init__(self):
+        self.calls = []
+
+    def client(self):
+        return self
+
+    def request(self, method, path, payload=None):
+        self.calls.append((method, path))
+        if method == 'GET' and path.startswith('/tasks?'):
+            return 200, json.dumps([{'id': 'a'}, {'id': 'b'}]).encode()
+        if method == 'POST' and path == '/tasks':
+            return 201, json.dumps({'id': f'new-{len(self.calls)}'}).encode()
+        return 200, b'{}'
+
+
+def test_percentile_nearest_rank():
+    values = sorted(range(1, 101))
+    assert bench.percentile(values, 50) == 50
+    assert bench.percentile(values, 95) == 95
+    assert bench.percentile(values, 99) == 99
+    assert bench.percentile([7], 99) == 7
+    assert bench.percentile([], 50) is None
+
+
+def test_parse_mix():
+    assert bench.parse_mix('list=3,get') == {'list': 3.0, 'get': 1.0}
+    with pytest.raises(Exception):
+        bench.parse_mix('list=1,explode=2')
+
+
+def test_workload_counts_every_request():
+    target = FakeTarget()
+    samples, errors, elapsed = bench.run_workload(target, bench.parse_mix('list=1,get=1,create=1,delete=1'),
+                                                  concurrency=4, duration=None, requests=200,
+                                                  page_size=10, random_seed=1)
+    report = bench.build_report(samples, errors, elapsed, {})
+    assert report['overall']['count'] == 200
+    assert report['overall']['errors'] == 0
+    assert set(report['operations']) == {'list', 'get', 'create', 'delete'}
+    assert report['overall']['p50_ms'] <= report['overall']['p95_ms'] <= report['overall']['p99_ms']
+
+
+def test_compare_flags_regressions():
+    def report(rps, p95):
+        stats = {'count': 100, 'throughput_rps': rps, 'p95_ms': p95}
+        return {'overall': stats, 'operations': {'list': stats}}
+
+    baseline = report(100.0, 10.0)
+    assert bench.compare(report(95.0, 10.5), baseline, 0.10) == []
+
+    regressions = bench.compare(report(80.0, 13.0), baseline, 0.10)
+    assert any('throughput' in line for line in regressions)
+    assert any('p95' in line for line in regressions)
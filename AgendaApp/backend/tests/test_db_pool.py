@@ -0,0 +1,140 @@
+import pytest
+import sys
+import os
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+import psycopg2.extensions
+from db_pool import ConnectionPool, PoolTimeout
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, query, params=None):
+        if self.conn.broken:
+            raise psycopg2.OperationalError("server closed the connection")
+        self.conn.status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.broken = False
+        self.rollbacks = 0
+        self.autocommit = False
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def pool():
+    return ConnectionPool(FakeConnection, minconn=1, maxconn=2, timeout=0.1)
+
+
+def test_connections_are_reused(pool):
+    """A returned connection is handed out again instead of opening a new one"""
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+    assert first is second
+    assert pool.stats()['created'] == 1
+    assert pool.stats()['in_use'] == 0
+
+
+def test_autocommit_is_per_checkout(pool):
+    """autocommit only applies to the borrow that asked for it"""
+    with pool.connection(autocommit=True) as conn:
+        assert conn.autocommit is True
+    with pool.connection() as again:
+        assert again is conn
+        assert again.autocommit is False
+
+
+def test_checkout_timeout(pool):
+    """Borrowing from an exhausted pool fails after the timeout"""
+    a = pool.getconn()
+    b = pool.getconn()
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+    assert pool.stats()['timeouts'] == 1
+    pool.putconn(a)
+    pool.putconn(b)
+
+
+def test_waiter_gets_returned_connection():
+    """A blocked checkout is served as soon as another thread returns a connection"""
+    pool = ConnectionPool(FakeConnection, minconn=0, maxconn=1, timeout=2)
+    held = pool.getconn()
+    result = {}
+
+    def borrow():
+        result['conn'] = pool.getconn()
+
+    t = threading.Thread(target=borrow)
+    t.start()
+    pool.putconn(held)
+    t.join(2)
+    assert result['conn'] is held
+
+
+def test_connection_returned_on_error(pool):
+    """An exception inside the with-block rolls back and returns the connection"""
+    with pytest.raises(ValueError):
+        with pool.connection() as conn:
+            conn.cursor().execute("UPDATE tasks SET done = true")
+            raise ValueError("boom")
+    assert conn.rollbacks == 1
+    assert pool.stats()['idle'] == 1
+
+
+def test_broken_connection_discarded_on_borrow():
+    """Stale connections that fail validation are replaced transparently"""
+    pool = ConnectionPool(FakeConnection, minconn=1, maxconn=1, timeout=0.1, validate_idle=0)
+    with pool.connection() as conn:
+        pass
+    conn.broken = True
+    with pool.connection() as fresh:
+        assert fresh is not conn
+    assert conn.closed
+    assert pool.stats()['discarded'] == 1
+
+
+def test_prefill_and_invalid_sizes():
+    pool = ConnectionPool(FakeConnection, minconn=2, maxconn=4)
+    pool.prefill()
+    assert pool.stats()['idle'] == 2
+    with pytest.raises(ValueError):
+        ConnectionPool(FakeConnection, minconn=5, maxconn=2)
+
+
+def test_forked_child_opens_its_own_connections(pool):
+    """After a fork the child never reuses (or closes) the parent's connections"""
+    with pool.connection() as parent_conn:
+        pass
+    pool._after_fork()
+
+    with pool.connection() as child_conn:
+        pass
+    assert child_conn is not parent_conn
+    assert not parent_conn.closed
+    assert pool.stats()['size'] == 1
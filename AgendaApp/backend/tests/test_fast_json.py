@@ -0,0 +1,57 @@
+import pytest
+import sys
+import os
+from datetime import date, datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+import fast_json
+
+pytestmark = pytest.mark.skipif(fast_json.orjson is None, reason="orjson not installed")
+
+
+@pytest.fixture
+def app():
+    return Flask(__name__)
+
+
+@pytest.fixture
+def providers(app):
+    return DefaultJSONProvider(app), fast_json.OrjsonProvider(app)
+
+
+def test_http_date_matches_werkzeug():
+    values = [
+        datetime(2025, 1, 1),
+        datetime(2024, 2, 29, 23, 59, 59, 999999),
+        datetime(2025, 6, 1, 12, 0, tzinfo=timezone(timedelta(hours=-5))),
+        date(2030, 12, 31),
+    ]
+    for value in values:
+        assert fast_json.http_date(value) == http_date(value)
+
+
+def test_orjson_provider_matches_default(providers):
+    default, fast = providers
+    payload = {
+        "success": True,
+        "tasks": [{"_id": "abc", "title": "Tarea ñ", "done": False,
+                   "created_at": datetime(2025, 3, 4, 5, 6, 7, 890)}],
+        "stats": {"total": 1, "completed": 0, "pending": 1},
+        "next": None,
+    }
+    # Same values and key order; the text is compact UTF-8 instead of \u escapes
+    assert fast.loads(fast.dumps(payload)) == default.loads(default.dumps(payload))
+    assert fast.dumps(payload) == default.dumps(payload, separators=(',', ':'), ensure_ascii=False)
+
+
+def test_orjson_provider_response(app, providers):
+    _, fast = providers
+    with app.test_request_context():
+        response = fast.response({"b": 1, "a": date(2025, 1, 2)})
+    assert response.mimetype == 'application/json'
+    assert response.get_data(as_text=True).startswith('{"a":"Thu, 02 Jan 2025 00:00:00 GMT","b":1}')
@@ -0,0 +1,84 @@
+import pytest
+import sys
+import os
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import group_commit
+from group_commit import GroupCommitter, GroupCommitTimeout
+
+
+def submit_all(committer, items):
+    results = [None] * len(items)
+
+    def worker(index):
+        try:
+            results[index] = committer.submit(items[index], timeout=5)
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(items))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_submits_share_batches():
+    batches = []
+    committer = GroupCommitter(lambda items: batches.append(items) or [item * 2 for item in items],
+                               window_ms=100, max_batch=4)
+
+    assert submit_all(committer, list(range(10))) == [i * 2 for i in range(10)]
+    assert sorted(item for batch in batches for item in batch) == list(range(10))
+    assert max(len(batch) for batch in batches) <= 4
+    assert len(batches) < 10
+
+
+def test_errors_reach_only_their_caller():
+    def flush(items):
+        return [ValueError(f"bad {item}") if item < 0 else item for item in items]
+
+    results = submit_all(GroupCommitter(flush, window_ms=20), [1, -1, 2])
+    assert results[0] == 1 and results[2] == 2
+    assert isinstance(results[1], ValueError)
+
+
+def test_failed_flush_fails_the_whole_batch():
+    def flush(items):
+        raise RuntimeError("database down")
+
+    committer = GroupCommitter(flush, window_ms=20)
+    with pytest.raises(RuntimeError):
+        committer.submit('task', timeout=5)
+    # The flusher keeps running after a failure
+    committer._flush = lambda items: items
+    assert committer.submit('task', timeout=5) == 'task'
+
+
+def test_metrics_errors_do_not_stop_the_flusher(monkeypatch):
+    def broken_metrics(size, waits):
+        raise RuntimeError("metrics down")
+
+    committer = GroupCommitter(lambda items: items, window_ms=20)
+    monkeypatch.setattr(group_commit, 'observe_group_commit', broken_metrics)
+    with pytest.raises(RuntimeError):
+        committer.submit('task', timeout=5)
+    monkeypatch.undo()
+    assert committer.submit('task', timeout=5) == 'task'
+
+
+def test_submit_times_out():
+    release = threading.Event()
+    committer = GroupCommitter(lambda items: release.wait(5) and items, window_ms=0)
+    with pytest.raises(GroupCommitTimeout):
+        committer.submit('task', timeout=0.05)
+    release.set()
+    assert committer.submit('task', timeout=5) == 'task'
+
+
+def test_invalid_settings():
+    with pytest.raises(ValueError):
+        GroupCommitter(lambda items: items, max_batch=0)
@@ -0,0 +1,34 @@
+import pytest
+import sys
+import os
+import runpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CONF = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'gunicorn.conf.py')
+
+
+def load(monkeypatch, **env):
+    for name in ('BACKEND_MODE', 'WORKER_MODEL', 'WEB_CONCURRENCY', 'GUNICORN_THREADS'):
+        monkeypatch.delenv(name, raising=False)
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    return runpy.run_path(CONF)
+
+
+def test_defaults_to_threaded_workers_without_preload(monkeypatch):
+    conf = load(monkeypatch)
+    assert conf['worker_class'] == 'gthread'
+    assert conf['wsgi_app'] == 'app:app'
+    assert conf['workers'] == 2
+    assert conf['preload_app'] is False
+
+
+def test_worker_models(monkeypatch):
+    assert load(monkeypatch, WORKER_MODEL='sync')['worker_class'] == 'sync'
+    assert load(monkeypatch, WORKER_MODEL='gevent', WEB_CONCURRENCY='4')['workers'] == 4
+    conf = load(monkeypatch, BACKEND_MODE='async')
+    assert conf['worker_class'] == 'uvicorn.workers.UvicornWorker'
+    assert conf['wsgi_app'] == 'app_async_postgres:app'
+    with pytest.raises(ValueError):
+        load(monkeypatch, WORKER_MODEL='eventlet')
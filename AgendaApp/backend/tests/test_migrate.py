@@ -0,0 +1,103 @@
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+
+import schema
+from migrate import DB_CONFIG, load_migrations, split_statements, migrate, status
+
+
+def write(directory, name, sql):
+    directory.joinpath(name).write_text(sql)
+
+
+@pytest.fixture
+def conn():
+    # A scratch schema, so the test migrations get their own schema_migrations
+    admin = psycopg2.connect(**DB_CONFIG)
+    admin.autocommit = True
+    admin.cursor().execute("DROP SCHEMA IF EXISTS migrate_test CASCADE; CREATE SCHEMA migrate_test")
+    conn = psycopg2.connect(**DB_CONFIG, options='-c search_path=migrate_test')
+    yield conn
+    conn.close()
+    admin.cursor().execute("DROP SCHEMA migrate_test CASCADE")
+    admin.close()
+
+
+def test_repo_migrations_are_ordered_and_flagged():
+    migrations = load_migrations()
+    assert [m.version for m in migrations] == sorted(m.version for m in migrations)
+    assert migrations[0].name == 'baseline' and migrations[0].transactional
+    indexes = next(m for m in migrations if m.name == 'indexes')
+    assert not indexes.transactional
+    assert all('CONCURRENTLY' in statement for statement in split_statements(indexes.sql))
+    trigram = next(m for m in migrations if m.name == 'trigram')
+    assert trigram.optional and trigram.version not in schema.REQUIRED_VERSIONS
+    # tasks is partitioned since 0004: its trigram index is built per partition
+    partitions = next(m for m in migrations if m.name == 'trigram_partitions')
+    assert partitions.optional and not partitions.transactional
+    assert not any('INDEX' in statement for statement in split_statements(trigram.sql))
+    assert any('ON ONLY tasks' in statement for statement in split_statements(partitions.sql))
+
+
+def test_unknown_option_and_duplicate_version_are_rejected(tmp_path):
+    write(tmp_path, '0001_a.sql', "-- migrate: no-transactions\nSELECT 1;")
+    with pytest.raises(ValueError, match='unknown migrate option'):
+        load_migrations(str(tmp_path))
+    write(tmp_path, '0001_a.sql', "SELECT 1;")
+    write(tmp_path, '0001_b.sql', "SELECT 1;")
+    with pytest.raises(ValueError, match='Duplicate'):
+        load_migrations(str(tmp_path))
+
+
+def test_migrate_applies_once_in_order(conn, tmp_path):
+    write(tmp_path, '0002_items_done.sql', "ALTER TABLE items ADD COLUMN done BOOLEAN NOT NULL DEFAULT FALSE;")
+    write(tmp_path, '0001_items.sql', "CREATE TABLE items (id INT PRIMARY KEY);\nINSERT INTO items VALUES (1);")
+    write(tmp_path, '0003_items_index.sql', "-- migrate: no-transaction\n"
+          "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_items_done ON items (done);\n")
+    migrations = load_migrations(str(tmp_path))
+
+    assert migrate(conn, migrations) == [1, 2, 3]
+    assert migrate(conn, migrations) == []
+    assert [applied for _, applied in status(conn, migrations)] == [True, True, True]
+
+    cur = conn.cursor()
+    cur.execute("SELECT done FROM items")
+    assert cur.fetchall() == [(False,)]
+    cur.execute("SELECT indisvalid FROM pg_index WHERE indexrelid = 'idx_items_done'::regclass")
+    assert cur.fetchone() == (True,)
+
+
+def test_failed_migration_is_rolled_back_and_stops_the_run(conn, tmp_path):
+    write(tmp_path, '0001_items.sql', "CREATE TABLE items (id INT PRIMARY KEY);\nSELECT 1 / 0;")
+    write(tmp_path, '0002_more.sql', "CREATE TABLE more_items (id INT);")
+    migrations = load_migrations(str(tmp_path))
+
+    with pytest.raises(psycopg2.DataError):
+        migrate(conn, migrations)
+    assert [applied for _, applied in status(conn, migrations)] == [False, False]
+    cur = conn.cursor()
+    cur.execute("SELECT to_regclass('items'), to_regclass('more_items')")
+    assert cur.fetchone() == (None, None)
+
+
+def test_optional_failure_stays_pending(conn, tmp_path):
+    write(tmp_path, '0001_items.sql', "CREATE TABLE items (id INT PRIMARY KEY);")
+    write(tmp_path, '0002_missing.sql', "-- migrate: no-transaction, optional\n"
+          "CREATE EXTENSION IF NOT EXISTS no_such_extension;\n")
+    write(tmp_path, '0003_more.sql', "CREATE TABLE more_items (id INT);")
+    migrations = load_migrations(str(tmp_path))
+
+    assert migrate(conn, migrations) == [1, 3]
+    assert [applied for _, applied in status(conn, migrations)] == [True, False, True]
+
+
+def test_apps_require_every_mandatory_migration():
+    schema.check_schema_versions(schema.REQUIRED_VERSIONS)
+    with pytest.raises(schema.SchemaOutdated, match='migrate.py'):
+        schema.check_schema_versions(None)
+    with pytest.raises(schema.SchemaOutdated, match='missing migration'):
+        schema.check_schema_versions(sorted(schema.REQUIRED_VERSIONS)[:-1])
@@ -0,0 +1,39 @@
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from probes import ReadinessChecker
+
+
+def test_not_ready_before_first_check():
+    ready, body = ReadinessChecker(lambda: {}).status()
+    assert not ready
+    assert body['status'] == 'not ready'
+
+
+def test_caches_last_result():
+    calls = []
+    checker = ReadinessChecker(lambda: calls.append(1) or {"tasks_estimate": 3})
+    checker.run_once()
+
+    for _ in range(3):
+        ready, body = checker.status()
+        assert ready and body['tasks_estimate'] == 3
+    assert len(calls) == 1
+
+
+def test_failed_and_stale_checks_are_not_ready():
+    def fail():
+        raise RuntimeError("connection refused")
+
+    checker = ReadinessChecker(fail)
+    checker.run_once()
+    ready, body = checker.status()
+    assert not ready and body['error'] == 'connection refused'
+
+    checker = ReadinessChecker(lambda: {}, ttl=0)
+    checker.run_once()
+    ready, body = checker.status()
+    assert not ready and body['error'] == 'database check is stale'
@@ -0,0 +1,87 @@
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from read_cache import ReadCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def cache(clock):
+    cache = ReadCache(maxsize=2, ttl=30, fallback_ttl=2, enabled=True, clock=clock)
+    cache.set_listening(True)
+    return cache
+
+
+def test_hit_and_miss_counters(cache):
+    assert cache.get('a') is None
+    cache.set('a', 1, cache.generation)
+    assert cache.get('a') == 1
+    stats = cache.stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+
+
+def test_lru_eviction(cache):
+    cache.set('a', 1, cache.generation)
+    cache.set('b', 2, cache.generation)
+    cache.get('a')
+    cache.set('c', 3, cache.generation)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.stats()['evictions'] == 1
+
+
+def test_ttl_depends_on_listener(cache, clock):
+    """Without an invalidation listener entries only live for the fallback TTL"""
+    cache.set('a', 1, cache.generation)
+    cache.set_listening(False)
+    cache.set('b', 2, cache.generation)
+    clock.now = 5
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+    clock.now = 31
+    assert cache.get('a') is None
+    assert cache.stats()['expirations'] == 2
+
+
+def test_load_racing_invalidation_is_dropped(cache):
+    """A value loaded before an invalidation must not be stored after it"""
+    generation = cache.generation
+    cache.invalidate_all()
+    cache.set('a', 'stale', generation)
+    assert cache.get('a') is None
+
+
+def test_invalidate_drops_one_owner(cache):
+    """An owner's invalidation keeps the other owners' entries and loads"""
+    cache.set(('stats', 'alice'), 1, cache.generation_for('alice'))
+    cache.set(('stats', 'bob'), 2, cache.generation_for('bob'))
+    alice, bob = cache.generation_for('alice'), cache.generation_for('bob')
+    cache.invalidate('alice')
+    assert cache.get(('stats', 'alice')) is None
+    assert cache.get(('stats', 'bob')) == 2
+    cache.set(('tasks', 'alice'), 'stale', alice)
+    cache.set(('tasks', 'bob'), 'fresh', bob)
+    assert cache.get(('tasks', 'alice')) is None
+    assert cache.get(('tasks', 'bob')) == 'fresh'
+
+
+def test_disabled_cache(clock):
+    cache = ReadCache(enabled=False, clock=clock)
+    cache.set('a', 1, cache.generation)
+    assert cache.get('a') is None
@@ -0,0 +1,89 @@
+import pytest
+import sys
+import os
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson.timestamp import Timestamp
+
+from read_cache import ReadCache
+from replicas import (ReplicaRouter, ReplicaMonitor, replica_hosts, parse_lsn, replica_lag, read_after,
+                      read_after_cookie, mongo_position, mongo_timestamp, READ_AFTER_COOKIE)
+
+
+def test_parsing_helpers():
+    assert replica_hosts('db-1, db-2:5433,', 5432) == [('db-1', 5432), ('db-2', 5433)]
+    assert replica_hosts('', 5432) == []
+    assert parse_lsn('16/B374D848') == 0x16 << 32 | 0xB374D848
+    assert parse_lsn('0/10') < parse_lsn('1/0')
+    assert replica_lag(parse_lsn('0/20'), parse_lsn('0/20'), 30.0) == 0.0
+    assert replica_lag(parse_lsn('0/10'), parse_lsn('0/20'), 1.5) == 1.5
+
+    name, value, options = read_after_cookie(parse_lsn('16/B374D848'))
+    assert name == READ_AFTER_COOKIE and options['httponly']
+    assert read_after(value) == parse_lsn('16/B374D848')
+    assert read_after(None) is None and read_after('not-hex') is None
+
+    ts = Timestamp(1700000000, 7)
+    assert mongo_timestamp(mongo_position(ts)) == ts
+    assert mongo_position(None) is None
+
+
+def test_router_skips_lagging_down_and_behind_replicas():
+    router = ReplicaRouter(['r1', 'r2'], max_lag=5)
+    # Nothing checked yet: the primary serves every read
+    assert router.choose() is None
+
+    router.update('r1', 100, 0.0)
+    router.update('r2', 200, 0.0)
+    assert {router.choose().name for _ in range(4)} == {'r1', 'r2'}
+    # A client that wrote at 150 only reads from a replica that has replayed it
+    assert {router.choose(read_after=150).name for _ in range(4)} == {'r2'}
+    assert router.choose(read_after=300) is None
+
+    router.update('r2', 300, 9.0)
+    assert router.choose().name == 'r1'
+    router.mark_down('r1', OSError('connection refused'))
+    router.mark_down('r1', OSError('connection refused'))
+    assert router.choose() is None
+
+    stats = router.stats()
+    assert stats['replicas'] == 2 and stats['healthy'] == 1 and stats['failovers'] == 1
+    assert stats['read_after_reads'] == 5 and stats['primary_reads'] == 3
+
+
+def test_monitor_records_results_and_failures():
+    router = ReplicaRouter(['r1', 'r2'])
+    results = {'r1': (10, 0.2), 'r2': ConnectionError('gone')}
+    monitor = ReplicaMonitor(router, lambda: results)
+    monitor.run_once()
+    assert router.choose().name == 'r1'
+    assert [status.error for status in router.status()] == [None, 'gone']
+
+    # A failing check takes every replica out of rotation
+    async def failing():
+        raise TimeoutError('primary unreachable')
+
+    async def scenario():
+        task = asyncio.create_task(ReplicaMonitor(router, failing, interval=60).run_async())
+        await asyncio.sleep(0.01)
+        task.cancel()
+    asyncio.run(scenario())
+    assert router.choose() is None
+
+
+def test_cache_entries_older_than_the_client_are_misses():
+    cache = ReadCache(ttl=60, fallback_ttl=60)
+    cache.set('stats', {'total': 1}, cache.generation, position=100)
+    assert cache.get('stats') == {'total': 1}
+    assert cache.get('stats', read_after=100) == {'total': 1}
+    assert cache.get('stats', read_after=101) is None
+
+    # Read on the primary: only known to include the position it was loaded for
+    cache.set('tasks', ['primary'], cache.generation)
+    assert cache.get('tasks') == ['primary']
+    assert cache.get('tasks', read_after=1) is None
+    cache.set('tasks', ['primary'], cache.generation, read_after=200)
+    assert cache.get('tasks', read_after=200) == ['primary']
+    assert cache.get('tasks', read_after=201) is None
@@ -0,0 +1,133 @@
+import pytest
+import sys
+import os
+import asyncio
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from single_flight import SingleFlight, AsyncSingleFlight
+
+
+def run_together(flights, key, load, callers):
+    """Call flights.do(key, load) from several threads; returns results or exceptions."""
+    results = [None] * callers
+    def call(i):
+        try:
+            results[i] = flights.do(key, load)
+        except Exception as e:
+            results[i] = e
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+def blocking_load(release, result=None, error=None):
+    calls = []
+    def load():
+        calls.append(1)
+        release.wait(5)
+        if error is not None:
+            raise error
+        return result
+    return load, calls
+
+
+def wait_for_waiters(flights, count):
+    for _ in range(500):
+        if flights.stats()['shared'] >= count:
+            return
+        threading.Event().wait(0.01)
+
+
+def test_concurrent_callers_share_one_load():
+    flights = SingleFlight()
+    release = threading.Event()
+    load, calls = blocking_load(release, result={'total': 3})
+    threading.Timer(0.01, lambda: (wait_for_waiters(flights, 7), release.set())).start()
+
+    results = run_together(flights, ('stats', 0), load, 8)
+
+    assert len(calls) == 1
+    assert all(result == {'total': 3} for result in results)
+    assert flights.stats()['leaders'] == 1 and flights.stats()['shared'] == 7
+    assert flights.stats()['in_flight'] == 0
+
+
+def test_leader_error_reaches_every_waiter_and_next_call_retries():
+    flights = SingleFlight()
+    release = threading.Event()
+    load, calls = blocking_load(release, error=RuntimeError('database down'))
+    threading.Timer(0.01, lambda: (wait_for_waiters(flights, 3), release.set())).start()
+
+    results = run_together(flights, 'key', load, 4)
+
+    assert len(calls) == 1
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert flights.stats()['errors'] == 1
+    assert flights.do('key', lambda: 'fresh') == 'fresh'
+
+
+def test_waiter_gives_up_after_the_bounded_wait():
+    flights = SingleFlight(wait=0.05)
+    release = threading.Event()
+    slow, _ = blocking_load(release, result='slow')
+    leader = threading.Thread(target=flights.do, args=('key', slow))
+    leader.start()
+    while not flights.stats()['in_flight']:
+        threading.Event().wait(0.001)
+
+    assert flights.do('key', lambda: 'own') == 'own'
+    assert flights.stats()['timeouts'] == 1
+    release.set()
+    leader.join()
+
+
+def test_different_keys_and_disabled_do_not_share():
+    flights = SingleFlight(enabled=False)
+    calls = []
+    assert flights.do('key', lambda: calls.append(1) or 'a') == 'a'
+    assert flights.do('key', lambda: calls.append(1) or 'b') == 'b'
+    assert len(calls) == 2 and flights.stats()['leaders'] == 0
+
+
+def test_async_callers_share_one_load_and_errors():
+    async def scenario():
+        flights = AsyncSingleFlight()
+        calls = []
+        async def load():
+            calls.append(1)
+            await asyncio.sleep(0.02)
+            return 'page'
+        results = await asyncio.gather(*[flights.do('key', load) for _ in range(5)])
+        assert results == ['page'] * 5 and len(calls) == 1
+
+        async def failing():
+            await asyncio.sleep(0.02)
+            raise ValueError('bad')
+        results = await asyncio.gather(*[flights.do('key', failing) for _ in range(3)],
+                                       return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+        assert flights.stats() == {'enabled': True, 'wait': flights.wait, 'in_flight': 0,
+                                   'leaders': 2, 'shared': 6, 'timeouts': 0, 'errors': 1}
+    asyncio.run(scenario())
+
+
+def test_async_waiters_survive_a_cancelled_leader():
+    async def scenario():
+        flights = AsyncSingleFlight()
+        async def load():
+            await asyncio.sleep(0.05)
+            return 'page'
+        leader = asyncio.create_task(flights.do('key', load))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(flights.do('key', load))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        assert await waiter == 'page'
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+    asyncio.run(scenario())
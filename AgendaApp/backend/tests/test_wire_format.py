@@ -0,0 +1,62 @@
+import pytest
+import sys
+import os
+import gzip
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wire_format import WIRE_JSON, WIRE_COLUMNS, WIRE_MSGPACK, WIRE_FORMATS, negotiate_format, columns, encode
+from compression import (COMPRESS_MIN_SIZE, StreamCompressor, choose_encoding, compressible, compress, weak_etag)
+
+
+def test_negotiate_format():
+    assert negotiate_format(None) == WIRE_JSON
+    assert negotiate_format('application/json, text/plain, */*') == WIRE_JSON
+    assert negotiate_format(WIRE_COLUMNS) == WIRE_COLUMNS
+    assert negotiate_format(f'{WIRE_COLUMNS};q=0.9, application/json;q=0.5') == WIRE_COLUMNS
+    # Ties go to JSON; the most specific range decides
+    assert negotiate_format('application/*') == WIRE_JSON
+    assert negotiate_format(f'application/*;q=0.2, {WIRE_COLUMNS};q=0') == WIRE_JSON
+    # Nothing acceptable: JSON rather than 406
+    assert negotiate_format('text/html') == WIRE_JSON
+    if WIRE_MSGPACK in WIRE_FORMATS:
+        assert negotiate_format('application/x-msgpack') == WIRE_MSGPACK
+
+
+def test_columns_layout():
+    tasks = [{'id': 'a', 'title': 'A', 'done': True}, {'id': 'b', 'title': 'B', 'due_date': '2030-01-01'}]
+    assert columns(tasks) == {'id': ['a', 'b'], 'title': ['A', 'B'], 'done': [True, None],
+                              'due_date': [None, '2030-01-01']}
+    assert columns([]) == {}
+    assert encode({'x': 1}, WIRE_JSON, lambda value: f'json:{value}') == "json:{'x': 1}"
+
+
+def test_msgpack_round_trip():
+    msgpack = pytest.importorskip('msgpack')
+    from datetime import datetime
+    body = encode({'created_at': datetime(2030, 1, 2, 3, 4, 5)}, WIRE_MSGPACK, None, default=lambda v: v.isoformat())
+    assert msgpack.unpackb(body) == {'created_at': '2030-01-02T03:04:05'}
+
+
+def test_choose_encoding():
+    assert choose_encoding(None) is None
+    assert choose_encoding('identity') is None
+    assert choose_encoding('gzip, deflate') == 'gzip'
+    assert choose_encoding('gzip;q=0') is None
+    assert choose_encoding('*') in ('br', 'gzip')
+    assert choose_encoding('*, gzip;q=0') in ('br', None)
+    assert compressible('application/json') and compressible('application/vnd.agendaapp.columns+json')
+    assert compressible('text/csv; charset=utf-8')
+    assert not compressible('text/event-stream') and not compressible(None)
+    assert weak_etag('"1-abc"') == 'W/"1-abc"' and weak_etag('W/"1-abc"') == 'W/"1-abc"'
+
+
+def test_gzip_whole_and_streamed():
+    body = b'{"title": "repeated"}, ' * COMPRESS_MIN_SIZE
+    assert gzip.decompress(compress(body, 'gzip')) == body
+
+    compressor = StreamCompressor('gzip')
+    chunks = [compressor.chunk(body[i:i + 500]) for i in range(0, len(body), 500)]
+    # Each chunk is flushed, so none is held back until the end
+    assert all(chunks)
+    assert gzip.decompress(b''.join(chunks) + compressor.finish()) == body
@@ -0,0 +1,100 @@
+"""Negotiated wire formats for GET /tasks, shared by every backend.
+
+The list always went out as an array of JSON objects, every row repeating
+its keys. Machine clients can now ask for a more compact form with the
+Accept header; the content of the response is the same in every format,
+only the encoding changes:
+
+- application/json (default): as before.
+- application/vnd.agendaapp.columns+json: the tasks as one array per
+  field, {"id": [...], "title": [...], ...}, so each key appears once per
+  page; task i is the i-th element of every array.
+- application/msgpack (or application/x-msgpack): the JSON body encoded as
+  MessagePack, same keys and values. The msgpack package is optional;
+  without it the format is not offered.
+
+The best match by q-value wins, JSON on ties and when nothing offered is
+acceptable (a 406 would break clients that send Accept: text/html). The
+format is part of the ETag and of the read cache key, and responses carry
+Vary: Accept. Compression (compression.py) applies on top of any of them.
+"""
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional format
+    msgpack = None
+
+WIRE_JSON = 'application/json'
+WIRE_COLUMNS = 'application/vnd.agendaapp.columns+json'
+WIRE_MSGPACK = 'application/msgpack'
+
+# In order of preference on equal q-values
+WIRE_FORMATS = (WIRE_JSON, WIRE_COLUMNS) + ((WIRE_MSGPACK,) if msgpack is not None else ())
+_ALIASES = {'application/x-msgpack': WIRE_MSGPACK}
+
+
+def _parse_accept(accept):
+    """[(media type, q)] of an Accept header value."""
+    ranges = []
+    for item in accept.split(','):
+        media_type, _, params = item.strip().partition(';')
+        media_type = media_type.strip().lower()
+        if not media_type:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name.lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        ranges.append((_ALIASES.get(media_type, media_type), q))
+    return ranges
+
+
+def negotiate_format(accept):
+    """Wire format for an Accept header value (None when absent)."""
+    if not accept:
+        return WIRE_JSON
+    ranges = _parse_accept(accept)
+    best, best_q = WIRE_JSON, 0.0
+    for wire_format in WIRE_FORMATS:
+        main_type = wire_format.split('/')[0]
+        # The most specific range that matches decides the q-value
+        q, specificity = 0.0, -1
+        for media_type, range_q in ranges:
+            if media_type == wire_format:
+                rank = 2
+            elif media_type == f'{main_type}/*':
+                rank = 1
+            elif media_type == '*/*':
+                rank = 0
+            else:
+                continue
+            if rank > specificity:
+                q, specificity = range_q, rank
+        if q > best_q:
+            best, best_q = wire_format, q
+    return best
+
+
+def columns(tasks):
+    """tasks (dicts) as {field: [value of each task]}; a field missing from a task is None."""
+    fields = {}
+    for task in tasks:
+        for field in task:
+            fields.setdefault(field, None)
+    return {field: [task.get(field) for task in tasks] for field in fields}
+
+
+def wire_tasks(tasks, wire_format):
+    """The tasks of a response body in the layout of wire_format."""
+    return columns(tasks) if wire_format == WIRE_COLUMNS else tasks
+
+
+def encode(value, wire_format, dumps, default=str):
+    """value encoded for wire_format; dumps is the app's JSON encoder, default
+    turns what MessagePack cannot encode (dates) into the same value as in JSON."""
+    if wire_format == WIRE_MSGPACK:
+        return msgpack.packb(value, default=default)
+    return dumps(value)
@@ -79,13 +79,14 @@ async function loadTasks() {
     try {
         showLoadingMessage('Cargando tareas...');
         
-        const response = await fetch(`${API_BASE_URL}/tasks`);
-        
-        if (!response.ok) {
-            throw new Error(`Error HTTP: ${response.status}`);
+        // Con el feed de cambios la carga inicial deja un cursor para sincronizar
+        // solo las diferencias; los backends sin feed (MongoDB) usan GET /tasks
+        const synced = await loadTasksFromFeed();
+        if (synced) {
+            startLiveUpdates();
+        } else {
+            tasks = await loadTaskPages();
         }
-        
-        tasks = await response.json();
         console.log(`Cargadas ${tasks.length} tareas`);
         
         renderTasks();
@@ -99,6 +100,143 @@ async function loadTasks() {
     }
 }
 
+// El backend pagina por cursor: seguir X-Next-Cursor hasta la última página
+async function loadTaskPages() {
+    let loaded = [];
+    let cursor = null;
+    do {
+        const url = cursor ?
+            `${API_BASE_URL}/tasks?cursor=${encodeURIComponent(cursor)}` :
+            `${API_BASE_URL}/tasks`;
+        const response = await fetch(url);
+
+        if (!response.ok) {
+            throw new Error(`Error HTTP: ${response.status}`);
+        }
+
+        loaded = loaded.concat(await response.json());
+        cursor = response.headers.get('X-Next-Cursor');
+    } while (cursor);
+    return loaded;
+}
+
+// Cursor del feed de cambios (GET /tasks/changes) y stream de eventos abierto
+let changesCursor = null;
+let changesSource = null;
+
+// Carga completa por el feed; false si el backend no lo tiene
+async function loadTasksFromFeed() {
+    tasks = [];
+    changesCursor = null;
+    let hasMore = true;
+    while (hasMore) {
+        const url = changesCursor ?
+            `${API_BASE_URL}/tasks/changes?since=${encodeURIComponent(changesCursor)}` :
+            `${API_BASE_URL}/tasks/changes`;
+        const response = await fetch(url);
+
+        if (response.status === 404 && !changesCursor) {
+            return false;
+        }
+        if (!response.ok) {
+            throw new Error(`Error HTTP: ${response.status}`);
+        }
+
+        const page = await response.json();
+        applyChanges(page.changes);
+        changesCursor = page.cursor;
+        hasMore = page.has_more;
+    }
+    return true;
+}
+
+// Aplicar altas, cambios y borrados recibidos del feed a la lista local
+function applyChanges(changes) {
+    const byId = new Map(tasks.map(t => [t.id, t]));
+    for (const change of changes) {
+        if (change.op === 'delete') {
+            byId.delete(change.id);
+        } else {
+            byId.set(change.task.id, change.task);
+        }
+    }
+    // Mismo orden que GET /tasks: las más recientes primero
+    tasks = Array.from(byId.values()).sort((a, b) =>
+        (a.created_at < b.created_at ? 1 : a.created_at > b.created_at ? -1 : 0));
+}
+
+// Recibir los cambios de otros clientes en vivo (Server-Sent Events)
+function startLiveUpdates() {
+    if (!window.EventSource || changesSource) return;
+    
+    changesSource = new EventSource(
+        `${API_BASE_URL}/tasks/changes/stream?since=${encodeURIComponent(changesCursor)}`);
+    
+    changesSource.addEventListener('changes', function(event) {
+        const page = JSON.parse(event.data);
+        applyChanges(page.changes);
+        changesCursor = page.cursor;
+        renderTasks();
+        updateStats();
+        updateCalendar();
+    });
+    
+    // El cursor caducó: volver a cargar todo
+    changesSource.addEventListener('reset', function() {
+        changesSource.close();
+        changesSource = null;
+        loadTasks();
+    });
+    
+    // Mientras readyState sea CONNECTING el navegador reintenta solo (con
+    // Last-Event-ID); si se rinde (CLOSED, p. ej. el servidor respondió con
+    // error) la vista queda desconectada hasta ponerse al día desde el cursor
+    changesSource.onerror = function() {
+        updateConnectionStatus('disconnected', 'Sin conexión: las tareas pueden no estar al día');
+        if (changesSource.readyState === EventSource.CLOSED) {
+            changesSource = null;
+            setTimeout(resumeLiveUpdates, LIVE_RETRY_MS);
+        }
+    };
+}
+
+// Espera antes de reabrir el stream cuando el navegador deja de reintentar
+const LIVE_RETRY_MS = 5000;
+
+// Traer los cambios perdidos desde el cursor y reabrir el stream
+async function resumeLiveUpdates() {
+    try {
+        let hasMore = true;
+        while (hasMore) {
+            const response = await fetch(
+                `${API_BASE_URL}/tasks/changes?since=${encodeURIComponent(changesCursor)}`);
+            
+            // El cursor caducó mientras tanto: volver a cargar todo
+            if (response.status === 410) {
+                loadTasks();
+                return;
+            }
+            if (!response.ok) {
+                throw new Error(`Error HTTP: ${response.status}`);
+            }
+            
+            const page = await response.json();
+            applyChanges(page.changes);
+            changesCursor = page.cursor;
+            hasMore = page.has_more;
+        }
+        renderTasks();
+        updateStats();
+        updateCalendar();
+        updateConnectionStatus('connected', 'Backend conectado');
+        startLiveUpdates();
+    } catch (error) {
+        console.error('Error al reanudar los cambios en vivo:', error);
+        updateConnectionStatus('disconnected', 'Sin conexión: las tareas pueden no estar al día');
+        setTimeout(resumeLiveUpdates, LIVE_RETRY_MS);
+    }
+}
+
 // Agregar nueva tarea
 async function addTask() {
     const title = taskTitleInput.value.trim();
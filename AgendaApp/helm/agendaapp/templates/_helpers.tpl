@@ -93,4 +93,29 @@ Image repository with registry
 {{- else }}
 {{- .repository }}
 {{- end }}
-{{- end }}
\ No newline at end of file
+{{- end }}
+
+{{/*
+PostgreSQL connection settings, shared by the backend and the migration job
+*/}}
+{{- define "agendaapp.postgresql.env" -}}
+- name: DB_TYPE
+  value: "postgresql"
+- name: DB_HOST
+  value: {{ .Values.postgresql.host | quote }}
+- name: DB_PORT
+  value: {{ .Values.postgresql.port | quote }}
+- name: DB_NAME
+  value: {{ .Values.postgresql.database | quote }}
+- name: DB_USER
+  value: {{ .Values.postgresql.username | quote }}
+- name: DB_PASSWORD
+  {{- if .Values.postgresql.existingSecret }}
+  valueFrom:
+    secretKeyRef:
+      name: {{ .Values.postgresql.existingSecret }}
+      key: {{ .Values.postgresql.existingSecretPasswordKey }}
+  {{- else }}
+  value: {{ .Values.postgresql.password | quote }}
+  {{- end }}
+{{- end }}
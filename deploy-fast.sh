@@ -46,6 +46,11 @@ docker push ${REGISTRY}/frontend:latest
 echo "🚀 Desplegando a Kubernetes..."
 cd ../k8s
 
+# Migrar el esquema antes de actualizar los pods del backend
+kubectl delete job backend-migrate --ignore-not-found
+sed "s|backend:latest|backend:${BUILD_TAG}|" backend-migrate-job.yaml | kubectl apply -f -
+kubectl wait --for=condition=complete job/backend-migrate --timeout=600s || { echo "❌ Fallaron las migraciones"; exit 1; }
+
 # Update deployments
 kubectl set image deployment/backend-postgres backend=${REGISTRY}/backend:${BUILD_TAG} --record
 kubectl set image deployment/frontend frontend=${REGISTRY}/frontend:${BUILD_TAG} --record